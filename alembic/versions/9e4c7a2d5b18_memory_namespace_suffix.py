@@ -0,0 +1,52 @@
+"""memory namespace suffix
+
+Moves long-term memories from `memories.<guild>.<user>` to `memories.<guild>.<user>.facts` in the agent's store, so
+searching one user's namespace by prefix can't match another user whose ID starts with the same digits.
+
+Revision ID: 9e4c7a2d5b18
+Revises: 7d2b9f4c1a60
+Create Date: 2026-10-20 10:41:19.663052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4c7a2d5b18'
+down_revision = '7d2b9f4c1a60'
+branch_labels = None
+depends_on = None
+
+# The store's tables are created by the store itself, in the `genai` schema, so may not exist yet. `store_vectors`
+# references `store` without ON UPDATE CASCADE, so rows are copied to the new prefix, their vectors moved over, and the
+# old rows deleted.
+_MOVE_PREFIXES = """
+DO $$
+BEGIN
+    IF to_regclass('genai.store') IS NOT NULL THEN
+        INSERT INTO genai.store (prefix, key, value, created_at, updated_at)
+        SELECT {new_prefix}, key, value, created_at, updated_at FROM genai.store WHERE prefix ~ '{old_pattern}'
+        ON CONFLICT DO NOTHING;
+        IF to_regclass('genai.store_vectors') IS NOT NULL THEN
+            UPDATE genai.store_vectors SET prefix = {new_prefix} WHERE prefix ~ '{old_pattern}';
+        END IF;
+        DELETE FROM genai.store WHERE prefix ~ '{old_pattern}';
+    END IF;
+END $$;
+"""
+
+
+def upgrade() -> None:
+    op.execute(
+        _MOVE_PREFIXES.format(new_prefix="prefix || '.facts'", old_pattern=r"^memories\.[^.]+\.[^.]+$")
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        _MOVE_PREFIXES.format(
+            new_prefix="left(prefix, -length('.facts'))", old_pattern=r"^memories\.[^.]+\.[^.]+\.facts$"
+        )
+    )
@@ -0,0 +1,122 @@
+"""
+Overload benchmark for the agent's admission control in `grug.admission`.
+
+Simulates a burst of agent requests against a stand-in agent, whose run time is log-normal: one busy guild floods the
+bot with mentions, while a number of quiet guilds send a few mentions each, voice replies arrive throughout, and some
+background work is queued. The same load is run through a plain FIFO semaphore with the same concurrency, and through
+an `AdmissionController`, and the benchmark reports the queue wait per class and for the busy and quiet guilds, and how
+many requests were shed.
+
+No API calls are made.
+
+Usage:
+    uv run python benchmarks/admission.py
+    uv run python benchmarks/admission.py --busy-requests 500 --quiet-guilds 20 --concurrency 4 --run-ms 500
+"""
+
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import numpy as np
+from loguru import logger
+
+from grug.admission import AdmissionController, AdmissionRejected, RequestClass
+
+BUSY_GUILD = 0
+
+
+def _percentiles(waits: list[float]) -> str:
+    if not waits:
+        return "none admitted"
+    p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+    return f"p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s max={max(waits):.2f}s (n={len(waits)})"
+
+
+def _requests(args: argparse.Namespace, rng: np.random.Generator) -> list[tuple[float, RequestClass, int]]:
+    """The (arrival time, class, guild) of each request, sorted by arrival."""
+    requests = [(rng.uniform(0, 1), RequestClass.MENTION, BUSY_GUILD) for _ in range(args.busy_requests)]
+    for guild in range(1, args.quiet_guilds + 1):
+        requests += [(rng.uniform(0, args.duration), RequestClass.MENTION, guild) for _ in range(3)]
+        requests.append((rng.uniform(0, args.duration), RequestClass.VOICE, guild))
+        requests.append((rng.uniform(0, 1), RequestClass.BACKGROUND, guild))
+    return sorted(requests)
+
+
+async def _drive(args: argparse.Namespace, admit) -> tuple[dict[str, list[float]], dict[str, int]]:
+    """Send the requests at their arrival times, returning the queue waits and the number shed, by class and guild."""
+    rng = np.random.default_rng(0)
+    waits: dict[str, list[float]] = defaultdict(list)
+    shed: dict[str, int] = defaultdict(int)
+    started_at = time.monotonic()
+
+    async def request(arrival: float, request_class: RequestClass, guild: int):
+        await asyncio.sleep(max(0.0, arrival - (time.monotonic() - started_at)))
+        keys = [request_class.name.lower()]
+        if request_class == RequestClass.MENTION:
+            keys.append("busy guild" if guild == BUSY_GUILD else "quiet guilds")
+        enqueued_at = time.monotonic()
+        try:
+            async with admit(request_class, guild):
+                for key in keys:
+                    waits[key].append(time.monotonic() - enqueued_at)
+                await asyncio.sleep(args.run_ms / 1000 * rng.lognormal(0, 0.5))
+        except AdmissionRejected:
+            for key in keys:
+                shed[key] += 1
+
+    await asyncio.gather(*(request(*r) for r in _requests(args, np.random.default_rng(1))))
+    return waits, shed
+
+
+def _report(name: str, waits: dict[str, list[float]], shed: dict[str, int]) -> None:
+    print(f"{name}:")
+    for key in ("voice", "mention", "busy guild", "quiet guilds", "background"):
+        print(f"  {key:<13} wait {_percentiles(waits[key])}, {shed[key]} shed")
+
+
+async def _run(args: argparse.Namespace) -> None:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    @asynccontextmanager
+    async def fifo(request_class: RequestClass, guild: int):
+        async with semaphore:
+            yield
+
+    _report("FIFO", *await _drive(args, fifo))
+
+    controller = AdmissionController(
+        max_concurrency=args.concurrency,
+        max_wait_seconds={
+            RequestClass.VOICE: args.voice_max_wait,
+            RequestClass.MENTION: args.mention_max_wait,
+            RequestClass.BACKGROUND: args.background_max_wait,
+        },
+        max_queued=args.max_queued,
+    )
+    # Start from a realistic run time estimate, as a running bot would have
+    controller.run_seconds = args.run_ms / 1000
+    _report("admission", *await _drive(args, controller.admit))
+    print(f"  {controller.metrics()}")
+
+
+def main():
+    # Don't log each request that is shed
+    logger.disable("grug")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--busy-requests", type=int, default=300, help="Mentions from the busy guild, all in 1s.")
+    parser.add_argument("--quiet-guilds", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds over which quiet guilds send requests.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--run-ms", type=float, default=300.0, help="Median run time of the stand-in agent.")
+    parser.add_argument("--max-queued", type=int, default=200)
+    parser.add_argument("--voice-max-wait", type=float, default=1.0)
+    parser.add_argument("--mention-max-wait", type=float, default=6.0)
+    parser.add_argument("--background-max-wait", type=float, default=20.0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
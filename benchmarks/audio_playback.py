@@ -0,0 +1,97 @@
+"""
+Playback start-up benchmark for the in-memory audio sources in `grug.audio_playback`.
+
+Plays a WAV file, e.g. a sound effect or a TTS response, the way the voice client does: creates the audio source and
+reads it frame by frame. Reports the time to the first frame and the CPU used per playback for:
+
+- `FFmpegPCMAudio`, which forks an ffmpeg process per playback (skipped if ffmpeg isn't installed),
+- `InMemoryPCMAudio.from_wav`, which decodes and resamples the file in process, like a TTS response, and
+- a preloaded sound effect, which only streams the already decoded buffer.
+
+The CPU time includes child processes, so ffmpeg's decoding is counted.
+
+Usage:
+    uv run python benchmarks/audio_playback.py
+    uv run python benchmarks/audio_playback.py --wav assets/sound_effects/boop.wav --playbacks 50
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Callable
+
+import discord
+import numpy as np
+from discord import FFmpegPCMAudio
+
+from grug.audio import wav_to_discord_pcm
+from grug.audio_playback import InMemoryPCMAudio
+
+
+def _cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _play(make_source: Callable[[], discord.AudioSource], playbacks: int) -> tuple[list[float], float]:
+    """Play a source `playbacks` times, returning the times to the first frame and the CPU seconds per playback."""
+    first_frame_seconds = []
+    cpu_started_at = _cpu_seconds()
+    for _ in range(playbacks):
+        started_at = time.perf_counter()
+        source = make_source()
+        source.read()
+        first_frame_seconds.append(time.perf_counter() - started_at)
+        while source.read():
+            pass
+        source.cleanup()
+    return first_frame_seconds, (_cpu_seconds() - cpu_started_at) / playbacks
+
+
+def _write_test_wav(path: Path, seconds: float, sample_rate: int = 24_000) -> None:
+    """A mono 16-bit chirp, like a TTS response."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (np.sin(2 * np.pi * (200 + 400 * t / seconds) * t) * 20_000).astype("<i2")
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wav", type=Path, help="The WAV file to play. Defaults to a generated 24 kHz mono chirp.")
+    parser.add_argument("--seconds", type=float, default=3.0, help="The length of the generated WAV file.")
+    parser.add_argument("--playbacks", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        wav_path = args.wav or Path(directory) / "test.wav"
+        if args.wav is None:
+            _write_test_wav(wav_path, args.seconds)
+
+        preloaded = wav_to_discord_pcm(wav_path)
+        sources = {
+            "in memory, decoded per playback": lambda: InMemoryPCMAudio.from_wav(wav_path),
+            "in memory, preloaded": lambda: InMemoryPCMAudio(preloaded),
+        }
+        if shutil.which("ffmpeg"):
+            sources = {"ffmpeg": lambda: FFmpegPCMAudio(wav_path.as_posix()), **sources}
+        else:
+            print("ffmpeg isn't installed, skipping FFmpegPCMAudio")
+
+        for name, make_source in sources.items():
+            first_frame_seconds, cpu_seconds = _play(make_source, args.playbacks)
+            p50, p95 = np.percentile(first_frame_seconds, [50, 95]) * 1000
+            print(
+                f"{name:<32} first frame p50={p50:.2f}ms p95={p95:.2f}ms, {cpu_seconds * 1000:.1f}ms CPU per playback"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark for the voice path audio processing in `grug.audio`.
+
+Measures the CPU time per second of audio to downmix Discord's 48 kHz stereo PCM, resample it to 16 kHz and normalize
+it, and the WAV upload size before and after.
+
+Usage:
+    uv run python benchmarks/audio_processing.py
+"""
+
+import argparse
+import io
+import time
+import wave
+
+import numpy as np
+
+from grug.audio import (
+    DISCORD_CHANNELS,
+    DISCORD_SAMPLE_RATE,
+    WHISPER_SAMPLE_RATE,
+    array_to_pcm,
+    downmix,
+    pcm_to_array,
+    prepare_for_transcription,
+    to_int16,
+)
+
+
+def _wav_size(pcm: bytes, sample_rate: int) -> int:
+    with io.BytesIO() as buffer:
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm)
+        return len(buffer.getvalue())
+
+
+def _cpu_seconds(func, repeats: int) -> float:
+    start = time.process_time()
+    for _ in range(repeats):
+        func()
+    return (time.process_time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of the synthetic speech segment.")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(args.seconds * DISCORD_SAMPLE_RATE)) / DISCORD_SAMPLE_RATE
+    voice = 6000 * np.sin(2 * np.pi * 180 * t) * (1 + np.sin(2 * np.pi * 3 * t)) + rng.normal(0, 300, len(t))
+    stereo = np.stack([voice, voice * 0.8], axis=1)
+    stereo_pcm = array_to_pcm(to_int16(stereo))
+    mono_48k_pcm = array_to_pcm(to_int16(downmix(pcm_to_array(stereo_pcm, DISCORD_CHANNELS))))
+
+    downmix_cpu = _cpu_seconds(
+        lambda: array_to_pcm(to_int16(downmix(pcm_to_array(stereo_pcm, DISCORD_CHANNELS)))), args.repeats
+    )
+    full_cpu = _cpu_seconds(
+        lambda: prepare_for_transcription(stereo_pcm, DISCORD_SAMPLE_RATE, channels=DISCORD_CHANNELS), args.repeats
+    )
+    mono_16k_pcm = prepare_for_transcription(stereo_pcm, DISCORD_SAMPLE_RATE, channels=DISCORD_CHANNELS)
+
+    size_48k = _wav_size(mono_48k_pcm, DISCORD_SAMPLE_RATE)
+    size_16k = _wav_size(mono_16k_pcm, WHISPER_SAMPLE_RATE)
+
+    print(f"segment length: {args.seconds:.1f}s")
+    print(f"downmix only:                  {1000 * downmix_cpu / args.seconds:.3f} ms CPU per second of audio")
+    print(f"downmix + resample + normalize: {1000 * full_cpu / args.seconds:.3f} ms CPU per second of audio")
+    print(f"upload size @ 48 kHz: {size_48k / 1024:.0f} KiB")
+    print(f"upload size @ 16 kHz: {size_16k / 1024:.0f} KiB ({1 - size_16k / size_48k:.0%} smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Lookup benchmark for the local compendium in `grug.compendium`.
+
+Generates a compendium of made up spells, feats, conditions, monsters and items (50,000 by default), builds its index,
+and reports the build time, the index size, how long opening the memory-mapped index takes, and the latency and top-1
+accuracy of lookups by exact name, by prefix, and with typos. The same lookups are also run with rapidfuzz's
+`process.extract` over every name, which is what the index's prefix and trigram candidates avoid.
+
+Usage:
+    uv run python benchmarks/compendium.py
+    uv run python benchmarks/compendium.py --entries 200000 --queries 500
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from grug.compendium import Compendium, CompendiumEntry, build_compendium_index, normalize
+
+CATEGORIES = ["Spell", "Feat", "Condition", "Creature", "Item", "Ancestry", "Trait"]
+SYLLABLES = "ka ra mon dul the vin sor ael bar gol ith ne vash tor im ul zen fa ro quel dra mir os ent har lo".split()
+WORDS = "fire frost shield blast ward strike bolt touch form sight step cloak storm hand mind flame".split()
+
+
+def _entries(count: int, rng: np.random.Generator) -> list[CompendiumEntry]:
+    names = set()
+    while len(names) < count:
+        words = ["".join(rng.choice(SYLLABLES, size=rng.integers(2, 4))) for _ in range(rng.integers(1, 3))]
+        words.append(rng.choice(WORDS))
+        names.add(" ".join(words).title())
+    return [
+        CompendiumEntry(
+            name=name,
+            category=CATEGORIES[i % len(CATEGORIES)],
+            text=f"{name} does something with {rng.choice(WORDS)}. " * int(rng.integers(2, 8)),
+            fields={"level": int(rng.integers(1, 21)), "source": "Benchmark Rulebook"},
+        )
+        for i, name in enumerate(sorted(names))
+    ]
+
+
+def _typo(name: str, rng: np.random.Generator) -> str:
+    """Drop, repeat or swap a letter."""
+    i = int(rng.integers(1, len(name) - 1))
+    typos = [
+        name[:i] + name[i + 1 :],  # noqa: E203
+        name[:i] + name[i] + name[i:],
+        name[: i - 1] + name[i] + name[i - 1] + name[i + 1 :],  # noqa: E203
+    ]
+    return typos[int(rng.integers(0, len(typos)))]
+
+
+def _measure(lookup: Callable[[str], str | None], queries: list[tuple[str, str]]) -> str:
+    latencies, correct = [], 0
+    for query, expected in queries:
+        started_at = time.perf_counter()
+        found = lookup(query)
+        latencies.append(time.perf_counter() - started_at)
+        correct += found == expected
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return f"p50={p50:.2f}ms p95={p95:.2f}ms, top-1 {correct / len(queries):.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200, help="The number of lookups of each kind.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    entries = _entries(args.entries, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = Path(directory) / "compendium.idx"
+        started_at = time.perf_counter()
+        build_compendium_index(entries, index_path)
+        print(
+            f"built the index of {len(entries)} entries in {time.perf_counter() - started_at:.2f}s, "
+            f"{index_path.stat().st_size / 2**20:.1f} MB"
+        )
+
+        started_at = time.perf_counter()
+        compendium = Compendium(index_path)
+        print(f"opened the index in {(time.perf_counter() - started_at) * 1000:.2f}ms")
+
+        sample = [entries[i].name for i in rng.choice(len(entries), size=args.queries, replace=False)]
+        kinds = {
+            "exact": [(name, name) for name in sample],
+            "prefix": [(name[: max(4, len(name) * 2 // 3)], name) for name in sample],
+            "typo": [(_typo(name, rng), name) for name in sample],
+        }
+
+        def indexed(query: str) -> str | None:
+            matches = compendium.lookup(query, limit=1)
+            return matches[0].entry.name if matches else None
+
+        keys = [normalize(entry.name) for entry in entries]
+
+        def scan(query: str) -> str | None:
+            match = process.extractOne(normalize(query), keys, scorer=fuzz.WRatio, processor=None)
+            return entries[match[2]].name if match else None
+
+        for kind, queries in kinds.items():
+            print(f"  {kind:<6} indexed {_measure(indexed, queries)}")
+            print(f"  {kind:<6} scan    {_measure(scan, queries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark for the dice engine in `grug.dice`.
+
+Compares rolling big dice pools many times with NumPy against a plain `random.randint` loop, and times the exact
+distributions of large expressions with a cold and a warm cache.
+
+Usage:
+    uv run python benchmarks/dice.py
+    uv run python benchmarks/dice.py --trials 100000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from grug import dice
+
+_POOLS = ["1000d6", "200d20kh10", "100d6!", "50d10>=8"]
+_DISTRIBUTIONS = ["1d20+14", "4d6dl1", "10000d6", "1000d10!", "100d20kh10", "20d10>=8+3d6"]
+
+
+def _naive_totals(expression: dice.DiceExpression, trials: int) -> list[int]:
+    totals = []
+    for _ in range(trials):
+        total = expression.modifier
+        for term in expression.terms:
+            rolls = []
+            for _ in range(term.count):
+                die = random.randint(1, term.sides)
+                while term.explode and die % term.sides == 0 and die < term.sides * dice.EXPLODE_DEPTH:
+                    die += random.randint(1, term.sides)
+                rolls.append(die)
+            if term.keep is not None:
+                rolls.sort(reverse=term.keep[0] == "h")
+                rolls = rolls[: term.keep[1]]
+            value = sum(die >= term.success_at for die in rolls) if term.success_at is not None else sum(rolls)
+            total += value * term.sign
+        totals.append(total)
+    return totals
+
+
+def _clear_caches() -> None:
+    dice.parse.cache_clear()
+    dice.term_distribution.cache_clear()
+    dice._die_distribution.cache_clear()
+    dice._expression_distribution.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=10_000)
+    parser.add_argument("--naive-trials", type=int, default=1_000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"rolling ({args.trials} trials, naive loop timed over {args.naive_trials} and scaled)")
+    for text in _POOLS:
+        expression = dice.parse(text)
+        start = time.perf_counter()
+        totals = dice.roll_totals(expression, args.trials, rng)
+        vectorized = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _naive_totals(expression, args.naive_trials)
+        naive = (time.perf_counter() - start) * args.trials / args.naive_trials
+
+        print(
+            f"  {text:<12} numpy {vectorized * 1000:8.1f} ms   naive {naive * 1000:9.1f} ms   "
+            f"{naive / vectorized:6.1f}x   mean {totals.mean():.2f}"
+        )
+
+    print("exact distributions")
+    _clear_caches()
+    for text in _DISTRIBUTIONS:
+        start = time.perf_counter()
+        outcomes = dice.distribution(text)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dice.distribution(text)
+        warm = time.perf_counter() - start
+
+        print(
+            f"  {text:<14} cold {cold * 1000:8.2f} ms   warm {warm * 1000:6.3f} ms   "
+            f"mean {outcomes.mean:9.2f}   std {outcomes.std:7.2f}   exact {outcomes.exact}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Throughput benchmark for the shared embedding service in `grug.embedding_service`.
+
+Simulates bursts of concurrent embedding requests: search queries and memory recalls of a few texts each, drawn with
+a skew from a pool of texts so popular ones repeat, like the same question asked in a busy channel. The requests are
+embedded by a local stand-in backend whose latency grows with the batch size, like the API's, either:
+
+- directly, one backend request per embedding request, as each feature did before the service,
+- through the service with its in-memory cache disabled, so only the micro-batching and the coalescing of concurrent
+  requests for the same text help, and
+- through the service as configured.
+
+The benchmark reports the backend requests and texts embedded, and the latency of the embedding requests. The
+persistent cache is not used, as it needs Postgres.
+
+Usage:
+    uv run python benchmarks/embeddings.py
+    uv run python benchmarks/embeddings.py --requests 2000 --window-ms 5 --pool 500
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from grug.ai_embeddings import LOCAL_EMBEDDING_MODEL, LocalEmbeddings
+from grug.embedding_service import EmbeddingService
+
+
+class SimulatedLatencyEmbeddings(LocalEmbeddings):
+    """Takes `base_seconds` per request plus `per_text_seconds` per text, and counts the requests and texts."""
+
+    def __init__(self, base_seconds: float, per_text_seconds: float):
+        super().__init__()
+        self.base_seconds = base_seconds
+        self.per_text_seconds = per_text_seconds
+        self.requests = 0
+        self.texts = 0
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.base_seconds + self.per_text_seconds * len(texts))
+        return await super().aembed_documents(texts)
+
+
+async def _run(args: argparse.Namespace, name: str, workload: list[tuple[float, list[str]]], service: bool) -> None:
+    backend = SimulatedLatencyEmbeddings(args.base_ms / 1000, args.per_text_ms / 1000)
+    embeddings = (
+        EmbeddingService(
+            backend,
+            model=LOCAL_EMBEDDING_MODEL,
+            batch_window_seconds=args.window_ms / 1000,
+            max_batch_size=args.max_batch_size,
+            concurrency=args.concurrency,
+            cache_size=args.cache_size if name != "service, no cache" else 0,
+        )
+        if service
+        else backend
+    )
+    latencies: list[float] = []
+
+    async def request(delay: float, texts: list[str]) -> None:
+        await asyncio.sleep(delay)
+        started_at = time.perf_counter()
+        await embeddings.aembed_documents(texts)
+        latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(request(delay, texts) for delay, texts in workload))
+    elapsed = time.perf_counter() - started_at
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    print(
+        f"  {name:<18} {backend.requests:>5} backend requests, {backend.texts:>5} texts embedded, "
+        f"latency p50={p50:.0f}ms p95={p95:.0f}ms, {elapsed:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=500, help="Embedding requests per second.")
+    parser.add_argument("--pool", type=int, default=2000, help="The number of distinct texts.")
+    parser.add_argument("--base-ms", type=float, default=150, help="The backend's latency per request.")
+    parser.add_argument("--per-text-ms", type=float, default=0.5, help="The backend's latency per text.")
+    parser.add_argument("--window-ms", type=float, default=10)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    arrivals = np.cumsum(rng.exponential(1 / args.rate, size=args.requests))
+    # Zipf-like popularity, so a few texts are requested often and most rarely
+    popularity = 1 / np.arange(1, args.pool + 1)
+    texts = rng.choice(args.pool, size=(args.requests, 4), p=popularity / popularity.sum())
+    workload = [
+        (float(arrival), [f"what are the rules for thing number {i}?" for i in row[: rng.integers(1, 5)]])
+        for arrival, row in zip(arrivals, texts)
+    ]
+    print(f"{args.requests} requests, {sum(len(t) for _, t in workload)} texts, {args.rate:.0f} requests/s")
+
+    asyncio.run(_run(args, "direct", workload, service=False))
+    asyncio.run(_run(args, "service, no cache", workload, service=True))
+    asyncio.run(_run(args, "service", workload, service=True))
+
+
+if __name__ == "__main__":
+    main()
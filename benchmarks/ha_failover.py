@@ -0,0 +1,203 @@
+"""
+Multi-process failover test for the replica coordination in `grug.replicas`.
+
+Starts several replica processes, each running a `ReplicaCoordinator` over the same set of fake guilds (IDs far above
+real Discord snowflakes, so a shared development database is safe), and reports:
+
+1. steady state: how the guilds are spread over the replicas, and which one is the leader.
+2. crash: the leader is killed with SIGKILL. Measures how long until another replica is the leader and every guild is
+   owned again.
+3. freeze: the new leader is stopped with SIGSTOP, so its connection stays open but stops heartbeating. Measures the
+   failover, which waits for Postgres to end the idle session after the lease, then resumes the frozen replica and
+   checks that it no longer claims any guild or leadership.
+4. scale out: a new replica is started. Measures how long until it owns its share of the guilds, and how many guilds
+   moved.
+
+Throughout, the replicas' own views of what they own are checked for overlaps. Views are sampled, so an overlap only
+counts if it lasts longer than a heartbeat, as a guild that just moved can briefly show in both replicas' samples.
+
+Requires the database from `docker compose up postgres` (Postgres 14 or later, for `idle_session_timeout`).
+
+Usage:
+    uv run python benchmarks/ha_failover.py
+    uv run python benchmarks/ha_failover.py --replicas 4 --guilds 2000 --lease 6 --heartbeat 1
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import anyio
+
+from grug.replicas import ReplicaCoordinator
+
+_FAKE_GUILD_ID_START = 10**18
+_REPORT_INTERVAL_SECONDS = 0.1
+
+
+def _replica_main(guild_ids: list[int], reports: multiprocessing.Queue, lease: float, heartbeat: float) -> None:
+    coordinator = ReplicaCoordinator(enabled=True, lease_seconds=lease, heartbeat_seconds=heartbeat)
+
+    async def report():
+        while True:
+            reports.put((os.getpid(), time.time(), coordinator.is_leader, coordinator.owned_guilds))
+            await anyio.sleep(_REPORT_INTERVAL_SECONDS)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(coordinator.run, lambda: guild_ids)
+            tg.start_soon(report)
+
+    asyncio.run(main())
+
+
+@dataclass
+class Cluster:
+    guild_ids: list[int]
+    lease: float
+    heartbeat: float
+    reports: multiprocessing.Queue = field(default_factory=lambda: multiprocessing.get_context("spawn").Queue())
+    processes: dict[int, multiprocessing.Process] = field(default_factory=dict)
+    views: dict[int, tuple[float, bool, set[int]]] = field(default_factory=dict)
+    overlapping_since: dict[int | str, float] = field(default_factory=dict)
+    conflicts: set[int | str] = field(default_factory=set)
+
+    def start_replica(self) -> int:
+        process = multiprocessing.get_context("spawn").Process(
+            target=_replica_main, args=(self.guild_ids, self.reports, self.lease, self.heartbeat), daemon=True
+        )
+        process.start()
+        self.processes[process.pid] = process
+        return process.pid
+
+    def drain(self, timeout: float) -> None:
+        """Collect reports for up to `timeout` seconds, checking for overlapping live views."""
+        deadline = time.time() + timeout
+        while (remaining := deadline - time.time()) > 0:
+            try:
+                pid, reported_at, is_leader, owned = self.reports.get(timeout=remaining)
+            except queue.Empty:
+                return
+            self.views[pid] = (reported_at, is_leader, owned)
+            self._check_overlaps()
+
+    def _check_overlaps(self) -> None:
+        claims = Counter()
+        for _, is_leader, owned in self.live_views().values():
+            claims.update(owned)
+            claims.update(["leader"] if is_leader else [])
+
+        now = time.time()
+        overlapping = {key for key, count in claims.items() if count > 1}
+        for key in list(self.overlapping_since):
+            if key not in overlapping:
+                del self.overlapping_since[key]
+        for key in overlapping:
+            if now - self.overlapping_since.setdefault(key, now) > self.heartbeat + 4 * _REPORT_INTERVAL_SECONDS:
+                self.conflicts.add(key)
+
+    def live_views(self) -> dict[int, tuple[float, bool, set[int]]]:
+        # Only the latest view of running, unfrozen replicas counts
+        return {
+            pid: view
+            for pid, view in self.views.items()
+            if self.processes[pid].is_alive() and view[0] > time.time() - 4 * _REPORT_INTERVAL_SECONDS
+        }
+
+    def leader(self) -> int | None:
+        return next((pid for pid, (_, is_leader, _) in self.live_views().items() if is_leader), None)
+
+    def owners(self) -> dict[int, int]:
+        return {guild_id: pid for pid, (_, _, owned) in self.live_views().items() for guild_id in owned}
+
+    def wait_until(self, condition, timeout: float) -> float | None:
+        """Wait until a condition holds, returning how long it took."""
+        start = time.time()
+        while time.time() - start < timeout:
+            self.drain(_REPORT_INTERVAL_SECONDS)
+            if condition():
+                return time.time() - start
+        return None
+
+    def fully_owned(self) -> bool:
+        # Every fake guild, plus the DM scope, has an owner and there is a leader
+        return len(self.owners()) == len(self.guild_ids) + 1 and self.leader() is not None
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGCONT)
+                process.kill()
+
+
+def _seconds(value: float | None) -> str:
+    return f"{value:.2f}s" if value is not None else "timed out"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--guilds", type=int, default=500)
+    parser.add_argument("--lease", type=float, default=8.0)
+    parser.add_argument("--heartbeat", type=float, default=1.0)
+    args = parser.parse_args()
+
+    cluster = Cluster(
+        guild_ids=list(range(_FAKE_GUILD_ID_START, _FAKE_GUILD_ID_START + args.guilds)),
+        lease=args.lease,
+        heartbeat=args.heartbeat,
+    )
+    timeout = args.lease * 4
+    try:
+        for _ in range(args.replicas):
+            cluster.start_replica()
+        print(f"startup:   all guilds owned after {_seconds(cluster.wait_until(cluster.fully_owned, timeout))}")
+        leader = cluster.leader()
+        shares = sorted(len(owned) for _, _, owned in cluster.live_views().values())
+        print(f"           guilds per replica: {shares}, leader: {leader}")
+
+        killed_at = time.time()
+        os.kill(leader, signal.SIGKILL)
+        cluster.processes[leader].join()
+        new_leader_took = cluster.wait_until(lambda: cluster.leader() is not None, timeout)
+        fully_owned = cluster.wait_until(cluster.fully_owned, timeout) is not None
+        print(
+            f"crash:     killed leader {leader}, new leader after {_seconds(new_leader_took)}, all guilds owned after "
+            f"{_seconds(time.time() - killed_at if fully_owned else None)}"
+        )
+
+        frozen = cluster.leader()
+        frozen_at = time.time()
+        os.kill(frozen, signal.SIGSTOP)
+        cluster.views.pop(frozen, None)
+        took = cluster.wait_until(lambda: cluster.leader() not in (None, frozen) and cluster.fully_owned(), timeout)
+        print(f"freeze:    froze leader {frozen}, all guilds and leadership taken over after {_seconds(took)}")
+        os.kill(frozen, signal.SIGCONT)
+        cluster.wait_until(lambda: cluster.views.get(frozen, (0,))[0] > frozen_at, timeout)
+        _, resumed_leader, resumed_owned = cluster.views[frozen]
+        print(f"           after resuming it claims {len(resumed_owned)} guilds, leader: {resumed_leader}")
+
+        before = cluster.owners()
+        new_replica = cluster.start_replica()
+        took = cluster.wait_until(
+            lambda: len(cluster.live_views().get(new_replica, (0, False, set()))[2]) > 0 and cluster.fully_owned(),
+            timeout,
+        )
+        cluster.drain(args.heartbeat * 3)
+        after = cluster.owners()
+        moved = sum(1 for guild_id, pid in after.items() if before.get(guild_id) != pid)
+        print(f"scale out: new replica {new_replica} owns guilds after {_seconds(took)}, {moved} guilds moved")
+
+        print(f"lasting ownership overlaps: {len(cluster.conflicts)}")
+    finally:
+        cluster.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Tail latency benchmark for the request hedging and failover in `grug.ai_chat_model`.
+
+Sends a stream of concurrent requests to stand-in chat models, whose latency is log-normal with occasional stalls (like
+an upstream request stuck behind a slow replica), and compares the latency percentiles of calling the model directly
+with those of a `ResilientChatModel` hedging it, along with the hedge rate and the latency hedges saved.
+
+Then the primary model fails every request, and the benchmark reports how many requests failed over to the fallback
+model, how often the primary's circuit breaker tripped, and how many requests still reached the failing primary.
+
+No API calls are made.
+
+Usage:
+    uv run python benchmarks/llm_hedging.py
+    uv run python benchmarks/llm_hedging.py --requests 2000 --concurrency 20 --stall-rate 0.05 --stall-seconds 20
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from grug.ai_chat_model import ResilientChatModel
+
+
+class StandInChatModel(BaseChatModel):
+    """A chat model that answers after a log-normal latency, sometimes stalling, and fails while `failing` is set."""
+
+    median_seconds: float
+    sigma: float
+    stall_rate: float
+    stall_seconds: float
+    failing: bool = False
+    calls: int = 0
+    rng: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "stand-in"
+
+    def _latency(self) -> float:
+        latency = self.median_seconds * self.rng.lognormal(0, self.sigma)
+        if self.rng.random() < self.stall_rate:
+            latency += self.stall_seconds
+        return latency
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        if self.failing:
+            await asyncio.sleep(self.median_seconds / 10)
+            raise ConnectionError("upstream unavailable")
+        await asyncio.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage("Grug answer."))])
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError
+
+
+def _stand_in(args: argparse.Namespace, seed: int) -> StandInChatModel:
+    return StandInChatModel(
+        median_seconds=args.median_ms / 1000,
+        sigma=args.sigma,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        rng=np.random.default_rng(seed),
+    )
+
+
+async def _drive(model: BaseChatModel, requests: int, concurrency: int) -> tuple[list[float], int]:
+    """Send requests, `concurrency` at a time, returning the latencies of the ones that succeeded and the failures."""
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request():
+        nonlocal failures
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await model.ainvoke([HumanMessage("Roll for initiative!")])
+            except Exception:
+                failures += 1
+            else:
+                latencies.append(time.perf_counter() - started_at)
+
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return latencies, failures
+
+
+def _percentiles(latencies: list[float]) -> str:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return f"p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s max={max(latencies):.2f}s"
+
+
+async def _run(args: argparse.Namespace) -> None:
+    direct, _ = await _drive(_stand_in(args, seed=0), args.requests, args.concurrency)
+    print(f"direct:    {_percentiles(direct)}")
+
+    hedged_model = ResilientChatModel(primary=_stand_in(args, seed=0), hedge_initial_delay_seconds=args.stall_seconds)
+    # Warm up the latency samples the hedge delay is adapted from
+    await _drive(hedged_model, 50, args.concurrency)
+    hedged, _ = await _drive(hedged_model, args.requests, args.concurrency)
+    metrics = hedged_model.metrics()
+    print(f"hedged:    {_percentiles(hedged)}")
+    print(
+        f"           hedge delay {metrics['hedge_delay_seconds']}s, hedge rate {metrics['hedge_rate']:.1%}, "
+        f"{metrics['hedge_wins']} hedges won, ~{metrics['hedge_seconds_saved']}s of latency saved, "
+        f"{hedged_model.primary.calls / (args.requests + 50):.3f} upstream calls per request"
+    )
+
+    primary, fallback = _stand_in(args, seed=1), _stand_in(args, seed=2)
+    resilient_model = ResilientChatModel(
+        primary=primary, fallback=fallback, circuit_reset_seconds=args.circuit_reset_seconds
+    )
+    primary.failing = True
+    outage_started_at = time.perf_counter()
+    outage, failures = await _drive(resilient_model, args.requests, args.concurrency)
+    outage_seconds = time.perf_counter() - outage_started_at
+    metrics = resilient_model.metrics()
+    print(f"outage:    {_percentiles(outage)}, {failures} requests failed")
+    print(
+        f"           {metrics['failovers']} failovers, {metrics['circuit_trips']} circuit trips, {primary.calls} of "
+        f"{args.requests} requests reached the failing primary in {outage_seconds:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--median-ms", type=float, default=200.0, help="Median latency of the stand-in models.")
+    parser.add_argument("--sigma", type=float, default=0.4, help="Log-normal shape of the latency.")
+    parser.add_argument("--stall-rate", type=float, default=0.03, help="Share of requests that stall.")
+    parser.add_argument("--stall-seconds", type=float, default=5.0)
+    parser.add_argument("--circuit-reset-seconds", type=float, default=2.0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
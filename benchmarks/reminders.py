@@ -0,0 +1,143 @@
+"""
+Scheduling and delivery throughput benchmark for the reminders in `grug.reminders`.
+
+Creates tens of thousands of pending reminders for throwaway channels (negative IDs), spread over a number of distinct
+due times, and reports:
+
+- creation: reminders stored per second by `create_reminders`.
+- scheduling: distinct due times registered per second by `schedule_reminder_delivery`, against the scheduler's
+  Postgres data store. The schedules are removed afterwards.
+- delivery: reminders (and channel messages) delivered per second once they are all due, by several concurrent
+  `deliver_due_reminders` runs posting through the dispatcher (with its usual rate limits) to a fake Discord client
+  with a simulated per-message latency. Every reminder is checked to have been posted exactly once.
+
+Requires the database from `docker compose up postgres` with migrations applied. No Discord calls are made.
+
+Usage:
+    uv run python benchmarks/reminders.py
+    uv run python benchmarks/reminders.py --reminders 50000 --channels 500 --due-times 1000 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import re
+import time
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from grug import reminders
+from grug.db import sqa_async_engine
+from grug.discord_dispatcher import discord_dispatcher
+from grug.models import Reminder
+from grug.scheduler import schedule_reminder_delivery, scheduler
+
+_REMINDER_PATTERN = re.compile(r"benchmark reminder (\d+)")
+
+
+class FakeChannel:
+    def __init__(self, client: "FakeClient", channel_id: int):
+        self.client = client
+        self.id = channel_id
+
+    async def send(self, content: str, **kwargs) -> None:
+        await asyncio.sleep(self.client.latency_seconds)
+        self.client.messages += 1
+        self.client.posted.update(int(number) for number in _REMINDER_PATTERN.findall(content))
+
+
+class FakeClient:
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.messages = 0
+        self.posted: Counter[int] = Counter()
+
+    def is_ready(self) -> bool:
+        return True
+
+    def get_channel(self, channel_id: int) -> FakeChannel:
+        return FakeChannel(self, channel_id)
+
+
+async def _delete_benchmark_reminders() -> None:
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(text(f"DELETE FROM {Reminder.__tablename__} WHERE channel_id < 0"))
+
+
+async def _run(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(0)
+    await _delete_benchmark_reminders()
+
+    start_time = datetime.now(tz=UTC).replace(microsecond=0) + timedelta(days=1)
+    due_times = [start_time + timedelta(minutes=int(i)) for i in range(args.due_times)]
+    channels = -1 - rng.integers(0, args.channels, args.reminders)
+    due = rng.integers(0, args.due_times, args.reminders)
+
+    # Bulk creation, grouped by channel like a request for a series of reminders
+    start = time.perf_counter()
+    created = []
+    for channel_id in np.unique(channels):
+        numbers = np.flatnonzero(channels == channel_id)
+        created += await reminders.create_reminders(
+            channel_id=int(channel_id),
+            user_id=1,
+            guild_id=None,
+            reminders=[(due_times[due[number]], f"benchmark reminder {number}") for number in numbers],
+        )
+    seconds = time.perf_counter() - start
+    print(f"creation:   {len(created)} reminders in {seconds:.2f}s, {len(created) / seconds:.0f} reminders/s")
+
+    async with scheduler:
+        start = time.perf_counter()
+        scheduled = await schedule_reminder_delivery(reminder.due_at for reminder in created)
+        seconds = time.perf_counter() - start
+        print(f"scheduling: {scheduled} due times in {seconds:.2f}s, {scheduled / seconds:.0f} due times/s")
+
+        start = time.perf_counter()
+        rescheduled = await schedule_reminder_delivery(reminder.due_at for reminder in created)
+        seconds = time.perf_counter() - start
+        print(f"            re-scheduling the same {rescheduled} due times (no-op) in {seconds:.2f}s")
+
+        for due_time in due_times:
+            await scheduler.remove_schedule(f"deliver_reminders_{due_time:%Y%m%dT%H%M%S}")
+
+    # Make everything due at once, the worst case for a single delivery
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(
+            text(f"UPDATE {Reminder.__tablename__} SET due_at = now() - interval '1 minute' WHERE channel_id < 0")
+        )
+
+    client = FakeClient(latency_seconds=args.latency_ms / 1000)
+    reminders.register_discord_client(client)  # type: ignore[arg-type]
+    dispatcher_task = asyncio.create_task(discord_dispatcher.run())
+    start = time.perf_counter()
+    delivered = sum(await asyncio.gather(*(reminders.deliver_due_reminders() for _ in range(args.concurrency))))
+    seconds = time.perf_counter() - start
+    dispatcher_task.cancel()
+    print(
+        f"delivery:   {delivered} reminders in {client.messages} messages in {seconds:.2f}s, "
+        f"{delivered / seconds:.0f} reminders/s ({args.concurrency} concurrent deliveries)"
+    )
+
+    duplicates = sum(1 for count in client.posted.values() if count > 1)
+    missing = len(created) - len(client.posted)
+    print(f"            {duplicates} reminders posted more than once, {missing} never posted")
+    print(f"            dispatcher: {discord_dispatcher.metrics()}")
+
+    await _delete_benchmark_reminders()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reminders", type=int, default=20_000)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--due-times", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated latency of each Discord message.")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
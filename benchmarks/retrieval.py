@@ -0,0 +1,208 @@
+"""
+Recall and latency benchmark for the hybrid source material retrieval in `grug.retrieval`.
+
+Builds a synthetic corpus in a throwaway guild partition of `source_chunks` and grows it in steps. Chunks belong to
+topics: their text is drawn from the topic's vocabulary and their embedding is the topic's centroid plus noise. The
+chunks are spread round-robin over `--documents` documents. Each query targets one chunk, with a few of its words as
+the text and a noisy copy of its embedding as the query vector. At each corpus size, reports:
+
+- ANN recall@k: the overlap of the HNSW results with the exact nearest neighbours (computed with NumPy).
+- filtered recall@k: the same, with the search filtered to the target chunk's document, which uses the
+  `hnsw.iterative_scan` path.
+- hybrid hit rate@k: how often the target chunk is in the top k fused results.
+- p95 latency of `vector_search` without and with the document filter, and of `hybrid_search`, including fetching the
+  fused chunks.
+
+Requires the database from `docker compose up postgres` (or any Postgres with pgvector) with migrations applied. No
+OpenAI calls are made.
+
+Usage:
+    uv run python benchmarks/retrieval.py
+    uv run python benchmarks/retrieval.py --sizes 1000 10000 50000 --queries 200 -k 10 --documents 20
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Awaitable, TypeVar
+
+import numpy as np
+from sqlalchemy import text
+
+from grug.ai_embeddings import EMBEDDING_DIMENSIONS
+from grug.db import copy_rows, ensure_list_partition, sqa_async_engine, vector_literal
+from grug.models import SourceChunk, SourceDocument
+from grug.retrieval import hybrid_search, vector_search
+
+T = TypeVar("T")
+
+BENCHMARK_GUILD_ID = -1
+N_TOPICS = 50
+WORDS_PER_TOPIC = 200
+WORDS_PER_CHUNK = 120
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+class SyntheticCorpus:
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.centroids = _normalize(self.rng.normal(size=(N_TOPICS, EMBEDDING_DIMENSIONS)))
+        self.vocabulary = np.array([f"w{topic}x{i}" for topic in range(N_TOPICS) for i in range(WORDS_PER_TOPIC)])
+        self.words: list[np.ndarray] = []
+        self.embeddings = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    def grow(self, n: int) -> tuple[list[np.ndarray], np.ndarray]:
+        topics = self.rng.integers(0, N_TOPICS, n)
+        # Zipf-distributed word choice within each topic, so some words are common and others rare
+        ranks = np.minimum(self.rng.zipf(1.3, size=(n, WORDS_PER_CHUNK)), WORDS_PER_TOPIC) - 1
+        words = list(self.vocabulary[topics[:, None] * WORDS_PER_TOPIC + ranks])
+        embeddings = _normalize(
+            self.centroids[topics]
+            + 0.8 * self.rng.normal(size=(n, EMBEDDING_DIMENSIONS)) / np.sqrt(EMBEDDING_DIMENSIONS)
+        ).astype(np.float32)
+        self.words.extend(words)
+        self.embeddings = np.concatenate([self.embeddings, embeddings])
+        return words, embeddings
+
+    def query(self) -> tuple[int, str, np.ndarray]:
+        target = int(self.rng.integers(0, len(self.words)))
+        query_text = " ".join(self.rng.choice(self.words[target], size=3, replace=False))
+        noise = 0.5 * self.rng.normal(size=EMBEDDING_DIMENSIONS) / np.sqrt(EMBEDDING_DIMENSIONS)
+        return target, query_text, _normalize(self.embeddings[target] + noise)
+
+
+async def _reset(document_ids: list[uuid.UUID]) -> str:
+    partition = await ensure_list_partition(SourceChunk.__tablename__, BENCHMARK_GUILD_ID)
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(text(f"TRUNCATE {partition}"))
+        await conn.execute(
+            text(f"DELETE FROM {SourceDocument.__tablename__} WHERE guild_id = :guild_id"),
+            {"guild_id": BENCHMARK_GUILD_ID},
+        )
+        await conn.execute(
+            text(
+                f"INSERT INTO {SourceDocument.__tablename__} (id, guild_id, name, page_count, page_hashes) "
+                "VALUES (:id, :guild_id, 'benchmark', 0, '{}')"
+            ),
+            [{"id": document_id, "guild_id": BENCHMARK_GUILD_ID} for document_id in document_ids],
+        )
+    return partition
+
+
+async def _load(document_ids: list[uuid.UUID], start: int, words: list[np.ndarray], embeddings: np.ndarray) -> None:
+    async with sqa_async_engine.begin() as conn:
+        await copy_rows(
+            conn,
+            SourceChunk.__tablename__,
+            ("guild_id", "document_id", "page_number", "chunk_index", "content", "embedding"),
+            [
+                (
+                    BENCHMARK_GUILD_ID,
+                    document_ids[(start + i) % len(document_ids)],
+                    start + i,
+                    0,
+                    " ".join(chunk_words),
+                    vector_literal(embedding),
+                )
+                for i, (chunk_words, embedding) in enumerate(zip(words, embeddings))
+            ],
+        )
+        await conn.execute(text(f"ANALYZE {SourceChunk.__tablename__}"))
+
+
+async def _page_to_id() -> dict[int, int]:
+    async with sqa_async_engine.connect() as conn:
+        rows = await conn.execute(
+            text(f"SELECT page_number, id FROM {SourceChunk.__tablename__} WHERE guild_id = :guild_id"),
+            {"guild_id": BENCHMARK_GUILD_ID},
+        )
+        return {page_number: chunk_id for page_number, chunk_id in rows}
+
+
+def _recall(exact: np.ndarray, ann: list[int], page_to_id: dict[int, int]) -> float:
+    return len({page_to_id[int(i)] for i in exact} & set(ann)) / len(exact)
+
+
+async def _timed(latencies: list[float], search: Awaitable[T]) -> T:
+    started = time.perf_counter()
+    result = await search
+    latencies.append(time.perf_counter() - started)
+    return result
+
+
+async def run(sizes: list[int], n_queries: int, k: int, n_documents: int, seed: int) -> None:
+    corpus = SyntheticCorpus(seed)
+    document_ids = [uuid.uuid4() for _ in range(n_documents)]
+    partition = await _reset(document_ids)
+
+    print(
+        f"{'chunks':>8} {'recall@' + str(k):>10} {'filtered':>10} {'hybrid hit@' + str(k):>14} "
+        f"{'p95 ms':>8} {'filtered':>10} {'hybrid':>8}"
+    )
+    try:
+        for size in sizes:
+            start = len(corpus.words)
+            words, embeddings = corpus.grow(size - start)
+            await _load(document_ids, start, words, embeddings)
+            page_to_id = await _page_to_id()
+            chunk_documents = np.arange(len(corpus.words)) % n_documents
+
+            recalls, filtered_recalls, hits = [], [], []
+            latencies, filtered_latencies, hybrid_latencies = [], [], []
+            for _ in range(n_queries):
+                target, query_text, query_embedding = corpus.query()
+                similarities = corpus.embeddings @ query_embedding
+
+                exact = np.argsort(-similarities)[:k]
+                ann = await _timed(latencies, vector_search(BENCHMARK_GUILD_ID, query_embedding.tolist(), limit=k))
+                recalls.append(_recall(exact, ann, page_to_id))
+
+                in_document = np.flatnonzero(chunk_documents == chunk_documents[target])
+                exact = in_document[np.argsort(-similarities[in_document])[:k]]
+                ann = await _timed(
+                    filtered_latencies,
+                    vector_search(
+                        BENCHMARK_GUILD_ID,
+                        query_embedding.tolist(),
+                        document_ids=[document_ids[chunk_documents[target]]],
+                        limit=k,
+                    ),
+                )
+                filtered_recalls.append(_recall(exact, ann, page_to_id))
+
+                results = await _timed(
+                    hybrid_latencies, hybrid_search(BENCHMARK_GUILD_ID, query_text, query_embedding.tolist())
+                )
+                hits.append(page_to_id[target] in {chunk.chunk_id for chunk in results[:k]})
+
+            p95s = [np.percentile(times, 95) * 1000 for times in (latencies, filtered_latencies, hybrid_latencies)]
+            print(
+                f"{size:>8} {np.mean(recalls):>10.3f} {np.mean(filtered_recalls):>10.3f} {np.mean(hits):>14.3f} "
+                f"{p95s[0]:>8.1f} {p95s[1]:>10.1f} {p95s[2]:>8.1f}"
+            )
+    finally:
+        async with sqa_async_engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+            await conn.execute(
+                text(f"DELETE FROM {SourceDocument.__tablename__} WHERE guild_id = :guild_id"),
+                {"guild_id": BENCHMARK_GUILD_ID},
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 5_000, 20_000, 50_000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=10, help="The number of documents the chunks are spread over.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(sorted(args.sizes), args.queries, args.k, args.documents, args.seed))
+
+
+if __name__ == "__main__":
+    main()
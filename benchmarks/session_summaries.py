@@ -0,0 +1,130 @@
+"""
+Wall time benchmark for the map-reduce voice session summaries in `grug.session_summaries`.
+
+Generates the transcript of a long voice session (4 hours by default), and summarizes it with a stand-in LLM whose
+latency grows with the tokens it reads and writes, like a real one:
+
+- serially, as a rolling summary: each chunk is summarized along with the summary of everything before it,
+- with `summarize_tree`, from scratch: the chunks are summarized concurrently, then merged level by level,
+- "summary so far" after another 10 minutes of talking, reusing the cached summaries, and
+- once the session ends with nothing new said, which reuses every summary.
+
+Latencies are simulated, and scaled down by `--time-scale` so the benchmark runs quickly, but are reported at full
+scale (so the time spent chunking and fingerprinting is overstated by the same factor). No API calls are made.
+
+Usage:
+    uv run python benchmarks/session_summaries.py
+    uv run python benchmarks/session_summaries.py --hours 6 --concurrency 8 --fan-in 4
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from grug.session_summaries import CHUNK_PROMPT, SummaryNode, chunk_transcript, summarize_tree
+
+WORDS = "the goblin dragon sword tavern gold door trap roll attack spell heal run quest map king cave".split()
+
+
+def _transcript(started_at: datetime, minutes: float, rng: np.random.Generator) -> list[SimpleNamespace]:
+    """A phrase every few seconds, from one of five speakers."""
+    segments, spoken_at = [], started_at
+    while spoken_at < started_at + timedelta(minutes=minutes):
+        spoken_at += timedelta(seconds=float(rng.exponential(4)))
+        segments.append(
+            SimpleNamespace(
+                spoken_at=spoken_at,
+                speaker_id=int(rng.integers(5)),
+                speaker_name=f"Player {rng.integers(5)}",
+                text=" ".join(rng.choice(WORDS, size=int(rng.integers(3, 20)))),
+            )
+        )
+    return segments
+
+
+class StandInLLM:
+    """Sleeps for `base_seconds`, plus the time to read the input and write a summary, at most `concurrency` at once."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.calls = 0
+
+    async def complete(self, prompt: str, text: str) -> str:
+        summary = " ".join(f"- {hashlib.sha256(text.encode()).hexdigest()[i:i + 8]}" for i in range(0, 48, 8)) * 5
+        seconds = (
+            self.args.base_seconds
+            + len(text) / 4 / 1000 * self.args.input_seconds_per_1k_tokens
+            + len(summary) / 4 * self.args.output_seconds_per_token
+        )
+        async with self.semaphore:
+            self.calls += 1
+            await asyncio.sleep(seconds * self.args.time_scale)
+        return summary
+
+
+async def _timed(args: argparse.Namespace, name: str, run) -> None:
+    started_at = time.perf_counter()
+    calls = await run()
+    print(f"  {name:<34} {(time.perf_counter() - started_at) / args.time_scale:>7.1f}s, {calls:>3} LLM calls")
+
+
+async def _run(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(0)
+    started_at = datetime(2026, 1, 1, 19, tzinfo=UTC)
+    window = timedelta(minutes=args.chunk_minutes)
+    max_chars = args.chunk_max_tokens * 4
+
+    transcript = _transcript(started_at, args.hours * 60, rng)
+    chunks = chunk_transcript(transcript, started_at, window, max_chars)
+    print(
+        f"{len(transcript)} transcript segments, {sum(len(c.text) for c in chunks) // 4} tokens, {len(chunks)} chunks"
+    )
+
+    async def serial() -> int:
+        llm = StandInLLM(args)
+        summary = ""
+        for chunk in chunks:
+            summary = await llm.complete(CHUNK_PROMPT, f"Summary so far:\n{summary}\n\nTranscript:\n{chunk.text}")
+        return llm.calls
+
+    cache: dict[tuple[int, int], tuple[str, str]] = {}
+
+    async def save(node: SummaryNode, summary: str) -> None:
+        cache[(node.level, node.position)] = (node.fingerprint, summary)
+
+    async def tree(segments) -> int:
+        llm = StandInLLM(args)
+        await summarize_tree(
+            chunk_transcript(segments, started_at, window, max_chars), cache, llm.complete, args.fan_in, save
+        )
+        return llm.calls
+
+    await _timed(args, "serial rolling summary", serial)
+    await _timed(args, "map-reduce, from scratch", lambda: tree(transcript))
+    more = transcript + _transcript(transcript[-1].spoken_at, 10, rng)
+    await _timed(args, "map-reduce, 10 minutes later", lambda: tree(more))
+    await _timed(args, "map-reduce, session ended", lambda: tree(more))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=4.0, help="The length of the voice session.")
+    parser.add_argument("--chunk-minutes", type=float, default=10.0)
+    parser.add_argument("--chunk-max-tokens", type=int, default=6000)
+    parser.add_argument("--fan-in", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-seconds", type=float, default=0.5, help="The stand-in LLM's latency per request.")
+    parser.add_argument("--input-seconds-per-1k-tokens", type=float, default=0.3)
+    parser.add_argument("--output-seconds-per-token", type=float, default=0.015)
+    parser.add_argument("--time-scale", type=float, default=0.1, help="How much faster than real time to run.")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
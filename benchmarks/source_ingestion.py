@@ -0,0 +1,85 @@
+"""
+Throughput and memory benchmark for the source material ingestion pipeline in `grug.source_material`.
+
+Generates a synthetic rulebook PDF (or uses the given one) and streams it through the extraction and chunking stages
+twice: once from scratch, and once as a re-ingestion with the fingerprints from the first pass, where every page is
+unchanged. Embedding and loading are not included, as they depend on the OpenAI API and the database.
+
+Usage:
+    uv run python benchmarks/source_ingestion.py
+    uv run python benchmarks/source_ingestion.py --pdf rulebook.pdf --workers 4
+"""
+
+import argparse
+import asyncio
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pymupdf
+
+from grug.source_material import iter_document_pages
+
+_WORDS = (
+    "the goblin strikes with its rusty blade dealing slashing damage to a creature within reach saving throw "
+    "dexterity spell slot cantrip ritual concentration ranged melee attack bonus proficiency initiative hit points "
+    "armor class advantage disadvantage rest level wizard cleric rogue fighter barbarian druid paladin ranger"
+).split()
+
+
+def make_pdf(path: Path, pages: int, seed: int = 0) -> None:
+    """Write a PDF of dense, two column pages of random rulebook-ish text."""
+    rng = np.random.default_rng(seed)
+    with pymupdf.open() as document:
+        for _ in range(pages):
+            page = document.new_page()
+            for column in range(2):
+                paragraph = " ".join(rng.choice(_WORDS, size=450))
+                rect = pymupdf.Rect(36 + column * 276, 36, 36 + column * 276 + 264, page.rect.height - 36)
+                page.insert_textbox(rect, paragraph, fontsize=8)
+        document.save(path)
+
+
+def _peak_rss_mb(who: int) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+async def _run(path: Path, workers: int, known_hashes: list[str] | None) -> tuple[list[str], int, float]:
+    hashes: list[str] = []
+    chunks = 0
+    start = time.perf_counter()
+    async for page in iter_document_pages(path, known_hashes=known_hashes, workers=workers):
+        hashes.append(page.page_hash)
+        chunks += len(page.chunks or [])
+    return hashes, chunks, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", type=Path)
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.pdf
+        if path is None:
+            path = Path(tmp_dir) / "rulebook.pdf"
+            make_pdf(path, args.pages)
+        print(f"document: {path.stat().st_size / 1024 / 1024:.1f} MB, workers: {args.workers}")
+        baseline_rss = _peak_rss_mb(resource.RUSAGE_SELF)
+
+        hashes, chunks, seconds = asyncio.run(_run(path, args.workers, None))
+        print(f"full ingestion:   {len(hashes)} pages, {chunks} chunks, {len(hashes) / seconds:.1f} pages/s")
+
+        _, chunks, seconds = asyncio.run(_run(path, args.workers, hashes))
+        print(f"re-ingestion:     {len(hashes)} pages, {chunks} chunks, {len(hashes) / seconds:.1f} pages/s")
+
+        print(f"peak RSS (main):    {_peak_rss_mb(resource.RUSAGE_SELF):.0f} MB (baseline {baseline_rss:.0f} MB)")
+        print(f"peak RSS (workers): {_peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Prompt size benchmark for the agent's per-request tool selection in `grug.tool_selection`.
+
+Runs a set of typical requests, from small talk to dice rolls, reminders and rules lookups, through a `ToolSelector`
+over the agent's tool catalog, and reports for each request the tools offered and the prompt tokens their schemas
+take, against sending the whole catalog, and the time taken to select them. Each request also names the tools it needs
+(any one of them will do), and the recall, the share of requests offered a tool they need, is reported too.
+
+Token counts use tiktoken's `o200k_base` encoding if it is available, and roughly 4 characters to a token otherwise.
+
+With `--live`, each request is also sent to `ai_openai_model` with the whole catalog and with the selected tools, and
+the benchmark reports the prompt tokens the API counted, and the latency of each.
+
+Usage:
+    uv run python benchmarks/tool_selection.py
+    uv run python benchmarks/tool_selection.py --live --repeats 3
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+
+from grug.ai_tools import all_ai_tools
+from grug.guild_config import GuildSettings
+from grug.settings import settings
+from grug.tool_selection import ToolSelector
+
+_RULES = ("compendium_lookup", "information_search")
+
+# The channel type, the request, and the tools it needs, any one of which will do (none for small talk)
+REQUESTS = [
+    ("text", "hi grug!", ()),
+    ("text", "how are you doing today?", ()),
+    ("text", "tell me a joke about goblins", ()),
+    ("text", "roll 2d6+3 for damage", ("roll_dice",)),
+    ("text", "what are the odds to hit AC 22 with a +14 attack?", ("dice_probability",)),
+    ("text", "draw me a picture of our party fighting a dragon", ("generate_ai_image",)),
+    ("text", "remind me tomorrow at 6pm that we have a session", ("set_reminders",)),
+    ("text", "cancel my reminder about the session", ("cancel_reminder",)),
+    ("text", "what does the rulebook say about grappling?", _RULES),
+    ("text", "what spells can a level 3 wizard cast?", _RULES),
+    ("text", "how does flanking work?", _RULES),
+    ("text", "what does grabbed do", _RULES),
+    ("text", "how much damage does a longsword do", _RULES),
+    ("text", "what are the rules for grappling in pf2e", _RULES),
+    ("text", "how does sneak attack work", _RULES),
+    ("text", "can I cast two spells in one turn?", _RULES),
+    ("text", "what did we decide about the heist last week?", ("search_chat_history", "recall_facts")),
+    ("text", "remember that my character is an elf rogue named Vex", ("remember_facts",)),
+    (
+        "text",
+        "what was said in our last voice session?",
+        ("search_voice_session_transcript", "summarize_voice_session"),
+    ),
+    ("voice", "grug roll a d20", ("roll_dice",)),
+    ("voice", "grug what's the weather like in the dungeon", ()),
+    ("voice", "grug remind me in ten minutes to check on the pizza", ("set_reminders",)),
+    ("voice", "grug what does the frightened condition do", _RULES),
+]
+
+
+def _token_counter() -> tuple[str, Callable[[str], int]]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("o200k_base")
+        return "tiktoken o200k_base", lambda text: len(encoding.encode(text))
+    except Exception:
+        return "~4 characters per token", lambda text: round(len(text) / 4)
+
+
+def _schema_tokens(tools: list[BaseTool], count_tokens: Callable[[str], int]) -> int:
+    return sum(count_tokens(json.dumps(convert_to_openai_tool(tool))) for tool in tools)
+
+
+async def _live(args: argparse.Namespace, selected: dict[str, list[BaseTool]]) -> None:
+    """Send each request with the whole catalog and with the selected tools, reporting prompt tokens and latency."""
+    model = ChatOpenAI(model_name=settings.ai_openai_model, temperature=0, openai_api_key=settings.openai_api_key)
+    results: dict[str, dict[str, list[float]]] = {"catalog": {}, "selected": {}}
+
+    for name, tools_for in (("catalog", lambda _: all_ai_tools), ("selected", lambda text: selected[text])):
+        latencies, prompt_tokens = [], []
+        for _ in range(args.repeats):
+            for _, text, _ in REQUESTS:
+                tools = tools_for(text)
+                bound = model.bind_tools(tools) if tools else model
+                started_at = time.perf_counter()
+                response = await bound.ainvoke([HumanMessage(text)])
+                latencies.append(time.perf_counter() - started_at)
+                prompt_tokens.append(response.usage_metadata["input_tokens"])
+        results[name] = {"latency": latencies, "prompt_tokens": prompt_tokens}
+
+    print(f"\nlive, {settings.ai_openai_model}, {args.repeats} x {len(REQUESTS)} requests:")
+    for name, result in results.items():
+        p50, p95 = np.percentile(result["latency"], [50, 95])
+        print(
+            f"  {name:<9} prompt tokens mean={np.mean(result['prompt_tokens']):.0f}, "
+            f"latency p50={p50:.2f}s p95={p95:.2f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="Also measure prompt tokens and latency with the API.")
+    parser.add_argument("--repeats", type=int, default=1, help="How many times to send each request with --live.")
+    args = parser.parse_args()
+
+    counter_name, count_tokens = _token_counter()
+    selector = ToolSelector(
+        all_ai_tools,
+        max_tools=settings.ai_tool_selection_max_tools,
+        voice_max_tools=settings.ai_tool_selection_voice_max_tools,
+        min_score=settings.ai_tool_selection_min_score,
+        always_include=settings.ai_tool_selection_always_include,
+        fallback=settings.ai_tool_selection_fallback_tools,
+    )
+    guild_settings = GuildSettings.from_guild_config(1, None)
+    catalog_tokens = _schema_tokens(all_ai_tools, count_tokens)
+    print(f"{len(all_ai_tools)} tools in the catalog, {catalog_tokens} schema tokens ({counter_name})\n")
+
+    selected: dict[str, list[BaseTool]] = {}
+    offered_tokens, selection_seconds, hits, needs = [], [], 0, 0
+    for channel_type, text, needed in REQUESTS:
+        started_at = time.perf_counter()
+        tools = selector.select([HumanMessage(text)], guild_settings, channel_type)
+        selection_seconds.append(time.perf_counter() - started_at)
+        selected[text] = tools
+        offered_tokens.append(_schema_tokens(tools, count_tokens))
+        hit = not needed or any(tool.name in needed for tool in tools)
+        hits += bool(needed) and hit
+        needs += bool(needed)
+        print(
+            f"  {'' if hit else 'MISS '}{channel_type:<5} {text!r:<58} {offered_tokens[-1]:>5} tokens: "
+            f"{[t.name for t in tools]}"
+        )
+
+    p50, p95 = np.percentile(selection_seconds, [50, 95]) * 1000
+    print(
+        f"\nschema tokens per request: catalog={catalog_tokens}, selected mean={np.mean(offered_tokens):.0f} "
+        f"({1 - np.mean(offered_tokens) / catalog_tokens:.0%} fewer)"
+    )
+    print(f"recall: {hits}/{needs} requests that need a tool were offered one")
+    print(f"selection time p50={p50:.3f}ms p95={p95:.3f}ms")
+
+    if args.live:
+        asyncio.run(_live(args, selected))
+
+
+if __name__ == "__main__":
+    main()
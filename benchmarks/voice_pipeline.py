@@ -0,0 +1,371 @@
+"""
+Offline benchmark for the voice path, from the audio Discord delivers to the spoken reply.
+
+Replays synthetic multi-speaker audio into `SpeechRecognitionSink.write` the way Discord delivers it (20 ms packets
+while someone is talking, nothing while they are silent), in real time or faster. Each speaker chats in short phrases
+and now and then says the wake phrase, which is played at a tone of its own. Discord, STT, the agent and TTS are
+replaced by stand-ins:
+
+- a fake `VoiceRecvClient` and voice channel, which record what is played and posted.
+- an STT backend with a configurable latency, which "transcribes" audio containing the wake tone as the wake phrase and
+  anything else as chatter.
+- an agent and a TTS function with configurable latencies.
+
+Everything in between is the real pipeline: speech recognition, the STT dispatcher, transcript storage, the PGMQ hop to
+the voice responder, and the Discord dispatcher. Each speaker count runs in a fresh process, and reports:
+
+- CPU: the process's CPU time per speaker, as a percentage of one core.
+- memory: the peak resident set size, and how much it grew during the run.
+- wake-to-response latency: from the end of a wake phrase until the reply is posted, and until it is spoken.
+- queue depths: the deepest the STT dispatcher's queue and the channel's PGMQ queue got.
+
+Requires the database from `docker compose up postgres` with migrations applied, and ffmpeg on the PATH (for playback).
+Fake guild and channel IDs are used, and everything created is removed afterwards. No Discord, OpenAI or TTS calls
+are made.
+
+Usage:
+    uv run python benchmarks/voice_pipeline.py
+    uv run python benchmarks/voice_pipeline.py --speakers 1 5 10 20 --seconds 60 --speed 2 --stt-latency-ms 400
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import re
+import resource
+import tempfile
+import threading
+import time
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import speech_recognition as sr
+from discord.ext.voice_recv import VoiceData
+from langchain_core.messages import AIMessage
+from sqlalchemy import text
+
+from grug.audio import DISCORD_CHANNELS, DISCORD_SAMPLE_RATE, array_to_pcm, pcm_to_array, to_int16
+from grug.db import sqa_async_engine
+from grug.discord_dispatcher import discord_dispatcher
+from grug.discord_voice_client import DiscordVoiceClient
+from grug.models import VoiceSession, VoiceTranscriptSegment
+from grug.settings import settings
+from grug.transcripts import start_voice_session, transcript_writer
+from grug.voice_recognition import SpeechRecognitionSink
+
+_FAKE_ID_START = 10**18
+_FRAME_SECONDS = 0.02
+_FRAME_BYTES = int(DISCORD_SAMPLE_RATE * _FRAME_SECONDS) * DISCORD_CHANNELS * 2
+_WAKE_HZ = 700.0
+_SAMPLE_INTERVAL_SECONDS = 0.25
+_SPEAKER_PATTERN = re.compile(r"speaker (\d+)")
+
+
+def _phrase(seconds: float, frequency: float, rng: np.random.Generator) -> list[bytes]:
+    """Synthetic speech: a tone with a syllable-rate envelope and some noise, as 20 ms stereo packets."""
+    t = np.arange(int(seconds * DISCORD_SAMPLE_RATE)) / DISCORD_SAMPLE_RATE
+    voice = 6000 * np.sin(2 * np.pi * frequency * t) * (1 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    voice += rng.normal(0, 300, len(t))
+    pcm = array_to_pcm(to_int16(np.stack([voice, voice * 0.8], axis=1)))
+    return [pcm[i : i + _FRAME_BYTES] for i in range(0, len(pcm), _FRAME_BYTES)]
+
+
+class ToneSTTBackend:
+    """Stand-in STT backend, which hears the wake phrase in audio containing the wake tone."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    def transcribe(self, audio: sr.AudioData) -> str | None:
+        time.sleep(self.latency_seconds)
+        samples = pcm_to_array(audio.frame_data)
+        spectrum = np.abs(np.fft.rfft(samples))
+        frequencies = np.fft.rfftfreq(len(samples), 1 / audio.sample_rate)
+        wake_band = np.abs(frequencies - _WAKE_HZ) < 10
+        if wake_band.any() and spectrum[wake_band].max() > 0.25 * spectrum.max():
+            return f"Hey, {settings.ai_name}, are you there?"
+        return "Mumble mumble, pass the dice."
+
+
+class FakeAgent:
+    """Stand-in for the ReAct agent, answering the speaker after a fixed latency."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    async def ainvoke(self, input: dict, config: dict) -> dict:
+        await asyncio.sleep(self.latency_seconds)
+        speaker_id = config["configurable"]["user_id"].rsplit("-", 1)[-1]
+        return {"messages": [*input["messages"], AIMessage(f"Grug hear you, speaker {speaker_id}.")]}
+
+
+@dataclass
+class Recorder:
+    """Everything the fake Discord objects saw, timestamped with `time.monotonic`."""
+
+    wakes: list[tuple[int, float]] = field(default_factory=list)
+    posts: list[tuple[int, float]] = field(default_factory=list)
+    spoken: list[tuple[int, float]] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+@dataclass
+class FakeUser:
+    id: int
+    display_name: str
+
+
+@dataclass
+class FakeGuild:
+    id: int
+    name: str = "Benchmark Guild"
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild, recorder: Recorder):
+        self.id = channel_id
+        self.name = "benchmark-voice"
+        self.guild = guild
+        self.recorder = recorder
+
+    async def send(self, content: str | None = None, **kwargs) -> None:
+        now = time.monotonic()
+        for speaker_id in _SPEAKER_PATTERN.findall(content or ""):
+            self.recorder.posts.append((int(speaker_id), now))
+
+
+class FakeVoiceClient:
+    """Stand-in for `VoiceRecvClient`, connected until `disconnect` and recording playback."""
+
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+        self.guild = channel.guild
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def play(self, source) -> None:
+        source.cleanup()
+
+    def disconnect(self) -> None:
+        self.connected = False
+
+
+class FakeDiscordClient:
+    def event(self, coro):
+        return coro
+
+
+def _make_tts(latency_seconds: float, recorder: Recorder, directory: Path):
+    audio_path = directory / "reply.wav"
+    with wave.open(str(audio_path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(24_000)
+        wav_file.writeframes(bytes(24_000))
+
+    def tts(text_to_speak: str, voice: str | None = None) -> Path:
+        time.sleep(latency_seconds)
+        now = time.monotonic()
+        for speaker_id in _SPEAKER_PATTERN.findall(text_to_speak):
+            recorder.spoken.append((int(speaker_id), now))
+        return audio_path
+
+    return tts
+
+
+def _speak(
+    sink: SpeechRecognitionSink,
+    speaker: FakeUser,
+    recorder: Recorder,
+    seconds: float,
+    speed: float,
+    wake_interval: float,
+    seed: int,
+) -> None:
+    """Talk into the sink for `seconds` of audio, paced at `speed` times real time."""
+    rng = np.random.default_rng(seed)
+    audio_time = 0.0
+    next_wake = rng.uniform(2, wake_interval)
+    started_at = time.monotonic()
+
+    while audio_time < seconds:
+        wake = audio_time >= next_wake
+        frames = _phrase(1.2, _WAKE_HZ, rng) if wake else _phrase(rng.uniform(1, 3), rng.uniform(120, 300), rng)
+        for frame in frames:
+            # Pace against the start, so sleep overshoot doesn't accumulate
+            if (delay := started_at + audio_time / speed - time.monotonic()) > 0:
+                time.sleep(delay)
+            sink.write(speaker, VoiceData(object(), speaker, pcm=frame))
+            audio_time += _FRAME_SECONDS
+
+        if wake:
+            with recorder.lock:
+                recorder.wakes.append((speaker.id, time.monotonic()))
+            next_wake = audio_time + wake_interval
+
+        # Silence, during which Discord sends nothing
+        audio_time += rng.uniform(1, 2.5)
+
+
+def _latencies(wakes: list[tuple[int, float]], replies: list[tuple[int, float]]) -> list[float]:
+    """Pair each wake with the first later reply to the same speaker."""
+    latencies = []
+    for speaker_id, woke_at in wakes:
+        reply_times = [
+            replied_at for replied_id, replied_at in replies if replied_id == speaker_id and replied_at > woke_at
+        ]
+        if reply_times:
+            latencies.append(min(reply_times) - woke_at)
+    return latencies
+
+
+def _percentiles(values: list[float]) -> str:
+    if not values:
+        return "-"
+    p50, p95 = np.percentile(values, [50, 95])
+    return f"{p50:.2f}/{p95:.2f}s"
+
+
+async def _cleanup(guild_id: int) -> None:
+    async with sqa_async_engine.begin() as conn:
+        for table in (VoiceTranscriptSegment.__tablename__, VoiceSession.__tablename__):
+            await conn.execute(text(f"DELETE FROM {table} WHERE guild_id = :guild_id"), {"guild_id": guild_id})
+
+
+async def _run(speakers: int, args: argparse.Namespace) -> dict:
+    recorder = Recorder()
+    guild = FakeGuild(id=_FAKE_ID_START + speakers)
+    channel = FakeVoiceChannel(channel_id=_FAKE_ID_START + speakers, guild=guild, recorder=recorder)
+    voice_client = FakeVoiceClient(channel)
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    voice_session = await start_voice_session(guild_id=guild.id, channel_id=channel.id)
+    sink = SpeechRecognitionSink(
+        discord_channel=channel,  # type: ignore[arg-type]
+        voice_session=voice_session,
+        stt_backend=ToneSTTBackend(latency_seconds=args.stt_latency_ms / 1000),
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        voice = DiscordVoiceClient(
+            discord_client=FakeDiscordClient(),  # type: ignore[arg-type]
+            react_agent=FakeAgent(latency_seconds=args.agent_latency_ms / 1000),  # type: ignore[arg-type]
+            tts=_make_tts(args.tts_latency_ms / 1000, recorder, Path(directory)),
+        )
+        background = [
+            asyncio.create_task(discord_dispatcher.run()),
+            asyncio.create_task(transcript_writer.run()),
+        ]
+        responder = asyncio.create_task(voice._listen_to_voice_channel(voice_client, voice_session))  # type: ignore
+        # The responder purges the channel's queue when it starts
+        await asyncio.sleep(1)
+
+        max_stt_depth = max_pgmq_depth = 0
+
+        async def sample_queues():
+            nonlocal max_stt_depth, max_pgmq_depth
+            while True:
+                max_stt_depth = max(max_stt_depth, sink.dispatcher.queue_depth)
+                metrics = await asyncio.to_thread(sink.queue.metrics, str(channel.id))
+                max_pgmq_depth = max(max_pgmq_depth, metrics.queue_length)
+                await asyncio.sleep(_SAMPLE_INTERVAL_SECONDS)
+
+        background.append(asyncio.create_task(sample_queues()))
+
+        started_at, cpu_started_at = time.monotonic(), time.process_time()
+        # A thread per speaker, like the packets arriving for each user
+        speaker_threads = [
+            threading.Thread(
+                target=_speak,
+                args=(
+                    sink,
+                    FakeUser(id=speaker_id, display_name=f"speaker {speaker_id}"),
+                    recorder,
+                    args.seconds,
+                    args.speed,
+                    args.wake_interval,
+                    speaker_id,
+                ),
+            )
+            for speaker_id in range(1, speakers + 1)
+        ]
+        for thread in speaker_threads:
+            thread.start()
+        while any(thread.is_alive() for thread in speaker_threads):
+            await asyncio.sleep(0.1)
+
+        # Let the last wakes be answered
+        drain_deadline = time.monotonic() + args.drain_seconds
+        while time.monotonic() < drain_deadline and len(_latencies(recorder.wakes, recorder.spoken)) < len(
+            recorder.wakes
+        ):
+            await asyncio.sleep(0.1)
+
+        wall_seconds = time.monotonic() - started_at
+        cpu_seconds = time.process_time() - cpu_started_at
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        voice_client.disconnect()
+        sink.cleanup()
+        await responder
+        for task in background:
+            task.cancel()
+
+    sink.queue.drop_queue(str(channel.id))
+    await _cleanup(guild.id)
+
+    return {
+        "speakers": speakers,
+        "cpu_percent_per_speaker": 100 * cpu_seconds / wall_seconds / speakers,
+        "peak_rss_mb": peak_rss_mb,
+        "rss_growth_mb": peak_rss_mb - baseline_rss_mb,
+        "wakes": len(recorder.wakes),
+        "posted_latencies": _latencies(recorder.wakes, recorder.posts),
+        "spoken_latencies": _latencies(recorder.wakes, recorder.spoken),
+        "max_stt_depth": max_stt_depth,
+        "max_pgmq_depth": max_pgmq_depth,
+        "stt_requests": sink.dispatcher.stats.requests_sent,
+    }
+
+
+def _run_in_process(speakers: int, args: argparse.Namespace, results: multiprocessing.Queue) -> None:
+    results.put(asyncio.run(_run(speakers, args)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--speakers", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--seconds", type=float, default=45.0, help="Audio seconds each speaker talks for.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, as a multiple of real time.")
+    parser.add_argument("--wake-interval", type=float, default=20.0, help="Audio seconds between a speaker's wakes.")
+    parser.add_argument("--stt-latency-ms", type=float, default=300.0)
+    parser.add_argument("--agent-latency-ms", type=float, default=800.0)
+    parser.add_argument("--tts-latency-ms", type=float, default=500.0)
+    parser.add_argument("--drain-seconds", type=float, default=30.0, help="How long to wait for the last replies.")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'speakers':>8} {'cpu/speaker':>12} {'peak rss':>9} {'rss growth':>11} {'answered':>9} "
+        f"{'posted p50/p95':>15} {'spoken p50/p95':>15} {'max stt q':>10} {'max pgmq q':>11} {'stt reqs':>9}"
+    )
+    for speakers in args.speakers:
+        results = context.Queue()
+        process = context.Process(target=_run_in_process, args=(speakers, args, results))
+        process.start()
+        result = results.get()
+        process.join()
+        print(
+            f"{result['speakers']:>8} {result['cpu_percent_per_speaker']:>11.1f}% {result['peak_rss_mb']:>7.0f}MB "
+            f"{result['rss_growth_mb']:>9.0f}MB {len(result['spoken_latencies']):>4}/{result['wakes']:<4} "
+            f"{_percentiles(result['posted_latencies']):>15} {_percentiles(result['spoken_latencies']):>15} "
+            f"{result['max_stt_depth']:>10} {result['max_pgmq_depth']:>11} {result['stt_requests']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
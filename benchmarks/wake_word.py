@@ -0,0 +1,119 @@
+"""
+False-accept / false-reject benchmark for the local wake word spotter.
+
+By default, a synthetic corpus of vowel-formant "speech" is generated: the wake phrase is a fixed syllable sequence
+spoken with random pitch, tempo, loudness and background noise, and the negatives are other random syllable sequences.
+Real recordings can be used instead by pointing the script at directories of 16-bit WAV files.
+
+Usage:
+    uv run python benchmarks/wake_word.py
+    uv run python benchmarks/wake_word.py --enroll-dir enroll/ --positive-dir positive/ --negative-dir negative/
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from grug.wake_word import WakeWordSpotter, read_wav
+
+SAMPLE_RATE = 48_000
+
+# (F1, F2) formant pairs for a handful of vowel-like syllables
+_SYLLABLES = {
+    "ee": (270, 2290),
+    "ih": (390, 1990),
+    "eh": (530, 1840),
+    "ae": (660, 1720),
+    "ah": (730, 1090),
+    "aw": (570, 840),
+    "uh": (640, 1190),
+    "oo": (300, 870),
+}
+_WAKE_PHRASE = ["eh", "ee", "uh", "oo"]
+
+
+def _syllable(formants: tuple[int, int], pitch: float, seconds: float, rng: np.random.Generator) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    harmonics = np.arange(1, int(4000 / pitch))[:, None]
+    envelope = sum(np.exp(-(((harmonics * pitch) - f) ** 2) / (2 * 120.0**2)) for f in formants)
+    tone = (envelope * np.sin(2 * np.pi * harmonics * pitch * t + rng.uniform(0, 2 * np.pi, harmonics.shape))).sum(0)
+    return tone * np.hanning(len(t))
+
+
+def synthesize(syllables: list[str], rng: np.random.Generator) -> np.ndarray:
+    """Synthesize a syllable sequence with random speaker and recording conditions."""
+    pitch = rng.uniform(90, 220)
+    tempo = rng.uniform(0.8, 1.25)
+    audio = np.concatenate(
+        [_syllable(_SYLLABLES[s], pitch * rng.uniform(0.95, 1.05), 0.18 / tempo, rng) for s in syllables]
+    )
+    audio /= np.abs(audio).max()
+    audio *= rng.uniform(0.2, 0.9)
+    audio += rng.normal(0, rng.uniform(0.005, 0.03), len(audio))
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+def _random_syllables(rng: np.random.Generator, count: int) -> list[str]:
+    return list(rng.choice(list(_SYLLABLES), size=count))
+
+
+def synthetic_corpus(n_enroll: int, n_test: int, seed: int) -> tuple[list, list, list]:
+    rng = np.random.default_rng(seed)
+    enroll = [synthesize(_WAKE_PHRASE, rng) for _ in range(n_enroll)]
+    positives = [synthesize(_WAKE_PHRASE + _random_syllables(rng, rng.integers(2, 10)), rng) for _ in range(n_test)]
+    negatives = [synthesize(_random_syllables(rng, rng.integers(4, 14)), rng) for _ in range(n_test)]
+    return enroll, positives, negatives
+
+
+def _load_dir(directory: Path) -> list[np.ndarray]:
+    samples = []
+    for path in sorted(directory.glob("*.wav")):
+        audio, sample_rate = read_wav(path)
+        if sample_rate != SAMPLE_RATE:
+            raise ValueError(f"{path} must be sampled at {SAMPLE_RATE} Hz")
+        samples.append(audio)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--enroll-dir", type=Path)
+    parser.add_argument("--positive-dir", type=Path)
+    parser.add_argument("--negative-dir", type=Path)
+    parser.add_argument("--n-enroll", type=int, default=5)
+    parser.add_argument("--n-test", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.enroll_dir:
+        enroll, positives, negatives = (_load_dir(d) for d in (args.enroll_dir, args.positive_dir, args.negative_dir))
+    else:
+        enroll, positives, negatives = synthetic_corpus(args.n_enroll, args.n_test, args.seed)
+
+    spotter = WakeWordSpotter()
+    for sample in enroll:
+        spotter.enroll(sample, SAMPLE_RATE)
+    threshold = spotter.threshold
+
+    start = time.process_time()
+    positive_scores = np.array([spotter.score(s, SAMPLE_RATE) for s in positives])
+    negative_scores = np.array([spotter.score(s, SAMPLE_RATE) for s in negatives])
+    cpu_seconds = time.process_time() - start
+    audio_seconds = sum(min(len(s) / SAMPLE_RATE, spotter.search_seconds) for s in positives + negatives)
+
+    print(f"templates: {len(enroll)}, positives: {len(positives)}, negatives: {len(negatives)}")
+    print(f"CPU per utterance: {1000 * cpu_seconds / (len(positives) + len(negatives)):.2f} ms")
+    print(f"CPU per second of searched audio: {1000 * cpu_seconds / audio_seconds:.2f} ms")
+    print()
+    print(f"{'threshold':>10} {'false reject':>13} {'false accept':>13}")
+    for candidate in sorted({threshold, *np.quantile(np.concatenate([positive_scores, negative_scores]), [0.3, 0.5])}):
+        frr = np.mean(positive_scores > candidate)
+        far = np.mean(negative_scores <= candidate)
+        marker = "  <- calibrated" if candidate == threshold else ""
+        print(f"{candidate:>10.3f} {frr:>13.1%} {far:>13.1%}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,17 @@ import contextlib
 import anyio
 from loguru import logger
 
+from grug.audio_playback import preload_sound_effects
+from grug.chat_archive import chat_archive_writer
+from grug.compendium import load_compendium
 from grug.db import init_db
 from grug.discord_client import DiscordClient
+from grug.discord_dispatcher import discord_dispatcher
+from grug.guild_config import listen_for_guild_config_changes
+from grug.replicas import replica_coordinator
 from grug.scheduler import start_scheduler
 from grug.settings import settings
+from grug.transcripts import transcript_writer
 
 # TODO: evaluate llm caching: https://python.langchain.com/api_reference/community/cache.html
 
@@ -22,10 +29,19 @@ async def main():
     logger.info("Starting Grug...")
 
     init_db()
+    preload_sound_effects()
+    load_compendium()
+
+    discord_client = DiscordClient()
 
     async with anyio.create_task_group() as tg:
-        tg.start_soon(DiscordClient().start, settings.discord_token.get_secret_value())
+        tg.start_soon(replica_coordinator.run, lambda: [guild.id for guild in discord_client.guilds])
+        tg.start_soon(discord_client.start, settings.discord_token.get_secret_value())
+        tg.start_soon(discord_dispatcher.run)
         tg.start_soon(start_scheduler)
+        tg.start_soon(listen_for_guild_config_changes)
+        tg.start_soon(transcript_writer.run)
+        tg.start_soon(chat_archive_writer.run)
 
     logger.info("Grug has shut down...")
 
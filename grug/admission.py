@@ -0,0 +1,361 @@
+"""
+Admission control for the agent, so a burst of requests degrades gracefully rather than piling up on the LLM API.
+
+Every agent invocation is admitted by `admission_controller` first, which keeps the agent within:
+
+- a global limit on concurrent agent runs, and
+- a token budget per minute (e.g. the OpenAI rate limit). A run is charged its estimated token usage, a moving average
+  of recent runs, when it is admitted, and the charge is settled against its actual usage when it finishes.
+
+Waiting requests are served by class: voice first, as users are waiting on the line, then mentions and DMs, then
+background work. Within a class, guilds share the capacity by weighted fair queuing, so one busy server can't crowd
+out the others: each request is tagged with a virtual finish time, its guild's previous tag (or the class's virtual
+time, if later) plus 1 / the guild's weight, and the smallest tag is admitted first. DMs are queued per user.
+
+When overloaded, requests are shed up front rather than left to time out: `AdmissionRejected` is raised if the
+request's estimated wait, behind the requests fair queuing puts ahead of it, is longer than its class's maximum wait,
+or once it has waited that long. When the queue is full, the waiting request that would be admitted last is shed to
+make room, if the new request would go before it, so a flood from one guild sheds that guild's requests. Callers reply
+with `settings.admission_overloaded_message` instead.
+
+`AdmissionController.metrics` reports queue wait percentiles per class, admissions and rejections.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Hashable
+
+import numpy as np
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from loguru import logger
+
+from grug.settings import settings
+from grug.tracing import set_attributes
+
+_WAIT_SAMPLES = 1000
+_METRICS_LOG_INTERVAL_SECONDS = 300
+# The weight of the latest run in the moving averages of token usage and run time
+_EWMA_ALPHA = 0.1
+_INITIAL_RUN_SECONDS = 5.0
+_MAX_FINISH_TAGS = 10_000
+
+
+class RequestClass(IntEnum):
+    VOICE = 0
+    """Replies in voice chat, admitted first."""
+    MENTION = 1
+    """Replies to mentions and DMs."""
+    BACKGROUND = 2
+    """Work nobody is waiting on, e.g. voice channel introductions, admitted when no replies are waiting."""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed because the agent is overloaded."""
+
+    def __init__(self, request_class: RequestClass, reason: str):
+        super().__init__(f"The {request_class.name.lower()} request was rejected: {reason}")
+        self.request_class = request_class
+        self.reason = reason
+
+
+@dataclass(eq=False)
+class _Waiter:
+    request_class: RequestClass
+    future: asyncio.Future[float] = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+@dataclass(eq=False)
+class Admission:
+    """An admitted request, which settles its token charge with `record_usage`."""
+
+    request_class: RequestClass
+    charged_tokens: float
+    queue_wait_seconds: float
+    tokens_used: int | None = None
+    admitted_at: float = field(default_factory=time.monotonic)
+
+    def record_usage(self, messages: list[BaseMessage]) -> None:
+        """Record the tokens the agent used responding to the last human message, from the model's usage metadata."""
+        usage = [
+            message.usage_metadata["total_tokens"]
+            for message in itertools.takewhile(
+                lambda message: not isinstance(message, HumanMessage), reversed(messages)
+            )
+            if isinstance(message, AIMessage) and message.usage_metadata
+        ]
+        if usage:
+            self.tokens_used = sum(usage)
+
+
+class AdmissionController:
+    """Admits agent requests within a concurrency limit and token budget, by class and fairly across guilds."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_wait_seconds: dict[RequestClass, float],
+        tokens_per_minute: int | None = None,
+        initial_tokens_estimate: int = 4000,
+        max_queued: int = 200,
+        guild_weights: dict[Hashable, float] | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queued = max_queued
+        self.guild_weights = guild_weights or {}
+
+        self.in_flight = 0
+        self.estimated_tokens = float(initial_tokens_estimate)
+        self.run_seconds = _INITIAL_RUN_SECONDS
+
+        # Per class, a heap of (virtual finish tag, sequence, waiter)
+        self._queues: dict[RequestClass, list[tuple[float, int, _Waiter]]] = {c: [] for c in RequestClass}
+        self._queued = dict.fromkeys(RequestClass, 0)
+        self._virtual_time = dict.fromkeys(RequestClass, 0.0)
+        self._finish_tags: dict[tuple[RequestClass, Hashable], float] = {}
+        self._sequence = itertools.count()
+
+        self._tokens = float(tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._refill_timer: asyncio.TimerHandle | None = None
+
+        self._waits: dict[RequestClass, Deque[float]] = {c: deque(maxlen=_WAIT_SAMPLES) for c in RequestClass}
+        self._admitted = dict.fromkeys(RequestClass, 0)
+        self._rejected = dict.fromkeys(RequestClass, 0)
+        self._metrics_logged_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute, self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60
+            )
+        self._refilled_at = now
+
+    def _charge(self) -> float:
+        # A run larger than the whole budget is admitted once the budget is full, rather than never
+        return min(self.estimated_tokens, self.tokens_per_minute) if self.tokens_per_minute else 0.0
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < self.max_concurrency and (not self.tokens_per_minute or self._tokens >= self._charge())
+
+    def _take_slot(self) -> float:
+        charge = self._charge()
+        self.in_flight += 1
+        self._tokens -= charge
+        return charge
+
+    def _pop(self) -> _Waiter | None:
+        """Pop the waiter with the smallest finish tag from the highest class with requests waiting."""
+        for request_class, queue in self._queues.items():
+            while queue:
+                tag, _, waiter = heapq.heappop(queue)
+                # Skip requests that were shed or cancelled while waiting
+                if waiter.future.done():
+                    continue
+                self._queued[request_class] -= 1
+                self._virtual_time[request_class] = tag
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        """Admit waiting requests while there is capacity, and wait for the token budget to refill if it is short."""
+        self._refill()
+        while any(self._queued.values()) and self._has_capacity():
+            if (waiter := self._pop()) is None:
+                break
+            waiter.future.set_result(self._take_slot())
+
+        if (
+            self.tokens_per_minute
+            and any(self._queued.values())
+            and self.in_flight < self.max_concurrency
+            and self._refill_timer is None
+        ):
+            refill_seconds = (self._charge() - self._tokens) * 60 / self.tokens_per_minute
+            self._refill_timer = asyncio.get_running_loop().call_later(refill_seconds, self._on_refill)
+
+    def _on_refill(self) -> None:
+        self._refill_timer = None
+        self._dispatch()
+
+    def _tag(self, request_class: RequestClass, tenant: Hashable) -> float:
+        """The virtual finish tag of the guild's next request: its previous tag, or the virtual time, plus its share."""
+        start = max(self._virtual_time[request_class], self._finish_tags.get((request_class, tenant), 0.0))
+        return start + 1 / self.guild_weights.get(tenant, 1.0)
+
+    def _enqueue(self, request_class: RequestClass, tenant: Hashable, tag: float) -> _Waiter:
+        if len(self._finish_tags) > _MAX_FINISH_TAGS:
+            # Tags behind the virtual time no longer change a guild's place in the queue
+            self._finish_tags = {key: tag for key, tag in self._finish_tags.items() if tag > self._virtual_time[key[0]]}
+
+        self._finish_tags[(request_class, tenant)] = tag
+        waiter = _Waiter(request_class)
+        heapq.heappush(self._queues[request_class], (tag, next(self._sequence), waiter))
+        self._queued[request_class] += 1
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        waiter.future.cancel()
+        self._queued[waiter.request_class] -= 1
+
+    def _ahead(self, request_class: RequestClass, tag: float) -> int:
+        """The number of waiting requests that would be admitted before one of the class with the tag."""
+        ahead = sum(count for c, count in self._queued.items() if c < request_class)
+        return ahead + sum(
+            1 for other_tag, _, waiter in self._queues[request_class] if other_tag <= tag and not waiter.future.done()
+        )
+
+    def estimated_wait(self, ahead: int) -> float:
+        """Estimate how long a request would wait behind `ahead` others, from the recent run time and token usage."""
+        runs_per_second = self.max_concurrency / self.run_seconds
+        if self.tokens_per_minute:
+            runs_per_second = min(runs_per_second, self.tokens_per_minute / 60 / max(self.estimated_tokens, 1.0))
+        return (ahead + 1) / runs_per_second
+
+    def _reject(self, request_class: RequestClass, reason: str) -> AdmissionRejected:
+        self._rejected[request_class] += 1
+        logger.warning(f"Shedding a {request_class.name.lower()} agent request: {reason}")
+        return AdmissionRejected(request_class, reason)
+
+    def _make_room(self, request_class: RequestClass, tag: float) -> bool:
+        """
+        When the queue is full, shed the waiting request that would be admitted last, if the new one would go before
+        it, so a full queue sheds the busiest guild's and the lowest class's requests first.
+        """
+        for victim_class in reversed(RequestClass):
+            live = [
+                (other_tag, waiter) for other_tag, _, waiter in self._queues[victim_class] if not waiter.future.done()
+            ]
+            if not live:
+                continue
+            victim_tag, victim = max(live, key=lambda entry: entry[0])
+            if (victim_class, victim_tag) <= (request_class, tag):
+                return False
+            self._queued[victim_class] -= 1
+            victim.future.set_exception(self._reject(victim_class, "it was displaced by a request ahead of it"))
+            return True
+        return False
+
+    async def _wait(self, request_class: RequestClass, tenant: Hashable) -> float:
+        """Queue the request until it is admitted, returning the tokens it was charged."""
+        max_wait = self.max_wait_seconds[request_class]
+        tag = self._tag(request_class, tenant)
+        if sum(self._queued.values()) >= self.max_queued and not self._make_room(request_class, tag):
+            raise self._reject(request_class, f"{self.max_queued} requests are already waiting")
+        if (estimated_wait := self.estimated_wait(self._ahead(request_class, tag))) > max_wait:
+            raise self._reject(request_class, f"the estimated wait of {estimated_wait:.0f}s is over {max_wait:.0f}s")
+
+        waiter = self._enqueue(request_class, tenant, tag)
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), max_wait)
+        except TimeoutError:
+            # The request may have been admitted just as the wait timed out
+            if waiter.future.done():
+                return waiter.future.result()
+            self._abandon(waiter)
+            raise self._reject(request_class, f"it waited over {max_wait:.0f}s") from None
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                self._abandon(waiter)
+            elif not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._release(waiter.future.result())
+            raise
+
+    def _release(self, charged_tokens: float, admission: Admission | None = None) -> None:
+        self.in_flight -= 1
+        if admission is not None:
+            self.run_seconds += _EWMA_ALPHA * (time.monotonic() - admission.admitted_at - self.run_seconds)
+            if admission.tokens_used is not None:
+                self._tokens += charged_tokens - admission.tokens_used
+                self.estimated_tokens += _EWMA_ALPHA * (admission.tokens_used - self.estimated_tokens)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        request_class: RequestClass,
+        guild_id: int | None,
+        user_id: int | str | None = None,
+    ) -> AsyncIterator[Admission]:
+        """
+        Wait to be admitted, holding the admission until the context exits.
+
+        Args:
+            request_class: The class of the request, which decides its priority and how long it can wait.
+            guild_id: The guild the request is for, to share capacity fairly across guilds.
+            user_id: The user the request is for, to share capacity fairly across DMs, when there is no guild.
+
+        Raises:
+            AdmissionRejected: If the request is shed because the agent is overloaded.
+        """
+        self._maybe_log_metrics()
+        started_at = time.monotonic()
+        self._refill()
+        if not any(count for c, count in self._queued.items() if c <= request_class) and self._has_capacity():
+            charged_tokens = self._take_slot()
+        else:
+            charged_tokens = await self._wait(request_class, guild_id if guild_id is not None else ("dm", user_id))
+
+        admission = Admission(request_class, charged_tokens, queue_wait_seconds=time.monotonic() - started_at)
+        self._admitted[request_class] += 1
+        self._waits[request_class].append(admission.queue_wait_seconds)
+        set_attributes(
+            admission_class=request_class.name.lower(), admission_queue_seconds=round(admission.queue_wait_seconds, 3)
+        )
+        try:
+            yield admission
+        finally:
+            self._release(charged_tokens, admission)
+
+    def _maybe_log_metrics(self) -> None:
+        if time.monotonic() - self._metrics_logged_at >= _METRICS_LOG_INTERVAL_SECONDS:
+            self._metrics_logged_at = time.monotonic()
+            logger.info(f"Admission controller: {self.metrics()}")
+
+    def metrics(self) -> dict[str, Any]:
+        """Queue depths, admissions and rejections, and queue wait percentiles over recent requests, per class."""
+        queue_wait_ms = {}
+        for request_class, waits in self._waits.items():
+            if waits:
+                p50, p95, p99 = np.percentile(np.fromiter(waits, dtype=float), [50, 95, 99]) * 1000
+                queue_wait_ms[request_class.name.lower()] = {
+                    "p50": round(float(p50), 1),
+                    "p95": round(float(p95), 1),
+                    "p99": round(float(p99), 1),
+                    "max": round(max(waits) * 1000, 1),
+                }
+
+        self._refill()
+        return {
+            "in_flight": self.in_flight,
+            "queued": {c.name.lower(): count for c, count in self._queued.items()},
+            "admitted": {c.name.lower(): count for c, count in self._admitted.items()},
+            "rejected": {c.name.lower(): count for c, count in self._rejected.items()},
+            "queue_wait_ms": queue_wait_ms,
+            "tokens_available": round(self._tokens) if self.tokens_per_minute else None,
+            "estimated_tokens_per_run": round(self.estimated_tokens),
+            "run_seconds": round(self.run_seconds, 2),
+        }
+
+
+admission_controller = AdmissionController(
+    max_concurrency=settings.admission_max_concurrency,
+    max_wait_seconds={
+        RequestClass.VOICE: settings.admission_voice_max_wait_seconds,
+        RequestClass.MENTION: settings.admission_mention_max_wait_seconds,
+        RequestClass.BACKGROUND: settings.admission_background_max_wait_seconds,
+    },
+    tokens_per_minute=settings.admission_tokens_per_minute,
+    initial_tokens_estimate=settings.admission_initial_tokens_estimate,
+    max_queued=settings.admission_max_queued,
+    guild_weights=settings.admission_guild_weights,
+)
@@ -1,15 +1,22 @@
 from contextlib import asynccontextmanager
+from datetime import UTC, datetime
 from typing import Any, AsyncGenerator
 
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.graph.graph import CompiledGraph
 from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt.chat_agent_executor import AgentState
 from langgraph.store.postgres import AsyncPostgresStore
 
+from grug.ai_chat_model import get_chat_model
 from grug.ai_tools import all_ai_tools
 from grug.db import get_genai_psycopg_async_pool
+from grug.guild_config import get_guild_settings
+from grug.memories import get_memory_index_config
 from grug.settings import settings
+from grug.tool_selection import ToolSelectingModel
 
 # TODO: implement the consept of a "focus" where the agent uses it's focus as reference to how it answers questions.
 #       For example, we will build Grug initially with a default focus on Pathfinder 2e, but we want to expand this to
@@ -35,7 +42,7 @@ async def get_react_agent() -> AsyncGenerator[CompiledGraph, Any]:
 
     # Configure `store` and `checkpointer` for long-term and short-term memory
     # (Ref: https://langchain-ai.github.io/langgraphjs/concepts/memory/#what-is-memory)
-    store = AsyncPostgresStore(conn_pool)
+    store = AsyncPostgresStore(conn_pool, index=get_memory_index_config())
     await store.setup()
     checkpointer = AsyncPostgresSaver(conn_pool)
     await checkpointer.setup()
@@ -53,22 +60,27 @@ async def get_react_agent() -> AsyncGenerator[CompiledGraph, Any]:
         ]
     )
 
+    async def state_modifier(state: AgentState, config: RunnableConfig) -> list[BaseMessage]:
+        """Build the system prompt, using the persona configured for the guild the request came from."""
+        guild_settings = await get_guild_settings(config.get("configurable", {}).get("guild_id"))
+        instructions = guild_settings.ai_instructions
+        system_prompt = (
+            f"# Primary Instructions:\n{base_instructions}\n"
+            f"- the current date and time is {datetime.now(tz=UTC):%A %Y-%m-%d %H:%M} UTC.\n\n"
+            f"{'# Additional Instructions:\n' + instructions if instructions else ''}"
+        )
+        return [SystemMessage(content=system_prompt)] + state["messages"]
+
+    # Send only the tools relevant to each request, rather than every tool's schema with every request
+    model = ToolSelectingModel(get_chat_model()) if settings.ai_tool_selection_enabled else get_chat_model()
+
     try:
         yield create_react_agent(
-            model=ChatOpenAI(
-                model_name=settings.ai_openai_model,
-                temperature=0,
-                max_tokens=None,
-                max_retries=2,
-                openai_api_key=settings.openai_api_key,
-            ),
+            model=model,
             tools=all_ai_tools,
             checkpointer=checkpointer,
             store=store,
-            state_modifier=(
-                f"# Primary Instructions:\n{base_instructions}\n\n"
-                f"{'# Additional Instructions:\n' + settings.ai_instructions if settings.ai_instructions else ''}"
-            ),
+            state_modifier=state_modifier,
         )
 
     finally:
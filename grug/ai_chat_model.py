@@ -0,0 +1,284 @@
+"""
+A chat model wrapper that keeps slow or failing upstream requests from stalling the agent.
+
+`ResilientChatModel` sends each request to its primary model and:
+
+- hedges: if the request runs past a deadline adapted to the primary's recent latency (its p95 by default), a duplicate
+  request is sent, the first response to arrive is used, and the other request is cancelled. Hedges are capped to a
+  share of recent requests, so a slow upstream doesn't get twice the load.
+- fails over: if the primary fails (after the hedge, if any), the request goes to the fallback model, e.g. another
+  model or an OpenAI-compatible endpoint.
+- circuit breaks: after several consecutive failures a model is skipped for a cool-down period, then a single trial
+  request decides whether it is used again.
+
+`ResilientChatModel.metrics` reports the hedge rate, how often hedges won, the latency they saved, and failovers.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Sequence
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+from loguru import logger
+from pydantic import PrivateAttr
+
+from grug.settings import settings
+
+_LATENCY_SAMPLES = 200
+_MIN_LATENCY_SAMPLES = 20
+_METRICS_LOG_INTERVAL_SECONDS = 300
+
+
+class CircuitOpenError(Exception):
+    """Raised when every model's circuit breaker is open."""
+
+
+class _CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, and lets a single trial request through after the reset."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+
+class ResilientChatModel(BaseChatModel):
+    """Wraps a primary, and optionally a fallback, chat model with request hedging, failover and circuit breakers."""
+
+    primary: BaseChatModel
+    fallback: BaseChatModel | None = None
+    hedge_percentile: float = 95.0
+    hedge_min_delay_seconds: float = 1.0
+    hedge_initial_delay_seconds: float = 10.0
+    hedge_max_rate: float = 0.1
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+
+    _latencies: Deque[float] = PrivateAttr(default_factory=lambda: deque(maxlen=_LATENCY_SAMPLES))
+    _recent_hedges: Deque[bool] = PrivateAttr(default_factory=lambda: deque(maxlen=_LATENCY_SAMPLES))
+    _breakers: dict[str, _CircuitBreaker] = PrivateAttr(default_factory=dict)
+    _counts: dict[str, float] = PrivateAttr(
+        default_factory=lambda: dict.fromkeys(
+            ("requests", "hedges", "hedge_wins", "hedge_seconds_saved", "failovers", "failures"), 0
+        )
+    )
+    _metrics_logged_at: float = PrivateAttr(default_factory=time.monotonic)
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat-model"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {
+            "primary": self.primary._identifying_params,
+            "fallback": self.fallback and self.fallback._identifying_params,
+        }
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> Runnable[LanguageModelInput, BaseMessage]:
+        # Tools are formatted by the primary, and the resulting request arguments are passed to whichever model is used
+        return self.bind(**self.primary.bind_tools(tools, **kwargs).kwargs)  # type: ignore[attr-defined]
+
+    def _breaker(self, name: str) -> _CircuitBreaker:
+        if name not in self._breakers:
+            self._breakers[name] = _CircuitBreaker(self.circuit_failure_threshold, self.circuit_reset_seconds)
+        return self._breakers[name]
+
+    def hedge_delay(self) -> float:
+        """How long to wait for the primary before sending a hedged request."""
+        if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+            return self.hedge_initial_delay_seconds
+        deadline = float(np.percentile(np.fromiter(self._latencies, dtype=float), self.hedge_percentile))
+        return max(self.hedge_min_delay_seconds, deadline)
+
+    def _can_hedge(self) -> bool:
+        # e.g. with a max rate of 0.1, at most 20 of the last 200 requests were hedged
+        return sum(self._recent_hedges) < self.hedge_max_rate * _LATENCY_SAMPLES
+
+    def _estimate_saved(self, elapsed: float) -> float:
+        """Estimate how much longer a cancelled request would have taken, from the recent latencies above `elapsed`."""
+        slower = [latency for latency in self._latencies if latency > elapsed]
+        return float(np.mean(slower)) - elapsed if slower else 0.0
+
+    async def _hedged(self, messages: list[BaseMessage], stop: list[str] | None, **kwargs: Any) -> ChatResult:
+        """Call the primary model, sending a duplicate request if the first is slower than the hedge delay."""
+        started_at = time.monotonic()
+        first = asyncio.ensure_future(self.primary._agenerate(messages, stop=stop, **kwargs))
+        tasks = {first}
+        started = [first]
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done and self._can_hedge():
+                hedged = True
+                self._counts["hedges"] += 1
+                started.append(asyncio.ensure_future(self.primary._agenerate(messages, stop=stop, **kwargs)))
+                tasks.add(started[-1])
+
+            while True:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    break
+                # One of the requests failed, wait for the other
+                tasks = pending
+
+            if not succeeded:
+                raise next(iter(done)).exception()
+
+            winner = succeeded[0]
+            elapsed = time.monotonic() - started_at
+            if winner is not first:
+                self._counts["hedge_wins"] += 1
+                self._counts["hedge_seconds_saved"] += self._estimate_saved(elapsed)
+            # When the hedge wins this is a lower bound on the first request's latency, which keeps the slow tail in
+            # the samples, rather than letting the hedge delay drift down
+            self._latencies.append(elapsed)
+            return winner.result()
+        finally:
+            self._recent_hedges.append(hedged)
+            # Cancel the slower request
+            for task in started:
+                task.cancel()
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._counts["requests"] += 1
+        self._maybe_log_metrics()
+
+        attempts = [("primary", self._hedged)]
+        if self.fallback is not None:
+            attempts.append(("fallback", self.fallback._agenerate))
+
+        error: BaseException | None = None
+        for i, (name, generate) in enumerate(attempts):
+            breaker = self._breaker(name)
+            if not breaker.allow():
+                continue
+            if i > 0:
+                self._counts["failovers"] += 1
+            try:
+                result = await generate(messages, stop=stop, **kwargs)
+            except asyncio.CancelledError:
+                breaker.trial_in_flight = False
+                raise
+            except Exception as e:
+                logger.warning(f"The {name} chat model failed: {e!r}")
+                self._counts["failures"] += 1
+                breaker.record_failure()
+                error = e
+                continue
+            breaker.record_success()
+            return result
+
+        raise error or CircuitOpenError("Every chat model is failing, try again shortly.")
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # The agent is async, so sync calls only fail over, without hedging
+        try:
+            return self.primary._generate(messages, stop=stop, **kwargs)
+        except Exception:
+            if self.fallback is None:
+                raise
+            self._counts["failovers"] += 1
+            return self.fallback._generate(messages, stop=stop, **kwargs)
+
+    def _maybe_log_metrics(self) -> None:
+        if time.monotonic() - self._metrics_logged_at >= _METRICS_LOG_INTERVAL_SECONDS:
+            self._metrics_logged_at = time.monotonic()
+            logger.info(f"Chat model: {self.metrics()}")
+
+    def metrics(self) -> dict[str, Any]:
+        """Request counts, the hedge rate and the latency hedges saved, and the circuit breaker states."""
+        counts = self._counts
+        requests = counts["requests"] or 1
+        return {
+            "requests": int(counts["requests"]),
+            "hedge_rate": round(counts["hedges"] / requests, 3),
+            "hedge_wins": int(counts["hedge_wins"]),
+            "hedge_seconds_saved": round(counts["hedge_seconds_saved"], 1),
+            "hedge_delay_seconds": round(self.hedge_delay(), 2),
+            "failovers": int(counts["failovers"]),
+            "failures": int(counts["failures"]),
+            "circuits": {name: breaker.state for name, breaker in self._breakers.items()},
+            "circuit_trips": sum(breaker.trips for breaker in self._breakers.values()),
+        }
+
+
+def get_chat_model() -> ResilientChatModel:
+    """Get the agent's chat model, with the fallback model or endpoint from the app settings, if any."""
+
+    def openai_model(model_name: str, base_url: str | None = None) -> ChatOpenAI:
+        return ChatOpenAI(
+            model_name=model_name,
+            temperature=0,
+            max_tokens=None,
+            # Retries would add to the tail latency, slow or failed requests are hedged or failed over instead
+            max_retries=0,
+            request_timeout=settings.ai_openai_request_timeout_seconds,
+            openai_api_key=settings.openai_api_key,
+            base_url=base_url,
+        )
+
+    fallback_model = settings.ai_openai_fallback_model or (
+        settings.ai_openai_model if settings.ai_openai_fallback_base_url else None
+    )
+    return ResilientChatModel(
+        primary=openai_model(settings.ai_openai_model),
+        fallback=openai_model(fallback_model, settings.ai_openai_fallback_base_url) if fallback_model else None,
+        hedge_percentile=settings.ai_hedge_percentile,
+        hedge_min_delay_seconds=settings.ai_hedge_min_delay_seconds,
+        hedge_initial_delay_seconds=settings.ai_hedge_initial_delay_seconds,
+        hedge_max_rate=settings.ai_hedge_max_rate,
+        circuit_failure_threshold=settings.ai_circuit_failure_threshold,
+        circuit_reset_seconds=settings.ai_circuit_reset_seconds,
+    )
@@ -0,0 +1,70 @@
+"""Text embedding backends. Features embed text through the shared `grug.embedding_service` rather than these."""
+
+import asyncio
+import hashlib
+import time
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from grug.settings import settings
+
+# The dimension of the vector columns, which must match `ai_openai_embedding_model`
+EMBEDDING_DIMENSIONS = 1536
+LOCAL_EMBEDDING_MODEL = "local-feature-hashing"
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Deterministic, offline stand-in for the embeddings API, intended for tests and benchmarks.
+
+    The words and character trigrams of a text are hashed into signed buckets of an `EMBEDDING_DIMENSIONS` vector, so
+    texts that share words are near each other, though unlike a real model it knows nothing of meaning.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.latency_seconds = latency_seconds
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> list[float]:
+        normalized = " ".join(text.lower().split())
+        features = normalized.split() + [normalized[i : i + 3] for i in range(len(normalized) - 2)]  # noqa: E203
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def get_embedding_model_name() -> str:
+    """The name of the configured embedding model, which tells apart the cached embeddings of different models."""
+    return LOCAL_EMBEDDING_MODEL if settings.ai_embedding_backend == "local" else settings.ai_openai_embedding_model
+
+
+@lru_cache
+def get_embedding_backend() -> Embeddings:
+    """Get the embedding backend configured in the app settings."""
+    if settings.ai_embedding_backend == "openai":
+        return OpenAIEmbeddings(model=settings.ai_openai_embedding_model, api_key=settings.openai_api_key)
+    if settings.ai_embedding_backend == "local":
+        return LocalEmbeddings()
+    raise ValueError(f"Unknown embedding backend: {settings.ai_embedding_backend}")
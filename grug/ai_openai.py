@@ -0,0 +1,20 @@
+"""Shared OpenAI API clients."""
+
+from functools import lru_cache
+
+from openai import AsyncOpenAI
+
+from grug.settings import settings
+
+
+@lru_cache
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Get the shared async OpenAI client, so every request reuses the same HTTP connection pool.
+
+    Raises:
+        ValueError: If the `OPENAI_API_KEY` environment variable is not set.
+    """
+    if not settings.openai_api_key:
+        raise ValueError("`OPENAI_API_KEY` env variable is required to run the Grug Discord Agent.")
+    return AsyncOpenAI(api_key=settings.openai_api_key.get_secret_value())
@@ -0,0 +1,316 @@
+"""Speech-to-text transcription dispatcher and backends for the voice client."""
+
+import hashlib
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from io import BytesIO
+from typing import Callable, Deque, Protocol
+
+import speech_recognition as sr
+from loguru import logger
+from openai import OpenAI
+
+from grug.audio import WHISPER_SAMPLE_RATE, prepare_for_transcription
+from grug.settings import settings
+from grug.tracing import NOOP_SPAN, NoopSpan, Span, span
+
+
+class STTBackend(Protocol):
+    """A speech-to-text backend that turns an audio segment into text."""
+
+    def transcribe(self, audio: sr.AudioData) -> str | None:
+        """Transcribe the audio segment, returning `None` if no speech was recognized."""
+        ...
+
+
+class WhisperSTTBackend:
+    """STT backend using the OpenAI Whisper API, sharing a single client across all calls."""
+
+    def __init__(self, model: str = "whisper-1", timeout_seconds: float = 30):
+        if not settings.openai_api_key:
+            raise ValueError("`OPENAI_API_KEY` env variable is required to use the Whisper STT backend.")
+
+        self.model = model
+        self.client = OpenAI(
+            api_key=settings.openai_api_key.get_secret_value(),
+            timeout=timeout_seconds,
+            max_retries=0,  # retries are handled by the dispatcher
+        )
+
+    def transcribe(self, audio: sr.AudioData) -> str | None:
+        wav_data = BytesIO(audio.get_wav_data())
+        wav_data.name = "speech.wav"
+        transcript = self.client.audio.transcriptions.create(file=wav_data, model=self.model)
+        return transcript.text or None
+
+
+class LocalSTTBackend:
+    """
+    Deterministic, offline stand-in for a real STT backend, intended for tests and benchmarks.
+
+    The "transcript" is derived from a hash of the audio bytes, so the same audio always produces the same text.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, phrase: str | None = None):
+        self.latency_seconds = latency_seconds
+        self.phrase = phrase
+
+    def transcribe(self, audio: sr.AudioData) -> str | None:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        if self.phrase is not None:
+            return self.phrase
+
+        duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        digest = hashlib.sha1(audio.frame_data, usedforsecurity=False).hexdigest()[:8]
+        return f"segment {digest} ({duration:.2f}s)"
+
+
+def get_stt_backend() -> STTBackend:
+    """Get the STT backend configured in the app settings."""
+    if settings.stt_backend == "whisper":
+        return WhisperSTTBackend(timeout_seconds=settings.stt_request_timeout_seconds)
+    if settings.stt_backend == "local":
+        return LocalSTTBackend()
+    raise ValueError(f"Unknown STT backend: {settings.stt_backend}")
+
+
+@dataclass
+class AudioSegment:
+    """A phrase of audio captured from a single speaker."""
+
+    speaker_id: int
+    audio: sr.AudioData
+    captured_at: datetime
+    speaker_name: str | None = None
+    wake_word: bool = False
+    submitted_at: float = field(default_factory=time.monotonic)
+    # The span tracing the phrase from capture to transcript, ended once it is transcribed
+    trace_span: Span | NoopSpan = NOOP_SPAN
+
+    @property
+    def duration_seconds(self) -> float:
+        return len(self.audio.frame_data) / (self.audio.sample_rate * self.audio.sample_width)
+
+
+@dataclass
+class DispatcherStats:
+    """Running statistics for a `TranscriptionDispatcher`."""
+
+    segments_submitted: int = 0
+    segments_transcribed: int = 0
+    requests_sent: int = 0
+    requests_failed: int = 0
+    retries: int = 0
+    max_queue_depth: int = 0
+    latencies_seconds: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+    @property
+    def p50_latency_seconds(self) -> float | None:
+        return statistics.median(self.latencies_seconds) if self.latencies_seconds else None
+
+    @property
+    def p95_latency_seconds(self) -> float | None:
+        if len(self.latencies_seconds) < 2:
+            return self.p50_latency_seconds
+        return statistics.quantiles(self.latencies_seconds, n=20)[-1]
+
+
+TranscriptCallback = Callable[[AudioSegment, str], None]
+
+
+class TranscriptionDispatcher:
+    """
+    Dispatches audio segments to an STT backend on a bounded worker pool.
+
+    - At most `max_workers` backend requests are in flight at once, regardless of how many users are speaking.
+    - Segments from the same speaker are transcribed strictly in the order they were submitted.
+    - Adjacent short phrases from one speaker that are waiting in the queue are merged into a single backend request
+      (up to `coalesce_max_seconds` of audio). A phrase that starts with the wake word always starts a new request.
+    - `on_transcript` is called with the first segment of each request and the transcribed text.
+    - Each request's audio is downmixed, resampled to `target_sample_rate` and normalized as a whole before it is
+      handed to the backend, which keeps uploads about a third of the size of the 48 kHz audio Discord provides.
+    - Failed backend requests are retried with exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        backend: STTBackend,
+        on_transcript: TranscriptCallback,
+        max_workers: int = 4,
+        coalesce_max_seconds: float = 15.0,
+        max_retries: int = 3,
+        retry_backoff_seconds: float = 0.5,
+        ignored_transcripts: list[str] | None = None,
+        target_sample_rate: int | None = WHISPER_SAMPLE_RATE,
+    ):
+        self.backend = backend
+        self.on_transcript = on_transcript
+        self.coalesce_max_seconds = coalesce_max_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.ignored_transcripts = {t.strip().lower() for t in (ignored_transcripts or [])}
+        self.target_sample_rate = target_sample_rate
+        self.stats = DispatcherStats()
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt")
+        self._lock = threading.Lock()
+        self._pending: defaultdict[int, Deque[AudioSegment]] = defaultdict(deque)
+        self._active_speakers: set[int] = set()
+        self._closed = False
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of segments waiting to be transcribed, across all speakers."""
+        with self._lock:
+            return sum(len(q) for q in self._pending.values())
+
+    def submit(self, segment: AudioSegment) -> None:
+        """Queue an audio segment for transcription."""
+        with self._lock:
+            if self._closed:
+                return
+
+            self._pending[segment.speaker_id].append(segment)
+            self.stats.segments_submitted += 1
+            queue_depth = sum(len(q) for q in self._pending.values())
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, queue_depth)
+
+            # Only one worker drains a given speaker's queue at a time, which keeps their transcripts in order
+            if segment.speaker_id not in self._active_speakers:
+                self._active_speakers.add(segment.speaker_id)
+                self._executor.submit(self._drain, segment.speaker_id)
+
+        logger.debug(f"Queued {segment.duration_seconds:.2f}s STT segment (queue depth: {queue_depth})")
+
+    def _take_batch(self, speaker_id: int) -> list[AudioSegment]:
+        """Pop the next run of adjacent segments for a speaker that fit in one request."""
+        with self._lock:
+            queue = self._pending[speaker_id]
+            if not queue:
+                self._active_speakers.discard(speaker_id)
+                del self._pending[speaker_id]
+                return []
+
+            batch = [queue.popleft()]
+            total_seconds = batch[0].duration_seconds
+            while (
+                queue
+                and not queue[0].wake_word
+                and total_seconds + queue[0].duration_seconds <= self.coalesce_max_seconds
+            ):
+                total_seconds += queue[0].duration_seconds
+                batch.append(queue.popleft())
+
+            return batch
+
+    def _drain(self, speaker_id: int) -> None:
+        if not (batch := self._take_batch(speaker_id)):
+            return
+
+        try:
+            self._process_batch(batch)
+        except Exception:
+            logger.exception(f"Failed to transcribe audio for speaker {speaker_id}")
+
+        # Requeue behind the other speakers rather than looping, so one talkative speaker can't starve the rest
+        with self._lock:
+            if not self._closed:
+                self._executor.submit(self._drain, speaker_id)
+                return
+            self._active_speakers.discard(speaker_id)
+
+    def _process_batch(self, batch: list[AudioSegment]) -> None:
+        try:
+            with span(
+                "stt.transcribe",
+                parent=batch[0].trace_span,
+                segments=len(batch),
+                audio_seconds=sum(segment.duration_seconds for segment in batch),
+            ):
+                self._transcribe_batch(batch)
+        except Exception as e:
+            for segment in batch:
+                segment.trace_span.end(error=e)
+            raise
+        for segment in batch:
+            segment.trace_span.end()
+
+    def _transcribe_batch(self, batch: list[AudioSegment]) -> None:
+        first = batch[0]
+        audio = (
+            first.audio
+            if len(batch) == 1
+            else sr.AudioData(
+                b"".join(segment.audio.frame_data for segment in batch),
+                first.audio.sample_rate,
+                first.audio.sample_width,
+            )
+        )
+        if self.target_sample_rate and audio.sample_rate != self.target_sample_rate and audio.sample_width == 2:
+            audio = sr.AudioData(
+                prepare_for_transcription(audio.frame_data, audio.sample_rate, to_rate=self.target_sample_rate),
+                self.target_sample_rate,
+                2,
+            )
+
+        text = self._transcribe_with_retry(audio)
+
+        now = time.monotonic()
+        with self._lock:
+            self.stats.segments_transcribed += len(batch)
+            self.stats.latencies_seconds.extend(now - segment.submitted_at for segment in batch)
+        logger.debug(
+            f"Transcribed {len(batch)} STT segment(s) for speaker {first.speaker_id} in "
+            f"{now - first.submitted_at:.2f}s (queue depth: {self.queue_depth})"
+        )
+
+        if text and text.strip().lower().strip(".!? ") not in self.ignored_transcripts:
+            self.on_transcript(first, text)
+
+    def _transcribe_with_retry(self, audio: sr.AudioData) -> str | None:
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                self.stats.requests_sent += 1
+            try:
+                return self.backend.transcribe(audio)
+            except sr.UnknownValueError:
+                logger.debug("Bad speech chunk")
+                return None
+            except Exception as e:
+                with self._lock:
+                    self.stats.requests_failed += 1
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff_seconds * (2**attempt) * random.uniform(0.5, 1.5)  # nosec B311
+                logger.warning(f"STT request failed ({e}), retrying in {delay:.2f}s")
+                with self._lock:
+                    self.stats.retries += 1
+                time.sleep(delay)
+        return None
+
+    def log_stats(self) -> None:
+        """Log a summary of the dispatcher statistics."""
+        p50, p95 = self.stats.p50_latency_seconds, self.stats.p95_latency_seconds
+        logger.info(
+            f"STT dispatcher: {self.stats.segments_transcribed}/{self.stats.segments_submitted} segments transcribed "
+            f"in {self.stats.requests_sent} requests ({self.stats.requests_failed} failed, {self.stats.retries} "
+            f"retries), queue depth {self.queue_depth} (max {self.stats.max_queue_depth}), latency "
+            f"p50={p50 or 0:.2f}s p95={p95 or 0:.2f}s"
+        )
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stop accepting segments and shut down the worker pool."""
+        with self._lock:
+            self._closed = True
+            if not wait:
+                self._pending.clear()
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.log_stats()
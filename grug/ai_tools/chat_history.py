@@ -0,0 +1,46 @@
+from datetime import UTC, datetime, timedelta
+
+import discord
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from grug.chat_archive import default_search_window, readable_channel_ids, search_chat_messages
+
+
+@tool(parse_docstring=True)
+async def search_chat_history(
+    config: RunnableConfig,
+    query: str,
+    days_ago: int | None = None,
+    all_channels: bool = False,
+) -> list[str]:
+    """
+    Search the chat history of this server for messages about a topic, e.g. to answer "what did we decide about X?".
+
+    Args:
+        query: Words or phrases to search for (web search syntax, e.g. `dragon "treasure hoard"`).
+        days_ago: Only search messages sent in this many past days. Defaults to the last month.
+        all_channels: Search every channel in the server that the user can read, instead of only the current channel.
+
+    Returns:
+        The best matching messages, formatted as "[time] author: message".
+    """
+    configurable = config.get("configurable", {})
+    if (guild_id := configurable.get("guild_id")) is None:
+        raise ValueError("Chat history is only available in a server.")
+
+    if not all_channels:
+        channel_ids = [int(configurable["thread_id"])]
+    elif isinstance(member := configurable.get("member"), discord.Member):
+        # Private and staff channels are archived too, so other channels are only searched if the member can read them
+        channel_ids = readable_channel_ids(member)
+    else:
+        raise ValueError("Other channels can only be searched for a member of this server.")
+
+    messages = await search_chat_messages(
+        guild_id=guild_id,
+        query=query,
+        channel_ids=channel_ids,
+        since=datetime.now(tz=UTC) - timedelta(days=days_ago) if days_ago else default_search_window(),
+    )
+    return [str(message) for message in sorted(messages, key=lambda message: message.created_at)]
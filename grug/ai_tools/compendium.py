@@ -0,0 +1,35 @@
+from langchain_core.tools import tool
+
+from grug.compendium import get_compendium
+from grug.settings import settings
+
+
+@tool(parse_docstring=True)
+def compendium_lookup(names: list[str], category: str | None = None) -> dict[str, list[str]]:
+    """
+    Look up rules entries, like spells, feats, conditions, monsters or items, by name in the game compendium. This is
+    instant, so try it first for anything with a name, before searching the source material.
+
+    Args:
+        names: The names to look up, e.g. ["Fireball", "Frightened"]. Misspelled or partial names are fine.
+        category: Only look up entries in this category, e.g. "spell". Defaults to all categories.
+
+    Returns:
+        The best matching entries for each name, best first, with their category, details and text.
+    """
+    if (compendium := get_compendium()) is None:
+        raise ValueError("No compendium is installed, use `information_search` instead.")
+
+    return {
+        name: [
+            str(match.entry)
+            for match in compendium.lookup(
+                name,
+                category=category,
+                limit=settings.compendium_lookup_limit,
+                min_score=settings.compendium_min_score,
+                candidates=settings.compendium_candidates,
+            )
+        ]
+        for name in names
+    }
@@ -1,27 +1,71 @@
-import random
-
 from langchain_core.tools import tool
 
+from grug.dice import distribution, parse, roll
+
+# Don't flood the agent's context with every die of a huge pool
+_MAX_REPORTED_DICE = 50
+
 
 @tool(parse_docstring=True)
-def roll_dice(number_of_dice: int, sides_of_dice: int) -> tuple[list[int], int]:
+def roll_dice(expression: str) -> dict[str, str | int | list]:
     """
-    Roll a number of dice with a certain number of sides.
+    Roll dice using standard dice notation.
 
     Args:
-        number_of_dice: The number of dice to roll.
-        sides_of_dice: The number of sides on the dice.  Valid options are 4, 6, 8, 10, 12, 20, and 100.
+        expression: The dice to roll, e.g. `1d20+5`, `4d6dl1` (drop lowest), `2d20kh1` (advantage), `2d20kl1`
+            (disadvantage), `8d6!` (exploding), `10d10>=8` (count successes), or `2d6+1d4-1`.
 
     Returns:
-        A Tuple with the first value being a list of the results of the dice rolls, and the second value is the sum
-        of the dice rolls.
+        A dictionary with the normalized `expression`, the `total`, and the `rolls` for each dice term (with the
+        dice that were `kept`, if any were dropped).
 
     Raises:
-        ValueError: If the number of sides on the dice is not one of the valid options
+        ValueError: If the dice notation is invalid.
+    """
+    result = roll(expression)
+    return {
+        "expression": str(result.expression),
+        "total": result.total,
+        "rolls": [
+            {
+                "dice": str(term_roll.term),
+                "rolls": term_roll.rolls[:_MAX_REPORTED_DICE],
+                **({"kept": term_roll.kept[:_MAX_REPORTED_DICE]} if term_roll.term.keep else {}),
+                "value": term_roll.value,
+            }
+            for term_roll in result.terms
+        ],
+    }
+
+
+@tool(parse_docstring=True)
+def dice_probability(expression: str, target: int | None = None) -> dict[str, str | int | float | bool]:
     """
-    if sides_of_dice not in [4, 6, 8, 10, 12, 20, 100]:
-        raise ValueError(f"Invalid number of sides on dice: {sides_of_dice}")
+    Calculate the exact odds of a dice roll, e.g. the chance to hit AC 22 with a +14 attack (`1d20+14`, target 22).
+
+    Args:
+        expression: The dice rolled, in the same notation as `roll_dice`, e.g. `1d20+14` or `4d6dl1`.
+        target: The total to meet or beat, if asking for the chance of success.
 
-    result = [random.randint(1, sides_of_dice) for _ in range(number_of_dice)]
+    Returns:
+        A dictionary with the `minimum`, `maximum`, `mean`, `median` and standard deviation (`std`) of the total, and
+        if a target was given, the `chance_at_least_target` (0-1). `exact` is false if the odds were estimated by
+        simulation, which is done for rare combinations like exploding dice with keep/drop, and for huge pools.
 
-    return result, sum(result)
+    Raises:
+        ValueError: If the dice notation is invalid.
+    """
+    parsed = parse(expression)
+    outcomes = distribution(parsed)
+    result = {
+        "expression": str(parsed),
+        "minimum": outcomes.minimum,
+        "maximum": outcomes.maximum,
+        "mean": round(outcomes.mean, 3),
+        "median": outcomes.percentile(0.5),
+        "std": round(outcomes.std, 3),
+        "exact": outcomes.exact,
+    }
+    if target is not None:
+        result["chance_at_least_target"] = round(outcomes.probability_at_least(target), 4)
+    return result
@@ -1,30 +1,32 @@
-from datetime import date
-
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from loguru import logger
-from openai import AsyncOpenAI
 from openai.types import Image
-from sqlalchemy import Date, cast, func
-from sqlmodel import select
 
+from grug.ai_openai import get_async_openai_client
 from grug.db import sqa_async_session_factory
+from grug.guild_config import get_guild_settings
+from grug.image_store import download_image, find_reusable_image, normalize_prompt
 from grug.models import DalleImageRequest
+from grug.quotas import QuotaExceededError, remaining, use_quota
 from grug.settings import settings
 
+IMAGE_GENERATION_QUOTA = "image_generation"
+
 
-@tool(parse_docstring=True)
-async def generate_ai_image(prompt: str) -> dict[str, str | int]:
+@tool(parse_docstring=True, response_format="content_and_artifact")
+async def generate_ai_image(prompt: str, config: RunnableConfig) -> tuple[dict[str, str | int | bool | None], dict]:
     """
-    Generate an image using OpenAI's DALL-E model, and returns a URL to the generated image.
+    Generate an image using OpenAI's DALL-E model. The image is attached to your reply automatically.
 
     Args:
         prompt (str): The prompt to generate the image from.
 
     Returns:
         dict: A dictionary with the following keys:
-            - image_url (str): The URL to the generated image.
             - model (str): The model used to generate the image.
             - size (str): The size of the generated image.
+            - reused (bool): True if an image previously generated for the same prompt was reused.
             - image_generations_left_today (Optional(int)): The number of image generations left today, based on the app's
               settings, and Grugs wallet.
 
@@ -33,7 +35,7 @@ async def generate_ai_image(prompt: str) -> dict[str, str | int]:
             `OPENAI_API_KEY` environment variable is not set.
 
     Notes:
-        - When providing links to images, make sure to format them as Markdown links so the image shows up.
+        - Do not include links to the image in your reply, it is already attached.
     """
     # Notes:
     #   - as of 6/9/2024, it costs $0.04 per dall-e-3 image, and $0.02 per dall-e-2 image
@@ -42,67 +44,85 @@ async def generate_ai_image(prompt: str) -> dict[str, str | int]:
 
     # TODO: have it so you can make recommendations for image that was just output.
 
-    if not settings.ai_image_generation_enabled:
+    guild_id = config.get("configurable", {}).get("guild_id")
+    guild_settings = await get_guild_settings(guild_id)
+    if not guild_settings.ai_image_generation_enabled:
         raise ValueError("AI image generation is disabled.")
 
-    # Return None if the assistant is not available
-    async with sqa_async_session_factory() as session:
+    # Reuse a recent image for the same prompt, rather than paying for and waiting on another generation
+    if reusable := await find_reusable_image(
+        guild_id,
+        prompt,
+        model=settings.ai_image_default_model,
+        size=settings.ai_image_default_size,
+        quality=settings.ai_image_default_quality,
+    ):
+        logger.info(f"Reusing {reusable} for prompt: {prompt}")
+        return (
+            {
+                "model": reusable.model,
+                "size": reusable.size,
+                "reused": True,
+                "image_generations_left_today": await remaining(
+                    IMAGE_GENERATION_QUOTA, guild_id, guild_settings.ai_image_daily_generation_limit
+                ),
+            },
+            {"image_path": reusable.image_path},
+        )
 
-        # Get the image requests remaining for the day
-        # noinspection PyTypeChecker,Pydantic
-        picture_request_count_for_today = (
-            await session.execute(
-                select(func.count("*"))
-                .select_from(DalleImageRequest)
-                .where(cast(DalleImageRequest.request_time, Date) == date.today())
+    openai_client = get_async_openai_client()
+
+    # The reservation is released if generation fails, so failed requests don't count against the limit
+    try:
+        async with use_quota(IMAGE_GENERATION_QUOTA, guild_id, guild_settings.ai_image_daily_generation_limit) as quota:
+            logger.info(f"Remaining Dall-E image requests: {quota.remaining}")
+
+            logger.info("### Generating AI Image ###")
+            logger.info(f"Prompt: {prompt}")
+            logger.info(f"Model: {settings.ai_image_default_model}")
+            logger.info(f"Size: {settings.ai_image_default_size}")
+            logger.info(f"Quality: {settings.ai_image_default_quality}")
+
+            response = await openai_client.images.generate(
+                model=settings.ai_image_default_model,
+                prompt=prompt,
+                size=settings.ai_image_default_size,
+                quality=settings.ai_image_default_quality,
+                n=1,
             )
-        ).scalar()
-
-        remaining_image_requests = settings.ai_image_daily_generation_limit - picture_request_count_for_today
-
-        # Check if the user has exceeded the daily image generation limit
-        if remaining_image_requests and remaining_image_requests <= 0:
-            raise ValueError("You have exceeded the daily image generation limit.")
-        logger.info(f"Remaining Dall-E image requests: {remaining_image_requests}")
-
-        logger.info("### Generating AI Image ###")
-        logger.info(f"Prompt: {prompt}")
-        logger.info(f"Model: {settings.ai_image_default_model}")
-        logger.info(f"Size: {settings.ai_image_default_size}")
-        logger.info(f"Quality: {settings.ai_image_default_quality}")
+            response_image: Image = response.data[0]
+    except QuotaExceededError:
+        raise ValueError("You have exceeded the daily image generation limit.")
 
-        if not settings.openai_api_key:
-            raise ValueError("`OPENAI_API_KEY` env variable is required to run the Grug Discord Agent.")
+    image_path = await download_image(response_image.url)
 
-        openai_client = AsyncOpenAI(api_key=settings.openai_api_key.get_secret_value())
-        response = await openai_client.images.generate(
-            model=settings.ai_image_default_model,
-            prompt=prompt,
-            size=settings.ai_image_default_size,
-            quality=settings.ai_image_default_quality,
-            n=1,
-        )
-        response_image: Image = response.data[0]
-
-        logger.info(f"revised prompt: {response_image.revised_prompt}")
-        logger.info(f"Image URL: {response_image.url}")
-        logger.info("### Completed Generating AI Image ###")
+    logger.info(f"revised prompt: {response_image.revised_prompt}")
+    logger.info(f"Image URL: {response_image.url}")
+    logger.info(f"Image path: {image_path}")
+    logger.info("### Completed Generating AI Image ###")
 
-        # Save the image request to the database
+    # Save the image request to the database
+    async with sqa_async_session_factory() as session:
         dalle_image_request = DalleImageRequest(
+            guild_id=guild_id,
             prompt=prompt,
+            normalized_prompt=normalize_prompt(prompt),
             model=settings.ai_image_default_model,
             size=settings.ai_image_default_size,
             quality=settings.ai_image_default_quality,
             revised_prompt=response_image.revised_prompt,
             image_url=response_image.url,
+            image_path=image_path,
         )
         session.add(dalle_image_request)
         await session.commit()
 
-    return {
-        "image_url": response_image.url,
-        "model": settings.ai_image_default_model,
-        "size": settings.ai_image_default_size,
-        "image_generations_left_today": remaining_image_requests,
-    }
+    return (
+        {
+            "model": settings.ai_image_default_model,
+            "size": settings.ai_image_default_size,
+            "reused": False,
+            "image_generations_left_today": quota.remaining,
+        },
+        {"image_path": image_path},
+    )
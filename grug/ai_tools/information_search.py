@@ -1,7 +1,39 @@
 # TODO: copy over code for general searches, thinking of re-writing it to be a second graph that knows which TTRPG
 #       the play is using and use tools (like AoN for pathfinder) that are specific to that TTRPG.
-# TODO: this is also where the RAG stuff comes in where admins can upload source material and have it be searchable.
 # TODO: create a slash-command that the user can use to set which TTTRPG they are playing and use that here when
-#       looking up information.  it would also be good to send a warning or something if no source material is found
-#       and give instructions for how to upload it.  should also have slash commands to perform crud operations on the
-#       source material for their server/guild.
+#       looking up information.
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from grug.retrieval import search_source_material
+from grug.source_material import get_source_documents
+
+
+def _get_guild_id(config: RunnableConfig) -> int:
+    if (guild_id := config.get("configurable", {}).get("guild_id")) is None:
+        raise ValueError("Source material is only available in a server.")
+    return guild_id
+
+
+@tool
+async def list_source_material(config: RunnableConfig) -> list[str]:
+    """
+    List the names of the source material documents (e.g. rulebooks) uploaded to this server. If there are none, tell
+    the user that an admin can upload PDFs with the `/source upload` command.
+    """
+    return [document.name for document in await get_source_documents(_get_guild_id(config))]
+
+
+@tool(parse_docstring=True)
+async def information_search(config: RunnableConfig, query: str, sources: list[str] | None = None) -> list[str]:
+    """
+    Look up information, like rules, monsters, spells or lore, in the source material uploaded to this server.
+
+    Args:
+        query: What to look up, phrased as a question or keywords.
+        sources: Only search these documents (by name, see `list_source_material`). Defaults to all documents.
+
+    Returns:
+        The most relevant passages, best first, each prefixed with the document name and page number to cite.
+    """
+    return [str(chunk) for chunk in await search_source_material(_get_guild_id(config), query, document_names=sources)]
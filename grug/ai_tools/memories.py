@@ -0,0 +1,93 @@
+from typing import Annotated, Any
+
+import discord
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedStore
+from langgraph.store.base import BaseStore
+
+from grug.memories import forget_memories, recall_memories, save_memories
+from grug.settings import settings
+
+
+def _memory_context(config: RunnableConfig) -> tuple[int | None, str]:
+    configurable = config.get("configurable", {})
+    if not (user_id := configurable.get("user_id")):
+        raise ValueError("Memories are only available when talking with a user.")
+    return configurable.get("guild_id"), user_id
+
+
+def _can_manage_server(config: RunnableConfig) -> bool:
+    # Server memories are shared by everyone in the server, so only its managers can change them
+    member = config.get("configurable", {}).get("member")
+    return isinstance(member, discord.Member) and member.guild_permissions.manage_guild
+
+
+@tool(parse_docstring=True)
+async def remember_facts(
+    config: RunnableConfig,
+    store: Annotated[BaseStore, InjectedStore()],
+    facts: list[str],
+    about_server: bool = False,
+) -> list[str]:
+    """
+    Save facts to long-term memory, to recall in later conversations. Use this for lasting things worth knowing, like
+    the user's preferences, their characters and their backstories, or the server's house rules.
+
+    Args:
+        facts: The facts to save, each a short, self-contained statement, e.g. "Plays Vex, a half-elf ranger".
+        about_server: Whether the facts are about the whole server (e.g. house rules, campaign details), rather than
+            the user. Only members who can manage the server can save facts about it.
+
+    Returns:
+        The IDs of the saved memories.
+    """
+    if len(facts) > settings.memory_max_facts_per_request:
+        raise ValueError(f"At most {settings.memory_max_facts_per_request} facts can be saved at once.")
+
+    guild_id, user_id = _memory_context(config)
+    if about_server and not _can_manage_server(config):
+        raise ValueError("Only members with the Manage Server permission can save facts about the server.")
+    return await save_memories(store, guild_id, user_id, facts, server=about_server)
+
+
+@tool(parse_docstring=True)
+async def recall_facts(
+    config: RunnableConfig,
+    store: Annotated[BaseStore, InjectedStore()],
+    queries: list[str],
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Recall facts from long-term memory about the user and the server, searching by meaning. Check here before asking
+    the user something they may have said in an earlier conversation.
+
+    Args:
+        queries: What to look for, e.g. ["user's character", "house rules for critical hits"]. Give several queries
+            to look up several things at once.
+
+    Returns:
+        The memories found for each query, most relevant first, with their `memory_id`, the `fact`, whether it is
+        `about` the user or the server, and when it was saved.
+    """
+    guild_id, user_id = _memory_context(config)
+    return await recall_memories(store, guild_id, user_id, queries)
+
+
+@tool(parse_docstring=True)
+async def forget_facts(
+    config: RunnableConfig,
+    store: Annotated[BaseStore, InjectedStore()],
+    memory_ids: list[str],
+) -> int:
+    """
+    Delete facts from long-term memory, e.g. because they are out of date or the user asked to forget them. Facts
+    about the server can only be deleted for members who can manage the server, others can only delete their own.
+
+    Args:
+        memory_ids: The IDs of the memories to delete, from `recall_facts` or `remember_facts`.
+
+    Returns:
+        The number of memories deleted.
+    """
+    guild_id, user_id = _memory_context(config)
+    return await forget_memories(store, guild_id, user_id, memory_ids, server=_can_manage_server(config))
@@ -1,8 +1,71 @@
-# TODO: tie into the scheduler to set reminders that can be sent back to the user or group chat
-from typing import Annotated
+from datetime import datetime
 
-from langchain_core.tools import InjectedToolArg
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
 
+from grug.reminders import cancel_reminders, create_reminders, get_pending_reminders
+from grug.scheduler import schedule_reminder_delivery
+from grug.settings import settings
 
-async def set_reminder(message: str, user_id: Annotated[str, InjectedToolArg]):
-    pass
+
+def _reminder_context(config: RunnableConfig) -> tuple[int, int, int | None]:
+    configurable = config.get("configurable", {})
+    # `user_id` is "<guild id>-<user id>" in guilds, and just the user ID in DMs
+    user_id = int(configurable["user_id"].split("-")[-1])
+    return int(configurable["thread_id"]), user_id, configurable.get("guild_id")
+
+
+@tool(parse_docstring=True)
+async def set_reminders(config: RunnableConfig, message: str, remind_at: list[datetime]) -> dict[str, list | int]:
+    """
+    Set one or more reminders, which will be posted in this channel, mentioning the user who asked for them.
+
+    Args:
+        message: What to remind the user of.
+        remind_at: When to post the reminder, as ISO 8601 date times with a timezone. Give several times to set a
+            series of reminders at once, e.g. every Friday at 7pm for the next 8 weeks.
+
+    Returns:
+        A dictionary with the `reminder_ids` of the reminders that were set and their `count`.
+
+    Raises:
+        ValueError: If a time is missing a timezone or is in the past, or if too many reminders are requested.
+    """
+    if len(remind_at) > settings.reminders_max_per_request:
+        raise ValueError(f"At most {settings.reminders_max_per_request} reminders can be set at once.")
+    if any(due_at.tzinfo is None for due_at in remind_at):
+        raise ValueError("Reminder times must include a timezone.")
+    if any(due_at < datetime.now(tz=due_at.tzinfo) for due_at in remind_at):
+        raise ValueError("Reminder times must be in the future.")
+
+    channel_id, user_id, guild_id = _reminder_context(config)
+    reminders = await create_reminders(
+        channel_id=channel_id,
+        user_id=user_id,
+        guild_id=guild_id,
+        reminders=[(due_at, message) for due_at in remind_at],
+    )
+    await schedule_reminder_delivery(reminder.due_at for reminder in reminders)
+    return {"reminder_ids": [reminder.id for reminder in reminders], "count": len(reminders)}
+
+
+@tool
+async def list_reminders(config: RunnableConfig) -> list[str]:
+    """List the upcoming reminders in this channel, with their IDs."""
+    channel_id, _, _ = _reminder_context(config)
+    return [str(reminder) for reminder in await get_pending_reminders(channel_id)]
+
+
+@tool(parse_docstring=True)
+async def cancel_reminder(config: RunnableConfig, reminder_ids: list[int]) -> int:
+    """
+    Cancel upcoming reminders in this channel.
+
+    Args:
+        reminder_ids: The IDs of the reminders to cancel, from `list_reminders` or `set_reminders`.
+
+    Returns:
+        The number of reminders cancelled.
+    """
+    channel_id, _, _ = _reminder_context(config)
+    return await cancel_reminders(channel_id, reminder_ids)
@@ -1,4 +1,119 @@
-# TODO: re-write the code for listening to a discord voice channel with tools to search what was said and get summaries
-# TODO: actually store the summaries in the database and make tooling to output them to google docs or other formats,
-#       along with having them go to a dedicate text channel for session notes.
+# TODO: make tooling to output the session summaries to google docs or other formats, along with having them go to a
+#       dedicate text channel for session notes.
 # TODO: users should be able to tell grug to start and stop recording, and to get the notes from the session.
+import uuid
+from datetime import datetime
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from grug.models import VoiceTranscriptSegment
+from grug.session_summaries import get_session_summary
+from grug.transcripts import get_voice_session, get_voice_sessions, search_transcript
+
+
+def _get_guild_id(config: RunnableConfig) -> int:
+    if (guild_id := config.get("configurable", {}).get("guild_id")) is None:
+        raise ValueError("Voice session transcripts are only available in a server.")
+    return guild_id
+
+
+def _format_page(segment: VoiceTranscriptSegment) -> str:
+    return f"{segment.spoken_at.isoformat()}/{segment.id}"
+
+
+def _parse_page(page: str) -> tuple[datetime, int]:
+    spoken_at, _, segment_id = page.rpartition("/")
+    try:
+        return datetime.fromisoformat(spoken_at), int(segment_id)
+    except ValueError:
+        raise ValueError("`after` must be the `next_page` value from a previous call.") from None
+
+
+@tool(parse_docstring=True)
+async def list_voice_sessions(config: RunnableConfig, limit: int = 5) -> list[dict[str, str | None]]:
+    """
+    List the most recent voice sessions that were recorded in this server, newest first.
+
+    Args:
+        limit: The maximum number of sessions to return.
+
+    Returns:
+        A list of sessions, each with its `session_id`, `started_at` and `ended_at` time (`None` if still ongoing).
+    """
+    return [
+        {
+            "session_id": str(voice_session.id),
+            "started_at": voice_session.started_at.isoformat(),
+            "ended_at": voice_session.ended_at.isoformat() if voice_session.ended_at else None,
+        }
+        for voice_session in await get_voice_sessions(_get_guild_id(config), limit=min(limit, 25))
+    ]
+
+
+@tool(parse_docstring=True)
+async def search_voice_session_transcript(
+    config: RunnableConfig,
+    query: str | None = None,
+    session_id: str | None = None,
+    after: str | None = None,
+) -> dict[str, str | list[str] | None]:
+    """
+    Search or read through the transcript of what was said in a voice session, in chronological order.
+
+    Args:
+        query: Words or phrases to search for (web search syntax, e.g. `dragon "treasure hoard"`). Leave empty to
+            read the whole transcript page by page.
+        session_id: The voice session to search. Defaults to the most recent session in this server.
+        after: The `next_page` value from a previous call, to get the next page of results.
+
+    Returns:
+        A dictionary with the `session_id`, the matching transcript `lines` (formatted as "[time] speaker: text"), and
+        `next_page`, which is `None` when there are no more results.
+    """
+    page_size = 50
+    voice_session = await get_voice_session(_get_guild_id(config), uuid.UUID(session_id) if session_id else None)
+    if voice_session is None:
+        raise ValueError("No voice session found.")
+
+    segments = await search_transcript(
+        voice_session,
+        query=query,
+        after=_parse_page(after) if after else None,
+        limit=page_size,
+    )
+
+    return {
+        "session_id": str(voice_session.id),
+        "lines": [str(segment) for segment in segments],
+        "next_page": _format_page(segments[-1]) if len(segments) == page_size else None,
+    }
+
+
+@tool(parse_docstring=True)
+async def summarize_voice_session(
+    config: RunnableConfig, session_id: str | None = None
+) -> dict[str, str | bool | None]:
+    """
+    Summarize a voice session: what happened in the game, decisions, characters, loot and open questions. If the
+    session is still going, this is a summary so far.
+
+    Args:
+        session_id: The voice session to summarize. Defaults to the most recent session in this server.
+
+    Returns:
+        A dictionary with the `session_id`, the `summary` (`None` if nothing was said), the time of the last thing said
+        that it covers (`until`), and whether the session has `ended`.
+    """
+    voice_session = await get_voice_session(_get_guild_id(config), uuid.UUID(session_id) if session_id else None)
+    if voice_session is None:
+        raise ValueError("No voice session found.")
+
+    # This runs in an agent request that was already admitted, so the summaries aren't admitted separately
+    session_summary = await get_session_summary(voice_session, request_class=None)
+    return {
+        "session_id": str(voice_session.id),
+        "summary": session_summary.summary,
+        "until": session_summary.until.isoformat() if session_summary.until else None,
+        "ended": voice_session.ended_at is not None,
+    }
@@ -9,11 +9,12 @@ from grug.utils import log_runtime, timeout
 
 
 @log_runtime
-def get_tts(text: str) -> Path:
+def get_tts(text: str, voice: str | None = None) -> Path:
     """Get a TTS audio file for the given text.
 
     Args:
         text (str): The text to convert to speech.
+        voice (str | None): The name of the reference voice in `assets/bot_voices`. Defaults to `settings.tts_voice`.
 
     Returns: The path to the generated wav audio file.
 
@@ -21,6 +22,8 @@ def get_tts(text: str) -> Path:
         - F5-TTS Hugging Face Space: https://huggingface.co/spaces/mrfakename/E2-F5-TTS
         - F5-TTS source code: https://github.com/SWivid/F5-TTS
     """
+    voice = voice or settings.tts_voice
+
     try:
         tts_client = Client(f"http://{settings.tts_f5_host}:{settings.tts_f5_port}/")
         tts_client.predict(new_choice="F5-TTS", api_name="/switch_tts_model")
@@ -30,8 +33,8 @@ def get_tts(text: str) -> Path:
         logger.info(f"Generating TTS for: {text}")
         with timeout(seconds=5):
             result = tts_client.predict(
-                ref_audio_input=handle_file(voices_dir / f"{settings.tts_voice}.wav"),
-                ref_text_input=yaml.safe_load((voices_dir / "reference_text.yml").read_text())[settings.tts_voice],
+                ref_audio_input=handle_file(voices_dir / f"{voice}.wav"),
+                ref_text_input=yaml.safe_load((voices_dir / "reference_text.yml").read_text())[voice],
                 gen_text_input=text,
                 remove_silence=settings.tts_remove_silence,
                 cross_fade_duration_slider=settings.tts_crossroad_duration_slider,
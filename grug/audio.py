@@ -0,0 +1,165 @@
+"""
+NumPy-backed PCM audio processing for the voice path.
+
+All functions operate on whole segments at once (no per-sample or per-packet Python loops), and replace the
+`audioop` module, which was removed from the standard library in Python 3.13.
+"""
+
+import wave
+from functools import lru_cache
+from math import gcd
+from pathlib import Path
+
+import numpy as np
+
+DISCORD_SAMPLE_RATE = 48_000
+DISCORD_CHANNELS = 2
+WHISPER_SAMPLE_RATE = 16_000
+
+
+def pcm_to_array(pcm: bytes, channels: int = 1) -> np.ndarray:
+    """Convert little-endian s16 PCM bytes to an int16 array of shape (frames,) or (frames, channels)."""
+    samples = np.frombuffer(pcm, dtype="<i2")
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels)
+    return samples
+
+
+def array_to_pcm(samples: np.ndarray) -> bytes:
+    """Convert an int16 array (mono or interleaved channels) to little-endian s16 PCM bytes."""
+    return samples.astype("<i2", copy=False).tobytes()
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """Average a (frames, channels) array down to a mono float32 array."""
+    if samples.ndim == 1:
+        return samples.astype(np.float32)
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def to_int16(samples: np.ndarray, normalize: bool = False, headroom: float = 0.95) -> np.ndarray:
+    """
+    Convert float samples (in int16 scale) to int16 with clipping.
+
+    Args:
+        samples: The samples to convert.
+        normalize: Scale the segment so its peak sits at `headroom` of full scale. Quiet speakers get boosted, which
+            helps both the wake word spotter and transcription.
+        headroom: The fraction of full scale the peak is normalized to.
+    """
+    if normalize and len(samples):
+        peak = np.abs(samples).max()
+        if peak > 0:
+            samples = samples * (headroom * 32767 / peak)
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+_FILTER_HALF_WIDTH = 10
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filters(up: int, down: int, half_width: int = _FILTER_HALF_WIDTH, beta: float = 5.0) -> np.ndarray:
+    """
+    Kaiser-windowed sinc low-pass filter split into `up` polyphase branches.
+
+    Returns an array of shape (up, taps_per_phase) with each branch reversed, ready to be dotted with input windows.
+    """
+    max_rate = max(up, down)
+    n_taps = 2 * half_width * max_rate + 1
+    t = np.arange(n_taps) - (n_taps - 1) / 2
+    h = np.sinc(t / max_rate) / max_rate * np.kaiser(n_taps, beta) * up
+
+    taps_per_phase = -(-n_taps // up)
+    padded = np.zeros(taps_per_phase * up)
+    padded[:n_taps] = h
+    return padded.reshape(taps_per_phase, up).T[:, ::-1].astype(np.float32).copy()
+
+
+def resample_poly(samples: np.ndarray, from_rate: int, to_rate: int) -> np.ndarray:
+    """
+    Resample a mono signal with a polyphase FIR filter.
+
+    Only the output samples that are actually kept are computed: for each of the `up` polyphase branches, the input
+    windows needed are a strided view of the signal, so each branch is a single matrix-vector product.
+
+    Returns:
+        A float32 array of the resampled signal, in the same scale as the input.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    g = gcd(from_rate, to_rate)
+    up, down = to_rate // g, from_rate // g
+    if up == down:
+        return samples
+
+    filters = _polyphase_filters(up, down)
+    taps_per_phase = filters.shape[1]
+    n_out = -(-len(samples) * up // down)
+    delay = _FILTER_HALF_WIDTH * max(up, down)  # group delay of the filter, in upsampled samples
+
+    # Pad so every window is in bounds: window `b` covers input samples b - taps_per_phase + 1 ... b
+    last_base = ((n_out - 1) * down + delay) // up
+    padded = np.zeros(taps_per_phase - 1 + max(len(samples), last_base + 1), dtype=np.float32)
+    padded[taps_per_phase - 1 : taps_per_phase - 1 + len(samples)] = samples  # noqa: E203
+    windows = np.lib.stride_tricks.sliding_window_view(padded, taps_per_phase)
+
+    out = np.empty(n_out, dtype=np.float32)
+    for offset in range(min(up, n_out)):
+        position = offset * down + delay
+        base, phase = divmod(position, up)
+        count = len(range(offset, n_out, up))
+        out[offset::up] = windows[base : base + count * down : down] @ filters[phase]  # noqa: E203
+    return out
+
+
+def prepare_for_transcription(
+    pcm: bytes, sample_rate: int, channels: int = 1, to_rate: int = WHISPER_SAMPLE_RATE
+) -> bytes:
+    """Downmix, resample and peak-normalize a whole PCM segment to mono s16 at `to_rate`."""
+    mono = downmix(pcm_to_array(pcm, channels))
+    return array_to_pcm(to_int16(resample_poly(mono, sample_rate, to_rate), normalize=True))
+
+
+def _decode_samples(frames: bytes, sample_width: int) -> np.ndarray:
+    """Decode little-endian integer PCM of any WAV sample width to float32 samples in int16 scale."""
+    frames = frames[: len(frames) - len(frames) % sample_width]
+    if sample_width == 1:
+        # 8-bit WAV samples are unsigned
+        return (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) * 256
+    if sample_width == 2:
+        return np.frombuffer(frames, dtype="<i2").astype(np.float32)
+    if sample_width == 3:
+        triplets = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Assemble into the top 24 bits, so the shift back down sign-extends
+        samples = (triplets[:, 0] << 8 | triplets[:, 1] << 16 | triplets[:, 2] << 24) >> 8
+        return samples.astype(np.float32) / 256
+    if sample_width == 4:
+        return np.frombuffer(frames, dtype="<i4").astype(np.float32) / 65536
+    raise ValueError(f"Unsupported WAV sample width: {sample_width} bytes")
+
+
+def wav_to_discord_pcm(path: Path) -> bytes:
+    """
+    Decode a PCM WAV file and convert it to the 48 kHz stereo s16le PCM Discord plays, in process.
+
+    Raises:
+        wave.Error: If the file isn't an integer PCM WAV file (e.g. a float or compressed one).
+    """
+    with wave.open(str(path), "rb") as wav_file:
+        channels, sample_width, sample_rate = wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    samples = _decode_samples(frames, sample_width)
+    samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels)
+    if channels > DISCORD_CHANNELS:
+        samples = downmix(samples)[:, np.newaxis]
+    if sample_rate != DISCORD_SAMPLE_RATE:
+        samples = np.stack(
+            [
+                resample_poly(samples[:, channel], sample_rate, DISCORD_SAMPLE_RATE)
+                for channel in range(samples.shape[1])
+            ],
+            axis=1,
+        )
+    if samples.shape[1] < DISCORD_CHANNELS:
+        samples = np.repeat(samples, DISCORD_CHANNELS, axis=1)
+    return array_to_pcm(to_int16(samples))
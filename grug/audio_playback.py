@@ -0,0 +1,77 @@
+"""
+In-memory audio sources for playing sound effects and spoken responses in voice channels.
+
+`FFmpegPCMAudio` forks an ffmpeg process for every playback, just to decode a WAV file. `InMemoryPCMAudio` instead
+decodes the WAV in process (see `grug.audio.wav_to_discord_pcm`) and streams it to the voice client in 20 ms frames
+from memory. Sound effects are decoded once, by `preload_sound_effects` at startup, and every playback reads the same
+buffer. Files that `wave` can't decode (e.g. float or compressed WAVs) still play through ffmpeg.
+"""
+
+import wave
+from pathlib import Path
+
+import discord
+from discord import FFmpegPCMAudio
+from discord.opus import Encoder
+from loguru import logger
+
+from grug.audio import wav_to_discord_pcm
+from grug.settings import settings
+
+SOUND_EFFECTS_DIR = settings.root_dir / "assets" / "sound_effects"
+
+# Decoded sound effects, by name (the file name without the extension)
+_sound_effects: dict[str, bytes] = {}
+
+
+class InMemoryPCMAudio(discord.AudioSource):
+    """Plays 48 kHz stereo s16le PCM from memory, one 20 ms frame at a time."""
+
+    def __init__(self, pcm: bytes):
+        self._pcm = memoryview(pcm)
+        self._position = 0
+
+    @classmethod
+    def from_wav(cls, path: Path) -> "InMemoryPCMAudio":
+        return cls(wav_to_discord_pcm(path))
+
+    def read(self) -> bytes:
+        frame = self._pcm[self._position : self._position + Encoder.FRAME_SIZE]  # noqa: E203
+        self._position += Encoder.FRAME_SIZE
+        if not frame:
+            return b""
+        # The encoder takes whole frames, so the last one is padded with silence
+        return frame.tobytes().ljust(Encoder.FRAME_SIZE, b"\0")
+
+    def is_opus(self) -> bool:
+        return False
+
+    @property
+    def duration_seconds(self) -> float:
+        return len(self._pcm) / Encoder.FRAME_SIZE * Encoder.FRAME_LENGTH / 1000
+
+
+def load_audio(path: Path) -> discord.AudioSource:
+    """Load a WAV file to play, decoding it in process if possible, and falling back to ffmpeg otherwise."""
+    try:
+        return InMemoryPCMAudio.from_wav(path)
+    except (wave.Error, EOFError, ValueError) as e:
+        logger.debug(f"Playing {path} through ffmpeg, as it can't be decoded in process: {e}")
+        return FFmpegPCMAudio(path.as_posix())
+
+
+def preload_sound_effects(directory: Path = SOUND_EFFECTS_DIR) -> None:
+    """Decode the sound effects, so playing them doesn't have to."""
+    for path in sorted(directory.glob("*.wav")):
+        try:
+            _sound_effects[path.stem] = wav_to_discord_pcm(path)
+        except (wave.Error, EOFError, ValueError) as e:
+            logger.warning(f"Failed to preload the {path.stem} sound effect, it will play through ffmpeg: {e}")
+    logger.info(f"Preloaded {len(_sound_effects)} sound effects")
+
+
+def sound_effect(name: str) -> discord.AudioSource:
+    """Get a sound effect to play, from memory if it was preloaded."""
+    if name in _sound_effects:
+        return InMemoryPCMAudio(_sound_effects[name])
+    return load_audio(SOUND_EFFECTS_DIR / f"{name}.wav")
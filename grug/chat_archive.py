@@ -0,0 +1,201 @@
+"""
+Archive of Discord text messages, for searching a channel's chat history.
+
+Live messages are buffered by `chat_archive_writer` and bulk loaded with `COPY`. Older history can be loaded with
+`backfill_channel`, which pages through `channel.history` and loads each page with a single `COPY`. Searches are always
+scoped to a guild (and optionally some of its channels) and time range, and are served by the full-text (GIN) and, when
+embeddings are enabled, vector (HNSW) indexes on the `chat_messages` table.
+
+Every text channel the bot can see is archived, including private and staff channels, so searches on behalf of a member
+must be scoped to the channels they can read, see `readable_channel_ids`.
+"""
+
+from datetime import UTC, datetime, timedelta
+
+import discord
+from loguru import logger
+from sqlalchemy import func
+from sqlmodel import col, select
+
+from grug.db import AsyncBatchWriter, copy_rows, sqa_async_engine, sqa_async_session_factory
+from grug.embedding_service import get_embedding_service
+from grug.models import ChatMessage
+from grug.settings import settings
+
+CHAT_ARCHIVE_TABLE = ChatMessage.__tablename__
+_COLUMNS = ("id", "guild_id", "channel_id", "author_id", "author_name", "content", "created_at")
+
+chat_archive_writer = AsyncBatchWriter(table=CHAT_ARCHIVE_TABLE, columns=_COLUMNS, skip_conflicts=True)
+
+
+def _message_row(message: discord.Message) -> tuple:
+    return (
+        message.id,
+        message.guild.id,
+        message.channel.id,
+        message.author.id,
+        message.author.display_name,
+        message.clean_content,
+        message.created_at,
+    )
+
+
+def _is_archivable(message: discord.Message) -> bool:
+    # Only server messages with text are archived, DMs are never stored
+    return message.guild is not None and bool(message.content) and message.type == discord.MessageType.default
+
+
+def readable_channel_ids(member: discord.Member) -> list[int]:
+    """The channels and threads in a member's guild whose message history the member can read."""
+    channels = [
+        *member.guild.channels,
+        # Threads inherit their parent's permissions, but private threads are only readable by their members
+        *(
+            thread
+            for thread in member.guild.threads
+            if not thread.is_private() or any(thread_member.id == member.id for thread_member in thread.members)
+        ),
+    ]
+    return [channel.id for channel in channels if channel.permissions_for(member).read_message_history]
+
+
+def archive_message(message: discord.Message) -> None:
+    """Queue a message to be archived."""
+    if settings.chat_archive_enabled and _is_archivable(message):
+        chat_archive_writer.add(_message_row(message))
+
+
+async def backfill_channel(
+    channel: discord.TextChannel | discord.Thread,
+    limit: int | None = None,
+    page_size: int = 1000,
+) -> int:
+    """
+    Load a channel's existing message history into the archive, skipping messages that are already archived.
+
+    Args:
+        channel: The channel to backfill.
+        limit: The maximum number of messages to load, newest first. If None, the whole history is loaded.
+        page_size: The number of messages to load per `COPY`.
+
+    Returns:
+        The number of messages read from Discord.
+    """
+    read = 0
+    page: list[tuple] = []
+
+    async def _load_page():
+        async with sqa_async_engine.begin() as conn:
+            await copy_rows(conn, CHAT_ARCHIVE_TABLE, _COLUMNS, page, skip_conflicts=True)
+        logger.info(f"Backfilled {read} messages from #{channel.name}")
+        page.clear()
+
+    async for message in channel.history(limit=limit):
+        read += 1
+        if _is_archivable(message):
+            page.append(_message_row(message))
+        if len(page) >= page_size:
+            await _load_page()
+
+    if page:
+        await _load_page()
+
+    return read
+
+
+async def embed_archived_messages(batch_size: int = 256, max_batches: int = 20) -> int:
+    """Fill in embeddings for archived messages that don't have one yet, newest first."""
+    if not settings.chat_archive_embeddings_enabled:
+        return 0
+
+    embedded = 0
+    embeddings = get_embedding_service()
+    for _ in range(max_batches):
+        async with sqa_async_session_factory() as session:
+            # noinspection PyTypeChecker
+            messages = list(
+                (
+                    await session.execute(
+                        select(ChatMessage)
+                        .where(col(ChatMessage.embedding).is_(None))
+                        .order_by(col(ChatMessage.id).desc())
+                        .limit(batch_size)
+                    )
+                ).scalars()
+            )
+            if not messages:
+                break
+
+            # The embeddings are stored with the messages, so they aren't saved to the persistent cache too
+            vectors = await embeddings.aembed_documents([message.content for message in messages], persist=False)
+            for message, vector in zip(messages, vectors):
+                message.embedding = vector
+                session.add(message)
+            await session.commit()
+
+        embedded += len(messages)
+
+    if embedded:
+        logger.info(f"Embedded {embedded} archived chat messages")
+    return embedded
+
+
+async def search_chat_messages(
+    guild_id: int,
+    query: str,
+    channel_ids: list[int] | None = None,
+    since: datetime | None = None,
+    limit: int = 20,
+) -> list[ChatMessage]:
+    """
+    Search a guild's archived chat messages, best matches first.
+
+    Full-text matches are ranked first. When embeddings are enabled, the nearest messages by meaning fill the rest of
+    the results, which catches messages that talk about the query without using the same words.
+
+    Args:
+        guild_id: The guild to search.
+        query: A web-search style full-text query.
+        channel_ids: Only search these channels, if given.
+        since: Only search messages sent after this time, if given.
+        limit: The maximum number of messages to return.
+    """
+
+    def _scoped(statement):
+        statement = statement.where(ChatMessage.guild_id == guild_id)
+        if channel_ids is not None:
+            statement = statement.where(col(ChatMessage.channel_id).in_(channel_ids))
+        if since is not None:
+            statement = statement.where(ChatMessage.created_at >= since)
+        return statement.limit(limit)
+
+    ts_query = func.websearch_to_tsquery("english", query)
+    full_text_statement = _scoped(
+        select(ChatMessage)
+        .where(col(ChatMessage.content_search).op("@@")(ts_query))
+        .order_by(func.ts_rank(ChatMessage.content_search, ts_query).desc(), col(ChatMessage.created_at).desc())
+    )
+
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        results = list((await session.execute(full_text_statement)).scalars())
+
+        if settings.chat_archive_embeddings_enabled and len(results) < limit:
+            query_embedding = await get_embedding_service().aembed_query(query)
+            semantic_statement = _scoped(
+                select(ChatMessage)
+                .where(col(ChatMessage.embedding).is_not(None))
+                .order_by(col(ChatMessage.embedding).cosine_distance(query_embedding))
+            )
+            seen = {message.id for message in results}
+            # noinspection PyTypeChecker
+            for message in (await session.execute(semantic_statement)).scalars():
+                if message.id not in seen and len(results) < limit:
+                    results.append(message)
+
+    return results
+
+
+def default_search_window() -> datetime:
+    """The default start of the time range for chat history searches."""
+    return datetime.now(tz=UTC) - timedelta(days=settings.chat_archive_default_search_days)
@@ -0,0 +1,350 @@
+"""
+A local compendium of rules entries (spells, feats, conditions, monsters, items, ...), for instant, offline lookups.
+
+Rules lookups are the most common thing Grug is asked for, and looking them up in uploaded source material, or a
+remote API, takes a round trip per question. Instead, dumps of compendium entries in `compendium_dir` (e.g. exported
+from Archives of Nethys) are compiled into a single index file, which is memory-mapped, so it opens in milliseconds
+whatever its size, and only the pages a lookup touches are read.
+
+Dumps are `*.json` files holding a list of entries, or `*.jsonl` files with an entry per line. Each entry needs a
+`name` and a `category` (or `type`), and its `text` (or `description`) is the answer. Any other fields, like the source
+book, level, traits or URL, are kept and returned with it. The index is rebuilt when the dumps change.
+
+The index file is a JSON header followed by flat arrays:
+
+- the entries, sorted by their normalized name, as offsets into blobs of names, normalized names and JSON records, and
+  their category IDs. As the entries are sorted, the normalized names double as a prefix index, searched by bisection.
+- a trigram index: the sorted trigrams of the normalized names, and for each, the entries whose names contain it (in
+  compressed sparse row form).
+
+A lookup collects candidates by prefix and by the number of trigrams they share with the query, and scores the
+candidates with rapidfuzz's `process.extract`, so typos and partial names still match, without scoring every entry.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+from loguru import logger
+from rapidfuzz import fuzz, process, utils
+
+from grug.settings import settings
+
+_MAGIC = b"GRUGCMP1"
+_ALIGNMENT = 8
+
+
+def normalize(name: str) -> str:
+    """Normalize a name for matching: lowercase, without accents, and with punctuation replaced by spaces."""
+    name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return " ".join(utils.default_process(name).split())
+
+
+def trigrams(key: str) -> np.ndarray:
+    """The trigrams of a normalized name, each packed into an integer, padded so short names and prefixes match."""
+    padded = f"  {key} "
+    codes = np.fromiter((ord(c) for c in padded), dtype=np.uint64, count=len(padded))
+    return np.unique((codes[:-2] << np.uint64(42)) | (codes[1:-1] << np.uint64(21)) | codes[2:])
+
+
+@dataclass
+class CompendiumEntry:
+    name: str
+    category: str
+    text: str
+    fields: dict[str, Any] = field(default_factory=dict)
+
+    def __str__(self):
+        details = ", ".join(f"{key}: {value}" for key, value in self.fields.items() if value not in (None, "", []))
+        return f"{self.name} ({self.category}{', ' + details if details else ''})\n{self.text}"
+
+
+@dataclass
+class CompendiumMatch:
+    entry: CompendiumEntry
+    score: float
+
+
+def iter_dump_entries(paths: Iterable[Path]) -> Iterator[CompendiumEntry]:
+    """Read the entries from compendium dumps, skipping any without a name, category or text."""
+    for path in paths:
+        with path.open(encoding="utf-8") as file:
+            records = (
+                (json.loads(line) for line in file if line.strip()) if path.suffix == ".jsonl" else json.load(file)
+            )
+            skipped = 0
+            for record in records:
+                record = dict(record)
+                name = record.pop("name", None)
+                category = record.pop("category", None) or record.pop("type", None)
+                text = record.pop("text", None) or record.pop("description", None)
+                if not (name and category and text):
+                    skipped += 1
+                    continue
+                yield CompendiumEntry(name=str(name), category=str(category), text=str(text), fields=record)
+        if skipped:
+            logger.warning(f"Skipped {skipped} entries of {path.name} without a name, category or text")
+
+
+def _offsets(blobs: list[bytes], dtype) -> np.ndarray:
+    offsets = np.zeros(len(blobs) + 1, dtype=dtype)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    return offsets
+
+
+def build_compendium_index(entries: Iterable[CompendiumEntry], path: Path, sources: dict | None = None) -> int:
+    """
+    Compile entries into an index file, replacing it atomically, and return the number of entries.
+
+    Args:
+        entries: The entries to index.
+        path: Where to write the index.
+        sources: Describes the dumps the entries came from, so `load_compendium` can tell when they change.
+    """
+    keyed = sorted(((normalize(entry.name), entry) for entry in entries), key=lambda item: (item[0], item[1].name))
+    keyed = [(key, entry) for key, entry in keyed if key]
+    categories = sorted({entry.category for _, entry in keyed})
+    category_ids = {category: i for i, category in enumerate(categories)}
+
+    names = [entry.name.encode() for _, entry in keyed]
+    keys = [key.encode() for key, _ in keyed]
+    records = [json.dumps({"text": entry.text, **entry.fields}, ensure_ascii=False).encode() for _, entry in keyed]
+
+    # Invert the trigrams of each name into postings lists, in compressed sparse row form
+    entry_trigrams = [trigrams(key) for key, _ in keyed]
+    all_trigrams = np.concatenate(entry_trigrams) if entry_trigrams else np.zeros(0, dtype=np.uint64)
+    all_entries = np.repeat(np.arange(len(keyed), dtype=np.uint32), [len(t) for t in entry_trigrams])
+    order = np.lexsort((all_entries, all_trigrams))
+    trigram_keys, trigram_counts = np.unique(all_trigrams[order], return_counts=True)
+    trigram_offsets = np.zeros(len(trigram_keys) + 1, dtype=np.uint64)
+    np.cumsum(trigram_counts, out=trigram_offsets[1:])
+
+    arrays = {
+        "name_offsets": _offsets(names, np.uint64),
+        "names": np.frombuffer(b"".join(names), dtype=np.uint8),
+        "key_offsets": _offsets(keys, np.uint64),
+        "keys": np.frombuffer(b"".join(keys), dtype=np.uint8),
+        "record_offsets": _offsets(records, np.uint64),
+        "records": np.frombuffer(b"".join(records), dtype=np.uint8),
+        "categories": np.array([category_ids[entry.category] for _, entry in keyed], dtype=np.uint16),
+        "trigram_keys": trigram_keys,
+        "trigram_offsets": trigram_offsets,
+        "trigram_postings": all_entries[order],
+    }
+
+    # Lay the arrays out after the header, each aligned so it can be viewed in place
+    layout, position = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, position, len(array)]
+        position += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps(
+        {"count": len(keyed), "categories": categories, "sources": sources or {}, "arrays": layout}
+    ).encode()
+    data_start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".tmp")
+    with temp_path.open("wb") as file:
+        file.write(_MAGIC + len(header).to_bytes(8, "little") + header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name][1])
+            file.write(array.tobytes())
+        file.truncate(data_start + position)
+    os.replace(temp_path, path)
+    return len(keyed)
+
+
+class Compendium:
+    """A memory-mapped compendium index, see `build_compendium_index`."""
+
+    def __init__(self, path: Path):
+        with path.open("rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a compendium index")
+        header_length = int.from_bytes(self._mmap[len(_MAGIC) : len(_MAGIC) + 8], "little")  # noqa: E203
+        header = json.loads(self._mmap[len(_MAGIC) + 8 : len(_MAGIC) + 8 + header_length])  # noqa: E203
+        data_start = -(-(len(_MAGIC) + 8 + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+        self.path = path
+        self.sources: dict = header["sources"]
+        self.categories: list[str] = header["categories"]
+        self._category_ids = {category.lower(): i for i, category in enumerate(self.categories)}
+        self._count: int = header["count"]
+        self._arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=length, offset=data_start + offset)
+            for name, (dtype, offset, length) in header["arrays"].items()
+        }
+        # Where the blobs start, to slice strings straight out of the mapping
+        self._blob_starts = {name: data_start + header["arrays"][name][1] for name in ("names", "keys", "records")}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> CompendiumEntry:
+        record = json.loads(self._blob("records", i))
+        return CompendiumEntry(
+            name=self._blob("names", i).decode(),
+            category=self.categories[self._arrays["categories"][i]],
+            text=record.pop("text"),
+            fields=record,
+        )
+
+    def _blob(self, name: str, i: int) -> bytes:
+        start, end = self._arrays[f"{name[:-1]}_offsets"][i : i + 2].tolist()  # noqa: E203
+        return self._mmap[self._blob_starts[name] + start : self._blob_starts[name] + end]  # noqa: E203
+
+    def key(self, i: int) -> str:
+        """The normalized name of an entry."""
+        return self._blob("keys", i).decode()
+
+    def keys(self, ids: np.ndarray) -> list[str]:
+        """The normalized names of several entries."""
+        offsets, base = self._arrays["key_offsets"], self._blob_starts["keys"]
+        return [
+            self._mmap[base + start : base + end].decode()  # noqa: E203
+            for start, end in zip(offsets[ids].tolist(), offsets[ids + 1].tolist())
+        ]
+
+    def category_id(self, category: str) -> int:
+        """Get a category's ID, matching its name loosely (e.g. "spells" for "Spell")."""
+        if (category_id := self._category_ids.get(category.lower())) is not None:
+            return category_id
+        match = process.extractOne(normalize(category), list(self._category_ids), scorer=fuzz.WRatio, score_cutoff=80)
+        if match is None:
+            raise ValueError(f"Unknown category {category!r}, the categories are: {', '.join(self.categories)}")
+        return self._category_ids[match[0]]
+
+    def _prefix_candidates(self, key: str, limit: int) -> list[int]:
+        """The entries whose normalized names start with the key, up to `limit`."""
+        start = bisect.bisect_left(range(self._count), key, key=self.key)
+        candidates = []
+        for i in range(start, min(start + limit, self._count)):
+            if not self.key(i).startswith(key):
+                break
+            candidates.append(i)
+        return candidates
+
+    def _trigram_candidates(self, key: str, limit: int, category_id: int | None, max_postings: int) -> np.ndarray:
+        """The `limit` entries (in the category, if any) sharing the most trigrams with the key."""
+        query = trigrams(key)
+        trigram_keys = self._arrays["trigram_keys"]
+        positions = np.searchsorted(trigram_keys, query)
+        found = positions < len(trigram_keys)
+        positions = positions[found][trigram_keys[positions[found]] == query[found]]
+        if not len(positions):
+            return np.zeros(0, dtype=np.uint32)
+
+        # Count the rarest trigrams first, and skip the most common ones once enough postings have been read, as they
+        # narrow the candidates down the least
+        offsets, postings = self._arrays["trigram_offsets"], self._arrays["trigram_postings"]
+        lengths = (offsets[positions + 1] - offsets[positions]).astype(np.int64)
+        order = np.argsort(lengths)
+        used = order[: max(1, int(np.searchsorted(np.cumsum(lengths[order]), max_postings, side="right")))]
+        entries = np.concatenate([postings[offsets[p] : offsets[p + 1]] for p in positions[used]])  # noqa: E203
+        if category_id is not None:
+            entries = entries[self._arrays["categories"][entries] == category_id]
+        # Rather than sorting the entries by the trigrams they share (with lots of ties), find the most shared count
+        # that at least `limit` entries reach, and take the entries above it, then those on it while there's room
+        shared = np.bincount(entries)
+        at_least = np.cumsum(np.bincount(shared)[::-1])[::-1]
+        reached = np.flatnonzero(at_least[1:] >= limit)
+        threshold = int(reached[-1]) + 1 if len(reached) else 1
+        above, tied = np.flatnonzero(shared > threshold), np.flatnonzero(shared == threshold)
+        return np.concatenate([above, tied[: max(0, limit - len(above))]])
+
+    def lookup(
+        self,
+        query: str,
+        category: str | None = None,
+        limit: int = 5,
+        min_score: float = 0,
+        candidates: int = 200,
+        max_postings: int = 10_000,
+    ) -> list[CompendiumMatch]:
+        """
+        Look up entries by name, best match first.
+
+        Args:
+            query: The name to look up. Typos and partial names are fine.
+            category: Only match entries in this category.
+            limit: The most matches to return.
+            min_score: The lowest rapidfuzz `WRatio` score, from 0 to 100, of a match.
+            candidates: The most entries, found by prefix and shared trigrams, that are scored.
+            max_postings: Roughly how many trigram postings to count, rarest trigrams first.
+        """
+        if not (key := normalize(query)):
+            return []
+
+        category_id = self.category_id(category) if category is not None else None
+        ids = np.union1d(
+            np.array(self._prefix_candidates(key, candidates), dtype=np.int64),
+            self._trigram_candidates(key, candidates, category_id, max_postings),
+        )
+        if category_id is not None:
+            ids = ids[self._arrays["categories"][ids] == category_id]
+
+        matches = process.extract(
+            key,
+            dict(zip(ids.tolist(), self.keys(ids))),
+            scorer=fuzz.WRatio,
+            processor=None,
+            limit=limit,
+            score_cutoff=min_score,
+        )
+        # Break ties in favour of exact and shorter names, e.g. "Shield" over "Shield Other" for "shield"
+        matches.sort(key=lambda match: (-match[1], match[0] != key, len(match[0])))
+        return [CompendiumMatch(entry=self[i], score=score) for _, score, i in matches]
+
+
+_compendium: Compendium | None = None
+
+
+def _dump_sources(paths: list[Path]) -> dict[str, list[int]]:
+    return {path.name: [path.stat().st_size, path.stat().st_mtime_ns] for path in paths}
+
+
+def _index_sources(index_path: Path) -> dict | None:
+    """The sources an index was built from, or None if there is no usable index."""
+    try:
+        return Compendium(index_path).sources
+    except (OSError, ValueError) as e:
+        if index_path.exists():
+            logger.warning(f"Rebuilding the compendium index, as {index_path} can't be read: {e}")
+        return None
+
+
+def load_compendium(
+    directory: Path = settings.compendium_dir, index_path: Path = settings.compendium_index_path
+) -> Compendium | None:
+    """Open the compendium index, first (re)building it if the dumps in `directory` changed since it was built."""
+    global _compendium
+
+    dumps = sorted(path for path in directory.glob("*") if path.suffix in (".json", ".jsonl"))
+    sources = _dump_sources(dumps)
+    if dumps and _index_sources(index_path) != sources:
+        started_at = time.perf_counter()
+        count = build_compendium_index(iter_dump_entries(dumps), index_path, sources=sources)
+        logger.info(
+            f"Indexed {count} compendium entries from {len(dumps)} dumps in {time.perf_counter() - started_at:.1f}s"
+        )
+
+    if not index_path.exists():
+        logger.info(f"No compendium dumps found in {directory}, compendium lookups are disabled")
+        return None
+
+    _compendium = Compendium(index_path)
+    logger.info(f"Loaded the compendium, {len(_compendium)} entries in {len(_compendium.categories)} categories")
+    return _compendium
+
+
+def get_compendium() -> Compendium | None:
+    """Get the compendium loaded by `load_compendium`, if any."""
+    return _compendium
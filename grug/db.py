@@ -1,15 +1,23 @@
 """Database setup and initialization."""
 
 import asyncio
+import re
 import subprocess  # nosec B404
 import sys
+import threading
+from collections import deque
+from datetime import date
+from typing import Any, Deque, Sequence
 
+import anyio
 from loguru import logger
 from psycopg.rows import dict_row
 from psycopg_pool import AsyncConnectionPool
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, async_sessionmaker, create_async_engine
 
 from grug.settings import settings
+from grug.tracing import instrument_sqlalchemy
 
 # Set the event loop policy for Windows
 # NOTE: https://youtrack.jetbrains.com/issue/PY-57667/Asyncio-support-for-the-debugger-EXPERIMENTAL-FEATURE
@@ -24,6 +32,7 @@ sqa_async_engine = create_async_engine(
     pool_size=10,
     max_overflow=20,
 )
+instrument_sqlalchemy(sqa_async_engine.sync_engine)
 
 # Database session factory singleton
 sqa_async_session_factory = async_sessionmaker(bind=sqa_async_engine, class_=AsyncSession, expire_on_commit=False)
@@ -51,6 +60,192 @@ async def get_genai_psycopg_async_pool() -> AsyncConnectionPool:
     return _genai_psycopg_async_pool
 
 
+async def copy_rows(
+    conn: AsyncConnection,
+    table: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence[Any]],
+    skip_conflicts: bool = False,
+) -> None:
+    """
+    Bulk load rows into a table with `COPY ... FROM STDIN` on the psycopg connection underlying `conn`.
+
+    Args:
+        conn: The connection to use, which must be in a transaction.
+        table: The table to load into.
+        columns: The columns being loaded, in the same order as the row values.
+        rows: The rows to load.
+        skip_conflicts: `COPY` has no `ON CONFLICT` clause, so if set, the rows are copied into a temporary staging
+            table first and then inserted with `ON CONFLICT DO NOTHING`.
+    """
+    column_list = ", ".join(columns)
+    target = f"_staging_{table}" if skip_conflicts else table
+
+    if skip_conflicts:
+        await conn.execute(
+            text(f"CREATE TEMP TABLE {target} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA")
+        )
+
+    raw_connection = await conn.get_raw_connection()
+    async with raw_connection.driver_connection.cursor() as cursor:
+        async with cursor.copy(f"COPY {target} ({column_list}) FROM STDIN") as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+    if skip_conflicts:
+        await conn.execute(
+            text(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {target} ON CONFLICT DO NOTHING")
+        )
+        await conn.execute(text(f"DROP TABLE {target}"))
+
+
+def vector_literal(vector: Sequence[float]) -> str:
+    """Format a vector as text for loading into a pgvector column with `copy_rows`."""
+    return f"[{','.join(map(str, vector))}]"
+
+
+class AsyncBatchWriter:
+    """
+    Buffers rows and bulk loads them into a table with `COPY` in batches.
+
+    `add` is thread-safe and never blocks, so it can be called from worker threads (e.g. speech recognition
+    callbacks). `run` must be running on the event loop to flush the buffer, which happens every
+    `flush_interval_seconds` or as soon as `max_batch_size` rows are waiting. Failed batches are put back at the front
+    of the buffer and retried. At most `max_buffered_rows` rows are held, beyond which rows are dropped. Set
+    `skip_conflicts` to ignore rows that violate a unique constraint instead of failing the batch.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: Sequence[str],
+        max_batch_size: int = 500,
+        flush_interval_seconds: float = 1.0,
+        max_buffered_rows: int = 50_000,
+        skip_conflicts: bool = False,
+    ):
+        self.table = table
+        self.columns = tuple(columns)
+        self.skip_conflicts = skip_conflicts
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self._buffer: Deque[tuple] = deque(maxlen=max_buffered_rows)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._flush_requested: asyncio.Event | None = None
+
+    def add(self, row: Sequence[Any]) -> None:
+        """Queue a row (values in `columns` order) to be written."""
+        with self._lock:
+            self._buffer.append(tuple(row))
+            full = len(self._buffer) >= self.max_batch_size
+
+        if full and self._loop is not None and self._flush_requested is not None:
+            self._loop.call_soon_threadsafe(self._flush_requested.set)
+
+    async def flush(self) -> int:
+        """Write everything currently buffered, returning the number of rows written."""
+        written = 0
+        while True:
+            with self._lock:
+                batch = [self._buffer.popleft() for _ in range(min(self.max_batch_size, len(self._buffer)))]
+            if not batch:
+                return written
+
+            try:
+                async with sqa_async_engine.begin() as conn:
+                    await copy_rows(conn, self.table, self.columns, batch, skip_conflicts=self.skip_conflicts)
+            except Exception:
+                with self._lock:
+                    self._buffer.extendleft(reversed(batch))
+                raise
+
+            written += len(batch)
+            logger.debug(f"Wrote {len(batch)} rows to {self.table}")
+
+    async def run(self) -> None:
+        """Flush the buffer periodically until cancelled, flushing one last time on the way out."""
+        self._loop = asyncio.get_running_loop()
+        self._flush_requested = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval_seconds)
+                except TimeoutError:
+                    pass
+                self._flush_requested.clear()
+
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception(f"Failed to write batch to {self.table}, will retry")
+        finally:
+            with anyio.CancelScope(shield=True):
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception(f"Failed to write final batch to {self.table}, {len(self._buffer)} rows lost")
+
+
+def _add_months(month: date, months: int) -> date:
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, month_index + 1, 1)
+
+
+async def ensure_monthly_partitions(table: str, months_ahead: int = 1) -> None:
+    """Create the monthly range partitions of `table` for the current month and the next `months_ahead` months."""
+    this_month = date.today().replace(day=1)
+    async with sqa_async_engine.begin() as conn:
+        for offset in range(months_ahead + 1):
+            start = _add_months(this_month, offset)
+            end = _add_months(start, 1)
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {table}_y{start.year}m{start.month:02d} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            )
+
+
+async def drop_monthly_partitions_before(table: str, cutoff: date) -> list[str]:
+    """Drop the monthly range partitions of `table` that only contain rows from before `cutoff`."""
+    pattern = re.compile(rf"^{re.escape(table)}_y(\d{{4}})m(\d{{2}})$")
+    dropped = []
+    async with sqa_async_engine.begin() as conn:
+        partitions = (
+            await conn.execute(
+                text(
+                    "SELECT child.relname FROM pg_inherits "
+                    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                    "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+                ),
+                {"table": table},
+            )
+        ).scalars()
+
+        for partition in partitions:
+            if (match := pattern.match(partition)) and _add_months(
+                date(int(match.group(1)), int(match.group(2)), 1), 1
+            ) <= cutoff:
+                await conn.execute(text(f"DROP TABLE {partition}"))
+                dropped.append(partition)
+
+    if dropped:
+        logger.info(f"Dropped expired partitions of {table}: {dropped}")
+    return dropped
+
+
+async def ensure_list_partition(table: str, value: int) -> str:
+    """Create the list partition of `table` holding `value`, if it doesn't exist yet, and return its name."""
+    partition = f"{table}_{value}".replace("-", "n")
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(
+            text(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES IN ({int(value)})")
+        )
+    return partition
+
+
 def init_db():
     # Run the Alembic migrations
     result = subprocess.run(  # nosec B607, B603
@@ -0,0 +1,442 @@
+"""
+Dice notation parser, roller and exact probability calculator.
+
+Supported notation (case-insensitive, whitespace is ignored):
+
+- `NdS`: roll N dice with S sides, e.g. `3d6`. N defaults to 1, and `d%` is a d100.
+- `!`: exploding dice, a die that rolls its maximum is rolled again and added, e.g. `4d6!`.
+- `khK` / `klK`: keep the K highest / lowest dice, e.g. `2d20kh1` (advantage). `k` is short for `kh`.
+- `dhK` / `dlK`: drop the K highest / lowest dice, e.g. `4d6dl1`. A bare `d` is short for `dl`.
+- `>=T` / `>T`: count successes (dice at or above the target number) instead of summing, e.g. `10d10>=8`.
+- `+` / `-`: add or subtract dice terms and modifiers, e.g. `1d20+7`, `2d6+1d4-1`.
+
+Plain English keep/drop phrases like `4d6 drop lowest` or `2d20 keep highest` are accepted too.
+
+Rolls are sampled with NumPy, so large pools and many trials are vectorized. Exact outcome distributions are computed by
+convolving the per-die probability mass functions (with FFTs for large supports), using exponentiation by squaring for
+pools of identical dice and a dynamic program over faces for keep/drop. Distributions are memoized per term and per
+expression, so common expressions are only computed once.
+
+Exact distributions are bounded, as the dice tools can be asked about any expression: expressions whose totals span more
+than `MAX_EXACT_SUPPORT` values, and keep/drop whose dynamic program would be too large, are estimated by simulation
+instead, with fewer trials for larger pools so a simulation rolls at most `MAX_SIMULATED_DICE` dice.
+"""
+
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from math import comb
+
+import numpy as np
+
+MAX_DICE = 10_000
+MAX_SIDES = 10_000
+
+# The number of times a die may explode when computing exact distributions. The probability mass beyond this is
+# (1 / sides) ** depth, e.g. 1e-9 for a d6.
+EXPLODE_DEPTH = 12
+# The number of times a die may explode when rolling, to guard against d1! and similar
+_MAX_ROLL_EXPLOSIONS = 100
+
+# Expressions whose totals span more values than this are estimated by simulation instead of computed exactly
+MAX_EXACT_SUPPORT = 1_000_000
+# Keep/drop over more dice than this, or whose dynamic program takes more steps or updates more probabilities than
+# these, is estimated by simulation instead of computed exactly
+MAX_EXACT_KEEP_DICE = 100
+MAX_EXACT_KEEP_STEPS = 150_000
+MAX_EXACT_KEEP_CELLS = 50_000_000
+SIMULATION_TRIALS = 200_000
+# Simulations of large pools run fewer trials, to roll at most this many dice
+MAX_SIMULATED_DICE = 5_000_000
+
+_FFT_THRESHOLD = 500
+
+_KEEP_PHRASE = re.compile(r"(keep|drop)\s*(highest|lowest)\s*(\d*)")
+_DICE_TERM = re.compile(r"^(?P<count>\d*)d(?P<sides>\d+|%)(?P<modifiers>.*)$")
+_MODIFIER = re.compile(r"(?P<explode>!)|(?P<keep>kh|kl|k|dh|dl|d)(?P<keep_count>\d+)|(?P<compare>>=|>)(?P<target>\d+)")
+
+
+class DiceNotationError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class DiceTerm:
+    count: int
+    sides: int
+    sign: int = 1
+    explode: bool = False
+    keep: tuple[str, int] | None = None
+    """`("h", K)` to keep the K highest dice, or `("l", K)` to keep the K lowest."""
+    success_at: int | None = None
+    """If set, the term counts the dice that rolled at least this value instead of summing them."""
+
+    def __str__(self):
+        text = f"{'-' if self.sign < 0 else ''}{self.count}d{self.sides}{'!' if self.explode else ''}"
+        if self.keep:
+            text += f"k{self.keep[0]}{self.keep[1]}"
+        if self.success_at is not None:
+            text += f">={self.success_at}"
+        return text
+
+
+@dataclass(frozen=True)
+class DiceExpression:
+    terms: tuple[DiceTerm, ...]
+    modifier: int = 0
+
+    def __str__(self):
+        text = "+".join(str(term) for term in self.terms).replace("+-", "-")
+        if self.modifier:
+            text += f"{self.modifier:+d}"
+        return text or str(self.modifier)
+
+
+def _parse_dice_term(text: str, sign: int) -> DiceTerm:
+    if not (match := _DICE_TERM.match(text)):
+        raise DiceNotationError(f"Invalid dice term: `{text}`")
+
+    count = int(match["count"] or 1)
+    sides = 100 if match["sides"] == "%" else int(match["sides"])
+    if not 1 <= count <= MAX_DICE:
+        raise DiceNotationError(f"The number of dice must be between 1 and {MAX_DICE}: `{text}`")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceNotationError(f"The number of sides must be between 1 and {MAX_SIDES}: `{text}`")
+
+    explode, keep, success_at = False, None, None
+    position, modifiers = 0, match["modifiers"]
+    while position < len(modifiers):
+        if not (modifier := _MODIFIER.match(modifiers, position)):
+            raise DiceNotationError(f"Invalid dice modifier `{modifiers[position:]}` in `{text}`")
+        position = modifier.end()
+
+        if modifier["explode"]:
+            if sides == 1:
+                raise DiceNotationError(f"A one-sided die can't explode: `{text}`")
+            explode = True
+        elif modifier["keep"]:
+            n = int(modifier["keep_count"])
+            if n > count:
+                raise DiceNotationError(f"Can't keep or drop {n} of {count} dice: `{text}`")
+            keep = {
+                "k": ("h", n),
+                "kh": ("h", n),
+                "kl": ("l", n),
+                "d": ("h", count - n),
+                "dl": ("h", count - n),
+                "dh": ("l", count - n),
+            }[modifier["keep"]]
+        else:
+            success_at = int(modifier["target"]) + (1 if modifier["compare"] == ">" else 0)
+
+    if keep is not None and keep[1] == count:
+        keep = None
+    return DiceTerm(count=count, sides=sides, sign=sign, explode=explode, keep=keep, success_at=success_at)
+
+
+@lru_cache(maxsize=1024)
+def parse(text: str) -> DiceExpression:
+    """
+    Parse dice notation.
+
+    Raises:
+        DiceNotationError: If the notation is invalid.
+    """
+    normalized = _KEEP_PHRASE.sub(
+        lambda m: f"{m[1][0]}{m[2][0]}{m[3] or 1}",
+        text.lower(),
+    )
+    normalized = "".join(normalized.split())
+    if not normalized:
+        raise DiceNotationError("Empty dice expression")
+
+    terms: list[DiceTerm] = []
+    modifier = 0
+    parts = re.findall(r"([+-]?)([^+-]+)", normalized)
+    if "".join(sign + term for sign, term in parts) != normalized:
+        raise DiceNotationError(f"Invalid dice expression: `{text}`")
+
+    for sign, term in parts:
+        sign = -1 if sign == "-" else 1
+        if term.isdigit():
+            modifier += sign * int(term)
+        else:
+            terms.append(_parse_dice_term(term, sign))
+    if sum(term.count for term in terms) > MAX_DICE:
+        raise DiceNotationError(f"An expression can roll at most {MAX_DICE} dice: `{text}`")
+    return DiceExpression(terms=tuple(terms), modifier=modifier)
+
+
+#
+# Rolling
+#
+
+
+@dataclass(frozen=True)
+class TermRoll:
+    term: DiceTerm
+    rolls: list[int]
+    """Every die rolled, with exploded dice already added together."""
+    kept: list[int]
+    value: int
+
+
+@dataclass(frozen=True)
+class RollResult:
+    expression: DiceExpression
+    terms: list[TermRoll]
+    total: int
+
+
+def _roll_dice(term: DiceTerm, trials: int, rng: np.random.Generator) -> np.ndarray:
+    """Roll a term's dice, returning an array of shape `(trials, count)` with exploded dice added together."""
+    rolls = rng.integers(1, term.sides + 1, size=(trials, term.count), dtype=np.int64)
+    if term.explode:
+        exploding = rolls == term.sides
+        for _ in range(_MAX_ROLL_EXPLOSIONS):
+            if not exploding.any():
+                break
+            extra = rng.integers(1, term.sides + 1, size=int(exploding.sum()), dtype=np.int64)
+            rolls[exploding] += extra
+            exploding[exploding] = extra == term.sides
+    return rolls
+
+
+def _term_values(term: DiceTerm, rolls: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the kept dice and the value of a term for each trial."""
+    kept = rolls
+    if term.keep is not None:
+        ordered = np.sort(rolls, axis=1)
+        kept = ordered[:, rolls.shape[1] - term.keep[1] :] if term.keep[0] == "h" else ordered[:, : term.keep[1]]
+    if term.success_at is not None:
+        return kept, (kept >= term.success_at).sum(axis=1) * term.sign
+    return kept, kept.sum(axis=1) * term.sign
+
+
+def roll_totals(expression: DiceExpression | str, trials: int, rng: np.random.Generator | None = None) -> np.ndarray:
+    """Roll an expression many times, returning the total of each trial."""
+    expression = parse(expression) if isinstance(expression, str) else expression
+    rng = rng or np.random.default_rng()
+    totals = np.full(trials, expression.modifier, dtype=np.int64)
+    for term in expression.terms:
+        totals += _term_values(term, _roll_dice(term, trials, rng))[1]
+    return totals
+
+
+def roll(expression: DiceExpression | str, rng: np.random.Generator | None = None) -> RollResult:
+    """Roll an expression once, keeping every die rolled."""
+    expression = parse(expression) if isinstance(expression, str) else expression
+    rng = rng or np.random.default_rng()
+    term_rolls = []
+    for term in expression.terms:
+        rolls = _roll_dice(term, 1, rng)
+        kept, value = _term_values(term, rolls)
+        term_rolls.append(TermRoll(term=term, rolls=rolls[0].tolist(), kept=kept[0].tolist(), value=int(value[0])))
+    return RollResult(
+        expression=expression,
+        terms=term_rolls,
+        total=sum(term_roll.value for term_roll in term_rolls) + expression.modifier,
+    )
+
+
+#
+# Exact distributions
+#
+
+
+@dataclass(frozen=True)
+class Distribution:
+    """A probability distribution over the integers `offset, offset + 1, ..., offset + len(probabilities) - 1`."""
+
+    offset: int
+    probabilities: np.ndarray
+    exact: bool = True
+
+    @property
+    def values(self) -> np.ndarray:
+        return np.arange(self.offset, self.offset + len(self.probabilities))
+
+    @property
+    def minimum(self) -> int:
+        return self.offset + int(np.flatnonzero(self.probabilities > 0)[0])
+
+    @property
+    def maximum(self) -> int:
+        return self.offset + int(np.flatnonzero(self.probabilities > 0)[-1])
+
+    @property
+    def mean(self) -> float:
+        return float(self.values @ self.probabilities)
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(((self.values - self.mean) ** 2) @ self.probabilities))
+
+    def probability_at_least(self, target: int) -> float:
+        return float(self.probabilities[max(target - self.offset, 0) :].sum())
+
+    def probability_at_most(self, target: int) -> float:
+        return float(self.probabilities[: max(target - self.offset + 1, 0)].sum())
+
+    def probability_of(self, target: int) -> float:
+        index = target - self.offset
+        return float(self.probabilities[index]) if 0 <= index < len(self.probabilities) else 0.0
+
+    def percentile(self, q: float) -> int:
+        """The smallest value whose cumulative probability is at least `q` (0-1)."""
+        return self.offset + int(np.searchsorted(np.cumsum(self.probabilities), q - 1e-12))
+
+    def __add__(self, other: "Distribution") -> "Distribution":
+        return Distribution(
+            offset=self.offset + other.offset,
+            probabilities=_convolve(self.probabilities, other.probabilities),
+            exact=self.exact and other.exact,
+        )
+
+    def __neg__(self) -> "Distribution":
+        return Distribution(
+            offset=-(self.offset + len(self.probabilities) - 1),
+            probabilities=self.probabilities[::-1],
+            exact=self.exact,
+        )
+
+    def shift(self, amount: int) -> "Distribution":
+        return Distribution(offset=self.offset + amount, probabilities=self.probabilities, exact=self.exact)
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """The distribution of the sum of two independent distributions, using an FFT when the supports are large."""
+    if min(len(a), len(b)) < _FFT_THRESHOLD:
+        return np.convolve(a, b)
+    size = len(a) + len(b) - 1
+    # FFTs of a power of two size are an order of magnitude faster than of sizes with large prime factors
+    fft_size = 1 << (size - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, fft_size) * np.fft.rfft(b, fft_size), fft_size)[:size]
+    # Clean up floating point noise around zero
+    result[result < 1e-15] = 0.0
+    return result / result.sum()
+
+
+def _power(pmf: np.ndarray, n: int) -> np.ndarray:
+    """The distribution of the sum of `n` independent copies of `pmf` (indexed from 0), by repeated squaring."""
+    result = np.ones(1)
+    while n:
+        if n & 1:
+            result = _convolve(result, pmf)
+        n >>= 1
+        if n:
+            pmf = _convolve(pmf, pmf)
+    return result
+
+
+@lru_cache(maxsize=256)
+def _die_distribution(sides: int, explode: bool) -> Distribution:
+    """The distribution of a single die, truncated after `EXPLODE_DEPTH` explosions if it explodes."""
+    if not explode:
+        return Distribution(offset=1, probabilities=np.full(sides, 1 / sides))
+
+    probabilities = np.zeros(sides * (EXPLODE_DEPTH + 1))
+    for depth in range(EXPLODE_DEPTH + 1):
+        # The die exploded `depth` times and then rolled 1 to sides - 1 (or anything, on the last allowed roll)
+        faces = sides if depth == EXPLODE_DEPTH else sides - 1
+        probabilities[depth * sides : depth * sides + faces] = (1 / sides) ** (depth + 1)
+    return Distribution(offset=1, probabilities=probabilities)
+
+
+def _keep_distribution(n: int, sides: int, keep: int, highest: bool) -> np.ndarray:
+    """
+    The distribution (indexed from 0) of the sum of the `keep` highest (or lowest) of `n` dice.
+
+    Faces are visited from the best to the worst. The state is the number of dice assigned a face so far, and for
+    each state we track the distribution of the sum of the dice kept so far. Assigning `t` of the remaining dice to a
+    face has multinomial weight `C(remaining, t) / sides ** t`, and the first `keep` dice assigned are the kept ones.
+    """
+    faces = range(sides, 0, -1) if highest else range(1, sides + 1)
+    max_sum = keep * sides
+    states = np.zeros((n + 1, max_sum + 1))
+    states[0, 0] = 1.0
+    p = 1 / sides
+    for face in faces:
+        new_states = np.zeros_like(states)
+        for assigned in range(n + 1):
+            if not states[assigned].any():
+                continue
+            remaining = n - assigned
+            for t in range(remaining + 1):
+                weight = comb(remaining, t) * p**t
+                shift = min(t, max(keep - assigned, 0)) * face
+                new_states[assigned + t, shift:] += weight * states[assigned, : max_sum + 1 - shift]
+        states = new_states
+    return states[n]
+
+
+def _support(term: DiceTerm) -> int:
+    """The number of values a term's exact distribution spans."""
+    if term.success_at is not None:
+        return term.count + 1
+    if term.keep is not None:
+        return term.keep[1] * term.sides + 1
+    return term.count * term.sides * (EXPLODE_DEPTH + 1 if term.explode else 1)
+
+
+def _exact_keep_is_bounded(term: DiceTerm) -> bool:
+    """Whether the dynamic program of `_keep_distribution` for the term is small enough to run."""
+    steps = term.sides * (term.count + 1) * (term.count + 2) // 2
+    return (
+        term.count <= MAX_EXACT_KEEP_DICE
+        and steps <= MAX_EXACT_KEEP_STEPS
+        and steps * _support(term) <= MAX_EXACT_KEEP_CELLS
+    )
+
+
+@lru_cache(maxsize=1024)
+def term_distribution(term: DiceTerm) -> Distribution:
+    """The distribution of a dice term's value. Combinations without an exact method are simulated."""
+    if term.sign < 0:
+        return -term_distribution(replace(term, sign=1))
+
+    if (
+        (term.explode and (term.keep is not None or term.success_at is not None))
+        or (term.keep is not None and term.success_at is not None)
+        or (term.keep is not None and not _exact_keep_is_bounded(term))
+        or _support(term) > MAX_EXACT_SUPPORT
+    ):
+        return _simulated_distribution(DiceExpression(terms=(term,)))
+
+    if term.success_at is not None:
+        # The number of successes is binomial, the sum of `count` Bernoulli trials
+        p_success = _die_distribution(term.sides, False).probability_at_least(term.success_at)
+        return Distribution(offset=0, probabilities=_power(np.array([1 - p_success, p_success]), term.count))
+
+    if term.keep is not None:
+        return Distribution(
+            offset=0,
+            probabilities=_keep_distribution(term.count, term.sides, term.keep[1], highest=term.keep[0] == "h"),
+        )
+
+    die = _die_distribution(term.sides, term.explode)
+    return Distribution(offset=die.offset * term.count, probabilities=_power(die.probabilities, term.count))
+
+
+def _simulated_distribution(expression: DiceExpression) -> Distribution:
+    dice = sum(term.count for term in expression.terms)
+    trials = max(min(SIMULATION_TRIALS, MAX_SIMULATED_DICE // max(dice, 1)), 1)
+    totals = roll_totals(expression, trials, np.random.default_rng(0))
+    offset = int(totals.min())
+    counts = np.bincount(totals - offset)
+    return Distribution(offset=offset, probabilities=counts / counts.sum(), exact=False)
+
+
+@lru_cache(maxsize=1024)
+def _expression_distribution(expression: DiceExpression) -> Distribution:
+    if sum(_support(term) for term in expression.terms) > MAX_EXACT_SUPPORT:
+        return _simulated_distribution(expression)
+    distribution = Distribution(offset=expression.modifier, probabilities=np.ones(1))
+    for term in expression.terms:
+        distribution = distribution + term_distribution(term)
+    return distribution
+
+
+def distribution(expression: DiceExpression | str) -> Distribution:
+    """Get the distribution of an expression's total, exact unless noted by `Distribution.exact`."""
+    return _expression_distribution(parse(expression) if isinstance(expression, str) else expression)
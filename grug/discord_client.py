@@ -1,15 +1,39 @@
 """Discord bot interface for the Grug assistant server."""
 
-import logging
-
 import discord.utils
+from discord import app_commands
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langgraph.graph.graph import CompiledGraph
 from loguru import logger
 
+from grug.admission import AdmissionRejected, RequestClass, admission_controller
 from grug.ai_agent import get_react_agent
+from grug.chat_archive import archive_message
+from grug.discord_commands import ChatArchiveCommands, GuildConfigCommands, SourceMaterialCommands
+from grug.discord_dispatcher import Priority, discord_dispatcher
 from grug.discord_voice_client import DiscordVoiceClient
+from grug.image_store import get_image_attachments
+from grug.reminders import register_discord_client
+from grug.replicas import replica_coordinator
 from grug.settings import settings
+from grug.tracing import span
+from grug.utils import InterceptLogHandler
+
+
+def _privileged_intents_message() -> str:
+    portal = "the Discord developer portal (https://discord.com/developers/applications)"
+    if settings.chat_archive_enabled:
+        return (
+            f"The bot needs the `members` and `message_content` privileged intents, the latter for the chat archive. "
+            f"Enable them for the bot in {portal}, or set `CHAT_ARCHIVE_ENABLED=false` to drop `message_content`."
+        )
+    return f"The bot needs the `members` privileged intent. Enable it for the bot in {portal}."
+
+
+class _CommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # With several replicas, only the one that owns the guild responds to its slash commands
+        return replica_coordinator.owns_guild(interaction.guild_id)
 
 
 class DiscordClient(discord.Client):
@@ -19,10 +43,23 @@ class DiscordClient(discord.Client):
         # Define Discord Intents required for the bot session
         intents = discord.Intents.default()
         intents.members = True  # TODO: link to justification for intent
+        intents.message_content = settings.chat_archive_enabled  # needed to read messages that don't mention the bot
 
         super().__init__(intents=intents)
         discord.utils.setup_logging(handler=InterceptLogHandler())
 
+        # Slash commands
+        self.tree = _CommandTree(self)
+        self.tree.add_command(GuildConfigCommands())
+        self.tree.add_command(ChatArchiveCommands())
+        self.tree.add_command(SourceMaterialCommands())
+
+        register_discord_client(self)
+
+    async def setup_hook(self):
+        """Register the slash commands with Discord."""
+        await self.tree.sync()
+
     def get_bot_invite_url(self) -> str | None:
         return (
             f"https://discord.com/api/oauth2/authorize?client_id={self.user.id}&permissions=8&scope=bot"
@@ -50,7 +87,11 @@ class DiscordClient(discord.Client):
         if not self.react_agent:
             raise ValueError("ReAct agent not Initialized!")
 
-        # TODO: make a tool that can search chat history for a given channel
+        # With several replicas, only the one that owns the guild handles its messages
+        if not replica_coordinator.owns_guild(message.guild.id if message.guild else None):
+            return
+
+        archive_message(message)
 
         # ignore messages from self and all bots
         if message.author == self.user or message.author.bot:
@@ -65,6 +106,10 @@ class DiscordClient(discord.Client):
             "configurable": {
                 "thread_id": str(message.channel.id),
                 "user_id": f"{str(message.guild.id) + '-' if message.guild else ''}{message.author.id}",
+                "guild_id": message.guild.id if message.guild else None,
+                # The member asking, so tools can check their permissions (None in DMs)
+                "member": message.author if isinstance(message.author, discord.Member) else None,
+                "channel_type": "text",
             }
         }
 
@@ -72,30 +117,51 @@ class DiscordClient(discord.Client):
         is_direct_message = isinstance(message.channel, discord.DMChannel)
         is_at_message = channel_is_text_or_thread and self.user in message.mentions
         if is_direct_message or is_at_message:
-            async with message.channel.typing():
-                messages: list[BaseMessage] = []
-
-                # Handle replies
-                if message_replied_to := message.reference.resolved.content if message.reference else None:
-                    messages.append(
-                        SystemMessage(
-                            f'You previously sent the following message: "{message_replied_to}", assume that that '
-                            "you are responding to a reply to that message."
+            with span(
+                "discord.message",
+                parent=None,
+                guild_id=message.guild.id if message.guild else 0,
+                channel_id=message.channel.id,
+                message_id=message.id,
+            ):
+                async with message.channel.typing():
+                    messages: list[BaseMessage] = []
+
+                    # Handle replies
+                    if message_replied_to := message.reference.resolved.content if message.reference else None:
+                        messages.append(
+                            SystemMessage(
+                                f'You previously sent the following message: "{message_replied_to}", assume that '
+                                "that you are responding to a reply to that message."
+                            )
                         )
-                    )
-
-                # Add the message that the user sent
-                messages.append(HumanMessage(message.content))
-
-                final_state = await self.react_agent.ainvoke(
-                    input={"messages": messages},
-                    config=agent_config,
-                )
 
-                await message.channel.send(
-                    content=final_state["messages"][-1].content,
-                    reference=message if channel_is_text_or_thread else None,
-                )
+                    # Add the message that the user sent
+                    messages.append(HumanMessage(message.content))
+
+                    try:
+                        async with admission_controller.admit(
+                            RequestClass.MENTION, agent_config["configurable"]["guild_id"], message.author.id
+                        ) as admission:
+                            final_state = await self.react_agent.ainvoke(
+                                input={"messages": messages},
+                                config=agent_config,
+                            )
+                            admission.record_usage(final_state["messages"])
+                    except AdmissionRejected:
+                        # Let the user know to try again, rather than leaving them waiting on a reply
+                        content, files = settings.admission_overloaded_message, []
+                    else:
+                        content = final_state["messages"][-1].content
+                        files = [discord.File(path) for path in get_image_attachments(final_state["messages"])]
+
+                    await discord_dispatcher.send(
+                        message.channel,
+                        content=content,
+                        reference=message if channel_is_text_or_thread else None,
+                        files=files,
+                        priority=Priority.INTERACTIVE,
+                    )
 
         # Otherwise, add the message to the conversation history without requesting a response
         else:
@@ -118,7 +184,10 @@ class DiscordClient(discord.Client):
 
             try:
                 await self.login(token)
-                await self.connect(reconnect=reconnect)
+                try:
+                    await self.connect(reconnect=reconnect)
+                except discord.PrivilegedIntentsRequired as e:
+                    raise ValueError(_privileged_intents_message()) from e
             finally:
                 # Disconnect from all voice channels
                 logger.info("Disconnecting from all voice channels...")
@@ -128,27 +197,3 @@ class DiscordClient(discord.Client):
                 # Close the Discord client
                 logger.info("Closing the Discord client...")
                 await self.close()
-
-
-class InterceptLogHandler(logging.Handler):
-    """
-    Default log handler from examples in loguru documentaion.
-    See https://loguru.readthedocs.io/en/stable/overview.html#entirely-compatible-with-standard-logging
-    """
-
-    def emit(self, record: logging.LogRecord):
-        """Intercept standard logging records."""
-        # Get corresponding Loguru level if it exists
-        try:
-            level = logger.level(record.levelname).name
-        except ValueError:
-            level = record.levelno
-
-        # Find caller from where originated the logged message
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
-            if frame.f_back:
-                frame = frame.f_back
-                depth += 1
-
-        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
@@ -0,0 +1,155 @@
+"""Slash commands for the Grug Discord bot."""
+
+import tempfile
+from pathlib import Path
+
+import discord
+from discord import app_commands
+
+from grug.chat_archive import backfill_channel
+from grug.guild_config import GuildSettings, get_guild_settings, update_guild_config
+from grug.settings import settings
+from grug.source_material import delete_source_document, get_source_documents, ingest_document
+
+
+def _format_guild_settings(guild_settings: GuildSettings) -> str:
+    image_limit = guild_settings.ai_image_daily_generation_limit
+    voice_channel = f"<#{guild_settings.voice_channel_id}>" if guild_settings.voice_channel_id else "not set"
+    return "\n".join(
+        [
+            f"**Voice channel:** {voice_channel}",
+            f"**Image generation:** {'enabled' if guild_settings.ai_image_generation_enabled else 'disabled'}",
+            f"**Daily image limit:** {image_limit if image_limit is not None else 'unlimited'}",
+            f"**TTS:** {'enabled' if guild_settings.tts_enabled else 'disabled'} (voice: `{guild_settings.tts_voice}`)",
+            f"**Persona:**\n{guild_settings.ai_instructions}",
+        ]
+    )
+
+
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+class GuildConfigCommands(app_commands.Group):
+    """Commands for viewing and changing this server's Grug configuration."""
+
+    def __init__(self):
+        super().__init__(name="config", description=f"View and change {settings.ai_name}'s settings for this server.")
+
+    async def _update(self, interaction: discord.Interaction, **values) -> None:
+        guild_settings = await update_guild_config(interaction.guild_id, **values)
+        await interaction.response.send_message(
+            f"Updated!\n\n{_format_guild_settings(guild_settings)}",
+            ephemeral=True,
+        )
+
+    @app_commands.command(description="Show the current configuration for this server.")
+    async def show(self, interaction: discord.Interaction):
+        guild_settings = await get_guild_settings(interaction.guild_id)
+        await interaction.response.send_message(_format_guild_settings(guild_settings), ephemeral=True)
+
+    @app_commands.command(name="voice-channel", description="Set the voice channel the bot listens in.")
+    @app_commands.describe(channel="The voice channel to listen in. Leave empty to disable voice.")
+    async def voice_channel(self, interaction: discord.Interaction, channel: discord.VoiceChannel | None = None):
+        await self._update(interaction, voice_channel_id=channel.id if channel else None)
+
+    @app_commands.command(description="Set the bot's persona instructions for this server.")
+    @app_commands.describe(instructions="The persona instructions. Leave empty to reset to the default.")
+    async def persona(self, interaction: discord.Interaction, instructions: str | None = None):
+        await self._update(interaction, ai_instructions=instructions)
+
+    @app_commands.command(name="image-generation", description="Enable or disable AI image generation.")
+    async def image_generation(self, interaction: discord.Interaction, enabled: bool):
+        await self._update(interaction, ai_image_generation_enabled=enabled)
+
+    @app_commands.command(name="image-limit", description="Set the daily AI image generation limit.")
+    @app_commands.describe(limit="The number of images that can be generated per day. Leave empty for the default.")
+    async def image_limit(self, interaction: discord.Interaction, limit: app_commands.Range[int, 0] | None = None):
+        await self._update(interaction, ai_image_daily_generation_limit=limit)
+
+    @app_commands.command(description="Enable or disable text-to-speech replies in voice chat.")
+    async def tts(self, interaction: discord.Interaction, enabled: bool):
+        await self._update(interaction, tts_enabled=enabled)
+
+    @app_commands.command(name="tts-voice", description="Set the text-to-speech voice.")
+    @app_commands.describe(voice="The name of the voice to use. Leave empty to reset to the default.")
+    async def tts_voice(self, interaction: discord.Interaction, voice: str | None = None):
+        if voice is not None and not (settings.root_dir / "assets" / "bot_voices" / f"{voice}.wav").exists():
+            await interaction.response.send_message(f"Unknown voice: `{voice}`", ephemeral=True)
+            return
+        await self._update(interaction, tts_voice=voice)
+
+
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+class ChatArchiveCommands(app_commands.Group):
+    """Commands for managing the archive of this server's chat history."""
+
+    def __init__(self):
+        super().__init__(name="archive", description="Manage the archive of this server's chat history.")
+
+    @app_commands.command(description="Load a channel's existing messages into the chat history archive.")
+    @app_commands.describe(
+        channel="The channel to load. Defaults to the current channel.",
+        limit="The maximum number of messages to load, newest first. Leave empty to load the whole history.",
+    )
+    async def backfill(
+        self,
+        interaction: discord.Interaction,
+        channel: discord.TextChannel | discord.Thread | None = None,
+        limit: app_commands.Range[int, 1] | None = None,
+    ):
+        if not settings.chat_archive_enabled:
+            await interaction.response.send_message("The chat history archive is disabled.", ephemeral=True)
+            return
+
+        channel = channel or interaction.channel
+        # Reading a long history can take far longer than Discord's 3 second interaction response window
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        read = await backfill_channel(channel, limit=limit)
+        await interaction.followup.send(f"Archived {read} messages from {channel.mention}.", ephemeral=True)
+
+
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+class SourceMaterialCommands(app_commands.Group):
+    """Commands for managing the source material (e.g. rulebooks) the bot can look things up in."""
+
+    def __init__(self):
+        super().__init__(name="source", description=f"Manage the source material {settings.ai_name} can search.")
+
+    @app_commands.command(description="Upload a PDF, or a new version of one, to the source material.")
+    @app_commands.describe(
+        document="The PDF to upload.",
+        name="The name of the document. Defaults to the file name. Uploading an existing name updates it.",
+    )
+    async def upload(self, interaction: discord.Interaction, document: discord.Attachment, name: str | None = None):
+        if not document.filename.lower().endswith(".pdf"):
+            await interaction.response.send_message("Only PDF files can be uploaded.", ephemeral=True)
+            return
+        if document.size > settings.source_material_max_upload_mb * 1024 * 1024:
+            await interaction.response.send_message(
+                f"Documents can be at most {settings.source_material_max_upload_mb} MB.", ephemeral=True
+            )
+            return
+
+        name = name or Path(document.filename).stem
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "document.pdf"
+            await document.save(path)
+            stats = await ingest_document(interaction.guild_id, name, path)
+        await interaction.followup.send(f"Ingested **{name}**: {stats}", ephemeral=True)
+
+    @app_commands.command(name="list", description="List the uploaded source material.")
+    async def list_documents(self, interaction: discord.Interaction):
+        documents = await get_source_documents(interaction.guild_id)
+        await interaction.response.send_message(
+            "\n".join(f"- {document}" for document in documents) or "No source material has been uploaded.",
+            ephemeral=True,
+        )
+
+    @app_commands.command(description="Delete a document from the source material.")
+    async def delete(self, interaction: discord.Interaction, name: str):
+        deleted = await delete_source_document(interaction.guild_id, name)
+        await interaction.response.send_message(
+            f"Deleted **{name}**." if deleted else f"No document named **{name}**.", ephemeral=True
+        )
@@ -0,0 +1,316 @@
+"""
+A single, rate-limit-aware queue for everything the bot posts to Discord.
+
+Messages are queued per channel and drained by a few workers, round-robin across channels, so a burst to one channel
+(e.g. a batch of reminders) can't hold up the others. Interactive replies are always sent before background posts.
+Sends are paced to stay within Discord's per-channel and global rate limits, rather than running into 429s and the
+stalls discord.py waits out for them. Consecutive small messages to the same channel are merged into one post, and
+messages over Discord's length limit are split.
+
+`DiscordDispatcher.metrics` reports queue depths and how long messages waited in the queue.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Deque
+
+import anyio
+import discord
+import numpy as np
+from loguru import logger
+
+from grug.settings import settings
+from grug.tracing import Span, current_span, span
+
+# Discord's maximum message length
+MAX_MESSAGE_LENGTH = 2000
+
+_LATENCY_SAMPLES = 1000
+_METRICS_LOG_INTERVAL_SECONDS = 300
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    """Replies to users, sent first."""
+    BACKGROUND = 1
+    """Notifications and scheduled posts (e.g. reminders), sent when no replies are waiting."""
+
+
+@dataclass(eq=False)
+class _Outbound:
+    channel: discord.abc.Messageable
+    content: str
+    future: asyncio.Future[discord.Message]
+    files: list[discord.File] = field(default_factory=list)
+    reference: discord.Message | discord.MessageReference | None = None
+    allowed_mentions: discord.AllowedMentions | None = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # The span that queued the message, so the send is traced as part of the same request
+    trace_parent: Span | None = field(default_factory=current_span)
+
+    def can_merge(self, other: "_Outbound") -> bool:
+        """Check if another message can be appended to this one as a single post."""
+        return (
+            not self.files
+            and not other.files
+            and other.reference is None
+            and _mentions_key(self.allowed_mentions) == _mentions_key(other.allowed_mentions)
+            and len(self.content) + 1 + len(other.content) <= MAX_MESSAGE_LENGTH
+        )
+
+
+def _mentions_key(allowed_mentions: discord.AllowedMentions | None) -> dict | None:
+    return allowed_mentions.to_dict() if allowed_mentions is not None else None
+
+
+class _RateLimit:
+    """A token bucket allowing `rate` sends per `period` seconds."""
+
+    def __init__(self, rate: int, period: float):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate / self.period)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Seconds until a send is allowed."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) * self.period / self.rate)
+
+    def acquire(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+
+def split_message(content: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split text into parts within Discord's length limit, preferring line and then word boundaries."""
+    parts = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = content.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(content[:cut])
+        content = content[cut:].lstrip("\n ")
+    return parts + [content]
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Failures are logged by the dispatcher, this stops asyncio warning about them for fire-and-forget sends
+    if not future.cancelled():
+        future.exception()
+
+
+class DiscordDispatcher:
+    def __init__(
+        self,
+        workers: int = settings.discord_dispatch_workers,
+        global_rate: int = settings.discord_dispatch_global_rate,
+        channel_rate: int = settings.discord_dispatch_channel_rate,
+        channel_period_seconds: float = settings.discord_dispatch_channel_period_seconds,
+    ):
+        self.workers = workers
+        self.channel_rate = channel_rate
+        self.channel_period_seconds = channel_period_seconds
+        self._global_limit = _RateLimit(global_rate, 1.0)
+        self._channel_limits: dict[int, _RateLimit] = {}
+
+        # Each channel with queued messages of a priority is in that priority's round-robin
+        self._queues: dict[int, dict[Priority, Deque[_Outbound]]] = {}
+        self._round_robin: dict[Priority, Deque[int]] = {priority: deque() for priority in Priority}
+        self._busy_channels: set[int] = set()
+        self._changed = asyncio.Event()
+
+        self._latencies: dict[Priority, Deque[float]] = {
+            priority: deque(maxlen=_LATENCY_SAMPLES) for priority in Priority
+        }
+        self.posts_sent = 0
+        self.messages_sent = 0
+        self.send_failures = 0
+
+    def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: str | None = None,
+        *,
+        files: list[discord.File] | None = None,
+        reference: discord.Message | discord.MessageReference | None = None,
+        allowed_mentions: discord.AllowedMentions | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> asyncio.Future[discord.Message]:
+        """
+        Queue a message to be posted to a channel.
+
+        Returns a future for the posted message, which can be awaited to wait for the post (and to get any error), or
+        ignored. Long messages are split, with the reference on the first part and the files on the last, and the
+        future is for the last part.
+        """
+        loop = asyncio.get_running_loop()
+        parts = split_message(content or "")
+        queue = self._queues.setdefault(channel.id, {}).setdefault(priority, deque())
+        if not queue:
+            self._round_robin[priority].append(channel.id)
+
+        future = None
+        for i, part in enumerate(parts):
+            future = loop.create_future()
+            future.add_done_callback(_consume_exception)
+            queue.append(
+                _Outbound(
+                    channel=channel,
+                    content=part,
+                    future=future,
+                    files=(files or []) if i == len(parts) - 1 else [],
+                    reference=reference if i == 0 else None,
+                    allowed_mentions=allowed_mentions,
+                )
+            )
+
+        self._changed.set()
+        return future
+
+    def _next_batch(self) -> tuple[int, Priority, list[_Outbound]] | float:
+        """Take the next messages to post, or return how long to wait before something can be sent."""
+        wait = float("inf")
+        for priority in Priority:
+            round_robin = self._round_robin[priority]
+            for _ in range(len(round_robin)):
+                channel_id = round_robin.popleft()
+                channel_limit = self._channel_limits.get(channel_id)
+                channel_wait = channel_limit.delay() if channel_limit else 0.0
+                if channel_id in self._busy_channels or channel_wait > 0:
+                    round_robin.append(channel_id)
+                    wait = min(wait, channel_wait or wait)
+                    continue
+
+                if (global_wait := self._global_limit.delay()) > 0:
+                    round_robin.appendleft(channel_id)
+                    return global_wait
+
+                queue = self._queues[channel_id][priority]
+                batch = [queue.popleft()]
+                while queue and batch[0].can_merge(queue[0]):
+                    merged = queue.popleft()
+                    batch[0] = _Outbound(
+                        channel=batch[0].channel,
+                        content=f"{batch[0].content}\n{merged.content}",
+                        future=batch[0].future,
+                        reference=batch[0].reference,
+                        allowed_mentions=batch[0].allowed_mentions,
+                        enqueued_at=batch[0].enqueued_at,
+                        trace_parent=batch[0].trace_parent,
+                    )
+                    batch.append(merged)
+
+                if queue:
+                    round_robin.append(channel_id)
+                self._busy_channels.add(channel_id)
+                return channel_id, priority, batch
+        return wait
+
+    async def _post(self, channel_id: int, priority: Priority, batch: list[_Outbound]) -> None:
+        post = batch[0]
+        now = time.monotonic()
+        self._latencies[priority].extend(now - message.enqueued_at for message in batch)
+
+        self._global_limit.acquire()
+        self._channel_limits.setdefault(
+            channel_id, _RateLimit(self.channel_rate, self.channel_period_seconds)
+        ).acquire()
+
+        try:
+            with span(
+                "discord.send",
+                parent=post.trace_parent,
+                channel_id=channel_id,
+                priority=priority.name.lower(),
+                messages=len(batch),
+                queue_seconds=now - post.enqueued_at,
+            ):
+                message = await post.channel.send(
+                    content=post.content or None,
+                    files=post.files or None,
+                    reference=post.reference,
+                    allowed_mentions=post.allowed_mentions,
+                )
+        except Exception as e:
+            logger.exception(f"Failed to post {len(batch)} messages to channel {channel_id}")
+            self.send_failures += 1
+            for outbound in batch:
+                if not outbound.future.done():
+                    outbound.future.set_exception(e)
+        else:
+            self.posts_sent += 1
+            self.messages_sent += len(batch)
+            for outbound in batch:
+                if not outbound.future.done():
+                    outbound.future.set_result(message)
+        finally:
+            self._busy_channels.discard(channel_id)
+            if not any(self._queues[channel_id].values()):
+                del self._queues[channel_id]
+            self._changed.set()
+
+    async def _worker(self) -> None:
+        while True:
+            self._changed.clear()
+            batch_or_wait = self._next_batch()
+            if isinstance(batch_or_wait, tuple):
+                await self._post(*batch_or_wait)
+                continue
+            with anyio.move_on_after(None if batch_or_wait == float("inf") else batch_or_wait):
+                await self._changed.wait()
+
+    async def _log_metrics(self) -> None:
+        posts_sent = 0
+        while True:
+            await anyio.sleep(_METRICS_LOG_INTERVAL_SECONDS)
+            if self.posts_sent != posts_sent:
+                posts_sent = self.posts_sent
+                logger.info(f"Discord dispatcher: {self.metrics()}")
+
+    async def run(self) -> None:
+        """Post queued messages until cancelled."""
+        async with anyio.create_task_group() as tg:
+            for _ in range(self.workers):
+                tg.start_soon(self._worker)
+            tg.start_soon(self._log_metrics)
+
+    def metrics(self) -> dict[str, Any]:
+        """Queue depths, send counts, and queue latency (enqueue to send) percentiles over recent messages."""
+        queued = {priority: 0 for priority in Priority}
+        for queues in self._queues.values():
+            for priority, queue in queues.items():
+                queued[priority] += len(queue)
+
+        queue_latency_ms = {}
+        for priority, latencies in self._latencies.items():
+            if latencies:
+                p50, p95, p99 = np.percentile(np.fromiter(latencies, dtype=float), [50, 95, 99]) * 1000
+                queue_latency_ms[priority.name.lower()] = {
+                    "p50": round(float(p50), 1),
+                    "p95": round(float(p95), 1),
+                    "p99": round(float(p99), 1),
+                    "max": round(max(latencies) * 1000, 1),
+                }
+
+        return {
+            "queued": {priority.name.lower(): count for priority, count in queued.items()},
+            "channels_queued": len(self._queues),
+            "posts_sent": self.posts_sent,
+            "messages_sent": self.messages_sent,
+            "send_failures": self.send_failures,
+            "queue_latency_ms": queue_latency_ms,
+        }
+
+
+discord_dispatcher = DiscordDispatcher()
@@ -1,221 +1,125 @@
 """
 Discord voice client for handling voice channels and speech recognition.
+
+The bot listens in each guild's configured voice channel while anyone is in it. By default it connects to the channel
+itself and runs speech recognition in process (see `grug.voice_recognition`). With `voice_workers_enabled`, it only
+orchestrates: it starts a voice session and queues it for a `grug-voice-worker` process to claim, which connects to the
+channel and publishes transcripts, and it queues the responses to be spoken for the worker to play (see
+`grug.voice_worker`). Either way, the voice responder here reads the channel's transcripts and responds to them.
 """
 
-import array
 import asyncio
-import audioop
-import concurrent.futures
-import time
-from collections import defaultdict, deque
+from collections import deque
 from datetime import UTC, datetime
-from typing import Any, Awaitable, Deque, Final, Optional, TypedDict, TypeVar
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Deque, Optional
 
 import discord
-import speech_recognition as sr
-from discord import FFmpegPCMAudio
 from discord.ext import voice_recv
-from discord.ext.voice_recv import AudioSink, SilencePacket, VoiceData, VoiceRecvClient
+from discord.ext.voice_recv import VoiceRecvClient
 from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph.graph import CompiledGraph
 from loguru import logger
 from pydantic import BaseModel
-from rapidfuzz import fuzz
-from speech_recognition.recognizers.whisper_api import openai as sr_openai
 from tembo_pgmq_python import async_queue
-from tembo_pgmq_python import queue as sync_queue
 
+from grug.admission import AdmissionRejected, RequestClass, admission_controller
 from grug.ai_tts_client import get_tts
+from grug.audio_playback import load_audio
+from grug.discord_dispatcher import Priority, discord_dispatcher
+from grug.guild_config import get_guild_settings
+from grug.image_store import get_image_attachments
+from grug.models import VoiceSession
+from grug.replicas import replica_coordinator
 from grug.settings import settings
+from grug.tracing import extract, span
+from grug.transcripts import end_voice_session, get_voice_sessions, start_voice_session
+from grug.voice_recognition import (
+    BOOP_SOUND_EFFECT,
+    SpeechRecognitionSink,
+    is_addressed,
+    play_sound_effect,
+    speech_queue_name,
+    transcript_queue_name,
+)
 
 
 class _RespondingTo(BaseModel):
     user_id: int
     last_message_timestamp: datetime
+    traceparent: str | None = None
 
 
-class _StreamData(TypedDict):
-    stopper: Optional[Any]
-    recognizer: sr.Recognizer
-    buffer: array.array[int]
-
-
-class _DiscordSRAudioSource(sr.AudioSource):
-    little_endian: Final[bool] = True
-    SAMPLE_RATE: Final[int] = 48_000
-    SAMPLE_WIDTH: Final[int] = 2
-    CHANNELS: Final[int] = 2
-    CHUNK: Final[int] = 960
-
-    # noinspection PyMissingConstructor
-    def __init__(self, buffer: array.array[int], read_timeout: int = 10):
-        self.read_timeout = read_timeout
-        self.buffer = buffer
-        self._entered: bool = False
-
-    @property
-    def stream(self):
-        return self
-
-    def __enter__(self):
-        if self._entered:
-            logger.warning("Already entered sr audio source")
-        self._entered = True
-        return self
-
-    def __exit__(self, *exc) -> None:
-        self._entered = False
-        if any(exc):
-            logger.exception("Error closing sr audio source")
-
-    def read(self, size: int) -> bytes:
-        for _ in range(self.read_timeout):
-            if len(self.buffer) < size * self.CHANNELS:
-                time.sleep(0.01)
-            else:
-                break
-        else:
-            if len(self.buffer) <= 100:
-                return b""
-
-        chunk_size = size * self.CHANNELS
-        audio_chunk = self.buffer[:chunk_size].tobytes()
-        del self.buffer[: min(chunk_size, len(audio_chunk))]
-        audio_chunk = audioop.tomono(audio_chunk, 2, 1, 1)
-        return audio_chunk
-
-    def close(self) -> None:
-        self.buffer.clear()
+class _RemoteVoiceClient:
+    """A voice session handled by a voice worker, which the voice responder uses in place of a voice connection."""
 
+    def __init__(self, channel: discord.VoiceChannel, voice_session: VoiceSession):
+        self.channel = channel
+        self.guild = channel.guild
+        self.voice_session = voice_session
+        self.connected = True
 
-class _SpeechRecognitionSink(AudioSink):
-    """
-    Speech recognition sink for Discord voice channels.
-
-    source: https://github.com/imayhaveborkedit/discord-ext-voice-recv/blob/main/discord/ext/voice_recv/extras/speechrecognition.py
-    """
-
-    _stream_data: defaultdict[int, _StreamData] = defaultdict(
-        lambda: _StreamData(stopper=None, recognizer=sr.Recognizer(), buffer=array.array("B"))
-    )
-
-    def __init__(self, discord_channel: discord.VoiceChannel):
-        super().__init__(None)
-        self.discord_channel: discord.VoiceChannel = discord_channel
-
-        self.queue = sync_queue.PGMQueue(
-            host=settings.postgres_host,
-            port=settings.postgres_port,
-            username=settings.postgres_user,
-            password=settings.postgres_password.get_secret_value(),
-            database=settings.postgres_db,
-        )
-
-        # Create a queue for the voice channel if it doesn't exist.
-        if str(self.discord_channel.id) not in self.queue.list_queues():
-            self.queue.create_queue(str(self.discord_channel.id))
-
-    def _await(self, coro: Awaitable[TypeVar]) -> concurrent.futures.Future[TypeVar]:
-        assert self.client is not None
-        return asyncio.run_coroutine_threadsafe(coro, self.client.loop)
-
-    def wants_opus(self) -> bool:
-        return False
-
-    def write(self, user: Optional[discord.User], data: VoiceData) -> None:
-        # Ignore silence packets and packets from users we don't have data for
-        if isinstance(data.packet, SilencePacket) or user is None:
-            return
-
-        sdata = self._stream_data[user.id]
-        sdata["buffer"].extend(data.pcm)
-
-        if not sdata["stopper"]:
-            sdata["stopper"] = sdata["recognizer"].listen_in_background(
-                source=_DiscordSRAudioSource(sdata["buffer"]),
-                callback=self.background_listener(user),
-                phrase_time_limit=10,
-            )
-
-    def background_listener(self, user: discord.User):
-        def callback(_recognizer: sr.Recognizer, _audio: sr.AudioData):
-            # Don't process empty audio data or audio data that is too small
-            if _audio.frame_data == b"" or len(bytes(_audio.frame_data)) < 10000:
-                return None
-
-            # Get the text from the audio data
-            text_output = None
-            try:
-                text_output = sr_openai.recognize(_recognizer, _audio)
-            except sr.UnknownValueError:
-                logger.debug("Bad speech chunk")
-
-            # WEIRDEST BUG EVER: for some reason whisper keeps getting the word "you" from the recognizer, so
-            #                    we'll just ignore any text segments that are just "you"
-            if text_output and text_output.lower() != "you":
-                self.queue.send(
-                    str(self.discord_channel.id),
-                    {
-                        "user_id": user.id,
-                        "message_timestamp": datetime.now(tz=UTC).isoformat(),
-                        "message": text_output,
-                    },
-                )
-
-        return callback
-
-    def cleanup(self) -> None:
-        for user_id in tuple(self._stream_data.keys()):
-            self._drop(user_id)
-
-    def _drop(self, user_id: int) -> None:
-        if user_id in self._stream_data:
-            data = self._stream_data.pop(user_id)
-            stopper = data.get("stopper")
-            if stopper:
-                stopper()
-
-            buffer = data.get("buffer")
-            if buffer:
-                # arrays don't have a clear function
-                del buffer[:]
+    def is_connected(self) -> bool:
+        return self.connected
 
 
 class DiscordVoiceClient:
-    def __init__(self, discord_client: discord.Client, react_agent: CompiledGraph):
+    def __init__(
+        self,
+        discord_client: discord.Client,
+        react_agent: CompiledGraph,
+        tts: Callable[..., Path] = get_tts,
+    ):
         if not react_agent:
             raise ValueError("ReAct agent not Initialized")
 
         self.discord_client = discord_client
         self.react_agent = react_agent
+        self.tts = tts
 
         # Initialize the background voice responder tasks set to keep track of running tasks
         self.background_voice_responder_tasks: set = set()
 
+        # With voice workers, the sessions this replica is responding in, by guild
+        self.remote_sessions: dict[int, _RemoteVoiceClient] = {}
+        self._queue: async_queue.PGMQueue | None = None
+
         # Register the on_voice_state_update event
         self.discord_client.event(self.on_voice_state_update)
 
+        # With several replicas, voice sessions follow guild ownership
+        replica_coordinator.on_ownership_change(self.on_guild_ownership_change)
+
     async def get_bot_introduction_text(self, voice_channel: discord.VoiceState) -> str:
         """Get the bot introduction text for a voice channel."""
-        final_state = await self.react_agent.ainvoke(
-            {
-                "messages": [
-                    SystemMessage(
-                        content=(
-                            "- When introducing yourself, give a quick summary of who you are. \n"
-                            f"- Make sure to let the user know that you are listening in {voice_channel.channel.name}"
-                            f" voice channel on the {voice_channel.channel.guild.name} server. \n"
-                        )
-                    ),
-                    HumanMessage(content="Introduce yourself!"),
-                ]
-            },
-            config={
-                "configurable": {
-                    "thread_id": str(voice_channel.channel.id),
-                }
-            },
-        )
+        try:
+            async with admission_controller.admit(RequestClass.BACKGROUND, voice_channel.channel.guild.id) as admission:
+                final_state = await self.react_agent.ainvoke(
+                    {
+                        "messages": [
+                            SystemMessage(
+                                content=(
+                                    "- When introducing yourself, give a quick summary of who you are. \n"
+                                    "- Make sure to let the user know that you are listening in "
+                                    f"{voice_channel.channel.name} voice channel on the "
+                                    f"{voice_channel.channel.guild.name} server. \n"
+                                )
+                            ),
+                            HumanMessage(content="Introduce yourself!"),
+                        ]
+                    },
+                    config={
+                        "configurable": {
+                            "thread_id": str(voice_channel.channel.id),
+                            "guild_id": voice_channel.channel.guild.id,
+                            "channel_type": "voice",
+                        }
+                    },
+                )
+                admission.record_usage(final_state["messages"])
+        except AdmissionRejected:
+            # Skip the generated introduction when the agent is overloaded
+            return f"I'm {settings.ai_name.title()}, and I'm listening in {voice_channel.channel.name}."
         return final_state["messages"][-1].content
 
     async def on_voice_state_update(
@@ -224,11 +128,13 @@ class DiscordVoiceClient:
         before: discord.VoiceState,
         after: discord.VoiceState,
     ):
-        # TODO: store this in the DB so that it can be configured for each server
-        bot_voice_channel_id = 1049728769541283883
+        # Ignore bot users, and guilds handled by another replica
+        if member.bot or not replica_coordinator.owns_guild(member.guild.id):
+            return
 
-        # Ignore bot users
-        if member.bot:
+        # Only listen in the voice channel configured for the guild
+        bot_voice_channel_id = (await get_guild_settings(member.guild.id)).voice_channel_id
+        if bot_voice_channel_id is None:
             return
 
         # If the user joined the bot voice channel
@@ -236,50 +142,180 @@ class DiscordVoiceClient:
             logger.info(f"{member.display_name} joined {after.channel.name}")
 
             # Notify the user that the bot is listening
-            await after.channel.send(
+            discord_dispatcher.send(
+                after.channel,
                 content=(
                     f"{await self.get_bot_introduction_text(after)}\n\n"
                     f'*You can talk to me by saying "Hey, {settings.ai_name.title()}"*'
                 ),
+                priority=Priority.BACKGROUND,
             )
 
-            # If the bot is not currently in the voice channel, connect to the voice channel
-            if self.discord_client.user not in after.channel.members:
-                logger.info(f"Connecting to {after.channel.name}")
-                voice_channel = await after.channel.connect(cls=voice_recv.VoiceRecvClient)
-                voice_channel.listen(_SpeechRecognitionSink(discord_channel=after.channel))
+            if settings.voice_workers_enabled:
+                # Resumes a session left running by an earlier run of the bot, if any
+                if member.guild.id not in self.remote_sessions:
+                    await self._resume_remote_session(member.guild)
 
-                # Start the voice responder agent
-                voice_responder_task = asyncio.create_task(self._listen_to_voice_channel(voice_channel))
-                self.background_voice_responder_tasks.add(voice_responder_task)
-                voice_responder_task.add_done_callback(self.background_voice_responder_tasks.discard)
+            # If the bot is not currently in the voice channel, connect to the voice channel. This checks this
+            # replica's own voice connection, as the bot may still appear in the channel after another replica failed.
+            elif after.channel.guild.voice_client is None:
+                await self._join_voice_channel(after.channel)
 
         # If the user left the bot voice channel
-        elif before.channel.id == bot_voice_channel_id and before.channel is not None:
+        elif before.channel is not None and before.channel.id == bot_voice_channel_id:
             logger.info(f"{member.display_name} left {before.channel.name}")
 
+            if settings.voice_workers_enabled:
+                if not any(not member.bot for member in before.channel.members):
+                    logger.info(f"No members in {before.channel.name}, ending the voice session...")
+                    if remote := self.remote_sessions.get(member.guild.id):
+                        await self._end_remote_session(remote)
+                    else:
+                        await self._resume_remote_session(member.guild)
+
             # If there are no members in the voice channel and the bot is in the voice channel, disconnect from
             # the voice channel
-            if len(before.channel.members) <= 1 and self.discord_client.user in before.channel.members:
+            elif len(before.channel.members) <= 1 and self.discord_client.user in before.channel.members:
                 logger.info(f"No members in {before.channel.name}, disconnecting...")
                 voice_channel = next(
                     (vc for vc in self.discord_client.voice_clients if vc.channel == before.channel), None
                 )
                 await voice_channel.disconnect(force=True)
 
-    async def _listen_to_voice_channel(self, voice_channel: VoiceRecvClient):
-        """A looping task that listens for messages in a voice channel and responds to them."""
-
-        # Initialize the queue
-        queue = async_queue.PGMQueue(
-            host=settings.postgres_host,
-            port=settings.postgres_port,
-            username=settings.postgres_user,
-            password=settings.postgres_password.get_secret_value(),
-            database=settings.postgres_db,
+    async def _get_queue(self) -> async_queue.PGMQueue:
+        if self._queue is None:
+            self._queue = async_queue.PGMQueue(
+                host=settings.postgres_host,
+                port=settings.postgres_port,
+                username=settings.postgres_user,
+                password=settings.postgres_password.get_secret_value(),
+                database=settings.postgres_db,
+            )
+            await self._queue.init()
+        return self._queue
+
+    def _start_responder(self, coro: Coroutine[Any, Any, None]) -> None:
+        voice_responder_task = asyncio.create_task(coro)
+        self.background_voice_responder_tasks.add(voice_responder_task)
+        voice_responder_task.add_done_callback(self.background_voice_responder_tasks.discard)
+
+    async def _join_voice_channel(self, channel: discord.VoiceChannel) -> None:
+        """Connect to a voice channel and start listening and responding in it."""
+        logger.info(f"Connecting to {channel.name}")
+        voice_session = await start_voice_session(guild_id=channel.guild.id, channel_id=channel.id)
+        voice_channel = await channel.connect(cls=voice_recv.VoiceRecvClient)
+        voice_channel.listen(
+            SpeechRecognitionSink(
+                discord_channel=channel,
+                voice_session=voice_session,
+                on_addressed=lambda: play_sound_effect(voice_channel, BOOP_SOUND_EFFECT),
+            )
         )
-        await queue.init()
-        await queue.purge(str(voice_channel.channel.id))  # Start with a fresh queue when the bot joins
+
+        # Start the voice responder agent, which ends the session when the bot disconnects
+        async def respond():
+            await self._listen_to_voice_channel(voice_channel, voice_session)
+            await end_voice_session(voice_session.id)
+
+        self._start_responder(respond())
+
+    async def _start_remote_session(self, channel: discord.VoiceChannel, voice_session: VoiceSession | None = None):
+        """
+        Respond in a voice channel whose speech is recognized by a voice worker, starting a new voice session and
+        queueing it for a worker to claim, unless resuming a session taken over from another replica.
+        """
+        queue = await self._get_queue()
+        existing_queues = await queue.list_queues()
+        for queue_name in (
+            settings.voice_worker_queue,
+            transcript_queue_name(channel.id),
+            speech_queue_name(channel.id),
+        ):
+            if queue_name not in existing_queues:
+                await queue.create_queue(queue_name)
+
+        resume = voice_session is not None
+        if voice_session is None:
+            logger.info(f"Queueing a voice session in {channel.name} for a voice worker")
+            voice_session = await start_voice_session(guild_id=channel.guild.id, channel_id=channel.id)
+            await queue.send(
+                settings.voice_worker_queue,
+                {"voice_session_id": str(voice_session.id), "guild_id": channel.guild.id, "channel_id": channel.id},
+            )
+
+        remote = self.remote_sessions[channel.guild.id] = _RemoteVoiceClient(channel, voice_session)
+        self._start_responder(self._listen_to_voice_channel(remote, voice_session, purge=not resume))
+
+    async def _end_remote_session(self, remote: _RemoteVoiceClient) -> None:
+        """End a voice session handled by a voice worker, which disconnects once it sees the session has ended."""
+        remote.connected = False
+        self.remote_sessions.pop(remote.guild.id, None)
+        await end_voice_session(remote.voice_session.id)
+
+    async def _resume_remote_session(self, guild: discord.Guild) -> None:
+        """Take over responding in a guild's voice session, starting or ending it if the channel's members changed."""
+        channel = guild.get_channel((await get_guild_settings(guild.id)).voice_channel_id or 0)
+        listening = isinstance(channel, discord.VoiceChannel) and any(not member.bot for member in channel.members)
+        sessions = await get_voice_sessions(guild.id, limit=1)
+        voice_session = sessions[0] if sessions and sessions[0].ended_at is None else None
+
+        if voice_session is not None and (not listening or voice_session.channel_id != channel.id):
+            await end_voice_session(voice_session.id)
+            voice_session = None
+        if listening:
+            await self._start_remote_session(channel, voice_session)
+
+    async def _speak(self, voice_channel: VoiceRecvClient | _RemoteVoiceClient, text: str, voice: str) -> None:
+        """Speak a response in a voice channel, or queue it for the voice worker handling the channel to speak."""
+        if isinstance(voice_channel, _RemoteVoiceClient):
+            queue = await self._get_queue()
+            await queue.send(speech_queue_name(voice_channel.channel.id), {"text": text, "voice": voice})
+        else:
+            voice_channel.play(load_audio(self.tts(text, voice=voice)))
+
+    async def on_guild_ownership_change(self, acquired: set[int], released: set[int]) -> None:
+        """Hand voice sessions over between replicas as guilds move between them."""
+        if settings.voice_workers_enabled:
+            # Voice workers keep handling the sessions, only the responder moves between replicas
+            for guild_id in released:
+                if remote := self.remote_sessions.pop(guild_id, None):
+                    remote.connected = False
+            for guild_id in acquired:
+                if (guild := self.discord_client.get_guild(guild_id)) and guild_id not in self.remote_sessions:
+                    try:
+                        await self._resume_remote_session(guild)
+                    except Exception:
+                        logger.exception(f"Failed to resume the voice session in {guild.name}")
+            return
+
+        for guild_id in released:
+            if (guild := self.discord_client.get_guild(guild_id)) and guild.voice_client:
+                logger.info(f"{guild.name} moved to another replica, disconnecting from voice...")
+                await guild.voice_client.disconnect(force=True)
+
+        # Resume listening in guilds taken over from another replica, if anyone is in the bot's voice channel
+        for guild_id in acquired:
+            guild = self.discord_client.get_guild(guild_id)
+            if guild is None or guild.voice_client is not None:
+                continue
+            channel = guild.get_channel((await get_guild_settings(guild_id)).voice_channel_id or 0)
+            if isinstance(channel, discord.VoiceChannel) and any(not member.bot for member in channel.members):
+                try:
+                    await self._join_voice_channel(channel)
+                except Exception:
+                    logger.exception(f"Failed to resume listening in {channel.name}")
+
+    async def _listen_to_voice_channel(
+        self,
+        voice_channel: VoiceRecvClient | _RemoteVoiceClient,
+        voice_session: VoiceSession,
+        purge: bool = True,
+    ):
+        """A looping task that listens for messages in a voice channel and responds to them."""
+        queue = await self._get_queue()
+        queue_name = transcript_queue_name(voice_channel.channel.id)
+        if purge:
+            await queue.purge(queue_name)  # Start with a fresh queue when the bot joins
 
         while voice_channel.is_connected():
             if not self.react_agent:
@@ -289,40 +325,31 @@ class DiscordVoiceClient:
             message_buffer: Deque = deque(maxlen=100)
             poll_interval_seconds = 0.1
             end_of_statement_seconds = 1
-            while True:
+            while voice_channel.is_connected():
                 # Read messages in batches off the queue
                 for message in await queue.read_batch(
-                    queue=str(voice_channel.channel.id),
+                    queue=queue_name,
                     vt=30,
                     batch_size=5,
                 ):
                     # Delete the message from the queue
-                    await queue.delete(str(voice_channel.channel.id), message.msg_id)
+                    await queue.delete(queue_name, message.msg_id)
 
                     # if currently responding to a message, add the user messages to the buffer
                     if responding_to and message.message.get("user_id") == responding_to.user_id:
                         message_buffer.append(message.message.get("message"))
 
-                    # Check if the bot was called by name
-                    elif (
-                        fuzz.partial_ratio(
-                            s1=f"hey, {settings.ai_name.lower()}",
-                            s2=message.message.get("message").lower(),
-                        )
-                        > 80
-                    ):
+                    # Check if the bot was called by name (either spotted locally or found in the transcript). The
+                    # boop sound effect was already played by the speech recognition sink when it published it.
+                    elif is_addressed(message.message):
                         logger.info(f"Bot was called by name by {message.message.get('user_id')}")
 
-                        # Play the boop sound effect when the bot is called by name
-                        voice_channel.play(
-                            FFmpegPCMAudio((settings.root_dir / "assets/sound_effects/boop.wav").as_posix())
-                        )
-
                         message_buffer.clear()
                         message_buffer.append(message.message.get("message"))
                         responding_to = _RespondingTo(
                             user_id=message.message.get("user_id"),
                             last_message_timestamp=message.enqueued_at,
+                            traceparent=message.message.get("traceparent"),
                         )
 
                 # Check to see if the bot should respond to its summons
@@ -331,32 +358,60 @@ class DiscordVoiceClient:
                     and (datetime.now(tz=UTC) - responding_to.last_message_timestamp).seconds > end_of_statement_seconds
                 ):
                     # Respond to the message
-                    final_state = await self.react_agent.ainvoke(
-                        {
-                            "messages": [
-                                SystemMessage(
-                                    content=(
-                                        "- you are are responding to a message sent by a user in voice chat. \n"
-                                        "- remember that the speach to text is not perfect, so there may be some errors in the text. \n"
-                                        "- Do your best to assume what the users meant to say, but DO NOT try to make sense of gibberish. \n"
-                                        "- If you are unsure what the user said, ask them to clarify. \n"
-                                        "- DO NOT correct the user about your name or who you are, assume they misspoke and ignore it. \n"
-                                    )
-                                ),
-                                HumanMessage(content=" ".join(list(message_buffer))),
-                            ]
-                        },
-                        config={
-                            "configurable": {
-                                "thread_id": str(voice_channel.channel.id),
-                                "user_id": f"{str(voice_channel.guild.id)}-{responding_to.user_id}",
-                            }
-                        },
-                    )
-
-                    response_text = final_state["messages"][-1].content
-                    await voice_channel.channel.send(content=response_text)
-                    voice_channel.play(FFmpegPCMAudio(get_tts(response_text).as_posix()))
+                    with span(
+                        "voice.response",
+                        parent=extract(responding_to.traceparent),
+                        guild_id=voice_channel.guild.id,
+                        channel_id=voice_channel.channel.id,
+                        user_id=responding_to.user_id,
+                    ):
+                        try:
+                            async with admission_controller.admit(
+                                RequestClass.VOICE, voice_channel.guild.id, responding_to.user_id
+                            ) as admission:
+                                final_state = await self.react_agent.ainvoke(
+                                    {
+                                        "messages": [
+                                            SystemMessage(
+                                                content=(
+                                                    "- you are are responding to a message sent by a user in voice chat. \n"
+                                                    "- remember that the speach to text is not perfect, so there may be some errors in the text. \n"
+                                                    "- Do your best to assume what the users meant to say, but DO NOT try to make sense of gibberish. \n"
+                                                    "- If you are unsure what the user said, ask them to clarify. \n"
+                                                    "- DO NOT correct the user about your name or who you are, assume they misspoke and ignore it. \n"
+                                                )
+                                            ),
+                                            HumanMessage(content=" ".join(list(message_buffer))),
+                                        ]
+                                    },
+                                    config={
+                                        "configurable": {
+                                            "thread_id": str(voice_channel.channel.id),
+                                            "user_id": f"{str(voice_channel.guild.id)}-{responding_to.user_id}",
+                                            "guild_id": voice_channel.guild.id,
+                                            "member": voice_channel.guild.get_member(responding_to.user_id),
+                                            "channel_type": "voice",
+                                        }
+                                    },
+                                )
+                                admission.record_usage(final_state["messages"])
+                        except AdmissionRejected:
+                            # Let the user know to try again, rather than leaving them waiting on a reply
+                            response_text, files = settings.admission_overloaded_message, []
+                        else:
+                            response_text = final_state["messages"][-1].content
+                            files = [discord.File(path) for path in get_image_attachments(final_state["messages"])]
+
+                        await discord_dispatcher.send(
+                            voice_channel.channel,
+                            content=response_text,
+                            files=files,
+                            priority=Priority.INTERACTIVE,
+                        )
+
+                        guild_settings = await get_guild_settings(voice_channel.guild.id)
+                        if guild_settings.tts_enabled:
+                            await self._speak(voice_channel, response_text, guild_settings.tts_voice)
 
                     logger.info(f"Responded to {responding_to.user_id} for request: {' '.join(list(message_buffer))}")
 
@@ -0,0 +1,267 @@
+"""
+The process-wide embedding service, shared by every feature that embeds text: chat history and source material
+search, and long-term memories.
+
+Embedding each request's texts with its own API call pays a round trip per request, and the same texts (a repeated
+query, a fact recalled for both a user and their server, an unchanged message) are embedded again and again.
+`EmbeddingService` implements langchain's `Embeddings`, so it can be used wherever an embeddings client is, and:
+
+- deduplicates texts by a SHA-256 hash of the embedding model and the text. Each text is looked up in an in-memory LRU
+  cache, and concurrent requests for the same text wait for the same pending embedding.
+- coalesces the texts of concurrent requests into batches: the first text to wait opens a window of
+  `ai_embedding_batch_window_ms`, and the batch is sent when it closes or once `ai_embedding_max_batch_size` texts
+  are waiting. Larger requests are split into several batches.
+- looks each batch up in the `embedding_cache` table before sending the misses to the backend, and saves the new
+  embeddings there, so they survive restarts and are shared by replicas. Callers that store the embeddings themselves,
+  like the chat archive, pass `persist=False` so they aren't stored twice, and `prune_embedding_cache` deletes entries
+  past `ai_embedding_cache_retention_days`.
+- sends at most `ai_embedding_concurrency` batches to the backend at once. A batch is only taken from the queue once
+  it can be sent, so when the backend is busy, texts keep queueing and go in fewer, larger batches.
+
+A failed batch fails the requests waiting for it, and nothing is cached. The persistent cache is best effort: if
+Postgres can't be reached, the texts are embedded by the backend.
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+from sqlalchemy import delete
+from sqlmodel import col, select
+
+from grug.ai_embeddings import get_embedding_backend, get_embedding_model_name
+from grug.db import copy_rows, sqa_async_engine, sqa_async_session_factory, vector_literal
+from grug.models import EmbeddingCacheEntry
+from grug.settings import settings
+from grug.utils import TTLCache
+
+_METRICS_LOG_INTERVAL_SECONDS = 300
+_CACHE_COLUMNS = ("content_hash", "model", "embedding", "created_at")
+
+
+class EmbeddingService(Embeddings):
+    """Embeds texts with a backend, in coalesced batches, through an in-memory and (optionally) a Postgres cache."""
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        model: str,
+        batch_window_seconds: float = 0.01,
+        max_batch_size: int = 256,
+        concurrency: int = 4,
+        cache_size: int = 4096,
+        persistent_cache: bool = False,
+    ):
+        self.backend = backend
+        self.model = model
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self.persistent_cache = persistent_cache
+        # Embeddings are kept as float32 arrays, a quarter of the size of a list of floats
+        self._cache = TTLCache(maxsize=cache_size, ttl_seconds=math.inf)
+        # Every text waiting to be embedded, by hash, and the texts waiting for the next batch to be sent
+        self._pending: dict[str, asyncio.Future[np.ndarray]] = {}
+        self._queue: dict[str, str] = {}
+        # The texts waiting to be embedded that at least one request wants saved to the persistent cache
+        self._persist: set[str] = set()
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._batches: set[asyncio.Task] = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._counts: Counter[str] = Counter()
+        self._metrics_logged_at = time.monotonic()
+
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode()).hexdigest()
+
+    async def aembed_documents(self, texts: list[str], persist: bool = True) -> list[list[float]]:
+        """Embed texts. With `persist=False`, new embeddings aren't saved to the persistent cache."""
+        hashes = [self.content_hash(text) for text in texts]
+        vectors: dict[str, np.ndarray] = {}
+        waiting: dict[str, asyncio.Future[np.ndarray]] = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash in vectors or content_hash in waiting:
+                continue
+            if (vector := self._cache.get(content_hash)) is not None:
+                vectors[content_hash] = vector
+            else:
+                waiting[content_hash] = self._enqueue(content_hash, text, persist)
+        self._counts["texts"] += len(texts)
+
+        if waiting:
+            # Shielded, so a cancelled request doesn't cancel the embeddings other requests are waiting for too
+            vectors.update(zip(waiting, await asyncio.shield(asyncio.gather(*waiting.values()))))
+
+        self._maybe_log_metrics()
+        return [vectors[content_hash].tolist() for content_hash in hashes]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Sync callers only share the in-memory cache, as batching needs the event loop
+        hashes = [self.content_hash(text) for text in texts]
+        vectors = {h: vector for h in dict.fromkeys(hashes) if (vector := self._cache.get(h)) is not None}
+        missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+        if missing:
+            embedded = self.backend.embed_documents(list(missing.values()))
+            for content_hash, vector in zip(missing, embedded):
+                vectors[content_hash] = np.asarray(vector, dtype=np.float32)
+                self._cache.set(content_hash, vectors[content_hash])
+            self._counts["backend_requests"] += 1
+            self._counts["embedded"] += len(missing)
+        self._counts["texts"] += len(texts)
+        return [vectors[content_hash].tolist() for content_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def _enqueue(self, content_hash: str, text: str, persist: bool) -> asyncio.Future[np.ndarray]:
+        if persist:
+            self._persist.add(content_hash)
+        if (future := self._pending.get(content_hash)) is not None:
+            self._counts["coalesced"] += 1
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = self._pending[content_hash] = loop.create_future()
+        self._queue[content_hash] = text
+        if len(self._queue) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window_seconds, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        """Close the batch window, sending the queued texts as soon as a backend request can be made."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._queue:
+            task = asyncio.ensure_future(self._send())
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send(self) -> None:
+        async with self._semaphore:
+            # The batch is taken once a request can be made, so while the backend is busy, batches grow instead of
+            # queueing up
+            batch = dict(list(self._queue.items())[: self.max_batch_size])
+            for content_hash in batch:
+                del self._queue[content_hash]
+            if self._queue and self._flush_handle is None:
+                self._flush()
+            if batch:
+                await self._embed_batch(batch)
+
+    async def _embed_batch(self, batch: dict[str, str]) -> None:
+        try:
+            vectors = await self._load(list(batch)) if self.persistent_cache else {}
+            self._counts["persistent_hits"] += len(vectors)
+            missing = [content_hash for content_hash in batch if content_hash not in vectors]
+            if missing:
+                embedded = await self.backend.aembed_documents([batch[content_hash] for content_hash in missing])
+                new_vectors = {h: np.asarray(vector, dtype=np.float32) for h, vector in zip(missing, embedded)}
+                self._counts["backend_requests"] += 1
+                self._counts["embedded"] += len(missing)
+                if self.persistent_cache and (to_save := {h: v for h, v in new_vectors.items() if h in self._persist}):
+                    await self._save(to_save)
+                vectors.update(new_vectors)
+        except BaseException as e:
+            self._persist -= batch.keys()
+            for content_hash in batch:
+                future = self._pending.pop(content_hash)
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                elif not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            self._counts["failed_batches"] += 1
+            return
+
+        self._persist -= batch.keys()
+        for content_hash in batch:
+            self._cache.set(content_hash, vectors[content_hash])
+            future = self._pending.pop(content_hash)
+            if not future.done():
+                future.set_result(vectors[content_hash])
+
+    async def _load(self, hashes: list[str]) -> dict[str, np.ndarray]:
+        try:
+            async with sqa_async_session_factory() as session:
+                # noinspection PyTypeChecker
+                rows = await session.execute(
+                    select(EmbeddingCacheEntry.content_hash, EmbeddingCacheEntry.embedding).where(
+                        col(EmbeddingCacheEntry.content_hash).in_(hashes)
+                    )
+                )
+                return {content_hash: np.asarray(embedding, dtype=np.float32) for content_hash, embedding in rows}
+        except Exception:
+            logger.exception("Failed to read cached embeddings")
+            return {}
+
+    async def _save(self, vectors: dict[str, np.ndarray]) -> None:
+        created_at = datetime.now(tz=UTC)
+        rows = [(h, self.model, vector_literal(vector.tolist()), created_at) for h, vector in vectors.items()]
+        try:
+            async with sqa_async_engine.begin() as conn:
+                await copy_rows(conn, EmbeddingCacheEntry.__tablename__, _CACHE_COLUMNS, rows, skip_conflicts=True)
+        except Exception:
+            logger.exception("Failed to cache embeddings")
+
+    def _maybe_log_metrics(self) -> None:
+        if time.monotonic() - self._metrics_logged_at >= _METRICS_LOG_INTERVAL_SECONDS:
+            self._metrics_logged_at = time.monotonic()
+            logger.info(f"Embedding service: {self.metrics()}")
+
+    def metrics(self) -> dict[str, Any]:
+        """Texts requested, how many were served by each cache, and the backend requests and their batch size."""
+        counts = self._counts
+        return {
+            "texts": counts["texts"],
+            "memory_hits": self._cache.hits,
+            "coalesced": counts["coalesced"],
+            "persistent_hits": counts["persistent_hits"],
+            "embedded": counts["embedded"],
+            "backend_requests": counts["backend_requests"],
+            "failed_batches": counts["failed_batches"],
+            "avg_batch_size": round(counts["embedded"] / (counts["backend_requests"] or 1), 1),
+            "embedded_share": round(counts["embedded"] / (counts["texts"] or 1), 3),
+            "cached": len(self._cache),
+        }
+
+
+async def prune_embedding_cache() -> int:
+    """Delete the embeddings cached in Postgres for longer than the retention period, returning how many."""
+    if settings.ai_embedding_cache_retention_days is None:
+        return 0
+
+    cutoff = datetime.now(tz=UTC) - timedelta(days=settings.ai_embedding_cache_retention_days)
+    async with sqa_async_engine.begin() as conn:
+        result = await conn.execute(delete(EmbeddingCacheEntry).where(col(EmbeddingCacheEntry.created_at) < cutoff))
+    if result.rowcount:
+        logger.info(f"Pruned {result.rowcount} cached embeddings")
+    return result.rowcount
+
+
+@lru_cache
+def get_embedding_service() -> EmbeddingService:
+    """Get the process-wide embedding service for the configured backend."""
+    return EmbeddingService(
+        get_embedding_backend(),
+        model=get_embedding_model_name(),
+        batch_window_seconds=settings.ai_embedding_batch_window_ms / 1000,
+        max_batch_size=settings.ai_embedding_max_batch_size,
+        concurrency=settings.ai_embedding_concurrency,
+        cache_size=settings.ai_embedding_cache_size,
+        # The local backend is faster than a round trip to Postgres
+        persistent_cache=settings.ai_embedding_persistent_cache and settings.ai_embedding_backend == "openai",
+    )
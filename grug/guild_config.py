@@ -0,0 +1,148 @@
+"""
+Per-guild configuration with an in-process cache.
+
+Reads go through the cache so hot paths (message handling, voice events, tools) never hit the database once a guild's
+config has been loaded. Writes go to the `guild_configs` table, whose trigger issues a Postgres `NOTIFY` on the
+`guild_config_changed` channel. Every process runs `listen_for_guild_config_changes`, which invalidates its cached entry
+for that guild.
+"""
+
+import asyncio
+from datetime import datetime
+
+import psycopg
+from loguru import logger
+from pydantic import BaseModel, ConfigDict
+
+from grug.db import sqa_async_session_factory
+from grug.models import GuildConfig
+from grug.settings import settings
+
+GUILD_CONFIG_NOTIFY_CHANNEL = "guild_config_changed"
+
+
+class GuildSettings(BaseModel):
+    """A guild's effective settings, with global defaults filled in for anything the guild hasn't set."""
+
+    model_config = ConfigDict(frozen=True)
+
+    guild_id: int | None
+    voice_channel_id: int | None
+    ai_instructions: str
+    ai_image_generation_enabled: bool
+    ai_image_daily_generation_limit: int | None
+    tts_enabled: bool
+    tts_voice: str
+
+    @classmethod
+    def from_guild_config(cls, guild_id: int | None, guild_config: GuildConfig | None) -> "GuildSettings":
+        def _resolve(field: str, default):
+            value = getattr(guild_config, field, None) if guild_config else None
+            return default if value is None else value
+
+        return cls(
+            guild_id=guild_id,
+            voice_channel_id=guild_config.voice_channel_id if guild_config else None,
+            ai_instructions=_resolve("ai_instructions", settings.ai_instructions),
+            ai_image_generation_enabled=_resolve("ai_image_generation_enabled", settings.ai_image_generation_enabled),
+            ai_image_daily_generation_limit=_resolve(
+                "ai_image_daily_generation_limit", settings.ai_image_daily_generation_limit
+            ),
+            tts_enabled=_resolve("tts_enabled", settings.tts_enabled),
+            tts_voice=_resolve("tts_voice", settings.tts_voice),
+        )
+
+
+_cache: dict[int, GuildSettings] = {}
+_cache_generation = 0  # bumped on every invalidation, so a load that raced with one isn't cached
+
+
+async def get_guild_settings(guild_id: int | None) -> GuildSettings:
+    """
+    Get the effective settings for a guild.
+
+    Args:
+        guild_id: The Discord guild ID, or `None` (e.g. for DMs) to get the global defaults.
+    """
+    if guild_id is None:
+        return GuildSettings.from_guild_config(None, None)
+
+    if (cached := _cache.get(guild_id)) is not None:
+        return cached
+
+    generation = _cache_generation
+    async with sqa_async_session_factory() as session:
+        guild_config = await session.get(GuildConfig, guild_id)
+
+    guild_settings = GuildSettings.from_guild_config(guild_id, guild_config)
+    if generation == _cache_generation:
+        _cache[guild_id] = guild_settings
+    return guild_settings
+
+
+def get_cached_guild_settings(guild_id: int | None) -> GuildSettings:
+    """
+    Get a guild's effective settings from the cache without touching the database, for use from sync code or other
+    threads. Falls back to the global defaults if the guild hasn't been loaded yet.
+    """
+    if guild_id is not None and (cached := _cache.get(guild_id)) is not None:
+        return cached
+    return GuildSettings.from_guild_config(guild_id, None)
+
+
+def invalidate_guild_settings(guild_id: int | None = None) -> None:
+    """Drop a guild's cached settings, or every guild's if `guild_id` is None."""
+    global _cache_generation
+    _cache_generation += 1
+    if guild_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(guild_id, None)
+
+
+async def update_guild_config(guild_id: int, **values) -> GuildSettings:
+    """
+    Update a guild's configuration, creating it if needed.
+
+    Args:
+        guild_id: The Discord guild ID.
+        **values: `GuildConfig` fields to set. Setting a field to `None` resets it to the global default.
+
+    Returns:
+        The guild's new effective settings.
+    """
+    async with sqa_async_session_factory() as session:
+        guild_config = await session.get(GuildConfig, guild_id) or GuildConfig(guild_id=guild_id)
+        for field, value in values.items():
+            setattr(guild_config, field, value)
+        guild_config.updated_at = datetime.now()
+        session.add(guild_config)
+        await session.commit()
+
+    # The NOTIFY from the table trigger invalidates other processes, this process can update its cache right away
+    guild_settings = GuildSettings.from_guild_config(guild_id, guild_config)
+    _cache[guild_id] = guild_settings
+    logger.info(f"Updated guild config for {guild_id}: {values}")
+    return guild_settings
+
+
+async def listen_for_guild_config_changes(reconnect_delay_seconds: float = 5.0):
+    """Listen for guild config change notifications and invalidate the cache, reconnecting if the connection drops."""
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(
+                settings.postgres_dsn.replace("+psycopg", ""), autocommit=True
+            ) as conn:
+                await conn.execute(f"LISTEN {GUILD_CONFIG_NOTIFY_CHANNEL}")
+
+                # Notifications may have been missed while disconnected, so start from a clean cache
+                invalidate_guild_settings()
+                logger.info("Listening for guild config changes...")
+
+                async for notify in conn.notifies():
+                    logger.debug(f"Guild config changed for {notify.payload}, invalidating cache")
+                    invalidate_guild_settings(int(notify.payload))
+
+        except psycopg.OperationalError as e:
+            logger.warning(f"Guild config listener disconnected ({e}), reconnecting in {reconnect_delay_seconds}s")
+            await asyncio.sleep(reconnect_delay_seconds)
@@ -0,0 +1,168 @@
+"""
+Local, content-addressed storage for generated images, with reuse of images for repeated prompts.
+
+OpenAI's image URLs expire after about an hour, so generated images are downloaded into `ai_image_store_dir` under
+their SHA-256 hash and sent to Discord as attachments. Before generating an image, `find_reusable_image` looks for a
+recent image in the same guild whose normalized prompt is the same or nearly the same, so repeated prompts don't pay
+for another generation. The store is kept under `ai_image_store_max_mb` by evicting the least recently used images,
+with the file modification time tracking use.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from datetime import UTC, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+import httpx
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from loguru import logger
+from rapidfuzz import fuzz, process
+from sqlmodel import col, select
+
+from grug.db import sqa_async_session_factory
+from grug.models import DalleImageRequest
+from grug.settings import settings
+
+_NEAR_DUPLICATE_CANDIDATES = 500
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase a prompt and strip its punctuation and extra whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", prompt.lower()).split())
+
+
+@lru_cache
+def _get_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=httpx.Timeout(60.0), follow_redirects=True)
+
+
+def resolve_image_path(image_path: str) -> Path:
+    return settings.ai_image_store_dir / image_path
+
+
+async def download_image(url: str) -> str:
+    """Download an image into the store, returning its path relative to the store."""
+    settings.ai_image_store_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+
+    # Stream into a temporary file in the store, so the final move is an atomic rename on the same filesystem
+    with tempfile.NamedTemporaryFile(dir=settings.ai_image_store_dir, suffix=".part", delete=False) as tmp_file:
+        try:
+            async with _get_http_client().stream("GET", url) as response:
+                response.raise_for_status()
+                async for data in response.aiter_bytes():
+                    digest.update(data)
+                    tmp_file.write(data)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+
+    sha256 = digest.hexdigest()
+    image_path = f"{sha256[:2]}/{sha256}.png"
+    destination = resolve_image_path(image_path)
+    destination.parent.mkdir(exist_ok=True)
+    os.replace(tmp_file.name, destination)
+
+    await asyncio.to_thread(evict_images)
+    return image_path
+
+
+def evict_images(max_bytes: int | None = None) -> int:
+    """Delete the least recently used images until the store fits in `max_bytes`, returning the number deleted."""
+    max_bytes = max_bytes if max_bytes is not None else settings.ai_image_store_max_mb * 1024 * 1024
+    images = [(path, path.stat()) for path in settings.ai_image_store_dir.glob("*/*.png")]
+    total_bytes = sum(stat.st_size for _, stat in images)
+
+    evicted = 0
+    for path, stat in sorted(images, key=lambda image: image[1].st_mtime):
+        if total_bytes <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total_bytes -= stat.st_size
+        evicted += 1
+
+    if evicted:
+        logger.info(f"Evicted {evicted} images from the image store")
+    return evicted
+
+
+def _touch(path: Path) -> bool:
+    """Mark an image as used, returning False if it has been evicted."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+async def find_reusable_image(
+    guild_id: int | None,
+    prompt: str,
+    model: str,
+    size: str,
+    quality: str,
+) -> DalleImageRequest | None:
+    """
+    Find a recent, still stored image generated in the same guild with the same settings and the same (or nearly the
+    same) normalized prompt.
+    """
+    if settings.ai_image_reuse_window_days is None:
+        return None
+
+    normalized_prompt = normalize_prompt(prompt)
+    statement = (
+        select(DalleImageRequest)
+        .where(
+            col(DalleImageRequest.guild_id) == guild_id
+            if guild_id is not None
+            else col(DalleImageRequest.guild_id).is_(None)
+        )
+        .where(
+            DalleImageRequest.request_time >= datetime.now(tz=UTC) - timedelta(days=settings.ai_image_reuse_window_days)
+        )
+        .where(DalleImageRequest.model == model)
+        .where(DalleImageRequest.size == size)
+        .where(DalleImageRequest.quality == quality)
+        .where(col(DalleImageRequest.image_path).is_not(None))
+        .order_by(col(DalleImageRequest.request_time).desc())
+    )
+
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        candidates = list(
+            (await session.execute(statement.where(DalleImageRequest.normalized_prompt == normalized_prompt))).scalars()
+        )
+        if not candidates and settings.ai_image_reuse_min_similarity < 100:
+            # noinspection PyTypeChecker
+            recent = list((await session.execute(statement.limit(_NEAR_DUPLICATE_CANDIDATES))).scalars())
+            matches = process.extract(
+                normalized_prompt,
+                [request.normalized_prompt or "" for request in recent],
+                scorer=fuzz.token_sort_ratio,
+                score_cutoff=settings.ai_image_reuse_min_similarity,
+                limit=None,
+            )
+            candidates = [recent[index] for _, _, index in matches]
+
+    for request in candidates:
+        if _touch(resolve_image_path(request.image_path)):
+            return request
+    return None
+
+
+def get_image_attachments(messages: list[BaseMessage]) -> list[Path]:
+    """Get the paths of the images generated while the agent responded to the last human message."""
+    paths = []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and isinstance(message.artifact, dict):
+            if image_path := message.artifact.get("image_path"):
+                path = resolve_image_path(image_path)
+                if path.exists():
+                    paths.append(path)
+    return list(reversed(paths))
@@ -0,0 +1,180 @@
+"""
+Long-term memory: facts the agent saves about players, their characters, and a server's house rules.
+
+Memories are stored in the agent's `AsyncPostgresStore`, which embeds each fact for vector search with the shared
+`grug.embedding_service`. A fact is saved either for the user it is about, under
+`("memories", <guild>, <user>, "facts")`, or for the whole server, under `("memories", <guild>, "server", "facts")`,
+and a recall searches both. The store searches by namespace prefix, so the trailing "facts" keeps a search for user
+123 from matching user 1234's memories. Saving several facts, or recalling for several queries, is a single store
+batch and a single embeddings request. Everyone in a server recalls its memories, but the tools only let members who
+can manage the server save or delete them.
+
+Recalls are cached in process, per user, so the repeated lookups of a conversation don't go back to Postgres. A user's
+cache is dropped when their memories change, and every user's cached recalls in a server are invalidated when the
+server's memories change. With several replicas each guild is handled by one of them, so the caches stay consistent.
+"""
+
+import uuid
+from datetime import UTC, datetime
+from typing import Any
+
+from langgraph.store.base import BaseStore, GetOp, PutOp, SearchOp
+from langgraph.store.postgres.base import PostgresIndexConfig
+
+from grug.ai_embeddings import EMBEDDING_DIMENSIONS
+from grug.embedding_service import get_embedding_service
+from grug.settings import settings
+from grug.utils import TTLCache
+
+MEMORY_NAMESPACE = "memories"
+SERVER_SCOPE = "server"
+# Ends every memory namespace, so a namespace is never a prefix of another one
+_FACTS = "facts"
+
+# Per user, a cache of recall results keyed by the query, the limit, and the server's memory generation
+_recall_cache = TTLCache(maxsize=settings.memory_cache_users, ttl_seconds=settings.memory_cache_ttl_seconds)
+_server_generations: dict[str, int] = {}
+
+
+def get_memory_index_config() -> PostgresIndexConfig:
+    """The store's vector index configuration, which embeds the `fact` of each memory."""
+    # A recall searches the user's and the server's memories for the same query, which the service embeds only once
+    return PostgresIndexConfig(dims=EMBEDDING_DIMENSIONS, embed=get_embedding_service(), fields=["fact"])
+
+
+def _namespaces(guild_id: int | None, user_id: str) -> tuple[tuple[str, ...], tuple[str, ...] | None]:
+    """The user's memory namespace, and the server's (None in DMs)."""
+    guild = str(guild_id) if guild_id is not None else "dm"
+    server_namespace = (MEMORY_NAMESPACE, guild, SERVER_SCOPE, _FACTS) if guild_id is not None else None
+    return (MEMORY_NAMESPACE, guild, user_id, _FACTS), server_namespace
+
+
+def _user_cache(guild_id: int | None, user_id: str) -> TTLCache:
+    key = (guild_id, user_id)
+    if (cache := _recall_cache.get(key)) is None:
+        cache = TTLCache(maxsize=settings.memory_cache_queries_per_user, ttl_seconds=settings.memory_cache_ttl_seconds)
+        _recall_cache.set(key, cache)
+    return cache
+
+
+def _invalidate(guild_id: int | None, user_id: str, server: bool) -> None:
+    if server:
+        _server_generations[str(guild_id)] = _server_generations.get(str(guild_id), 0) + 1
+    else:
+        _user_cache(guild_id, user_id).clear()
+
+
+async def save_memories(
+    store: BaseStore,
+    guild_id: int | None,
+    user_id: str,
+    facts: list[str],
+    server: bool = False,
+) -> list[str]:
+    """
+    Save facts about a user, or with `server`, about the whole server.
+
+    Args:
+        store: The agent's store.
+        guild_id: The guild the facts belong to, or None in DMs.
+        user_id: The agent's `user_id` for the user.
+        facts: The facts to save.
+        server: Whether the facts are about the server (e.g. house rules) rather than the user.
+
+    Returns:
+        The IDs of the saved memories.
+    """
+    user_namespace, server_namespace = _namespaces(guild_id, user_id)
+    if server and server_namespace is None:
+        raise ValueError("Server memories can only be saved in a server.")
+
+    namespace = server_namespace if server else user_namespace
+    saved_at = datetime.now(tz=UTC).isoformat()
+    ops = [PutOp(namespace, str(uuid.uuid4()), {"fact": fact, "saved_at": saved_at}) for fact in facts]
+    await store.abatch(ops)
+    _invalidate(guild_id, user_id, server)
+    return [op.key for op in ops]
+
+
+def _memory(item: Any, about: str) -> dict[str, Any]:
+    return {
+        "memory_id": item.key,
+        "fact": item.value.get("fact"),
+        "about": about,
+        "saved_at": item.value.get("saved_at"),
+        "relevance": round(item.score, 3) if item.score is not None else None,
+    }
+
+
+async def recall_memories(
+    store: BaseStore,
+    guild_id: int | None,
+    user_id: str,
+    queries: list[str],
+    limit: int = settings.memory_recall_limit,
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Recall the memories most relevant to each query, from the user's and the server's memories.
+
+    Returns:
+        The memories for each query, most relevant first.
+    """
+    user_namespace, server_namespace = _namespaces(guild_id, user_id)
+    cache = _user_cache(guild_id, user_id)
+    generation = _server_generations.get(str(guild_id), 0)
+
+    results = {}
+    missing = []
+    for query in dict.fromkeys(queries):
+        if (cached := cache.get((query, limit, generation))) is not None:
+            results[query] = cached
+        else:
+            missing.append(query)
+
+    if missing:
+        namespaces = [(user_namespace, "user")] + ([(server_namespace, SERVER_SCOPE)] if server_namespace else [])
+        found = await store.abatch(
+            [
+                SearchOp(namespace_prefix=namespace, query=query, limit=limit)
+                for query in missing
+                for namespace, _ in namespaces
+            ]
+        )
+        for i, query in enumerate(missing):
+            memories = [
+                _memory(item, about)
+                for (namespace, about), items in zip(namespaces, found[i * len(namespaces) : (i + 1) * len(namespaces)])
+                for item in items
+                # A search matches namespaces by prefix, so make sure no other namespace gets through
+                if tuple(item.namespace) == namespace
+            ]
+            memories.sort(key=lambda memory: memory["relevance"] or 0, reverse=True)
+            results[query] = memories[:limit]
+            cache.set((query, limit, generation), results[query])
+
+    return results
+
+
+async def forget_memories(
+    store: BaseStore, guild_id: int | None, user_id: str, memory_ids: list[str], server: bool = True
+) -> int:
+    """
+    Delete memories, of the user or (with `server`) the server, by ID.
+
+    Returns:
+        The number of memories deleted.
+    """
+    user_namespace, server_namespace = _namespaces(guild_id, user_id)
+    namespaces = [user_namespace] + ([server_namespace] if server_namespace and server else [])
+    found = [
+        item
+        for item in await store.abatch(
+            [GetOp(namespace, memory_id) for namespace in namespaces for memory_id in dict.fromkeys(memory_ids)]
+        )
+        if item is not None
+    ]
+    if found:
+        await store.abatch([PutOp(item.namespace, item.key, None) for item in found])
+        for server in {item.namespace == server_namespace for item in found}:
+            _invalidate(guild_id, user_id, server)
+    return len(found)
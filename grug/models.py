@@ -1,9 +1,14 @@
-from datetime import datetime
+import uuid
+from datetime import date, datetime
 
 import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlmodel import Field, SQLModel
 from sqlmodel._compat import SQLModelConfig
 
+from grug.ai_embeddings import EMBEDDING_DIMENSIONS
+
 
 class SQLModelValidation(SQLModel):
     """
@@ -17,17 +22,302 @@ class DalleImageRequest(SQLModelValidation, table=True):
     """Model for tracking image requests to the DALLE API."""
 
     __tablename__ = "dalle_image_requests"
+    __table_args__ = (
+        sa.Index("ix_dalle_image_requests_guild_id_normalized_prompt", "guild_id", "normalized_prompt"),
+        sa.Index("ix_dalle_image_requests_guild_id_request_time", "guild_id", "request_time"),
+    )
 
     id: int | None = Field(default=None, primary_key=True)
     request_time: datetime = Field(
         default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
     )
+    guild_id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, nullable=True))
     prompt: str
     model: str
     size: str
     quality: str
     revised_prompt: str | None = None
     image_url: str | None = None
+    normalized_prompt: str | None = None
+    image_path: str | None = Field(default=None, description="The image's path, relative to `ai_image_store_dir`.")
 
     def __str__(self):
         return f"Dall-E Image {self.id} [{self.request_time}]"
+
+
+class QuotaCounter(SQLModelValidation, table=True):
+    """
+    Daily usage counter for a rate-limited resource (e.g. image generations), per scope (e.g. guild).
+
+    `reserved` counts uses that have been granted but not yet completed, and `reserved_at` is when the last one was
+    granted, so leaked reservations can be discarded, see `grug.quotas`.
+    """
+
+    __tablename__ = "quota_counters"
+
+    name: str = Field(primary_key=True)
+    scope_id: int = Field(sa_column=sa.Column(sa.BigInteger, primary_key=True, autoincrement=False))
+    day: date = Field(primary_key=True)
+    used: int = 0
+    reserved: int = 0
+    reserved_at: datetime | None = Field(default=None, sa_column=sa.Column(sa.DateTime(timezone=True)))
+
+    def __str__(self):
+        return f"{self.name} [{self.scope_id}, {self.day}]: {self.used} used, {self.reserved} reserved"
+
+
+class GuildConfig(SQLModelValidation, table=True):
+    """
+    Per-guild (Discord server) configuration.
+
+    Any value left as `None` falls back to the corresponding global default in `grug.settings`.
+    """
+
+    __tablename__ = "guild_configs"
+
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, primary_key=True, autoincrement=False))
+    voice_channel_id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, nullable=True))
+    ai_instructions: str | None = None
+    ai_image_generation_enabled: bool | None = None
+    ai_image_daily_generation_limit: int | None = None
+    tts_enabled: bool | None = None
+    tts_voice: str | None = None
+    updated_at: datetime = Field(
+        default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
+    )
+
+    def __str__(self):
+        return f"Guild Config {self.guild_id}"
+
+
+class VoiceSession(SQLModelValidation, table=True):
+    """A period during which the bot was listening in a voice channel."""
+
+    __tablename__ = "voice_sessions"
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False, index=True))
+    channel_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    started_at: datetime = Field(
+        default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
+    )
+    ended_at: datetime | None = Field(default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True))
+
+    def __str__(self):
+        return f"Voice Session {self.id} [{self.started_at}]"
+
+
+class VoiceSessionSummary(SQLModelValidation, table=True):
+    """
+    A cached summary of part of a voice session's transcript, see `grug.session_summaries`.
+
+    Level 0 summaries are of consecutive, time-aligned chunks of the transcript, and each summary on the levels above
+    merges a group of the summaries below it, up to a single summary of the whole session. `fingerprint` is a hash of
+    the text that was summarized, so a summary is only redone when its input changed.
+    """
+
+    __tablename__ = "voice_session_summaries"
+
+    session_id: uuid.UUID = Field(primary_key=True)
+    level: int = Field(primary_key=True)
+    position: int = Field(primary_key=True)
+    started_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
+    ended_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
+    fingerprint: str
+    summary: str
+    is_final: bool = False
+    created_at: datetime = Field(
+        default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
+    )
+
+    def __str__(self):
+        return f"Voice Session Summary {self.session_id} [level {self.level}, {self.started_at} - {self.ended_at}]"
+
+
+class VoiceTranscriptSegment(SQLModelValidation, table=True):
+    """
+    A transcribed phrase spoken in a voice session.
+
+    The table is range-partitioned by month on `spoken_at` (see `grug.transcripts`), so old transcripts are removed by
+    dropping whole partitions. `text_search` is a generated tsvector column backing full-text search.
+    """
+
+    __tablename__ = "voice_transcript_segments"
+    __table_args__ = (
+        sa.Index("ix_voice_transcript_segments_session_id_spoken_at", "session_id", "spoken_at"),
+        sa.Index("ix_voice_transcript_segments_text_search", "text_search", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (spoken_at)"},
+    )
+
+    id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, sa.Identity(), primary_key=True))
+    spoken_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), primary_key=True))
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    channel_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    session_id: uuid.UUID = Field(nullable=False)
+    speaker_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    speaker_name: str | None = None
+    text: str
+    text_search: str | None = Field(
+        default=None,
+        sa_column=sa.Column(TSVECTOR, sa.Computed("to_tsvector('english', text)", persisted=True)),
+        exclude=True,
+    )
+
+    def __str__(self):
+        return f"[{self.spoken_at}] {self.speaker_name or self.speaker_id}: {self.text}"
+
+
+class ChatMessage(SQLModelValidation, table=True):
+    """
+    An archived Discord text message, used to search a channel's chat history.
+
+    `content_search` is a generated tsvector column backing full-text search. `embedding` is only populated when
+    `chat_archive_embeddings_enabled` is set, and backs semantic search.
+    """
+
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        sa.Index("ix_chat_messages_guild_id_channel_id_created_at", "guild_id", "channel_id", "created_at"),
+        sa.Index("ix_chat_messages_content_search", "content_search", postgresql_using="gin"),
+        sa.Index(
+            "ix_chat_messages_embedding",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
+
+    id: int = Field(sa_column=sa.Column(sa.BigInteger, primary_key=True, autoincrement=False))
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    channel_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    author_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    author_name: str
+    content: str
+    created_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
+    content_search: str | None = Field(
+        default=None,
+        sa_column=sa.Column(TSVECTOR, sa.Computed("to_tsvector('english', content)", persisted=True)),
+        exclude=True,
+    )
+    embedding: list[float] | None = Field(
+        default=None, sa_column=sa.Column(Vector(EMBEDDING_DIMENSIONS), nullable=True), exclude=True
+    )
+
+    def __str__(self):
+        return f"[{self.created_at:%Y-%m-%d %H:%M}] {self.author_name}: {self.content}"
+
+
+class SourceDocument(SQLModelValidation, table=True):
+    """
+    A piece of source material (e.g. a rulebook PDF) uploaded to a guild.
+
+    `page_hashes` holds a fingerprint of each page's text, so re-uploading a document only re-processes the pages that
+    changed.
+    """
+
+    __tablename__ = "source_documents"
+    __table_args__ = (sa.UniqueConstraint("guild_id", "name"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    name: str
+    page_count: int = 0
+    page_hashes: list[str] = Field(default_factory=list, sa_column=sa.Column(sa.ARRAY(sa.String), nullable=False))
+    ingested_at: datetime | None = Field(default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True))
+
+    def __str__(self):
+        return f"{self.name} ({self.page_count} pages)"
+
+
+class SourceChunk(SQLModelValidation, table=True):
+    """
+    A chunk of a source document's text, with its embedding.
+
+    The table is list-partitioned by `guild_id` with one partition per guild (see `grug.source_material`), so each
+    guild's chunks have their own, smaller HNSW graph and every search is pruned to a single partition.
+    """
+
+    __tablename__ = "source_chunks"
+    __table_args__ = (
+        sa.Index("ix_source_chunks_document_id_page_number", "document_id", "page_number"),
+        sa.Index("ix_source_chunks_content_search", "content_search", postgresql_using="gin"),
+        sa.Index(
+            "ix_source_chunks_embedding",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+        {"postgresql_partition_by": "LIST (guild_id)"},
+    )
+
+    id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, sa.Identity(), primary_key=True))
+    guild_id: int = Field(sa_column=sa.Column(sa.BigInteger, primary_key=True))
+    document_id: uuid.UUID = Field(nullable=False)
+    page_number: int
+    chunk_index: int
+    content: str
+    content_search: str | None = Field(
+        default=None,
+        sa_column=sa.Column(TSVECTOR, sa.Computed("to_tsvector('english', content)", persisted=True)),
+        exclude=True,
+    )
+    embedding: list[float] = Field(sa_column=sa.Column(Vector(EMBEDDING_DIMENSIONS), nullable=False), exclude=True)
+
+    def __str__(self):
+        return f"[page {self.page_number + 1}] {self.content}"
+
+
+class EmbeddingCacheEntry(SQLModelValidation, table=True):
+    """
+    A cached text embedding, see `grug.embedding_service`.
+
+    `content_hash` is a SHA-256 hash of the embedding model's name and the text, so the text itself isn't stored, and
+    embeddings from different models never collide. Entries past `ai_embedding_cache_retention_days` are pruned by
+    `created_at`.
+    """
+
+    __tablename__ = "embedding_cache"
+
+    content_hash: str = Field(primary_key=True)
+    model: str
+    embedding: list[float] = Field(sa_column=sa.Column(Vector(EMBEDDING_DIMENSIONS), nullable=False), exclude=True)
+    created_at: datetime = Field(
+        default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False, index=True)
+    )
+
+    def __str__(self):
+        return f"Embedding {self.content_hash[:12]} ({self.model})"
+
+
+class Reminder(SQLModelValidation, table=True):
+    """
+    A reminder to post in a channel at a given time.
+
+    `delivered_at` is set once the reminder has been posted, see `grug.reminders`.
+    """
+
+    __tablename__ = "reminders"
+    __table_args__ = (
+        sa.Index(
+            "ix_reminders_due_at_undelivered",
+            "due_at",
+            postgresql_where=sa.text("delivered_at IS NULL"),
+        ),
+        sa.Index("ix_reminders_channel_id_due_at", "channel_id", "due_at"),
+    )
+
+    id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, sa.Identity(), primary_key=True))
+    guild_id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, nullable=True))
+    channel_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    user_id: int = Field(sa_column=sa.Column(sa.BigInteger, nullable=False))
+    message: str
+    due_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
+    created_at: datetime = Field(
+        default_factory=datetime.now, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
+    )
+    delivered_at: datetime | None = Field(default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True))
+
+    def __str__(self):
+        return f"Reminder {self.id} [{self.due_at}]: {self.message}"
@@ -0,0 +1,80 @@
+"""
+PDF text extraction and chunking.
+
+These functions run in worker processes (see `grug.source_material`), so this module only imports what they need,
+which keeps worker start-up fast.
+"""
+
+import hashlib
+from dataclasses import dataclass
+
+import pymupdf
+
+
+@dataclass
+class ExtractedPage:
+    """A page of a document, with its chunks, or `None` for `chunks` if the page is unchanged."""
+
+    page_number: int
+    page_hash: str
+    chunks: list[str] | None
+
+
+def chunk_text(page_text: str, chunk_size: int, overlap: int) -> list[str]:
+    """Split text into chunks of up to `chunk_size` characters that overlap by about `overlap` characters."""
+    words = page_text.split()
+    chunks: list[str] = []
+    start = 0
+    while start < len(words):
+        length = -1
+        end = start
+        while end < len(words) and length + 1 + len(words[end]) <= chunk_size:
+            length += 1 + len(words[end])
+            end += 1
+        end = max(end, start + 1)  # always make progress, even past a single oversized word
+        chunks.append(" ".join(words[start:end]))
+        if end == len(words):
+            break
+
+        # Step back over whole words to build the overlap with the next chunk
+        back = end
+        overlap_length = -1
+        while back - 1 > start and overlap_length + 1 + len(words[back - 1]) <= overlap:
+            back -= 1
+            overlap_length += 1 + len(words[back])
+        start = back
+    return chunks
+
+
+def fingerprint(page_text: str, salt: str) -> str:
+    """Hash a page's text, ignoring whitespace differences. `salt` should identify how the text is processed."""
+    return hashlib.sha256(f"{salt}:{' '.join(page_text.split())}".encode()).hexdigest()
+
+
+def extract_pages(
+    path: str,
+    start: int,
+    stop: int,
+    known_hashes: dict[int, str],
+    chunk_size: int,
+    overlap: int,
+    salt: str = "",
+) -> list[ExtractedPage]:
+    """
+    Extract, fingerprint and chunk the text of pages `[start, stop)` of a PDF.
+
+    Pages whose fingerprint matches the one in `known_hashes` aren't chunked, and are returned with `chunks=None`.
+    """
+    pages = []
+    with pymupdf.open(path) as document:
+        for page_number in range(start, stop):
+            page_text = document[page_number].get_text()
+            page_hash = fingerprint(page_text, salt)
+            chunks = None if known_hashes.get(page_number) == page_hash else chunk_text(page_text, chunk_size, overlap)
+            pages.append(ExtractedPage(page_number=page_number, page_hash=page_hash, chunks=chunks))
+    return pages
+
+
+def get_page_count(path: str) -> int:
+    with pymupdf.open(path) as document:
+        return document.page_count
@@ -0,0 +1,165 @@
+"""
+Daily usage quotas, e.g. for image generations per guild.
+
+A use is granted by atomically reserving a slot in the `quota_counters` row for the quota, scope and day, with a
+single `INSERT ... ON CONFLICT DO UPDATE ... WHERE used + reserved < limit` statement. Concurrent requests (from any
+process) can't overshoot the limit, since Postgres serializes the updates on the row. Once the use completes the
+reservation is committed, and if it fails the reservation is released, so failed uses don't count.
+
+A process that dies (or is cancelled while settling) between reserving and settling leaks its reservation. The row
+records when the last reservation was made in `reserved_at`, and once no reservation has been made for
+`_RESERVATION_TTL_SECONDS`, longer than any use takes, the outstanding reservations can only be leaked ones. The next
+reservation then discards them instead of counting them.
+
+Denials are remembered in-process for a short while, so once a quota is exhausted further requests are refused without
+a database round trip.
+"""
+
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import UTC, date, datetime
+from typing import AsyncIterator
+
+from loguru import logger
+from sqlalchemy import text
+
+from grug.db import sqa_async_engine
+from grug.models import QuotaCounter
+
+# Scope used for quotas outside a guild (e.g. DMs)
+GLOBAL_SCOPE_ID = 0
+
+_EXHAUSTED_TTL_SECONDS = 60.0
+_RESERVATION_TTL_SECONDS = 15 * 60
+# The reservations still outstanding, or 0 if they are all older than the TTL and so have leaked
+_LIVE_RESERVED = (
+    "CASE WHEN counter.reserved_at IS NULL "
+    "OR counter.reserved_at < now() - CAST(:ttl AS integer) * interval '1 second' THEN 0 ELSE counter.reserved END"
+)
+_exhausted: dict[tuple[str, int, date, int | None], float] = {}
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Reservation:
+    name: str
+    scope_id: int
+    day: date
+    remaining: int | None
+    """The number of uses left for the day after this one, or None if unlimited."""
+
+
+def _today() -> date:
+    return datetime.now(tz=UTC).date()
+
+
+async def reserve(name: str, scope_id: int | None, limit: int | None) -> Reservation:
+    """
+    Reserve one use of a quota for today.
+
+    Args:
+        name: The name of the quota, e.g. "image_generation".
+        scope_id: What the quota applies to, e.g. a guild ID. None for the global scope.
+        limit: The number of uses allowed per day. If None, uses are counted but never refused.
+
+    Raises:
+        QuotaExceededError: If the limit has been reached.
+    """
+    scope_id = GLOBAL_SCOPE_ID if scope_id is None else scope_id
+    day = _today()
+    exhausted_key = (name, scope_id, day, limit)
+
+    if limit is not None:
+        if limit <= 0 or _exhausted.get(exhausted_key, 0) > time.monotonic():
+            raise QuotaExceededError(f"The daily {name} limit of {limit} has been reached.")
+
+    async with sqa_async_engine.begin() as conn:
+        row = (
+            await conn.execute(
+                text(
+                    f"INSERT INTO {QuotaCounter.__tablename__} AS counter "
+                    "(name, scope_id, day, used, reserved, reserved_at) "
+                    "VALUES (:name, :scope_id, :day, 0, 1, now()) "
+                    "ON CONFLICT (name, scope_id, day) DO UPDATE "
+                    f"SET reserved = {_LIVE_RESERVED} + 1, reserved_at = now() "
+                    f"WHERE CAST(:limit AS integer) IS NULL OR counter.used + {_LIVE_RESERVED} < :limit "
+                    "RETURNING counter.used + counter.reserved"
+                ),
+                {"name": name, "scope_id": scope_id, "day": day, "limit": limit, "ttl": _RESERVATION_TTL_SECONDS},
+            )
+        ).first()
+
+    if row is None:
+        now = time.monotonic()
+        for key in [key for key, expires_at in _exhausted.items() if expires_at <= now]:
+            del _exhausted[key]
+        _exhausted[exhausted_key] = now + _EXHAUSTED_TTL_SECONDS
+        raise QuotaExceededError(f"The daily {name} limit of {limit} has been reached.")
+
+    return Reservation(name=name, scope_id=scope_id, day=day, remaining=None if limit is None else limit - row[0])
+
+
+async def remaining(name: str, scope_id: int | None, limit: int | None) -> int | None:
+    """The number of uses of a quota left today, without reserving one, or None if unlimited."""
+    if limit is None:
+        return None
+
+    async with sqa_async_engine.connect() as conn:
+        row = (
+            await conn.execute(
+                text(
+                    f"SELECT counter.used + {_LIVE_RESERVED} FROM {QuotaCounter.__tablename__} AS counter "
+                    "WHERE name = :name AND scope_id = :scope_id AND day = :day"
+                ),
+                {
+                    "name": name,
+                    "scope_id": GLOBAL_SCOPE_ID if scope_id is None else scope_id,
+                    "day": _today(),
+                    "ttl": _RESERVATION_TTL_SECONDS,
+                },
+            )
+        ).first()
+    return max(limit - (row[0] if row else 0), 0)
+
+
+async def _settle(reservation: Reservation, used: int) -> None:
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(
+            text(
+                # A reservation settled after it was discarded as leaked must not settle another one
+                f"UPDATE {QuotaCounter.__tablename__} SET reserved = GREATEST(reserved - 1, 0), used = used + :used "
+                "WHERE name = :name AND scope_id = :scope_id AND day = :day"
+            ),
+            {"used": used, "name": reservation.name, "scope_id": reservation.scope_id, "day": reservation.day},
+        )
+
+
+async def commit(reservation: Reservation) -> None:
+    """Count a reserved use as used."""
+    await _settle(reservation, used=1)
+
+
+async def release(reservation: Reservation) -> None:
+    """Give back a reserved use, e.g. because it failed."""
+    await _settle(reservation, used=0)
+    for key in [key for key in _exhausted if key[:3] == (reservation.name, reservation.scope_id, reservation.day)]:
+        del _exhausted[key]
+
+
+@asynccontextmanager
+async def use_quota(name: str, scope_id: int | None, limit: int | None) -> AsyncIterator[Reservation]:
+    """Reserve one use of a quota, committing it if the block succeeds and releasing it if the block raises."""
+    reservation = await reserve(name, scope_id, limit)
+    try:
+        yield reservation
+    except BaseException:
+        try:
+            await release(reservation)
+        except Exception:
+            logger.exception(f"Failed to release {reservation}")
+        raise
+    await commit(reservation)
@@ -0,0 +1,204 @@
+"""
+Reminders that are posted back to the channel they were set in.
+
+Reminders are stored in the `reminders` table, and each distinct due time gets a single one-off job on the scheduler
+(see `grug.scheduler.schedule_reminder_delivery`), so however many reminders are due at the same moment they are
+delivered by one job, and all of the reminders due in a channel are posted as one message.
+
+Delivery is at-least-once: due reminders are claimed with `SELECT ... FOR UPDATE SKIP LOCKED`, posted, and marked
+delivered in the same transaction. If the bot stops after posting but before committing, the locks are released and
+the reminders are posted again after the restart, but a delivered reminder is never posted twice, and concurrent
+deliveries never claim the same reminder. A periodic sweep delivers anything a one-off job missed, e.g. reminders that
+came due while the bot was offline.
+"""
+
+import asyncio
+from collections import defaultdict
+from datetime import UTC, datetime
+
+import discord
+from loguru import logger
+from sqlalchemy import func, insert, update
+from sqlmodel import col, select
+
+from grug.db import sqa_async_session_factory
+from grug.discord_dispatcher import MAX_MESSAGE_LENGTH, Priority, discord_dispatcher
+from grug.models import Reminder
+from grug.settings import settings
+
+_discord_client: discord.Client | None = None
+
+
+def register_discord_client(client: discord.Client) -> None:
+    """Set the client reminders are posted with."""
+    global _discord_client
+    _discord_client = client
+
+
+def reminder_due_time(due_at: datetime) -> datetime:
+    """Truncate a due time to the second (in UTC), so reminders set for the same moment share a delivery job."""
+    if due_at.tzinfo is None:
+        raise ValueError("Reminder times must include a timezone.")
+    return due_at.astimezone(UTC).replace(microsecond=0)
+
+
+async def create_reminders(
+    channel_id: int,
+    user_id: int,
+    guild_id: int | None,
+    reminders: list[tuple[datetime, str]],
+) -> list[Reminder]:
+    """
+    Store reminders in bulk. They still need to be scheduled with `grug.scheduler.schedule_reminder_delivery`.
+
+    Args:
+        channel_id: The channel to post the reminders in.
+        user_id: The user the reminders are for.
+        guild_id: The guild the channel belongs to, or None for DMs.
+        reminders: The due time and message of each reminder.
+    """
+    now = datetime.now(tz=UTC)
+    rows = [
+        {
+            "guild_id": guild_id,
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "message": message,
+            "due_at": reminder_due_time(due_at),
+            "created_at": now,
+        }
+        for due_at, message in reminders
+    ]
+    if not rows:
+        return []
+
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        created = list((await session.execute(insert(Reminder).returning(Reminder), rows)).scalars())
+        await session.commit()
+    return created
+
+
+async def get_pending_reminders(channel_id: int, limit: int = 25) -> list[Reminder]:
+    """Get the next reminders due in a channel."""
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await session.execute(
+                    select(Reminder)
+                    .where(Reminder.channel_id == channel_id)
+                    .where(col(Reminder.delivered_at).is_(None))
+                    .order_by(col(Reminder.due_at))
+                    .limit(limit)
+                )
+            ).scalars()
+        )
+
+
+async def cancel_reminders(channel_id: int, reminder_ids: list[int]) -> int:
+    """Cancel pending reminders in a channel, returning how many were cancelled."""
+    async with sqa_async_session_factory() as session:
+        # Cancelled reminders are marked delivered, so their scheduled jobs find nothing to do
+        result = await session.execute(
+            update(Reminder)
+            .where(col(Reminder.id).in_(reminder_ids))
+            .where(Reminder.channel_id == channel_id)
+            .where(col(Reminder.delivered_at).is_(None))
+            .values(delivered_at=func.now())
+        )
+        await session.commit()
+    return result.rowcount
+
+
+def format_reminders(reminders: list[Reminder]) -> list[str]:
+    """Format a channel's reminders as few messages as possible, within Discord's message length limit."""
+    messages: list[str] = []
+    current = ""
+    for reminder in sorted(reminders, key=lambda reminder: (reminder.due_at, reminder.id)):
+        line = f"⏰ <@{reminder.user_id}> {reminder.message}"[:MAX_MESSAGE_LENGTH]
+        if current and len(current) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+async def _post_reminders(client: discord.Client, channel_id: int, reminders: list[Reminder]) -> bool:
+    """
+    Post a channel's reminders, returning True if they are done with (posted, or the channel can't be posted to) and
+    False if they should be retried.
+    """
+    try:
+        channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+        await asyncio.gather(
+            *(
+                discord_dispatcher.send(
+                    channel,
+                    content,
+                    allowed_mentions=discord.AllowedMentions(users=True),
+                    priority=Priority.BACKGROUND,
+                )
+                for content in format_reminders(reminders)
+            )
+        )
+    except (discord.NotFound, discord.Forbidden) as e:
+        logger.warning(f"Dropping {len(reminders)} reminders for channel {channel_id}: {e}")
+    except Exception:
+        logger.exception(f"Failed to post {len(reminders)} reminders to channel {channel_id}, will retry")
+        return False
+    return True
+
+
+async def deliver_due_reminders() -> int:
+    """Post every due reminder, one message per channel, returning the number of reminders delivered."""
+    client = _discord_client
+    if client is None or not client.is_ready():
+        logger.warning("Discord client is not ready, reminders will be delivered by the next sweep")
+        return 0
+
+    delivered = 0
+    failed_ids: list[int] = []
+    while True:
+        async with sqa_async_session_factory() as session:
+            # noinspection PyTypeChecker
+            reminders = list(
+                (
+                    await session.execute(
+                        select(Reminder)
+                        .where(col(Reminder.delivered_at).is_(None))
+                        .where(Reminder.due_at <= func.now())
+                        .where(col(Reminder.id).not_in(failed_ids))
+                        .order_by(col(Reminder.due_at))
+                        .limit(settings.reminders_delivery_batch_size)
+                        .with_for_update(skip_locked=True)
+                    )
+                ).scalars()
+            )
+            if not reminders:
+                break
+
+            by_channel: dict[int, list[Reminder]] = defaultdict(list)
+            for reminder in reminders:
+                by_channel[reminder.channel_id].append(reminder)
+
+            # Channels are posted to concurrently, the dispatcher paces them within Discord's rate limits
+            results = await asyncio.gather(
+                *(_post_reminders(client, channel_id, batch) for channel_id, batch in by_channel.items())
+            )
+
+            done_ids = []
+            for posted, batch in zip(results, by_channel.values()):
+                (done_ids if posted else failed_ids).extend(reminder.id for reminder in batch)
+
+            await session.execute(
+                update(Reminder).where(col(Reminder.id).in_(done_ids)).values(delivered_at=func.now())
+            )
+            await session.commit()
+            delivered += len(done_ids)
+
+    if delivered:
+        logger.info(f"Delivered {delivered} reminders")
+    return delivered
@@ -0,0 +1,252 @@
+"""
+Coordination between Grug replicas that share a database, so more than one container can run at a time.
+
+With `ha_enabled`, every replica connects to Discord, but each guild (and all of its messages, slash commands and
+voice sessions) is handled by exactly one replica, and only one replica, the leader, runs the scheduler. Ownership is
+held as Postgres session-level advisory locks on a dedicated connection per replica:
+
+- each replica holds a replica slot lock, `(_SLOT_LOCK_NAMESPACE, slot)`, and reads the live slots from `pg_locks`.
+- guilds are spread over the live slots with rendezvous hashing, so when a replica joins or leaves only the guilds it
+  gains or loses move. Each replica locks its guilds by ID (`pg_try_advisory_lock(guild_id)`), releasing the ones that
+  have moved to another replica. DMs are owned like a guild with ID `DM_GUILD_ID`.
+- the leader holds `(_LEADER_LOCK_NAMESPACE, 0)`.
+
+Locks act as leases. The connection is configured with `idle_session_timeout` of `ha_lease_seconds`, and TCP
+keepalives that give up on an unresponsive replica after about as long, so a replica that crashes or is cut off loses
+its locks within seconds. Postgres ends the session after whichever of the two comes first, and a replica only treats
+its locks as valid until a heartbeat interval before that since its last successful heartbeat, so a replica that is
+frozen (or loses the database) stops handling its guilds before another replica can take them over.
+
+Without `ha_enabled`, the replica owns every guild and is always the leader.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Iterable
+
+import psycopg
+from loguru import logger
+
+from grug.settings import settings
+
+DM_GUILD_ID = 0
+
+# Seconds between TCP keepalive probes once the connection has been idle for a heartbeat interval
+_KEEPALIVE_INTERVAL_SECONDS = 1
+
+# Advisory lock namespaces for the two-key lock functions, which can't collide with the single bigint guild ID locks
+_SLOT_LOCK_NAMESPACE = 0x47525547  # "GRUG"
+_LEADER_LOCK_NAMESPACE = _SLOT_LOCK_NAMESPACE + 1
+
+OwnershipCallback = Callable[[set[int], set[int]], Awaitable[None]]
+
+
+def _rendezvous_weight(guild_id: int, slot: int) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{guild_id}:{slot}".encode(), digest_size=8).digest())
+
+
+def assign_guilds(guild_ids: Iterable[int], live_slots: Iterable[int]) -> dict[int, int]:
+    """Map each guild to the live replica slot that should own it."""
+    live_slots = list(live_slots)
+    if not live_slots:
+        return {}
+    return {
+        guild_id: max(live_slots, key=lambda slot: _rendezvous_weight(guild_id, slot)) for guild_id in set(guild_ids)
+    }
+
+
+class ReplicaCoordinator:
+    def __init__(
+        self,
+        enabled: bool = settings.ha_enabled,
+        lease_seconds: float = settings.ha_lease_seconds,
+        heartbeat_seconds: float = settings.ha_heartbeat_seconds,
+        max_replicas: int = settings.ha_max_replicas,
+    ):
+        if heartbeat_seconds * 4 > lease_seconds:
+            raise ValueError("The heartbeat interval must be at most a quarter of the lease.")
+
+        self.enabled = enabled
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_replicas = max_replicas
+        # Enough keepalive probes that a dead connection is detected after about a lease, not a few seconds
+        self._keepalive_idle = max(1, int(heartbeat_seconds))
+        self._keepalive_count = max(1, math.ceil((lease_seconds - self._keepalive_idle) / _KEEPALIVE_INTERVAL_SECONDS))
+        # How long after the last traffic Postgres may end the session: when it's idle, or when keepalives go unanswered
+        self.session_timeout = min(
+            lease_seconds, self._keepalive_idle + self._keepalive_count * _KEEPALIVE_INTERVAL_SECONDS
+        )
+        self.name = f"grug-{socket.gethostname()}-{os.getpid()}"
+
+        self.slot: int | None = None
+        self.live_slots: list[int] = []
+        self._guilds: set[int] = set()
+        self._is_leader = False
+        self._valid_until = 0.0
+        self._assignment_key: tuple | None = None
+        self._assignment: set[int] = set()
+
+        self._changed = asyncio.Condition()
+        self._callbacks: list[OwnershipCallback] = []
+        self._callback_tasks: set[asyncio.Task] = set()
+
+    def valid_until(self, heartbeat_started_at: float) -> float:
+        """When locks renewed by a heartbeat that started at `heartbeat_started_at` stop being trusted."""
+        # A heartbeat interval before Postgres could have ended the session, since the last traffic on it
+        return heartbeat_started_at + self.session_timeout - self.heartbeat_seconds
+
+    @property
+    def _valid(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this replica should run singleton work, like the scheduler."""
+        return not self.enabled or (self._is_leader and self._valid)
+
+    @property
+    def owned_guilds(self) -> set[int]:
+        """The guilds this replica currently owns. Always empty without `ha_enabled`, where it owns every guild."""
+        return set(self._guilds) if self._valid else set()
+
+    def owns_guild(self, guild_id: int | None) -> bool:
+        """Whether this replica should handle events for a guild (None for DMs)."""
+        if not self.enabled:
+            return True
+        return (DM_GUILD_ID if guild_id is None else guild_id) in self._guilds and self._valid
+
+    def on_ownership_change(self, callback: OwnershipCallback) -> None:
+        """Register a callback for when guilds are acquired or released, called with `(acquired, released)`."""
+        self._callbacks.append(callback)
+
+    async def wait_for_leadership(self, leader: bool = True) -> None:
+        """Wait until this replica is (or, with `leader=False`, is no longer) the leader."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.is_leader == leader)
+
+    async def _connect(self) -> psycopg.AsyncConnection:
+        lease_ms = int(self.lease_seconds * 1000)
+        return await psycopg.AsyncConnection.connect(
+            settings.postgres_dsn.replace("+psycopg", ""),
+            autocommit=True,
+            application_name=self.name,
+            connect_timeout=max(2, int(self.lease_seconds)),
+            keepalives=1,
+            keepalives_idle=self._keepalive_idle,
+            keepalives_interval=_KEEPALIVE_INTERVAL_SECONDS,
+            keepalives_count=self._keepalive_count,
+            # Postgres ends the session, and releases its locks, if the replica stops heartbeating or disappears
+            options=(
+                f"-c idle_session_timeout={lease_ms} -c statement_timeout={lease_ms // 2} "
+                f"-c tcp_keepalives_idle={self._keepalive_idle} "
+                f"-c tcp_keepalives_interval={_KEEPALIVE_INTERVAL_SECONDS} "
+                f"-c tcp_keepalives_count={self._keepalive_count}"
+            ),
+        )
+
+    async def _try_lock(self, conn: psycopg.AsyncConnection, namespace: int, key: int) -> bool:
+        cursor = await conn.execute("SELECT pg_try_advisory_lock(%s, %s)", (namespace, key))
+        return (await cursor.fetchone())[0]
+
+    def _assigned_guilds(self, guild_ids: set[int]) -> set[int]:
+        # Hashing every guild against every slot is only redone when the guilds or live replicas change
+        key = (frozenset(guild_ids), tuple(self.live_slots), self.slot)
+        if key != self._assignment_key:
+            self._assignment_key = key
+            self._assignment = {
+                guild_id for guild_id, slot in assign_guilds(guild_ids, self.live_slots).items() if slot == self.slot
+            }
+        return self._assignment
+
+    async def _heartbeat(self, conn: psycopg.AsyncConnection, guild_ids: set[int]) -> tuple[set[int], set[int]]:
+        """Renew the leases and rebalance guilds, returning the guilds acquired and released."""
+        if self.slot is None:
+            for slot in range(self.max_replicas):
+                if await self._try_lock(conn, _SLOT_LOCK_NAMESPACE, slot):
+                    self.slot = slot
+                    logger.info(f"Replica {self.name} took slot {slot}")
+                    break
+            else:
+                logger.warning(f"All {self.max_replicas} replica slots are taken, {self.name} is on standby")
+
+        cursor = await conn.execute(
+            "SELECT objid::bigint FROM pg_locks "
+            "WHERE locktype = 'advisory' AND granted AND objsubid = 2 AND classid = %s::bigint::oid "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) ORDER BY 1",
+            (_SLOT_LOCK_NAMESPACE,),
+        )
+        self.live_slots = [row[0] for row in await cursor.fetchall()]
+
+        if not self._is_leader and self.slot is not None:
+            if await self._try_lock(conn, _LEADER_LOCK_NAMESPACE, 0):
+                self._is_leader = True
+                logger.info(f"Replica {self.name} is now the leader")
+
+        assigned = self._assigned_guilds(guild_ids | {DM_GUILD_ID}) if self.slot is not None else set()
+        released = self._guilds - assigned
+        if released:
+            await conn.execute(
+                "SELECT pg_advisory_unlock(guild_id) FROM unnest(%s::bigint[]) AS guild_id", (list(released),)
+            )
+            self._guilds -= released
+
+        # Guilds still held by their previous owner are picked up on a later heartbeat, once it has released them
+        acquired = set()
+        if wanted := assigned - self._guilds:
+            cursor = await conn.execute(
+                "SELECT guild_id FROM unnest(%s::bigint[]) AS guild_id WHERE pg_try_advisory_lock(guild_id)",
+                (list(wanted),),
+            )
+            acquired = {row[0] for row in await cursor.fetchall()}
+            self._guilds |= acquired
+
+        return acquired, released
+
+    def _notify(self, acquired: set[int], released: set[int]) -> None:
+        if acquired or released:
+            logger.info(f"Replica {self.name} acquired {len(acquired)} and released {len(released)} guilds")
+            # Callbacks (e.g. joining voice channels) run in the background, so they can't delay the next heartbeat
+            for callback in self._callbacks:
+                task = asyncio.create_task(callback(acquired, released))
+                self._callback_tasks.add(task)
+                task.add_done_callback(self._callback_tasks.discard)
+
+    async def _set_state(self, valid_until: float) -> None:
+        self._valid_until = valid_until
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _lose_ownership(self) -> None:
+        released = self._guilds
+        self.slot, self.live_slots, self._guilds, self._is_leader = None, [], set(), False
+        await self._set_state(0.0)
+        self._notify(set(), released)
+
+    async def run(self, get_guild_ids: Callable[[], Iterable[int]]) -> None:
+        """Hold and renew this replica's leases until cancelled."""
+        if not self.enabled:
+            return
+
+        while True:
+            try:
+                async with await self._connect() as conn:
+                    while True:
+                        started_at = time.monotonic()
+                        acquired, released = await asyncio.wait_for(
+                            self._heartbeat(conn, set(get_guild_ids())), timeout=self.lease_seconds / 2
+                        )
+                        await self._set_state(self.valid_until(started_at))
+                        self._notify(acquired, released)
+                        await asyncio.sleep(self.heartbeat_seconds)
+            except Exception:
+                logger.exception(f"Replica {self.name} lost its database connection, releasing its guilds")
+                await self._lose_ownership()
+                await asyncio.sleep(self.heartbeat_seconds)
+
+
+replica_coordinator = ReplicaCoordinator()
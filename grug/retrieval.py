@@ -0,0 +1,246 @@
+"""
+Hybrid retrieval over a guild's source material.
+
+A query is run as an approximate nearest neighbour (HNSW) search on the chunk embeddings and as a full-text search,
+concurrently and on separate connections, with both scoped to the guild's partition of `source_chunks` (and
+optionally to specific documents). The two rankings are merged with reciprocal rank fusion, which needs no score
+calibration between the two, and the fused results are trimmed to a token budget so they fit in the agent's context.
+Results are cached per guild and query, and the cache is invalidated whenever the guild's source material changes.
+"""
+
+import asyncio
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import tiktoken
+from sqlalchemy import func, text
+from sqlmodel import col, select
+
+from grug.db import sqa_async_session_factory
+from grug.embedding_service import get_embedding_service
+from grug.models import SourceChunk, SourceDocument
+from grug.settings import settings
+from grug.utils import TTLCache
+
+# The constant from the original RRF paper, which damps the advantage of the very top ranks
+RRF_K = 60
+
+_search_cache = TTLCache(
+    maxsize=settings.source_material_search_cache_size,
+    ttl_seconds=settings.source_material_search_cache_ttl_seconds,
+)
+_guild_generations: defaultdict[int, int] = defaultdict(int)
+
+
+@dataclass(frozen=True)
+class RetrievedChunk:
+    chunk_id: int
+    document_name: str
+    page_number: int
+    content: str
+    score: float
+
+    def __str__(self):
+        return f"[{self.document_name}, page {self.page_number + 1}] {self.content}"
+
+
+def reciprocal_rank_fusion(*rankings: list[int], k: int = RRF_K) -> list[tuple[int, float]]:
+    """Fuse rankings of IDs (best first) into one, scoring each ID by the sum of `1 / (k + rank)` over the rankings."""
+    scores: defaultdict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+@lru_cache
+def _get_encoding() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(settings.ai_openai_model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def trim_to_token_budget(chunks: list[RetrievedChunk], token_budget: int) -> list[RetrievedChunk]:
+    """Keep the best chunks that fit in `token_budget`, truncating the first one if it doesn't fit on its own."""
+    encoding = _get_encoding()
+    trimmed = []
+    remaining = token_budget
+    for chunk in chunks:
+        tokens = encoding.encode(str(chunk))
+        if len(tokens) <= remaining:
+            trimmed.append(chunk)
+            remaining -= len(tokens)
+        elif not trimmed:
+            content_tokens = encoding.encode(chunk.content)
+            overhead = len(tokens) - len(content_tokens)
+            trimmed.append(replace(chunk, content=encoding.decode(content_tokens[: max(remaining - overhead, 0)])))
+            break
+    return trimmed
+
+
+def _scoped(statement, guild_id: int, document_ids: list[uuid.UUID] | None):
+    # Filtering on the partition key prunes the search down to the guild's own partition and HNSW graph
+    statement = statement.where(SourceChunk.guild_id == guild_id)
+    if document_ids is not None:
+        statement = statement.where(col(SourceChunk.document_id).in_(document_ids))
+    return statement
+
+
+async def vector_search(
+    guild_id: int,
+    query_embedding: list[float],
+    document_ids: list[uuid.UUID] | None = None,
+    limit: int = 40,
+) -> list[int]:
+    """Get the IDs of the chunks nearest to `query_embedding`, nearest first."""
+    async with sqa_async_session_factory() as session, session.begin():
+        await session.execute(
+            text(f"SET LOCAL hnsw.ef_search = {max(settings.source_material_search_ef_search, limit)}")
+        )
+        if document_ids is not None:
+            # Keep scanning the graph until enough rows pass the document filter
+            await session.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+        statement = _scoped(select(SourceChunk.id), guild_id, document_ids)
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await session.execute(
+                    statement.order_by(col(SourceChunk.embedding).cosine_distance(query_embedding)).limit(limit)
+                )
+            ).scalars()
+        )
+
+
+async def full_text_search(
+    guild_id: int,
+    query: str,
+    document_ids: list[uuid.UUID] | None = None,
+    limit: int = 40,
+) -> list[int]:
+    """Get the IDs of the chunks that best match `query` as a web-search style full-text query, best first."""
+    ts_query = func.websearch_to_tsquery("english", query)
+    statement = _scoped(select(SourceChunk.id), guild_id, document_ids)
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await session.execute(
+                    statement.where(col(SourceChunk.content_search).op("@@")(ts_query))
+                    .order_by(func.ts_rank_cd(SourceChunk.content_search, ts_query).desc())
+                    .limit(limit)
+                )
+            ).scalars()
+        )
+
+
+async def hybrid_search(
+    guild_id: int,
+    query: str,
+    query_embedding: list[float] | asyncio.Future[list[float]],
+    document_ids: list[uuid.UUID] | None = None,
+    candidates: int = 40,
+) -> list[RetrievedChunk]:
+    """
+    Run the vector and full-text searches concurrently and fuse their results, best first.
+
+    `query_embedding` can be an awaitable, so the full-text search starts while the query is still being embedded.
+    """
+
+    async def _vector_search() -> list[int]:
+        embedding = query_embedding if isinstance(query_embedding, list) else await query_embedding
+        return await vector_search(guild_id, embedding, document_ids, limit=candidates)
+
+    vector_ids, full_text_ids = await asyncio.gather(
+        _vector_search(),
+        full_text_search(guild_id, query, document_ids, limit=candidates),
+    )
+    fused = reciprocal_rank_fusion(vector_ids, full_text_ids)
+    if not fused:
+        return []
+
+    async with sqa_async_session_factory() as session:
+        rows = (
+            await session.execute(
+                select(SourceChunk.id, SourceDocument.name, SourceChunk.page_number, SourceChunk.content)
+                .join(SourceDocument, col(SourceDocument.id) == col(SourceChunk.document_id))
+                .where(SourceChunk.guild_id == guild_id)
+                .where(col(SourceChunk.id).in_([chunk_id for chunk_id, _ in fused]))
+            )
+        ).all()
+
+    chunks_by_id = {row[0]: row for row in rows}
+    return [
+        RetrievedChunk(
+            chunk_id=chunk_id,
+            document_name=chunks_by_id[chunk_id][1],
+            page_number=chunks_by_id[chunk_id][2],
+            content=chunks_by_id[chunk_id][3],
+            score=score,
+        )
+        for chunk_id, score in fused
+        if chunk_id in chunks_by_id
+    ]
+
+
+async def _get_document_ids(guild_id: int, names: list[str]) -> list[uuid.UUID]:
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await session.execute(
+                    select(SourceDocument.id)
+                    .where(SourceDocument.guild_id == guild_id)
+                    .where(func.lower(SourceDocument.name).in_([name.lower() for name in names]))
+                )
+            ).scalars()
+        )
+
+
+def invalidate_search_cache(guild_id: int) -> None:
+    """Invalidate the cached search results for a guild, e.g. after its source material changed."""
+    _guild_generations[guild_id] += 1
+
+
+async def search_source_material(
+    guild_id: int,
+    query: str,
+    document_names: list[str] | None = None,
+    token_budget: int | None = None,
+) -> list[RetrievedChunk]:
+    """
+    Search a guild's source material, returning the best matching chunks that fit in the token budget.
+
+    Args:
+        guild_id: The guild whose source material to search.
+        query: The search query.
+        document_names: Only search these documents (case-insensitive), if given.
+        token_budget: Defaults to `source_material_search_token_budget`.
+    """
+    token_budget = token_budget or settings.source_material_search_token_budget
+    cache_key = (
+        guild_id,
+        _guild_generations[guild_id],
+        " ".join(query.lower().split()),
+        tuple(sorted(name.lower() for name in document_names)) if document_names else None,
+        token_budget,
+    )
+    if (cached := _search_cache.get(cache_key)) is not None:
+        return cached
+
+    document_ids = await _get_document_ids(guild_id, document_names) if document_names else None
+    if document_ids == []:
+        return []
+
+    chunks = await hybrid_search(
+        guild_id,
+        query,
+        asyncio.ensure_future(get_embedding_service().aembed_query(query)),
+        document_ids,
+        candidates=settings.source_material_search_candidates,
+    )
+    results = trim_to_token_budget(chunks, token_budget)
+    _search_cache.set(cache_key, results)
+    return results
@@ -1,13 +1,25 @@
 """Scheduler for the Grug bot."""
 
-from apscheduler import AsyncScheduler
+from datetime import datetime
+from typing import Iterable
+
+from apscheduler import AsyncScheduler, ConflictPolicy
 from apscheduler.datastores.sqlalchemy import SQLAlchemyDataStore
 from apscheduler.eventbrokers.asyncpg import AsyncpgEventBroker
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from loguru import logger
 from pydantic import PostgresDsn
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from grug.chat_archive import embed_archived_messages
+from grug.embedding_service import prune_embedding_cache
+from grug.reminders import deliver_due_reminders, reminder_due_time
+from grug.replicas import replica_coordinator
+from grug.session_summaries import summarize_voice_sessions
 from grug.settings import settings
+from grug.transcripts import maintain_transcript_partitions
 
 # TODO: deprecated! as soon as ApScheduler releases past 4.0.0a5 we can switch to psycopg for the event broker.
 scheduler = AsyncScheduler(
@@ -41,4 +53,63 @@ async def start_scheduler(discord_bot_startup_timeout: int = 15):
 
     # start the scheduler
     async with scheduler:
-        await scheduler.run_until_stopped()
+        await scheduler.add_schedule(
+            maintain_transcript_partitions,
+            IntervalTrigger(hours=12),
+            id="maintain_transcript_partitions",
+            conflict_policy=ConflictPolicy.replace,
+        )
+        await scheduler.add_schedule(
+            prune_embedding_cache,
+            IntervalTrigger(hours=12),
+            id="prune_embedding_cache",
+            conflict_policy=ConflictPolicy.replace,
+        )
+        await scheduler.add_schedule(
+            embed_archived_messages,
+            IntervalTrigger(minutes=5),
+            id="embed_archived_messages",
+            conflict_policy=ConflictPolicy.replace,
+        )
+        await scheduler.add_schedule(
+            summarize_voice_sessions,
+            IntervalTrigger(minutes=settings.session_summary_interval_minutes),
+            id="summarize_voice_sessions",
+            max_running_jobs=1,
+            conflict_policy=ConflictPolicy.replace,
+        )
+        await scheduler.add_schedule(
+            deliver_due_reminders,
+            IntervalTrigger(seconds=settings.reminders_sweep_interval_seconds),
+            id="deliver_due_reminders",
+            max_running_jobs=1,
+            conflict_policy=ConflictPolicy.replace,
+        )
+
+        # Every replica can add schedules, but only the leader runs them
+        while True:
+            await replica_coordinator.wait_for_leadership()
+            logger.info("Starting the scheduler")
+            await scheduler.start_in_background()
+
+            await replica_coordinator.wait_for_leadership(False)
+            logger.info("No longer the leader, stopping the scheduler")
+            await scheduler.stop()
+            await scheduler.wait_until_stopped()
+
+
+async def schedule_reminder_delivery(due_times: Iterable[datetime]) -> int:
+    """
+    Schedule the delivery of reminders, with one job per distinct due time. Reminders due at the same moment share a
+    job, and scheduling a time that already has a job is a no-op. Returns the number of distinct due times.
+    """
+    distinct_due_times = sorted({reminder_due_time(due_time) for due_time in due_times})
+    for due_time in distinct_due_times:
+        await scheduler.add_schedule(
+            deliver_due_reminders,
+            DateTrigger(due_time),
+            id=f"deliver_reminders_{due_time:%Y%m%dT%H%M%S}",
+            misfire_grace_time=None,
+            conflict_policy=ConflictPolicy.do_nothing,
+        )
+    return len(distinct_due_times)
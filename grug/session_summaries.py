@@ -0,0 +1,339 @@
+"""
+Map-reduce summaries of voice session transcripts, cached so only the new parts of a session are summarized.
+
+A long session's transcript is far larger than an LLM's context, and summarizing it piece by piece in order would take
+minutes. Instead:
+
+1. map: the transcript is split into chunks aligned to `session_summary_chunk_minutes` windows from the start of the
+   session (split further if a window has more than `session_summary_chunk_max_tokens` of text), and the chunks are
+   summarized concurrently.
+2. reduce: every `session_summary_fan_in` consecutive summaries are merged into one, level by level, until a single
+   summary of the whole session is left. The merges on each level run concurrently too.
+
+At most `session_summary_concurrency` summaries are requested at once, across sessions, and each request goes through
+the agent's admission control as background work, unless it runs inside an agent request that was already admitted.
+
+Every summary is stored in `voice_session_summaries` with a fingerprint of the text it summarized, and is only redone
+when that text changed. A transcript only grows at the end, so summarizing a session again, e.g. when it ends or when
+someone asks for a summary so far, only summarizes the newest chunks, and redoes the merges along the right edge of the
+tree, one per level.
+
+`summarize_voice_sessions` runs as a scheduled job: it summarizes the finished chunks of ongoing sessions as they go,
+and completes the summaries of sessions that ended.
+"""
+
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterable
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from loguru import logger
+from sqlalchemy import and_, or_
+from sqlmodel import col, select
+
+from grug.admission import AdmissionRejected, RequestClass, admission_controller
+from grug.ai_chat_model import ResilientChatModel, get_chat_model
+from grug.db import sqa_async_session_factory
+from grug.models import VoiceSession, VoiceSessionSummary, VoiceTranscriptSegment
+from grug.settings import settings
+from grug.transcripts import search_transcript
+
+_CHARS_PER_TOKEN = 4
+_TRANSCRIPT_PAGE_SIZE = 1000
+
+CHUNK_PROMPT = (
+    "You are taking notes for a tabletop RPG group. Summarize this part of the transcript of their voice chat as "
+    "concise bullet points: what happened in the game, the decisions the players made, the characters and places "
+    "that came up, loot, and open questions or plans. Say who said or did what, and skip small talk. The transcript "
+    "was transcribed automatically, so it may have errors."
+)
+MERGE_PROMPT = (
+    "You are taking notes for a tabletop RPG group. Combine these summaries of consecutive parts of their voice chat "
+    "into one summary, as concise bullet points in chronological order. Keep the important events, decisions, "
+    "characters, loot and open questions, and drop anything repeated."
+)
+
+# Shared by every session being summarized, so the job and requests for summaries together stay within the budget
+_concurrency = asyncio.Semaphore(settings.session_summary_concurrency)
+
+
+@dataclass
+class SummaryNode:
+    """A chunk of a transcript, or a group of consecutive summaries, to summarize."""
+
+    level: int
+    position: int
+    started_at: datetime
+    ended_at: datetime
+    text: str
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+
+@dataclass
+class SessionSummary:
+    voice_session: VoiceSession
+    summary: str | None
+    until: datetime | None
+    chunks: int
+    summarized: int
+    is_final: bool
+
+
+def chunk_transcript(
+    segments: Iterable[VoiceTranscriptSegment],
+    started_at: datetime,
+    window: timedelta,
+    max_chars: int,
+) -> list[SummaryNode]:
+    """Split a transcript into chunks aligned to windows from the start of the session, of at most `max_chars`."""
+    chunks: list[SummaryNode] = []
+    lines: list[tuple[datetime, str]] = []
+    length, chunk_window = 0, None
+
+    def close_chunk():
+        chunks.append(
+            SummaryNode(
+                level=0,
+                position=len(chunks),
+                started_at=lines[0][0],
+                ended_at=lines[-1][0],
+                text="\n".join(line for _, line in lines),
+            )
+        )
+
+    for segment in segments:
+        segment_window = (segment.spoken_at - started_at) // window
+        line = f"[{segment.spoken_at:%H:%M:%S}] {segment.speaker_name or segment.speaker_id}: {segment.text}"
+        if lines and (segment_window != chunk_window or length + len(line) > max_chars):
+            close_chunk()
+            lines, length = [], 0
+        lines.append((segment.spoken_at, line))
+        length += len(line) + 1
+        chunk_window = segment_window
+
+    if lines:
+        close_chunk()
+    return chunks
+
+
+def _merge_nodes(summaries: list[tuple[SummaryNode, str]], fan_in: int) -> list[SummaryNode]:
+    """Group consecutive summaries into the nodes of the level above."""
+    level = summaries[0][0].level + 1
+    groups = [summaries[i : i + fan_in] for i in range(0, len(summaries), fan_in)]  # noqa: E203
+    return [
+        SummaryNode(
+            level=level,
+            position=position,
+            started_at=group[0][0].started_at,
+            ended_at=group[-1][0].ended_at,
+            text="\n\n".join(
+                f"[{node.started_at:%H:%M} - {node.ended_at:%H:%M}]\n{summary}" for node, summary in group
+            ),
+        )
+        for position, group in enumerate(groups)
+    ]
+
+
+async def summarize_tree(
+    chunks: list[SummaryNode],
+    cached: dict[tuple[int, int], tuple[str, str]],
+    complete: Callable[[str, str], Awaitable[str]],
+    fan_in: int,
+    save: Callable[[SummaryNode, str], Awaitable[None]] | None = None,
+    merge: bool = True,
+) -> tuple[list[tuple[SummaryNode, str]], int]:
+    """
+    Summarize the chunks, then merge their summaries level by level into one, reusing the cached summaries.
+
+    Args:
+        chunks: The chunks of the transcript, in order.
+        cached: The fingerprint and summary of previously summarized nodes, by their level and position.
+        complete: Summarizes text, given the prompt and the text.
+        fan_in: The number of summaries merged into each summary of the level above.
+        save: Called with each new summary, as soon as it is done.
+        merge: Whether to merge the summaries, or only summarize the chunks.
+
+    Returns:
+        The nodes and summaries of the top level (a single one, unless `merge` is False), and how many summaries were
+        requested rather than reused.
+    """
+    summarized = 0
+
+    async def summarize(node: SummaryNode) -> tuple[SummaryNode, str]:
+        nonlocal summarized
+        fingerprint, summary = cached.get((node.level, node.position), (None, None))
+        if fingerprint != node.fingerprint:
+            summary = await complete(CHUNK_PROMPT if node.level == 0 else MERGE_PROMPT, node.text)
+            summarized += 1
+            if save is not None:
+                await save(node, summary)
+        return node, summary
+
+    summaries = list(await asyncio.gather(*(summarize(chunk) for chunk in chunks)))
+    while merge and len(summaries) > 1:
+        summaries = list(await asyncio.gather(*(summarize(node) for node in _merge_nodes(summaries, fan_in))))
+    return summaries, summarized
+
+
+@lru_cache
+def _get_model() -> ResilientChatModel:
+    return get_chat_model()
+
+
+async def _complete(prompt: str, text: str, guild_id: int, request_class: RequestClass | None) -> str:
+    messages = [SystemMessage(prompt), HumanMessage(text)]
+    async with _concurrency:
+        if request_class is None:
+            response = await _get_model().ainvoke(messages)
+        else:
+            async with admission_controller.admit(request_class, guild_id) as admission:
+                response = await _get_model().ainvoke(messages)
+                admission.record_usage([*messages, response])
+    return response.content
+
+
+async def _get_transcript(voice_session: VoiceSession) -> list[VoiceTranscriptSegment]:
+    segments: list[VoiceTranscriptSegment] = []
+    while page := await search_transcript(
+        voice_session,
+        after=(segments[-1].spoken_at, segments[-1].id) if segments else None,
+        limit=_TRANSCRIPT_PAGE_SIZE,
+    ):
+        segments += page
+        if len(page) < _TRANSCRIPT_PAGE_SIZE:
+            break
+    return segments
+
+
+async def _get_cached_summaries(session_id) -> dict[tuple[int, int], VoiceSessionSummary]:
+    async with sqa_async_session_factory() as db_session:
+        # noinspection PyTypeChecker
+        rows = (
+            await db_session.execute(select(VoiceSessionSummary).where(VoiceSessionSummary.session_id == session_id))
+        ).scalars()
+        return {(row.level, row.position): row for row in rows}
+
+
+async def _save_summary(voice_session: VoiceSession, node: SummaryNode, summary: str, is_final: bool = False) -> None:
+    async with sqa_async_session_factory() as db_session:
+        await db_session.merge(
+            VoiceSessionSummary(
+                session_id=voice_session.id,
+                level=node.level,
+                position=node.position,
+                started_at=node.started_at,
+                ended_at=node.ended_at,
+                fingerprint=node.fingerprint,
+                summary=summary,
+                is_final=is_final,
+                created_at=datetime.now(tz=UTC),
+            )
+        )
+        await db_session.commit()
+
+
+async def get_session_summary(
+    voice_session: VoiceSession,
+    finished_chunks_only: bool = False,
+    request_class: RequestClass | None = RequestClass.BACKGROUND,
+) -> SessionSummary:
+    """
+    Summarize a voice session, or the session so far if it is ongoing, summarizing only what changed since last time.
+
+    Args:
+        voice_session: The session to summarize.
+        finished_chunks_only: Only summarize the chunks whose window has passed, without merging them, to keep up with
+            an ongoing session.
+        request_class: The admission class of the summary requests, or None if this runs in an admitted request.
+    """
+    window = timedelta(minutes=settings.session_summary_chunk_minutes)
+    segments = await _get_transcript(voice_session)
+    if finished_chunks_only:
+        current_window = (datetime.now(tz=UTC) - voice_session.started_at) // window
+        segments = [s for s in segments if (s.spoken_at - voice_session.started_at) // window < current_window]
+
+    chunks = chunk_transcript(
+        segments,
+        voice_session.started_at,
+        window,
+        max_chars=settings.session_summary_chunk_max_tokens * _CHARS_PER_TOKEN,
+    )
+    if not chunks:
+        return SessionSummary(voice_session, None, None, chunks=0, summarized=0, is_final=False)
+
+    rows = await _get_cached_summaries(voice_session.id)
+    summaries, summarized = await summarize_tree(
+        chunks,
+        cached={key: (row.fingerprint, row.summary) for key, row in rows.items()},
+        complete=lambda prompt, text: _complete(prompt, text, voice_session.guild_id, request_class),
+        fan_in=settings.session_summary_fan_in,
+        save=lambda node, summary: _save_summary(voice_session, node, summary),
+        merge=not finished_chunks_only,
+    )
+    if summarized:
+        logger.info(f"Summarized {summarized} parts of {voice_session} ({len(chunks)} chunks)")
+
+    top, summary = summaries[-1]
+    # Mark the summary of an ended session as final, so the scheduled job leaves it be
+    is_final = voice_session.ended_at is not None and not finished_chunks_only
+    top_row = rows.get((top.level, top.position))
+    if is_final and (top_row is None or not top_row.is_final or top_row.fingerprint != top.fingerprint):
+        await _save_summary(voice_session, top, summary, is_final=True)
+
+    return SessionSummary(
+        voice_session,
+        summary=summary if not finished_chunks_only else None,
+        until=top.ended_at,
+        chunks=len(chunks),
+        summarized=summarized,
+        is_final=is_final,
+    )
+
+
+async def summarize_voice_sessions() -> int:
+    """
+    Summarize the finished chunks of ongoing voice sessions, and complete the summaries of the sessions that ended in
+    the last `session_summary_lookback_hours`. Returns the number of summaries requested.
+    """
+    since = datetime.now(tz=UTC) - timedelta(hours=settings.session_summary_lookback_hours)
+    async with sqa_async_session_factory() as db_session:
+        # noinspection PyTypeChecker
+        voice_sessions = list(
+            (
+                await db_session.execute(
+                    select(VoiceSession)
+                    .where(
+                        or_(
+                            and_(col(VoiceSession.ended_at).is_(None), VoiceSession.started_at >= since),
+                            VoiceSession.ended_at >= since,
+                        )
+                    )
+                    .where(
+                        col(VoiceSession.id).not_in(
+                            select(VoiceSessionSummary.session_id).where(col(VoiceSessionSummary.is_final))
+                        )
+                    )
+                )
+            ).scalars()
+        )
+
+    summarized = 0
+    for voice_session in voice_sessions:
+        try:
+            result = await get_session_summary(voice_session, finished_chunks_only=voice_session.ended_at is None)
+        except AdmissionRejected:
+            # The summaries done so far are saved, the rest are picked up on the next run
+            logger.info("The agent is overloaded, postponing voice session summaries")
+            break
+        except Exception:
+            logger.exception(f"Failed to summarize {voice_session}")
+            continue
+        summarized += result.summarized
+
+    return summarized
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Literal
 
 from pydantic import Field, PostgresDsn, SecretStr, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -20,16 +21,87 @@ class Settings(BaseSettings):
 
     # Discord Settings
     discord_enable_voice_client: bool = True
+    discord_dispatch_workers: int = Field(
+        default=4, ge=1, description="The number of messages that can be posted to Discord at the same time."
+    )
+    discord_dispatch_global_rate: int = Field(
+        default=45, ge=1, description="The most messages posted per second, across all channels."
+    )
+    discord_dispatch_channel_rate: int = Field(
+        default=5,
+        ge=1,
+        description="The most messages posted to a channel per `discord_dispatch_channel_period_seconds`.",
+    )
+    discord_dispatch_channel_period_seconds: float = Field(default=5.0, gt=0)
 
     # AI Base Agent Settings
     ai_name: str = "Grug"
     ai_openai_model: str = "gpt-4o-mini"
+    ai_openai_embedding_model: str = "text-embedding-3-small"
+    ai_openai_request_timeout_seconds: float = Field(default=60.0, gt=0)
+    ai_openai_fallback_model: str | None = Field(
+        default=None, description="A model to fail over to when `ai_openai_model` is failing, see `grug.ai_chat_model`."
+    )
+    ai_openai_fallback_base_url: str | None = Field(
+        default=None,
+        description=(
+            "An OpenAI-compatible endpoint to fail over to, with `ai_openai_fallback_model` (or `ai_openai_model`)."
+        ),
+    )
+    ai_hedge_percentile: float = Field(
+        default=95.0,
+        gt=0,
+        le=100,
+        description="Requests slower than this percentile of recent requests are hedged with a duplicate request.",
+    )
+    ai_hedge_min_delay_seconds: float = Field(default=1.0, ge=0)
+    ai_hedge_initial_delay_seconds: float = Field(
+        default=10.0, gt=0, description="The hedge delay until enough requests have been seen to adapt it."
+    )
+    ai_hedge_max_rate: float = Field(
+        default=0.1, ge=0, le=1, description="The largest share of recent requests that can be hedged. 0 disables."
+    )
+    ai_circuit_failure_threshold: int = Field(
+        default=5, ge=1, description="Consecutive failures after which a model is skipped for a while."
+    )
+    ai_circuit_reset_seconds: float = Field(
+        default=30.0, gt=0, description="How long a failing model is skipped before it is tried again."
+    )
     ai_instructions: str = "\n".join(
         [
             "- You should ALWAYS talk as though you are a barbarian orc with low intelligence but high charisma.",
         ]
     )
 
+    # Embedding Settings
+    ai_embedding_backend: Literal["openai", "local"] = Field(
+        default="openai",
+        description="The embedding backend. `local` is a deterministic offline stand-in for tests and benchmarks.",
+    )
+    ai_embedding_batch_window_ms: float = Field(
+        default=10.0,
+        ge=0,
+        description="How long texts to embed wait for other concurrent requests, to be sent in the same batch.",
+    )
+    ai_embedding_max_batch_size: int = Field(
+        default=256, ge=1, le=2048, description="The most texts sent to the embedding backend in one request."
+    )
+    ai_embedding_concurrency: int = Field(
+        default=4, ge=1, description="The most requests to the embedding backend in flight at once."
+    )
+    ai_embedding_cache_size: int = Field(
+        default=4096, ge=0, description="The number of embeddings kept in memory, least recently used first out."
+    )
+    ai_embedding_persistent_cache: bool = Field(
+        default=True,
+        description="Also cache the embeddings of the `openai` backend in Postgres, by a hash of the model and text.",
+    )
+    ai_embedding_cache_retention_days: int | None = Field(
+        default=30,
+        ge=1,
+        description="How long embeddings are kept in the Postgres cache. If None, they are kept forever.",
+    )
+
     # AI Image Settings
     ai_image_generation_enabled: bool = True
     ai_image_daily_generation_limit: int | None = Field(
@@ -38,6 +110,62 @@ class Settings(BaseSettings):
     ai_image_default_size: str = "1024x1024"
     ai_image_default_quality: str = "standard"
     ai_image_default_model: str = "dall-e-3"
+    ai_image_store_dir: Path = Field(
+        default=_ROOT_DIR / "data" / "images",
+        description="Where generated images are stored, since the URLs returned by OpenAI expire.",
+    )
+    ai_image_store_max_mb: int = Field(
+        default=1024, ge=1, description="The least recently used images are evicted once the store exceeds this size."
+    )
+    ai_image_reuse_window_days: int | None = Field(
+        default=30,
+        ge=1,
+        description=(
+            "How old an image can be and still be reused for the same prompt. If None, images are never reused."
+        ),
+    )
+    ai_image_reuse_min_similarity: float = Field(
+        default=95.0,
+        ge=0,
+        le=100,
+        description="How similar (0-100) a normalized prompt has to be to a previous one for its image to be reused.",
+    )
+
+    # STT Settings
+    stt_backend: Literal["whisper", "local"] = Field(
+        default="whisper",
+        description="The speech-to-text backend. `local` is a deterministic offline stand-in for tests and benchmarks.",
+    )
+    stt_max_concurrent_requests: int = Field(
+        default=4, ge=1, description="The maximum number of STT requests in flight at once, across all speakers."
+    )
+    stt_coalesce_max_seconds: float = Field(
+        default=15.0,
+        gt=0,
+        description="Adjacent queued phrases from one speaker are merged into one STT request up to this duration.",
+    )
+    stt_max_retries: int = Field(default=3, ge=0, description="The number of times to retry a failed STT request.")
+    stt_request_timeout_seconds: float = Field(default=30.0, gt=0)
+    stt_ignored_transcripts: list[str] = Field(
+        default=["you"],
+        description="Transcripts to discard. Whisper tends to hallucinate these on near-silent audio.",
+    )
+    stt_wake_word_enabled: bool = Field(
+        default=False,
+        description=(
+            "Only transcribe speech that starts with the wake phrase, as detected by a local keyword spotter. "
+            "Requires a few 16-bit WAV recordings of the wake phrase in `stt_wake_word_samples_dir`."
+        ),
+    )
+    stt_wake_word_samples_dir: Path = _ROOT_DIR / "assets" / "wake_words"
+    stt_wake_word_threshold: float | None = Field(
+        default=None, description="Wake word match threshold. If None, it is calibrated from the enrolled samples."
+    )
+    stt_wake_word_followup_seconds: float = Field(
+        default=3.0,
+        gt=0,
+        description="How long after a wake word hit the speaker's follow-up phrases keep being transcribed.",
+    )
 
     # Database Settings
     postgres_user: str = "postgres"
@@ -46,6 +174,232 @@ class Settings(BaseSettings):
     postgres_port: int = 5432
     postgres_db: str = "postgres"
 
+    # High Availability Settings
+    ha_enabled: bool = Field(
+        default=False,
+        description=(
+            "Run as one of several replicas sharing the database. Guilds are spread across the replicas, and one of "
+            "them runs the scheduler, see `grug.replicas`."
+        ),
+    )
+    ha_lease_seconds: float = Field(
+        default=10.0, gt=0, description="How long a replica's guilds stay locked after it stops responding."
+    )
+    ha_heartbeat_seconds: float = Field(
+        default=2.0, gt=0, description="How often replicas renew their leases and rebalance guilds."
+    )
+    ha_max_replicas: int = Field(default=16, ge=1)
+
+    # Voice Worker Settings
+    voice_workers_enabled: bool = Field(
+        default=False,
+        description=(
+            "Recognize speech in separate `grug-voice-worker` processes, which claim the voice sessions the bot "
+            "starts, rather than in the bot. See `grug.voice_worker`."
+        ),
+    )
+    voice_worker_queue: str = Field(
+        default="voice_sessions", description="The PGMQ queue voice sessions are queued on for voice workers to claim."
+    )
+    voice_worker_max_sessions: int = Field(
+        default=4, ge=1, description="The most voice sessions a voice worker handles at once."
+    )
+    voice_worker_lease_seconds: int = Field(
+        default=30,
+        ge=5,
+        description="How long a voice worker's claim on a session lasts unrenewed, before another worker resumes it.",
+    )
+    voice_worker_poll_seconds: float = Field(
+        default=2.0, gt=0, description="How often voice workers renew their claims and look for new sessions."
+    )
+
+    # Voice Transcript Settings
+    voice_transcript_retention_days: int | None = Field(
+        default=90,
+        ge=1,
+        description=(
+            "How long to keep voice session transcripts. Transcripts are stored in monthly partitions, which are "
+            "dropped once all of their rows are past the retention period. If None, transcripts are kept forever."
+        ),
+    )
+
+    # Session Summary Settings
+    session_summary_chunk_minutes: float = Field(
+        default=10, gt=0, description="The length of the time-aligned transcript chunks that are summarized first."
+    )
+    session_summary_chunk_max_tokens: int = Field(
+        default=6000, ge=100, description="The most transcript tokens summarized at once, longer chunks are split."
+    )
+    session_summary_fan_in: int = Field(
+        default=6, ge=2, description="The number of summaries merged into each summary on the level above."
+    )
+    session_summary_concurrency: int = Field(
+        default=4, ge=1, description="The most summaries requested from the LLM at once."
+    )
+    session_summary_interval_minutes: int = Field(
+        default=10, ge=1, description="How often ongoing and recently ended voice sessions are summarized."
+    )
+    session_summary_lookback_hours: int = Field(
+        default=24, ge=1, description="How long after a voice session ends it is still summarized by the job."
+    )
+
+    # Chat Archive Settings
+    chat_archive_enabled: bool = Field(
+        default=False,
+        description=(
+            "Archive server text messages so the agent can search a channel's chat history. DMs are never archived. "
+            "Needs the privileged `message_content` intent, which must be enabled in the Discord developer portal."
+        ),
+    )
+    chat_archive_embeddings_enabled: bool = Field(
+        default=False,
+        description=(
+            "Embed archived messages with `ai_openai_embedding_model` so chat history can be searched by meaning."
+        ),
+    )
+    chat_archive_default_search_days: int = Field(
+        default=30, ge=1, description="How far back chat history searches go when no time range is given."
+    )
+
+    # Source Material Settings
+    source_material_max_upload_mb: int = Field(default=100, ge=1, description="The largest PDF that can be uploaded.")
+    source_material_chunk_size: int = Field(
+        default=1500, ge=100, description="The target length, in characters, of the chunks that pages are split into."
+    )
+    source_material_chunk_overlap: int = Field(
+        default=200, ge=0, description="How many characters adjacent chunks share, so ideas aren't cut in half."
+    )
+    source_material_ingest_workers: int = Field(
+        default=2, ge=1, description="The number of processes used to parse and chunk PDFs."
+    )
+    source_material_pages_per_task: int = Field(
+        default=8, ge=1, description="The number of pages each parsing process handles at a time."
+    )
+    source_material_embedding_batch_size: int = Field(
+        default=256, ge=1, description="The number of chunks embedded and stored per batch."
+    )
+    source_material_search_candidates: int = Field(
+        default=40, ge=1, description="The number of candidates each of the vector and full-text searches return."
+    )
+    source_material_search_ef_search: int = Field(
+        default=80, ge=1, description="The HNSW `ef_search` for vector searches. Higher is slower but more accurate."
+    )
+    source_material_search_token_budget: int = Field(
+        default=2000, ge=1, description="The maximum number of tokens of source material returned by a search."
+    )
+    source_material_search_cache_size: int = Field(default=256, ge=0)
+    source_material_search_cache_ttl_seconds: float = Field(default=600, gt=0)
+
+    # Compendium Settings
+    compendium_dir: Path = Field(
+        default=_ROOT_DIR / "assets" / "compendium",
+        description="Where dumps of compendium entries (spells, feats, conditions, ...) are read from.",
+    )
+    compendium_index_path: Path = Field(
+        default=_ROOT_DIR / "data" / "compendium.idx", description="Where the compendium index is built."
+    )
+    compendium_lookup_limit: int = Field(default=3, ge=1, description="The most entries returned for each name.")
+    compendium_min_score: float = Field(
+        default=70, ge=0, le=100, description="How closely, from 0 to 100, a name must match an entry's to return it."
+    )
+    compendium_candidates: int = Field(
+        default=200, ge=1, description="The most entries, found by prefix and trigrams, that each lookup scores."
+    )
+
+    # Reminder Settings
+    reminders_max_per_request: int = Field(
+        default=100, ge=1, description="The most reminders the agent can set from a single request."
+    )
+    reminders_delivery_batch_size: int = Field(
+        default=500, ge=1, description="The number of due reminders claimed and posted at a time."
+    )
+    reminders_sweep_interval_seconds: int = Field(
+        default=60, ge=1, description="How often to check for due reminders that weren't delivered on time."
+    )
+
+    # Long-Term Memory Settings
+    memory_max_facts_per_request: int = Field(
+        default=20, ge=1, description="The most facts the agent can save to long-term memory at once."
+    )
+    memory_recall_limit: int = Field(
+        default=5, ge=1, description="The number of memories recalled for each query, by default."
+    )
+    memory_cache_users: int = Field(
+        default=1000, ge=0, description="The number of users whose recalled memories are cached in process."
+    )
+    memory_cache_queries_per_user: int = Field(default=32, ge=1)
+    memory_cache_ttl_seconds: float = Field(default=900, gt=0)
+
+    # Admission Control Settings
+    admission_max_concurrency: int = Field(default=8, ge=1, description="The most agent requests run at once.")
+    admission_tokens_per_minute: int | None = Field(
+        default=None,
+        ge=1,
+        description="The LLM token budget per minute across agent requests, e.g. the OpenAI rate limit. None for none.",
+    )
+    admission_initial_tokens_estimate: int = Field(
+        default=4000, ge=1, description="The tokens an agent request is expected to use, until actual usage is known."
+    )
+    admission_max_queued: int = Field(
+        default=200, ge=0, description="The most agent requests waiting to be admitted, beyond which they are shed."
+    )
+    admission_voice_max_wait_seconds: float = Field(
+        default=10, gt=0, description="How long a voice chat reply can wait to be admitted before it is shed."
+    )
+    admission_mention_max_wait_seconds: float = Field(
+        default=60, gt=0, description="How long a reply to a mention or DM can wait to be admitted before it is shed."
+    )
+    admission_background_max_wait_seconds: float = Field(
+        default=600, gt=0, description="How long background work can wait to be admitted before it is shed."
+    )
+    admission_guild_weights: dict[int, float] = Field(
+        default_factory=dict,
+        description="Guilds' shares of the agent's capacity, relative to a default of 1, e.g. `{\"1234\": 2}`.",
+    )
+    admission_overloaded_message: str = Field(
+        default="I'm getting a lot of requests right now, please try again in a minute!",
+        description="The reply sent when a request is shed because the agent is overloaded.",
+    )
+
+    # Tool Selection Settings
+    ai_tool_selection_enabled: bool = Field(
+        default=True, description="Send only the tools relevant to each request, see `grug.tool_selection`."
+    )
+    ai_tool_selection_max_tools: int = Field(default=6, ge=1, description="The most tools offered for a request.")
+    ai_tool_selection_voice_max_tools: int = Field(
+        default=3, ge=1, description="The most tools offered for a voice chat reply."
+    )
+    ai_tool_selection_min_score: float = Field(
+        default=2.0, ge=0, description="The keyword relevance score a tool needs to be offered for a request."
+    )
+    ai_tool_selection_always_include: list[str] = Field(
+        default=["compendium_lookup", "information_search"],
+        description="The names of tools offered for every request, by default the rules lookups.",
+    )
+    ai_tool_selection_fallback_tools: list[str] = Field(
+        default=["compendium_lookup", "information_search", "recall_facts", "search_chat_history"],
+        description="The names of tools offered when no tool matches a request well.",
+    )
+    ai_tool_selection_history_messages: int = Field(
+        default=10, ge=0, description="Tools called in this many of the latest messages stay offered."
+    )
+
+    # Tracing Settings
+    tracing_enabled: bool = Field(default=False, description="Trace requests end to end as spans, see `grug.tracing`.")
+    tracing_sample_ratio: float = Field(
+        default=0.05, ge=0.0, le=1.0, description="The fraction of requests traced, besides slow and failed ones."
+    )
+    tracing_slow_threshold_seconds: float | None = Field(
+        default=5.0, gt=0, description="Requests taking at least this long are always traced. None to disable."
+    )
+    tracing_file: Path | None = Field(
+        default=_ROOT_DIR / "data" / "traces.jsonl",
+        description="A JSON lines file to write traces to, in the OTLP/JSON format. None to disable.",
+    )
+    tracing_otlp_endpoint: str | None = Field(
+        default=None, description="An OTLP/HTTP collector to send traces to, e.g. `http://localhost:4318`."
+    )
+
     # TTS Settings
     tts_enabled: bool = True
     tts_f5_host: str = "localhost"
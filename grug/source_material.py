@@ -0,0 +1,235 @@
+"""
+Ingestion of source material (e.g. rulebook PDFs) for retrieval augmented generation.
+
+Documents are streamed through a pipeline, so memory use stays flat no matter how many pages a document has:
+
+1. `iter_document_pages` hands out small ranges of pages to a process pool, which extracts, fingerprints and chunks
+   the text. Only a bounded number of ranges are in flight at a time, and pages are yielded in order.
+2. Pages whose fingerprint matches the previous ingestion of the document are skipped.
+3. The chunks of changed pages are embedded in batches, and each batch is bulk loaded with `COPY` into the guild's
+   partition of the `source_chunks` table, replacing the chunks previously stored for those pages.
+"""
+
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+
+from loguru import logger
+from sqlalchemy import delete
+from sqlmodel import col, select
+
+from grug.db import copy_rows, ensure_list_partition, sqa_async_engine, sqa_async_session_factory, vector_literal
+from grug.embedding_service import get_embedding_service
+from grug.models import SourceChunk, SourceDocument
+from grug.pdf_text import ExtractedPage, extract_pages, get_page_count
+from grug.retrieval import invalidate_search_cache
+from grug.settings import settings
+
+SOURCE_CHUNK_TABLE = SourceChunk.__tablename__
+_CHUNK_COLUMNS = ("guild_id", "document_id", "page_number", "chunk_index", "content", "embedding")
+
+
+@dataclass
+class IngestionStats:
+    pages: int = 0
+    pages_skipped: int = 0
+    chunks: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+    finished_at: float | None = None
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.pages} pages ({self.pages_skipped} unchanged), {self.chunks} chunks in {self.seconds:.1f}s "
+            f"({self.pages_per_second:.1f} pages/s)"
+        )
+
+
+async def iter_document_pages(
+    path: Path,
+    known_hashes: list[str] | None = None,
+    workers: int | None = None,
+    pages_per_task: int | None = None,
+    chunk_size: int | None = None,
+    overlap: int | None = None,
+) -> AsyncIterator[ExtractedPage]:
+    """
+    Extract, fingerprint and chunk the pages of a PDF in a process pool, yielding them in page order.
+
+    Args:
+        path: The PDF to read.
+        known_hashes: The page fingerprints from a previous ingestion. Pages with a matching fingerprint are yielded
+            with `chunks=None`.
+        workers: The number of worker processes. Defaults to `source_material_ingest_workers`.
+        pages_per_task: The number of pages each task extracts. Defaults to `source_material_pages_per_task`.
+        chunk_size: Defaults to `source_material_chunk_size`.
+        overlap: Defaults to `source_material_chunk_overlap`.
+    """
+    workers = workers or settings.source_material_ingest_workers
+    pages_per_task = pages_per_task or settings.source_material_pages_per_task
+    chunk_size = chunk_size or settings.source_material_chunk_size
+    overlap = settings.source_material_chunk_overlap if overlap is None else overlap
+    known_hashes = known_hashes or []
+
+    page_count = get_page_count(str(path))
+    loop = asyncio.get_running_loop()
+    # The chunking and embedding settings are part of the fingerprint, so changing them re-processes every page
+    salt = f"{settings.ai_openai_embedding_model}:{chunk_size}:{overlap}"
+
+    # Spawned (rather than forked) workers don't inherit the bot's threads, sockets and event loop
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight: deque[asyncio.Future[list[ExtractedPage]]] = deque()
+        next_page = 0
+        try:
+            while next_page < page_count or in_flight:
+                # Bound the number of tasks in flight, so memory use doesn't grow with the document
+                while next_page < page_count and len(in_flight) < workers * 2:
+                    stop = min(next_page + pages_per_task, page_count)
+                    task_hashes = {i: known_hashes[i] for i in range(next_page, min(stop, len(known_hashes)))}
+                    in_flight.append(
+                        loop.run_in_executor(
+                            pool, extract_pages, str(path), next_page, stop, task_hashes, chunk_size, overlap, salt
+                        )
+                    )
+                    next_page = stop
+
+                for page in await in_flight.popleft():
+                    yield page
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+async def _store_pages(document: SourceDocument, pages: list[ExtractedPage]) -> int:
+    """Embed the chunks of the given pages and replace the chunks previously stored for them."""
+    rows = [
+        (document.guild_id, document.id, page.page_number, chunk_index, chunk)
+        for page in pages
+        for chunk_index, chunk in enumerate(page.chunks)
+    ]
+    # The embeddings are stored with the chunks, so they aren't saved to the persistent cache too
+    vectors = await get_embedding_service().aembed_documents([row[-1] for row in rows], persist=False) if rows else []
+
+    async with sqa_async_engine.begin() as conn:
+        await conn.execute(
+            delete(SourceChunk)
+            .where(SourceChunk.guild_id == document.guild_id)
+            .where(SourceChunk.document_id == document.id)
+            .where(col(SourceChunk.page_number).in_([page.page_number for page in pages]))
+        )
+        await copy_rows(
+            conn,
+            SOURCE_CHUNK_TABLE,
+            _CHUNK_COLUMNS,
+            [(*row, vector_literal(vector)) for row, vector in zip(rows, vectors)],
+        )
+
+    return len(rows)
+
+
+async def ingest_document(guild_id: int, name: str, path: Path) -> IngestionStats:
+    """
+    Ingest (or re-ingest) a PDF as a guild's source material, only re-processing the pages that changed.
+
+    Args:
+        guild_id: The guild the document belongs to.
+        name: The name of the document, unique per guild. Ingesting a document with an existing name updates it.
+        path: The PDF to ingest.
+    """
+    stats = IngestionStats()
+    await ensure_list_partition(SOURCE_CHUNK_TABLE, guild_id)
+
+    async with sqa_async_session_factory() as session:
+        document = (
+            await session.execute(
+                select(SourceDocument).where(SourceDocument.guild_id == guild_id).where(SourceDocument.name == name)
+            )
+        ).scalar_one_or_none() or SourceDocument(guild_id=guild_id, name=name)
+
+    page_hashes: list[str] = []
+    pending: list[ExtractedPage] = []
+    pending_chunks = 0
+    async for page in iter_document_pages(path, known_hashes=document.page_hashes):
+        stats.pages += 1
+        page_hashes.append(page.page_hash)
+        if page.chunks is None:
+            stats.pages_skipped += 1
+            continue
+
+        pending.append(page)
+        pending_chunks += len(page.chunks)
+        if pending_chunks >= settings.source_material_embedding_batch_size:
+            stats.chunks += await _store_pages(document, pending)
+            pending, pending_chunks = [], 0
+            logger.debug(f"Ingesting {name}: {stats}")
+
+    if pending:
+        stats.chunks += await _store_pages(document, pending)
+
+    async with sqa_async_session_factory() as session:
+        # Remove the chunks of pages that no longer exist
+        await session.execute(
+            delete(SourceChunk)
+            .where(SourceChunk.guild_id == guild_id)
+            .where(SourceChunk.document_id == document.id)
+            .where(SourceChunk.page_number >= len(page_hashes))
+        )
+        document.page_count = len(page_hashes)
+        document.page_hashes = page_hashes
+        document.ingested_at = datetime.now(tz=UTC)
+        session.add(document)
+        await session.commit()
+
+    invalidate_search_cache(guild_id)
+    stats.finished_at = time.perf_counter()
+    logger.info(f"Ingested {name} for guild {guild_id}: {stats}")
+    return stats
+
+
+async def get_source_documents(guild_id: int) -> list[SourceDocument]:
+    """Get a guild's source documents, by name."""
+    async with sqa_async_session_factory() as session:
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await session.execute(
+                    select(SourceDocument).where(SourceDocument.guild_id == guild_id).order_by(col(SourceDocument.name))
+                )
+            ).scalars()
+        )
+
+
+async def delete_source_document(guild_id: int, name: str) -> bool:
+    """Delete a guild's source document and its chunks, returning whether it existed."""
+    async with sqa_async_session_factory() as session:
+        document = (
+            await session.execute(
+                select(SourceDocument).where(SourceDocument.guild_id == guild_id).where(SourceDocument.name == name)
+            )
+        ).scalar_one_or_none()
+        if document is None:
+            return False
+
+        await session.execute(
+            delete(SourceChunk).where(SourceChunk.guild_id == guild_id).where(SourceChunk.document_id == document.id)
+        )
+        await session.delete(document)
+        await session.commit()
+
+    invalidate_search_cache(guild_id)
+
+    logger.info(f"Deleted source document {name} for guild {guild_id}")
+    return True
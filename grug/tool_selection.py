@@ -0,0 +1,330 @@
+"""
+Per-request tool selection, so the agent's prompt only carries the tools a request may need.
+
+Every tool's JSON schema is sent with every request the agent makes, so as the tool catalog grows, even "hi grug" pays
+for the schemas of the image, dice, reminder, search, notes and memory tools, in prompt tokens and latency.
+`ToolSelectingModel` stands in for the agent's chat model: it binds the whole catalog when the agent is created, and
+binds only the tools selected for each request when it is called.
+
+`ToolSelector` picks the tools in process, without an API call:
+
+- a BM25 keyword index over each tool's name, description and argument descriptions, built once, scores the tools
+  against the latest user message, and the best scoring tools are selected. Tools from the same module (e.g. setting,
+  listing and cancelling reminders) are selected together, as they are used together.
+- the rules lookups (`ai_tool_selection_always_include`) fill the rest of the budget, as rules questions are the bot's
+  main use and name game terms no tool description mentions, like "flanking" or "grabbed". When no tool matches a
+  request well, the `ai_tool_selection_fallback_tools` are offered too, rather than no tools.
+- tools disabled by the guild's config (e.g. image generation) are left out, as are tools that need a server in DMs.
+- voice chat replies get a smaller tool budget, as their latency matters most.
+- tools already called in the conversation's recent messages stay selected, for follow ups like "now cancel it", and
+  so the agent can keep using the tools it called for the current request.
+
+The agent still runs every tool it is asked to, so a request that needs a tool that wasn't selected gets an answer
+without it, and a follow up that names the tool selects it.
+"""
+
+import json
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Iterable, Sequence
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from loguru import logger
+
+from grug.guild_config import GuildSettings, get_cached_guild_settings, get_guild_settings
+from grug.settings import settings
+
+_METRICS_LOG_INTERVAL_SECONDS = 300
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+# Guild settings that disable a tool when they are off
+_GUILD_SETTING_TOOLS = {"generate_ai_image": "ai_image_generation_enabled"}
+
+# Tools that raise outside of a server, so are never offered in DMs
+_GUILD_ONLY_TOOLS = {
+    "information_search",
+    "list_source_material",
+    "list_voice_sessions",
+    "search_chat_history",
+    "search_voice_session_transcript",
+    "summarize_voice_session",
+}
+
+# Words people use for a tool that its description doesn't, mapped to words it does (both stemmed)
+_SYNONYMS = {
+    "art": "image",
+    "chance": "odds",
+    "die": "dice",
+    "draw": "image",
+    "forgot": "forget",
+    "illustrate": "image",
+    "illustration": "image",
+    "paint": "image",
+    "photo": "image",
+    "pic": "image",
+    "picture": "image",
+    "probability": "odds",
+    "remind": "reminder",
+    "rulebook": "source",
+    "said": "transcript",
+}
+
+_STOP_WORDS = frozenset(
+    "a about an and are as at be by can do does e for from g get how i if in is it its like me much my of on one or so "
+    "tell that the their them there they this to two up us user was we what when where which who will with work you "
+    "your".split()
+)
+
+_DICE_NOTATION = re.compile(r"^\d*d\d+$")
+
+
+def _stem(word: str) -> str:
+    """A deliberately crude stemmer, so "reminders", "reminding" and "reminded" all match "remind"."""
+    for suffix in ("ing", "ed", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix) and not word.endswith("ss"):
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into the stemmed keywords that the index matches on."""
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", text.lower().replace("_", " ")):
+        if word in _STOP_WORDS:
+            continue
+        if _DICE_NOTATION.match(word):
+            word = "dice"
+        word = _stem(word)
+        tokens.append(_SYNONYMS.get(word, word))
+    return tokens
+
+
+def tool_schema_chars(tool: BaseTool) -> int:
+    """The size of the schema sent to the model for a tool."""
+    return len(json.dumps(convert_to_openai_tool(tool)))
+
+
+def _tool_document(tool: BaseTool) -> str:
+    """The text a tool is indexed by: its name, description and argument descriptions."""
+    schema = convert_to_openai_tool(tool)["function"]
+    arguments = schema.get("parameters", {}).get("properties", {})
+    return " ".join(
+        [tool.name, schema.get("description", "")]
+        + [f"{name} {argument.get('description', '')}" for name, argument in arguments.items()]
+    )
+
+
+def _tool_group(tool: BaseTool) -> str:
+    """The module a tool is defined in, as tools defined together are used together."""
+    function = getattr(tool, "coroutine", None) or getattr(tool, "func", None)
+    return getattr(function, "__module__", tool.name)
+
+
+def _message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return " ".join(part.get("text", "") for part in message.content if isinstance(part, dict))
+
+
+class ToolSelector:
+    """Selects the tools relevant to a request, from a keyword index built over the tool catalog."""
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        max_tools: int = 6,
+        voice_max_tools: int = 3,
+        min_score: float = 2.0,
+        always_include: Iterable[str] = (),
+        fallback: Iterable[str] = (),
+        history_messages: int = 10,
+    ):
+        self.tools = list(tools)
+        self.max_tools = max_tools
+        self.voice_max_tools = voice_max_tools
+        self.min_score = min_score
+        self.always_include = list(always_include)
+        self.fallback = list(fallback)
+        self.history_messages = history_messages
+
+        self._tools_by_name = {tool.name: tool for tool in self.tools}
+        self._groups: dict[str, list[str]] = {}
+        for tool in self.tools:
+            self._groups.setdefault(_tool_group(tool), []).append(tool.name)
+
+        # Precompute the BM25 term frequencies, document lengths and inverse document frequencies
+        documents = {tool.name: tokenize(_tool_document(tool)) for tool in self.tools}
+        self._term_counts = {name: Counter(tokens) for name, tokens in documents.items()}
+        self._lengths = {name: len(tokens) for name, tokens in documents.items()}
+        self._average_length = sum(self._lengths.values()) / len(self.tools) if self.tools else 0
+        document_frequencies = Counter(term for counts in self._term_counts.values() for term in counts)
+        self._idf = {
+            term: math.log(1 + (len(self.tools) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+        self._schema_chars = {tool.name: tool_schema_chars(tool) for tool in self.tools}
+        self._counts: Counter = Counter()
+        self._metrics_logged_at = time.monotonic()
+
+    def scores(self, text: str) -> dict[str, float]:
+        """Score each tool against the text, returning the tools that matched at all."""
+        query = Counter(tokenize(text))
+        scores = {}
+        for name, term_counts in self._term_counts.items():
+            length_norm = _K1 * (1 - _B + _B * self._lengths[name] / self._average_length)
+            score = sum(
+                self._idf[term] * term_counts[term] * (_K1 + 1) / (term_counts[term] + length_norm)
+                for term in query
+                if term in term_counts
+            )
+            if score > 0:
+                scores[name] = score
+        return scores
+
+    def _allowed(self, name: str, guild_settings: GuildSettings) -> bool:
+        if guild_settings.guild_id is None and name in _GUILD_ONLY_TOOLS:
+            return False
+        setting = _GUILD_SETTING_TOOLS.get(name)
+        return setting is None or bool(getattr(guild_settings, setting))
+
+    def select(
+        self,
+        messages: Sequence[BaseMessage],
+        guild_settings: GuildSettings,
+        channel_type: str | None = None,
+    ) -> list[BaseTool]:
+        """
+        Select the tools for the agent's next model call.
+
+        Args:
+            messages: The messages sent to the model, the latest last.
+            guild_settings: The settings of the guild the request came from.
+            channel_type: "voice" for voice chat replies, which get a smaller tool budget.
+        """
+        max_tools = self.voice_max_tools if channel_type == "voice" else self.max_tools
+        query = next((_message_text(m) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+        # Keep the tools called recently, including those called for this request
+        selected = []
+        for message in messages[-self.history_messages :]:  # noqa: E203
+            if isinstance(message, AIMessage):
+                selected += [call["name"] for call in message.tool_calls if call["name"] in self._tools_by_name]
+        selected = [name for name in dict.fromkeys(selected) if self._allowed(name, guild_settings)]
+
+        # Then add the best matches, with the tools defined alongside them, while there is room
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)
+        for name, score in ranked:
+            if score < self.min_score or len(selected) >= max_tools:
+                break
+            if name in selected or not self._allowed(name, guild_settings):
+                continue
+            group = [
+                other
+                for other in self._groups[_tool_group(self._tools_by_name[name])]
+                if other not in selected and self._allowed(other, guild_settings)
+            ]
+            # Add the whole group if it fits in the budget, or else just the matching tool
+            selected += group if len(selected) + len(group) <= max_tools else [name]
+
+        # Fill the rest of the budget with the tools offered for every request, and when nothing matched well (e.g. a
+        # rules question about a term no tool mentions), with the fallback tools
+        defaults = self.always_include + (self.fallback if not ranked or ranked[0][1] < self.min_score else [])
+        for name in dict.fromkeys(defaults):
+            if len(selected) >= max_tools:
+                break
+            if name in self._tools_by_name and name not in selected and self._allowed(name, guild_settings):
+                selected.append(name)
+
+        self._record(selected)
+        return [self._tools_by_name[name] for name in selected]
+
+    def _record(self, selected: list[str]) -> None:
+        self._counts["requests"] += 1
+        self._counts["tools_offered"] += len(selected)
+        self._counts["schema_chars_offered"] += sum(self._schema_chars[name] for name in selected)
+        self._counts["schema_chars_catalog"] += sum(self._schema_chars.values())
+        self._counts.update(f"selected:{name}" for name in selected)
+        self._maybe_log_metrics()
+
+    def _maybe_log_metrics(self) -> None:
+        if time.monotonic() - self._metrics_logged_at >= _METRICS_LOG_INTERVAL_SECONDS:
+            self._metrics_logged_at = time.monotonic()
+            logger.info(f"Tool selection: {self.metrics()}")
+
+    def metrics(self) -> dict[str, Any]:
+        """The tools offered per model call, and the share of the catalog's schema size that was sent."""
+        counts = self._counts
+        requests = counts["requests"] or 1
+        return {
+            "model_calls": counts["requests"],
+            "catalog_tools": len(self.tools),
+            "avg_tools_offered": round(counts["tools_offered"] / requests, 2),
+            # Roughly 4 characters to a token
+            "avg_schema_tokens_offered": round(counts["schema_chars_offered"] / requests / 4),
+            "schema_share_offered": round(counts["schema_chars_offered"] / (counts["schema_chars_catalog"] or 1), 3),
+            "selected": {
+                name: counts[f"selected:{name}"] for name in self._tools_by_name if counts[f"selected:{name}"]
+            },
+        }
+
+
+class ToolSelectingModel(Runnable[LanguageModelInput, BaseMessage]):
+    """
+    A chat model that binds only the tools selected for each call.
+
+    `create_react_agent` binds the tool catalog to it, which builds the `ToolSelector`. The graph passes each call's
+    config through, so the selection can use the guild and channel type from its "configurable". Other arguments to
+    `bind_tools` (e.g. `tool_choice` or `parallel_tool_calls`) are passed on when the selected tools are bound.
+    """
+
+    def __init__(self, model: BaseChatModel, selector: ToolSelector | None = None, **bind_kwargs: Any):
+        self.model = model
+        self.selector = selector
+        self._bind_kwargs = bind_kwargs
+
+    def bind_tools(self, tools: Sequence[BaseTool], **kwargs: Any) -> "ToolSelectingModel":
+        return ToolSelectingModel(
+            self.model,
+            ToolSelector(
+                tools,
+                max_tools=settings.ai_tool_selection_max_tools,
+                voice_max_tools=settings.ai_tool_selection_voice_max_tools,
+                min_score=settings.ai_tool_selection_min_score,
+                always_include=settings.ai_tool_selection_always_include,
+                fallback=settings.ai_tool_selection_fallback_tools,
+                history_messages=settings.ai_tool_selection_history_messages,
+            ),
+            **kwargs,
+        )
+
+    def _bound(self, messages: Sequence[BaseMessage], guild_settings: GuildSettings, config: RunnableConfig | None):
+        if self.selector is None:
+            return self.model
+        channel_type = (config or {}).get("configurable", {}).get("channel_type")
+        if not (tools := self.selector.select(messages, guild_settings, channel_type)):
+            # An empty tool list is rejected by the API, so send none at all
+            return self.model
+        return self.model.bind_tools(tools, **self._bind_kwargs)
+
+    def invoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        # The agent is async, so sync calls select with the guild's config from the cache
+        guild_settings = get_cached_guild_settings((config or {}).get("configurable", {}).get("guild_id"))
+        messages = self.model._convert_input(input).to_messages()
+        return self._bound(messages, guild_settings, config).invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any
+    ) -> BaseMessage:
+        guild_settings = await get_guild_settings((config or {}).get("configurable", {}).get("guild_id"))
+        messages = self.model._convert_input(input).to_messages()
+        return await self._bound(messages, guild_settings, config).ainvoke(input, config, **kwargs)
@@ -0,0 +1,456 @@
+"""
+Structured request tracing, following a request from Discord (or a voice transcript) through the agent's graph nodes,
+LLM calls and tools, database queries, TTS/STT and the Discord send.
+
+Spans are tracked with a context variable, so they nest across `await`s and tasks, and can be parented explicitly
+where work moves between threads (e.g. the speech recognition callbacks) or processes: `inject` and `extract` carry a
+span's context as a W3C `traceparent` string, e.g. in PGMQ messages. Agent runs are traced by a LangChain callback
+handler registered for every run, and database queries by SQLAlchemy engine events.
+
+Sampling is decided when a span that has no parent in this process (a local root) ends, so slow or failed requests
+are always kept:
+
+- a fraction, `tracing_sample_ratio`, of traces are kept, chosen by trace ID so every process makes the same choice.
+- traces whose local root took at least `tracing_slow_threshold_seconds`, or failed, are kept.
+
+Kept spans are exported in the background, as OTLP/JSON `ExportTraceServiceRequest`s, to a JSON lines file
+(`tracing_file`, readable by the OpenTelemetry collector's `otlpjsonfile` receiver) and/or an OTLP/HTTP endpoint
+(`tracing_otlp_endpoint`).
+"""
+
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+from loguru import logger
+from sqlalchemy import event
+
+from grug.settings import settings
+
+_MAX_SPANS_PER_ROOT = 2000
+_MAX_REMEMBERED_DECISIONS = 10_000
+_EXPORT_BATCH_SIZE = 512
+_EXPORT_INTERVAL_SECONDS = 2.0
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """The identity of a span, as carried across threads and processes."""
+
+    trace_id: str
+    span_id: str
+    sampled: bool = False
+
+
+@dataclass(eq=False)
+class Span:
+    name: str
+    context: SpanContext
+    parent_id: str | None
+    local_root_id: str
+    remote_parent: bool = False
+    attributes: dict[str, Any] = field(default_factory=dict)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int | None = None
+    error: str | None = None
+
+    @property
+    def duration_seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | str | None = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        _tracer.on_end(self)
+
+
+class NoopSpan:
+    """Stands in for spans when tracing is disabled, so call sites don't need to check."""
+
+    context = None
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+    def end(self, error: BaseException | str | None = None) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+_current_span: ContextVar[Span | None] = ContextVar("grug_current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Add attributes to the current span, if any."""
+    if span_ := _current_span.get():
+        span_.set_attributes(**attributes)
+
+
+def inject(span_: Span | NoopSpan | None = None) -> str | None:
+    """Get the W3C `traceparent` for a span (by default the current one), to continue the trace elsewhere."""
+    span_ = span_ or _current_span.get()
+    if span_ is None or span_.context is None:
+        return None
+    return f"00-{span_.context.trace_id}-{span_.context.span_id}-{'01' if span_.context.sampled else '00'}"
+
+
+def extract(traceparent: str | None) -> SpanContext | None:
+    """Parse a W3C `traceparent`, returning None if it is missing or malformed."""
+    try:
+        _, trace_id, span_id, flags = (traceparent or "").split("-")
+        int(trace_id, 16), int(span_id, 16)
+        return SpanContext(trace_id=trace_id, span_id=span_id, sampled=bool(int(flags, 16) & 1))
+    except ValueError:
+        return None
+
+
+def _ratio_sampled(trace_id: str) -> bool:
+    return int(trace_id[-16:], 16) < settings.tracing_sample_ratio * 2**64
+
+
+_CURRENT = object()
+
+
+def start_span(
+    name: str,
+    parent: Span | NoopSpan | SpanContext | None | object = _CURRENT,
+    **attributes: Any,
+) -> Span | NoopSpan:
+    """
+    Start a span that must be ended with `Span.end`, e.g. because it ends in another thread. It is not made current.
+
+    Args:
+        name: The name of the span, e.g. "tool generate_ai_image".
+        parent: The parent span, or the context of a span in another process. Defaults to the current span, and None
+            starts a new trace.
+        **attributes: Attributes of the span.
+    """
+    if not settings.tracing_enabled:
+        return NOOP_SPAN
+
+    parent = _current_span.get() if parent is _CURRENT else parent
+    span_id = os.urandom(8).hex()
+    if isinstance(parent, Span):
+        return Span(
+            name=name,
+            context=SpanContext(trace_id=parent.context.trace_id, span_id=span_id, sampled=parent.context.sampled),
+            parent_id=parent.context.span_id,
+            local_root_id=parent.local_root_id,
+            attributes=attributes,
+        )
+
+    remote_parent = isinstance(parent, SpanContext)
+    trace_id = parent.trace_id if remote_parent else os.urandom(16).hex()
+    span_ = Span(
+        name=name,
+        context=SpanContext(
+            trace_id=trace_id,
+            span_id=span_id,
+            sampled=(parent.sampled if remote_parent else False) or _ratio_sampled(trace_id),
+        ),
+        parent_id=parent.span_id if remote_parent else None,
+        local_root_id=span_id,
+        remote_parent=remote_parent,
+        attributes=attributes,
+    )
+    _tracer.on_start_root(span_)
+    return span_
+
+
+@contextmanager
+def span(
+    name: str,
+    parent: Span | NoopSpan | SpanContext | None | object = _CURRENT,
+    **attributes: Any,
+) -> Iterator[Span | NoopSpan]:
+    """Trace a block as a span, which is current within the block."""
+    span_ = start_span(name, parent, **attributes)
+    if span_ is NOOP_SPAN:
+        yield span_
+        return
+
+    token = _current_span.set(span_)
+    try:
+        yield span_
+    except Exception as e:
+        span_.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span_.end()
+
+
+#
+# Sampling and export
+#
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span_: Span) -> dict[str, Any]:
+    return {
+        "traceId": span_.context.trace_id,
+        "spanId": span_.context.span_id,
+        "parentSpanId": span_.parent_id or "",
+        "name": span_.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span_.start_ns),
+        "endTimeUnixNano": str(span_.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span_.attributes.items()],
+        "status": {"code": 2, "message": span_.error} if span_.error else {"code": 1},
+    }
+
+
+def otlp_request(spans: list[Span]) -> dict[str, Any]:
+    """Encode spans as an OTLP/JSON `ExportTraceServiceRequest`."""
+    resource_attributes = {"service.name": "grug", "host.name": socket.gethostname(), "process.pid": os.getpid()}
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": key, "value": _otlp_value(value)} for key, value in resource_attributes.items()
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "grug.tracing"}, "spans": [_otlp_span(span_) for span_ in spans]}],
+            }
+        ]
+    }
+
+
+class _Tracer:
+    """Buffers each local root's spans until it ends, then exports them if the trace is sampled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: dict[str, list[Span]] = {}
+        self._decisions: OrderedDict[str, bool] = OrderedDict()
+        self._export_queue: queue.SimpleQueue[Span | None] = queue.SimpleQueue()
+        self._exporter: threading.Thread | None = None
+
+    def on_start_root(self, span_: Span) -> None:
+        with self._lock:
+            self._pending[span_.local_root_id] = []
+
+    def _should_export(self, root: Span) -> bool:
+        return (
+            root.context.sampled
+            or root.error is not None
+            or (
+                settings.tracing_slow_threshold_seconds is not None
+                and root.duration_seconds >= settings.tracing_slow_threshold_seconds
+            )
+            or self._decisions.get(root.context.trace_id, False)
+        )
+
+    def on_end(self, span_: Span) -> None:
+        with self._lock:
+            pending = self._pending.get(span_.local_root_id)
+            if span_.context.span_id == span_.local_root_id:
+                spans = (self._pending.pop(span_.local_root_id, None) or []) + [span_]
+                export = self._should_export(span_)
+                self._decisions[span_.context.trace_id] = export
+                self._decisions.move_to_end(span_.context.trace_id)
+                while len(self._decisions) > _MAX_REMEMBERED_DECISIONS:
+                    self._decisions.popitem(last=False)
+            elif pending is not None:
+                if len(pending) < _MAX_SPANS_PER_ROOT:
+                    pending.append(span_)
+                return
+            else:
+                # The local root has already ended, e.g. a fire-and-forget Discord send, so follow its decision
+                spans = [span_]
+                export = self._decisions.get(span_.context.trace_id, False)
+
+        if export:
+            self._ensure_exporter()
+            for exported in spans:
+                self._export_queue.put(exported)
+
+    def _ensure_exporter(self) -> None:
+        if self._exporter is None:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = threading.Thread(target=self._export_loop, name="tracing-export", daemon=True)
+                    self._exporter.start()
+                    atexit.register(self.flush)
+
+    def _export_loop(self) -> None:
+        http_client = httpx.Client(timeout=10) if settings.tracing_otlp_endpoint else None
+        while True:
+            batch: list[Span] = []
+            deadline = time.monotonic() + _EXPORT_INTERVAL_SECONDS
+            stop = False
+            while len(batch) < _EXPORT_BATCH_SIZE and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    item = self._export_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self._export(batch, http_client)
+                except Exception as e:
+                    logger.warning(f"Failed to export {len(batch)} spans: {e}")
+            if stop:
+                return
+
+    def _export(self, spans: list[Span], http_client: httpx.Client | None) -> None:
+        request = otlp_request(spans)
+        if settings.tracing_file is not None:
+            settings.tracing_file.parent.mkdir(parents=True, exist_ok=True)
+            with settings.tracing_file.open("a") as file:
+                file.write(json.dumps(request, separators=(",", ":")) + "\n")
+        if http_client is not None:
+            http_client.post(f"{settings.tracing_otlp_endpoint.rstrip('/')}/v1/traces", json=request).raise_for_status()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Export everything queued, stopping the exporter."""
+        if self._exporter is not None:
+            self._export_queue.put(None)
+            self._exporter.join(timeout)
+            self._exporter = None
+
+
+_tracer = _Tracer()
+
+
+#
+# Instrumentation
+#
+
+
+class _LangChainTracer(BaseCallbackHandler):
+    """Traces graph nodes, LLM calls and tools as spans, parented to the span current when the agent was called."""
+
+    run_inline = True
+
+    def __init__(self):
+        # Each run's span (or, for runs that aren't traced themselves, their parent's) and the span current before it
+        self._spans: dict[UUID, tuple[Span | None, Span | None, bool]] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: UUID | None, name: str | None, **attributes: Any) -> None:
+        parent = self._spans[parent_run_id][0] if parent_run_id in self._spans else _current_span.get()
+        previous = _current_span.get()
+        if name is None:
+            # e.g. the runnables inside a node, which pass their parent through to the runs they start
+            self._spans[run_id] = (parent, previous, False)
+            return
+
+        span_ = start_span(name, parent=parent, **attributes)
+        if isinstance(span_, Span):
+            self._spans[run_id] = (span_, previous, True)
+            # Make the span current, so spans started by the run itself (e.g. a tool's DB queries) are its children
+            _current_span.set(span_)
+
+    def _end(self, run_id: UUID, error: BaseException | None = None, **attributes: Any) -> None:
+        span_, previous, owned = self._spans.pop(run_id, (None, None, False))
+        if owned:
+            _current_span.set(previous)
+            span_.set_attributes(**attributes)
+            span_.end(error=error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        name = kwargs.get("name")
+        # Only the graph's own nodes are traced, not LangGraph's internal ones (e.g. `__start__`)
+        traced_node = node and node == name and not node.startswith("__")
+        self._start(run_id, parent_run_id, f"graph.node {node}" if traced_node else None)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model_name")
+        self._start(run_id, parent_run_id, "llm", model=model or "unknown")
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self._end(
+            run_id,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, f"tool {(serialized or {}).get('name') or kwargs.get('name')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=error)
+
+
+# Registered as a configure hook, so every LangChain run is traced without passing callbacks around
+_langchain_tracer: ContextVar[_LangChainTracer | None] = ContextVar(
+    "grug_langchain_tracer", default=_LangChainTracer() if settings.tracing_enabled else None
+)
+register_configure_hook(_langchain_tracer, inheritable=True)
+
+
+def instrument_sqlalchemy(engine) -> None:
+    """Trace every query run on a (sync) SQLAlchemy engine, e.g. `AsyncEngine.sync_engine`."""
+    if not settings.tracing_enabled:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # SQLAlchemy's async greenlets run in the calling task's context, so the current span is the caller's
+        conn.info.setdefault("grug_spans", []).append(
+            start_span("db.query", statement=statement[:300], executemany=executemany)
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if spans := conn.info.get("grug_spans"):
+            spans.pop().end()
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and (spans := connection.info.get("grug_spans")):
+            spans.pop().end(error=exception_context.original_exception)
@@ -0,0 +1,159 @@
+"""
+Persistent storage and search for voice session transcripts.
+
+Transcribed phrases are buffered and bulk loaded with `COPY` by `transcript_writer`, into a table that is
+range-partitioned by month. Old transcripts are removed by dropping whole partitions, and searches are scoped to a
+single session's time range so Postgres only touches the partitions and index entries for that session.
+"""
+
+import uuid
+from datetime import UTC, date, datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import func, tuple_
+from sqlmodel import col, select
+
+from grug.db import (
+    AsyncBatchWriter,
+    drop_monthly_partitions_before,
+    ensure_monthly_partitions,
+    sqa_async_session_factory,
+)
+from grug.models import VoiceSession, VoiceTranscriptSegment
+from grug.settings import settings
+
+TRANSCRIPT_TABLE = VoiceTranscriptSegment.__tablename__
+
+transcript_writer = AsyncBatchWriter(
+    table=TRANSCRIPT_TABLE,
+    columns=("spoken_at", "guild_id", "channel_id", "session_id", "speaker_id", "speaker_name", "text"),
+)
+
+
+def record_transcript_segment(
+    session: VoiceSession,
+    speaker_id: int,
+    speaker_name: str | None,
+    text: str,
+    spoken_at: datetime,
+) -> None:
+    """Queue a transcribed phrase to be stored. Safe to call from any thread."""
+    transcript_writer.add(
+        (spoken_at, session.guild_id, session.channel_id, session.id, speaker_id, speaker_name, text),
+    )
+
+
+async def start_voice_session(guild_id: int, channel_id: int) -> VoiceSession:
+    """Record the start of a voice session."""
+    async with sqa_async_session_factory() as db_session:
+        voice_session = VoiceSession(guild_id=guild_id, channel_id=channel_id, started_at=datetime.now(tz=UTC))
+        db_session.add(voice_session)
+        await db_session.commit()
+
+    logger.info(f"Started voice session {voice_session.id} in channel {channel_id}")
+    return voice_session
+
+
+async def end_voice_session(session_id: uuid.UUID) -> None:
+    """Record the end of a voice session, flushing any transcript segments still buffered."""
+    await transcript_writer.flush()
+    async with sqa_async_session_factory() as db_session:
+        if voice_session := await db_session.get(VoiceSession, session_id):
+            voice_session.ended_at = datetime.now(tz=UTC)
+            db_session.add(voice_session)
+            await db_session.commit()
+
+    logger.info(f"Ended voice session {session_id}")
+
+
+async def get_ended_voice_sessions(session_ids: list[uuid.UUID]) -> set[uuid.UUID]:
+    """Get which of the voice sessions have ended."""
+    async with sqa_async_session_factory() as db_session:
+        # noinspection PyTypeChecker
+        return set(
+            (
+                await db_session.execute(
+                    select(VoiceSession.id)
+                    .where(col(VoiceSession.id).in_(session_ids))
+                    .where(col(VoiceSession.ended_at).is_not(None))
+                )
+            ).scalars()
+        )
+
+
+async def get_voice_sessions(guild_id: int, limit: int = 10) -> list[VoiceSession]:
+    """Get a guild's most recent voice sessions, newest first."""
+    async with sqa_async_session_factory() as db_session:
+        # noinspection PyTypeChecker
+        return list(
+            (
+                await db_session.execute(
+                    select(VoiceSession)
+                    .where(VoiceSession.guild_id == guild_id)
+                    .order_by(col(VoiceSession.started_at).desc())
+                    .limit(limit)
+                )
+            ).scalars()
+        )
+
+
+async def get_voice_session(guild_id: int, session_id: uuid.UUID | None = None) -> VoiceSession | None:
+    """Get a guild's voice session by ID, or its most recent session if no ID is given."""
+    if session_id is None:
+        sessions = await get_voice_sessions(guild_id, limit=1)
+        return sessions[0] if sessions else None
+
+    async with sqa_async_session_factory() as db_session:
+        voice_session = await db_session.get(VoiceSession, session_id)
+    return voice_session if voice_session and voice_session.guild_id == guild_id else None
+
+
+async def search_transcript(
+    voice_session: VoiceSession,
+    query: str | None = None,
+    after: tuple[datetime, int] | None = None,
+    limit: int = 50,
+) -> list[VoiceTranscriptSegment]:
+    """
+    Page through a session's transcript in chronological order, optionally filtered by a full-text query.
+
+    Args:
+        voice_session: The session to search.
+        query: A web-search style full-text query (e.g. `dragon -red "treasure hoard"`). If None, all segments match.
+        after: Keyset pagination cursor, the `(spoken_at, id)` of the last segment of the previous page. Segments can
+            share a `spoken_at`, so the ID breaks ties.
+        limit: The maximum number of segments to return.
+    """
+    # Bounding by the session's time range lets Postgres prune every partition outside of the session
+    started_at = voice_session.started_at
+    ended_at = voice_session.ended_at or datetime.now(tz=UTC)
+
+    statement = (
+        select(VoiceTranscriptSegment)
+        .where(VoiceTranscriptSegment.session_id == voice_session.id)
+        .where(VoiceTranscriptSegment.spoken_at >= started_at)
+        .where(VoiceTranscriptSegment.spoken_at <= ended_at + timedelta(minutes=1))
+        .order_by(col(VoiceTranscriptSegment.spoken_at), col(VoiceTranscriptSegment.id))
+        .limit(limit)
+    )
+    if after is not None:
+        statement = statement.where(
+            tuple_(col(VoiceTranscriptSegment.spoken_at), col(VoiceTranscriptSegment.id)) > tuple_(*after)
+        )
+    if query:
+        statement = statement.where(
+            col(VoiceTranscriptSegment.text_search).op("@@")(func.websearch_to_tsquery("english", query))
+        )
+
+    async with sqa_async_session_factory() as db_session:
+        # noinspection PyTypeChecker
+        return list((await db_session.execute(statement)).scalars())
+
+
+async def maintain_transcript_partitions() -> None:
+    """Create upcoming transcript partitions and drop the ones past the retention period."""
+    await ensure_monthly_partitions(TRANSCRIPT_TABLE, months_ahead=1)
+
+    if settings.voice_transcript_retention_days is not None:
+        cutoff = date.today() - timedelta(days=settings.voice_transcript_retention_days)
+        await drop_monthly_partitions_before(TRANSCRIPT_TABLE, cutoff)
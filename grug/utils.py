@@ -1,20 +1,42 @@
+import inspect
+import logging
 import signal
 import time
+from collections import OrderedDict
+from collections.abc import Hashable
 from contextlib import contextmanager
 from functools import wraps
+from typing import Any
 
 from loguru import logger
 
+from grug.tracing import span
+
 
 class TimeoutException(Exception):
     pass
 
 
 def log_runtime(func):
+    """Log how long each call of a function, sync or async, takes, and trace it as a span."""
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.time()
+            with span(func.__qualname__):
+                result = await func(*args, **kwargs)
+            runtime = time.time() - start_time
+            logger.info(f"Function {func.__name__} ran for {runtime:.4f} seconds")
+            return result
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
-        result = func(*args, **kwargs)
+        with span(func.__qualname__):
+            result = func(*args, **kwargs)
         end_time = time.time()
         runtime = end_time - start_time
         logger.info(f"Function {func.__name__} ran for {runtime:.4f} seconds")
@@ -34,3 +56,60 @@ def timeout(seconds: int):
         yield
     finally:
         signal.alarm(0)  # type: ignore
+
+
+class TTLCache:
+    """A least-recently-used cache whose entries also expire `ttl_seconds` after they were set."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InterceptLogHandler(logging.Handler):
+    """
+    Default log handler from examples in loguru documentaion.
+    See https://loguru.readthedocs.io/en/stable/overview.html#entirely-compatible-with-standard-logging
+    """
+
+    def emit(self, record: logging.LogRecord):
+        """Intercept standard logging records."""
+        # Get corresponding Loguru level if it exists
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+
+        # Find caller from where originated the logged message
+        frame, depth = logging.currentframe(), 2
+        while frame.f_code.co_filename == logging.__file__:
+            if frame.f_back:
+                frame = frame.f_back
+                depth += 1
+
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
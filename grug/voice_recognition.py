@@ -0,0 +1,275 @@
+"""
+Speech recognition for Discord voice channels.
+
+`SpeechRecognitionSink` receives the decoded audio of a voice connection, splits each speaker's audio into phrases,
+and transcribes them, publishing each transcript to the channel's PGMQ queue for the voice responder. It runs in the
+bot, or with `voice_workers_enabled`, in `grug-voice-worker` processes (see `grug.voice_worker`).
+"""
+
+import array
+import asyncio
+import concurrent.futures
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+from typing import Any, Awaitable, Callable, Final, Optional, TypedDict, TypeVar
+
+import discord
+import speech_recognition as sr
+from discord.ext.voice_recv import AudioSink, SilencePacket, VoiceData
+from loguru import logger
+from rapidfuzz import fuzz
+from tembo_pgmq_python import queue as sync_queue
+
+from grug.ai_stt_client import AudioSegment, STTBackend, TranscriptionDispatcher, get_stt_backend
+from grug.audio import WHISPER_SAMPLE_RATE, array_to_pcm, downmix, pcm_to_array, resample_poly, to_int16
+from grug.audio_playback import sound_effect
+from grug.models import VoiceSession
+from grug.settings import settings
+from grug.tracing import inject, span, start_span
+from grug.transcripts import record_transcript_segment
+from grug.wake_word import get_wake_word_spotter
+
+BOOP_SOUND_EFFECT = "boop"
+
+
+def transcript_queue_name(channel_id: int) -> str:
+    """The PGMQ queue a voice channel's transcripts are published to."""
+    return str(channel_id)
+
+
+def speech_queue_name(channel_id: int) -> str:
+    """The PGMQ queue of responses to be spoken in a voice channel handled by a voice worker."""
+    return f"speech_{channel_id}"
+
+
+def is_addressed(transcript: dict[str, Any]) -> bool:
+    """Check if a published transcript calls the bot by name, either spotted by the wake word spotter or in the text."""
+    return (
+        bool(transcript.get("wake_word"))
+        or fuzz.partial_ratio(s1=f"hey, {settings.ai_name.lower()}", s2=transcript.get("message", "").lower()) > 80
+    )
+
+
+def play_sound_effect(voice_client: discord.VoiceClient, name: str) -> None:
+    """Play a sound effect in a voice channel, unless something is already playing. Safe to call from any thread."""
+
+    def play():
+        if voice_client.is_connected() and not voice_client.is_playing():
+            voice_client.play(sound_effect(name))
+
+    voice_client.loop.call_soon_threadsafe(play)
+
+
+class _StreamData(TypedDict):
+    stopper: Optional[Any]
+    recognizer: sr.Recognizer
+    buffer: array.array[int]
+
+
+class _DiscordSRAudioSource(sr.AudioSource):
+    little_endian: Final[bool] = True
+    SAMPLE_RATE: Final[int] = 48_000
+    SAMPLE_WIDTH: Final[int] = 2
+    CHANNELS: Final[int] = 2
+    CHUNK: Final[int] = 960
+
+    # noinspection PyMissingConstructor
+    def __init__(self, buffer: array.array[int], read_timeout: int = 10):
+        self.read_timeout = read_timeout
+        self.buffer = buffer
+        self._entered: bool = False
+
+    @property
+    def stream(self):
+        return self
+
+    def __enter__(self):
+        if self._entered:
+            logger.warning("Already entered sr audio source")
+        self._entered = True
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._entered = False
+        if any(exc):
+            logger.exception("Error closing sr audio source")
+
+    def read(self, size: int) -> bytes:
+        for _ in range(self.read_timeout):
+            if len(self.buffer) < size * self.CHANNELS:
+                time.sleep(0.01)
+            else:
+                break
+        else:
+            if len(self.buffer) <= 100:
+                return b""
+
+        chunk_size = size * self.CHANNELS
+        audio_chunk = self.buffer[:chunk_size].tobytes()
+        del self.buffer[: min(chunk_size, len(audio_chunk))]
+        return array_to_pcm(to_int16(downmix(pcm_to_array(audio_chunk, self.CHANNELS))))
+
+    def close(self) -> None:
+        self.buffer.clear()
+
+
+class SpeechRecognitionSink(AudioSink):
+    """
+    Speech recognition sink for Discord voice channels.
+
+    source: https://github.com/imayhaveborkedit/discord-ext-voice-recv/blob/main/discord/ext/voice_recv/extras/speechrecognition.py
+    """
+
+    _stream_data: defaultdict[int, _StreamData] = defaultdict(
+        lambda: _StreamData(stopper=None, recognizer=sr.Recognizer(), buffer=array.array("B"))
+    )
+
+    def __init__(
+        self,
+        discord_channel: discord.VoiceChannel,
+        voice_session: VoiceSession,
+        stt_backend: STTBackend | None = None,
+        on_addressed: Callable[[], None] | None = None,
+    ):
+        super().__init__(None)
+        self.discord_channel: discord.VoiceChannel = discord_channel
+        self.voice_session = voice_session
+        # Called, from a transcription thread, when a transcript calls the bot by name (e.g. to play a sound effect)
+        self.on_addressed = on_addressed
+
+        self.queue = sync_queue.PGMQueue(
+            host=settings.postgres_host,
+            port=settings.postgres_port,
+            username=settings.postgres_user,
+            password=settings.postgres_password.get_secret_value(),
+            database=settings.postgres_db,
+        )
+
+        # Create a queue for the voice channel if it doesn't exist.
+        self.queue_name = transcript_queue_name(self.discord_channel.id)
+        if self.queue_name not in self.queue.list_queues():
+            self.queue.create_queue(self.queue_name)
+
+        self.dispatcher = TranscriptionDispatcher(
+            backend=stt_backend or get_stt_backend(),
+            on_transcript=self._publish_transcript,
+            max_workers=settings.stt_max_concurrent_requests,
+            coalesce_max_seconds=settings.stt_coalesce_max_seconds,
+            max_retries=settings.stt_max_retries,
+            ignored_transcripts=settings.stt_ignored_transcripts,
+        )
+
+        # When wake word spotting is enabled, only speech addressed to the bot is transcribed
+        self.wake_word_spotter = get_wake_word_spotter()
+        self._addressed_until: dict[int, float] = {}
+
+    def _await(self, coro: Awaitable[TypeVar]) -> concurrent.futures.Future[TypeVar]:
+        assert self.client is not None
+        return asyncio.run_coroutine_threadsafe(coro, self.client.loop)
+
+    def wants_opus(self) -> bool:
+        return False
+
+    def write(self, user: Optional[discord.User], data: VoiceData) -> None:
+        # Ignore silence packets and packets from users we don't have data for
+        if isinstance(data.packet, SilencePacket) or user is None:
+            return
+
+        sdata = self._stream_data[user.id]
+        sdata["buffer"].extend(data.pcm)
+
+        if not sdata["stopper"]:
+            sdata["stopper"] = sdata["recognizer"].listen_in_background(
+                source=_DiscordSRAudioSource(sdata["buffer"]),
+                callback=self.background_listener(user),
+                phrase_time_limit=10,
+            )
+
+    def background_listener(self, user: discord.User):
+        def callback(_recognizer: sr.Recognizer, _audio: sr.AudioData):
+            # Don't process empty audio data or audio data that is too small
+            if _audio.frame_data == b"" or len(bytes(_audio.frame_data)) < 10000:
+                return None
+
+            segment = AudioSegment(
+                speaker_id=user.id,
+                speaker_name=user.display_name,
+                audio=_audio,
+                captured_at=datetime.now(tz=UTC),
+            )
+            if self._wants_transcription(segment):
+                segment.trace_span = start_span(
+                    "voice.phrase",
+                    parent=None,
+                    guild_id=self.discord_channel.guild.id,
+                    channel_id=self.discord_channel.id,
+                    speaker_id=user.id,
+                    audio_seconds=segment.duration_seconds,
+                    wake_word=segment.wake_word,
+                )
+                self.dispatcher.submit(segment)
+
+        return callback
+
+    def _wants_transcription(self, segment: AudioSegment) -> bool:
+        """Check the segment against the wake word spotter, if enabled, to decide whether to transcribe it."""
+        if self.wake_word_spotter is None:
+            return True
+
+        # Keep transcribing the speaker's follow-up phrases until they finish their statement
+        now = time.monotonic()
+        if now < self._addressed_until.get(segment.speaker_id, 0):
+            self._addressed_until[segment.speaker_id] = now + settings.stt_wake_word_followup_seconds
+            return True
+
+        # Only the start of the phrase is searched, downsampled to make feature extraction cheaper
+        audio = segment.audio
+        head = pcm_to_array(audio.frame_data)[: int(self.wake_word_spotter.search_seconds * audio.sample_rate)]
+        samples = to_int16(resample_poly(head, audio.sample_rate, WHISPER_SAMPLE_RATE))
+        if self.wake_word_spotter.detect(samples, WHISPER_SAMPLE_RATE):
+            logger.info(f"Wake word detected for {segment.speaker_id}")
+            segment.wake_word = True
+            self._addressed_until[segment.speaker_id] = now + settings.stt_wake_word_followup_seconds
+            return True
+
+        return False
+
+    def _publish_transcript(self, segment: AudioSegment, text: str) -> None:
+        with span("voice.publish") as publish_span:
+            record_transcript_segment(
+                session=self.voice_session,
+                speaker_id=segment.speaker_id,
+                speaker_name=segment.speaker_name,
+                text=text,
+                spoken_at=segment.captured_at,
+            )
+            transcript = {
+                "user_id": segment.speaker_id,
+                "message_timestamp": segment.captured_at.isoformat(),
+                "message": text,
+                "wake_word": segment.wake_word,
+                # Continues the trace in the voice responder
+                "traceparent": inject(publish_span),
+            }
+            self.queue.send(self.queue_name, transcript)
+
+        if self.on_addressed is not None and is_addressed(transcript):
+            self.on_addressed()
+
+    def cleanup(self) -> None:
+        for user_id in tuple(self._stream_data.keys()):
+            self._drop(user_id)
+        self.dispatcher.shutdown()
+
+    def _drop(self, user_id: int) -> None:
+        if user_id in self._stream_data:
+            data = self._stream_data.pop(user_id)
+            stopper = data.get("stopper")
+            if stopper:
+                stopper()
+
+            buffer = data.get("buffer")
+            if buffer:
+                # arrays don't have a clear function
+                del buffer[:]
@@ -0,0 +1,228 @@
+"""
+A voice worker process, `grug-voice-worker`, which recognizes speech for voice sessions outside of the bot.
+
+Decoding audio, detecting phrases and transcribing them is the heavy part of voice chat, so with
+`voice_workers_enabled` the bot doesn't connect to voice channels itself, and one busy voice channel can't slow down
+its text replies. When someone joins a guild's voice channel, the bot starts a voice session and queues it on the
+`voice_worker_queue` PGMQ queue. A voice worker with a free slot claims it, connects to the channel, and runs the
+speech recognition sink, which publishes transcripts to the channel's queue for the bot's voice responder, as it does
+in process. The worker also plays the boop when the bot is called by name, and speaks the responses the bot queues for
+the channel.
+
+A claim is a lease on the queue message: the worker reads it with a visibility timeout of
+`voice_worker_lease_seconds`, and keeps extending it while the session runs. When the bot ends the session (everyone
+left the channel), the worker disconnects and deletes the message. If a worker stops or loses its voice connection,
+the message becomes visible again and another worker resumes the session.
+
+Each worker is its own Discord gateway connection, with only the guild and voice state intents, and handles up to
+`voice_worker_max_sessions` sessions, so workers can be added across cores or hosts.
+"""
+
+import asyncio
+import contextlib
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import anyio
+import discord
+from discord.ext.voice_recv import VoiceRecvClient
+from loguru import logger
+from tembo_pgmq_python import async_queue
+from tembo_pgmq_python.messages import Message
+
+from grug.ai_tts_client import get_tts
+from grug.audio_playback import load_audio, preload_sound_effects
+from grug.settings import settings
+from grug.transcripts import get_ended_voice_sessions, get_voice_session, transcript_writer
+from grug.utils import InterceptLogHandler
+from grug.voice_recognition import BOOP_SOUND_EFFECT, SpeechRecognitionSink, play_sound_effect, speech_queue_name
+
+
+@dataclass
+class _ClaimedSession:
+    msg_id: int
+    voice_client: VoiceRecvClient
+    speaker_task: asyncio.Task
+
+
+class VoiceWorker(discord.Client):
+    """A Discord client that claims queued voice sessions and recognizes speech in them."""
+
+    def __init__(self, max_sessions: int = settings.voice_worker_max_sessions, tts: Callable[..., Path] = get_tts):
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.voice_states = True
+
+        super().__init__(intents=intents)
+        discord.utils.setup_logging(handler=InterceptLogHandler())
+
+        self.max_sessions = max_sessions
+        self.tts = tts
+        self.sessions: dict[uuid.UUID, _ClaimedSession] = {}
+        self.queue = async_queue.PGMQueue(
+            host=settings.postgres_host,
+            port=settings.postgres_port,
+            username=settings.postgres_user,
+            password=settings.postgres_password.get_secret_value(),
+            database=settings.postgres_db,
+        )
+        self._claims_task: asyncio.Task | None = None
+
+    async def setup_hook(self):
+        await self.queue.init()
+        if settings.voice_worker_queue not in await self.queue.list_queues():
+            await self.queue.create_queue(settings.voice_worker_queue)
+        self._claims_task = asyncio.create_task(self._run_claims())
+
+    async def _run_claims(self) -> None:
+        """Renew the claims on this worker's sessions, and claim queued sessions while it has free slots."""
+        await self.wait_until_ready()
+        logger.info(f"Voice worker {self.user} is ready for up to {self.max_sessions} voice sessions")
+        while not self.is_closed():
+            try:
+                await self._renew_claims()
+                if free_slots := self.max_sessions - len(self.sessions):
+                    for message in await self.queue.read_batch(
+                        settings.voice_worker_queue, vt=settings.voice_worker_lease_seconds, batch_size=free_slots
+                    ):
+                        await self._claim(message)
+            except Exception:
+                logger.exception("Failed to update the voice worker's sessions")
+            await asyncio.sleep(settings.voice_worker_poll_seconds)
+
+    async def _claim(self, message: Message) -> None:
+        """Connect to a claimed session's voice channel and start recognizing speech in it."""
+        voice_session = await get_voice_session(
+            message.message["guild_id"], uuid.UUID(message.message["voice_session_id"])
+        )
+        if voice_session is None or voice_session.ended_at is not None:
+            await self.queue.delete(settings.voice_worker_queue, message.msg_id)
+            return
+
+        guild = self.get_guild(voice_session.guild_id)
+        channel = guild.get_channel(voice_session.channel_id) if guild else None
+        if not isinstance(channel, discord.VoiceChannel):
+            logger.warning(f"Voice channel {voice_session.channel_id} of {voice_session} not found, dropping it")
+            await self.queue.delete(settings.voice_worker_queue, message.msg_id)
+            return
+
+        if guild.voice_client is not None:
+            # Left over from a session in the guild that has since ended
+            await guild.voice_client.disconnect(force=True)
+
+        logger.info(f"Claimed {voice_session}, connecting to {channel.name}")
+        voice_client = await channel.connect(cls=VoiceRecvClient)
+        voice_client.listen(
+            SpeechRecognitionSink(
+                discord_channel=channel,
+                voice_session=voice_session,
+                on_addressed=lambda: play_sound_effect(voice_client, BOOP_SOUND_EFFECT),
+            )
+        )
+
+        speech_queue = speech_queue_name(channel.id)
+        if speech_queue not in await self.queue.list_queues():
+            await self.queue.create_queue(speech_queue)
+        self.sessions[voice_session.id] = _ClaimedSession(
+            msg_id=message.msg_id,
+            voice_client=voice_client,
+            speaker_task=asyncio.create_task(self._speak_responses(voice_client, speech_queue)),
+        )
+
+    async def _renew_claims(self) -> None:
+        """Extend the claims on running sessions, and release the ones that ended or lost their voice connection."""
+        if not self.sessions:
+            return
+
+        ended = await get_ended_voice_sessions(list(self.sessions))
+        for session_id, claimed in list(self.sessions.items()):
+            if session_id in ended:
+                logger.info(f"Voice session {session_id} ended, disconnecting...")
+                await self._release(session_id, ended=True)
+            elif not claimed.voice_client.is_connected():
+                logger.warning(f"Lost the voice connection of session {session_id}, releasing it")
+                await self._release(session_id, ended=False)
+            else:
+                await self.queue.set_vt(
+                    settings.voice_worker_queue, claimed.msg_id, settings.voice_worker_lease_seconds
+                )
+
+    async def _release(self, session_id: uuid.UUID, ended: bool) -> None:
+        """Stop handling a session, deleting it from the queue if it ended, or making it claimable again if not."""
+        claimed = self.sessions.pop(session_id)
+        claimed.speaker_task.cancel()
+        if claimed.voice_client.is_connected():
+            await claimed.voice_client.disconnect(force=True)
+
+        if ended:
+            await self.queue.delete(settings.voice_worker_queue, claimed.msg_id)
+        else:
+            await self.queue.set_vt(settings.voice_worker_queue, claimed.msg_id, 0)
+
+    async def _speak_responses(self, voice_client: VoiceRecvClient, speech_queue: str) -> None:
+        """Speak the responses the bot queues for the channel, in order."""
+        while voice_client.is_connected():
+            message = await self.queue.read(speech_queue, vt=30)
+            if message is None:
+                await asyncio.sleep(0.1)
+                continue
+
+            await self.queue.delete(speech_queue, message.msg_id)
+            try:
+                # Synthesize and decode the response off the event loop
+                audio = await asyncio.to_thread(
+                    lambda: load_audio(self.tts(message.message["text"], voice=message.message["voice"]))
+                )
+            except Exception:
+                logger.exception("Failed to synthesize a voice response")
+                continue
+
+            # Wait for the previous response, or a boop, to finish playing
+            while voice_client.is_playing():
+                await asyncio.sleep(0.1)
+            if voice_client.is_connected():
+                voice_client.play(audio)
+
+    async def start(self, token: str, *, reconnect: bool = True) -> None:
+        """Start the voice worker."""
+        try:
+            await self.login(token)
+            await self.connect(reconnect=reconnect)
+        finally:
+            # Hand the sessions over to other workers straight away, rather than when the claims expire
+            logger.info("Releasing voice sessions...")
+            for session_id in list(self.sessions):
+                with contextlib.suppress(Exception):
+                    await self._release(session_id, ended=False)
+
+            logger.info("Closing the voice worker...")
+            await self.close()
+
+
+async def main():
+    """Voice worker entrypoint."""
+    if not settings.discord_token:
+        raise ValueError("`DISCORD_TOKEN` env variable is required to run a Grug voice worker.")
+
+    logger.info("Starting Grug voice worker...")
+
+    preload_sound_effects()
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(VoiceWorker().start, settings.discord_token.get_secret_value())
+        tg.start_soon(transcript_writer.run)
+
+    logger.info("Grug voice worker has shut down...")
+
+
+def run_voice_worker():
+    with contextlib.suppress(KeyboardInterrupt):
+        anyio.run(main)
+
+    logger.info("Shutting down Grug voice worker...")
+
+
+if __name__ == "__main__":
+    run_voice_worker()
@@ -0,0 +1,209 @@
+"""
+On-device wake-word spotting for the voice client.
+
+The spotter compares log-mel cepstral features (MFCCs) of incoming speech against a handful of enrolled recordings of
+the wake phrase (e.g. "hey grug") using subsequence dynamic time warping. Everything runs on the CPU with NumPy, so
+only speech that was actually addressed to the bot needs to be sent off for full transcription.
+"""
+
+import wave
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from grug.settings import settings
+
+_FRAME_SECONDS = 0.025
+_HOP_SECONDS = 0.010
+_N_MELS = 26
+_N_MFCC = 13
+_MAX_FREQUENCY = 8_000
+
+
+@lru_cache(maxsize=8)
+def _mel_filterbank(sample_rate: int, n_fft: int) -> np.ndarray:
+    """Triangular mel filterbank with shape (n_mels, n_fft // 2 + 1)."""
+    max_frequency = min(_MAX_FREQUENCY, sample_rate / 2)
+    mel_points = np.linspace(0, 2595 * np.log10(1 + max_frequency / 700), _N_MELS + 2)
+    hz_points = 700 * (10 ** (mel_points / 2595) - 1)
+    bins = np.floor((n_fft + 1) * hz_points / sample_rate).astype(int)
+
+    filterbank = np.zeros((_N_MELS, n_fft // 2 + 1))
+    for m in range(1, _N_MELS + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            filterbank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filterbank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filterbank
+
+
+@lru_cache(maxsize=1)
+def _dct_matrix() -> np.ndarray:
+    """Orthonormal DCT-II matrix with shape (n_mels, n_mfcc)."""
+    n = np.arange(_N_MELS)
+    k = np.arange(_N_MFCC)[:, None]
+    dct = np.cos(np.pi / _N_MELS * (n + 0.5) * k) * np.sqrt(2 / _N_MELS)
+    dct[0] /= np.sqrt(2)
+    return dct.T
+
+
+def extract_features(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Extract mean/variance normalized MFCC features from mono audio.
+
+    Args:
+        samples: Mono audio samples, either int16 PCM or floats in [-1, 1].
+        sample_rate: The sample rate of the audio.
+
+    Returns:
+        An array of shape (frames, 13). Audio shorter than a single frame returns an empty array.
+    """
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / 32768.0
+    samples = samples.astype(np.float32, copy=False)
+
+    frame_length = int(round(_FRAME_SECONDS * sample_rate))
+    hop_length = int(round(_HOP_SECONDS * sample_rate))
+    if len(samples) < frame_length:
+        return np.empty((0, _N_MFCC), dtype=np.float32)
+
+    # Pre-emphasis, then slice into overlapping windowed frames without copying
+    emphasized = np.append(samples[0], samples[1:] - 0.97 * samples[:-1])
+    frames = np.lib.stride_tricks.sliding_window_view(emphasized, frame_length)[::hop_length]
+    frames = frames * np.hamming(frame_length)
+
+    n_fft = 1 << (frame_length - 1).bit_length()
+    power = np.abs(np.fft.rfft(frames, n=n_fft)) ** 2 / n_fft
+    mel_energies = np.log(power @ _mel_filterbank(sample_rate, n_fft).T + 1e-10)
+    mfcc = mel_energies @ _dct_matrix()
+
+    # Cepstral mean and variance normalization makes the features robust to gain and channel differences
+    mfcc = (mfcc - mfcc.mean(axis=0)) / (mfcc.std(axis=0) + 1e-8)
+    return mfcc.astype(np.float32)
+
+
+def subsequence_dtw_distance(template: np.ndarray, query: np.ndarray) -> float:
+    """
+    Length-normalized DTW distance of the best match of `template` anywhere inside `query`.
+
+    The recurrence is evaluated one anti-diagonal at a time so each step is a single vectorized operation.
+    """
+    n, m = len(template), len(query)
+    if n == 0 or m == 0:
+        return float("inf")
+
+    # Euclidean distance between every template frame and every query frame
+    cost = np.sqrt(((template[:, None, :] - query[None, :, :]) ** 2).sum(axis=-1))
+
+    acc = np.full((n + 1, m + 1), np.inf, dtype=np.float64)
+    acc[0, :] = 0.0  # the match may start at any query frame
+    for diagonal in range(2, n + m + 1):
+        i = np.arange(max(1, diagonal - m), min(n, diagonal - 1) + 1)
+        j = diagonal - i
+        acc[i, j] = cost[i - 1, j - 1] + np.minimum(np.minimum(acc[i - 1, j], acc[i - 1, j - 1]), acc[i, j - 1])
+
+    return float(acc[n, 1:].min() / n)
+
+
+def read_wav(path: Path) -> tuple[np.ndarray, int]:
+    """Read a 16-bit PCM WAV file, returning mono int16 samples and the sample rate."""
+    with wave.open(str(path), "rb") as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV files are supported: {path}")
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, sample_rate
+
+
+class WakeWordSpotter:
+    """
+    Template-matching keyword spotter.
+
+    Enroll a few recordings of the wake phrase, then call `detect` on the start of each utterance. If no `threshold`
+    is given, one is calibrated from the spread between the enrolled templates.
+    """
+
+    def __init__(self, threshold: float | None = None, search_seconds: float = 3.0, threshold_margin: float = 1.25):
+        self.templates: list[np.ndarray] = []
+        self.search_seconds = search_seconds
+        self.threshold_margin = threshold_margin
+        self._threshold = threshold
+
+    @classmethod
+    def from_directory(cls, directory: Path, **kwargs) -> "WakeWordSpotter":
+        """Create a spotter enrolled with every `.wav` file in a directory."""
+        spotter = cls(**kwargs)
+        for path in sorted(directory.glob("*.wav")):
+            spotter.enroll(*read_wav(path))
+
+        logger.info(f"Enrolled {len(spotter.templates)} wake word templates from {directory}")
+        return spotter
+
+    def enroll(self, samples: np.ndarray, sample_rate: int) -> None:
+        """Add a recording of the wake phrase as a template."""
+        features = extract_features(samples, sample_rate)
+        if len(features) == 0:
+            raise ValueError("Wake word sample is too short to enroll.")
+        self.templates.append(features)
+
+    @property
+    def threshold(self) -> float:
+        """The distance below which a match counts as a wake word hit."""
+        if self._threshold is not None:
+            return self._threshold
+        if len(self.templates) < 2:
+            raise ValueError("At least two wake word templates are needed to calibrate a threshold.")
+
+        # The worst-case distance between two enrollments of the same phrase, plus some margin
+        distances = [
+            subsequence_dtw_distance(a, b)
+            for idx, a in enumerate(self.templates)
+            for b in self.templates[idx + 1 :]  # noqa: E203
+        ]
+        self._threshold = max(distances) * self.threshold_margin
+        logger.info(f"Calibrated wake word threshold: {self._threshold:.3f}")
+        return self._threshold
+
+    def score(self, samples: np.ndarray, sample_rate: int) -> float:
+        """The best (lowest) distance between the start of the audio and any enrolled template."""
+        if not self.templates:
+            raise ValueError("No wake word templates have been enrolled.")
+
+        query = extract_features(samples[: int(self.search_seconds * sample_rate)], sample_rate)
+        return min(subsequence_dtw_distance(template, query) for template in self.templates)
+
+    def detect(self, samples: np.ndarray, sample_rate: int) -> bool:
+        """Check whether the audio starts with the wake phrase."""
+        return self.score(samples, sample_rate) <= self.threshold
+
+
+@lru_cache(maxsize=1)
+def get_wake_word_spotter() -> WakeWordSpotter | None:
+    """Get the wake word spotter configured in the app settings, or `None` if wake word spotting is disabled."""
+    if not settings.stt_wake_word_enabled:
+        return None
+
+    samples_dir = settings.stt_wake_word_samples_dir
+    if not samples_dir.is_dir() or not any(samples_dir.glob("*.wav")):
+        logger.warning(f"No wake word samples found in {samples_dir}, wake word spotting is disabled.")
+        return None
+
+    try:
+        spotter = WakeWordSpotter.from_directory(samples_dir, threshold=settings.stt_wake_word_threshold)
+        if settings.stt_wake_word_threshold is None and len(spotter.templates) < 2:
+            raise ValueError(
+                "at least two samples are needed to calibrate a threshold, or set `stt_wake_word_threshold`"
+            )
+        # Calibrate now, rather than on the first detection in a listener thread
+        spotter.threshold
+    except (OSError, ValueError, wave.Error) as e:
+        logger.warning(f"Invalid wake word samples in {samples_dir} ({e}), wake word spotting is disabled.")
+        return None
+    return spotter
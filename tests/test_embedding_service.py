@@ -0,0 +1,153 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from grug.ai_embeddings import LOCAL_EMBEDDING_MODEL, LocalEmbeddings, get_embedding_backend
+from grug.embedding_service import EmbeddingService, get_embedding_service
+from grug.settings import settings
+
+
+class CountingEmbeddings(LocalEmbeddings):
+    """The local backend, recording the texts of each request."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        super().__init__(latency_seconds=latency_seconds)
+        self.requests: list[list[str]] = []
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(list(texts))
+        return await super().aembed_documents(texts)
+
+
+@pytest.fixture
+def local_backend(monkeypatch):
+    monkeypatch.setattr(settings, "ai_embedding_backend", "local")
+    get_embedding_backend.cache_clear()
+    get_embedding_service.cache_clear()
+    yield
+    get_embedding_backend.cache_clear()
+    get_embedding_service.cache_clear()
+
+
+@pytest.fixture
+def service(local_backend) -> EmbeddingService:
+    service = get_embedding_service()
+    service.backend = CountingEmbeddings(latency_seconds=0.01)
+    return service
+
+
+@pytest.fixture
+def persisted(monkeypatch) -> tuple[EmbeddingService, list[set[str]]]:
+    """A service with a persistent cache, whose Postgres table is replaced by a dict."""
+    service = EmbeddingService(CountingEmbeddings(), model=LOCAL_EMBEDDING_MODEL, persistent_cache=True)
+    table: dict[str, np.ndarray] = {}
+    saves: list[set[str]] = []
+
+    async def load(hashes: list[str]) -> dict[str, np.ndarray]:
+        return {h: table[h] for h in hashes if h in table}
+
+    async def save(vectors: dict[str, np.ndarray]) -> None:
+        saves.append(set(vectors))
+        table.update(vectors)
+
+    monkeypatch.setattr(service, "_load", load)
+    monkeypatch.setattr(service, "_save", save)
+    return service, saves
+
+
+async def test_local_backend_is_configured(service):
+    assert service.model == LOCAL_EMBEDDING_MODEL
+    assert not service.persistent_cache
+
+
+async def test_concurrent_callers_share_one_backend_request(service):
+    results = await asyncio.gather(
+        service.aembed_documents(["a goblin"]),
+        service.aembed_documents(["a dragon", "a goblin"]),
+        service.aembed_query("the tavern"),
+    )
+
+    assert len(service.backend.requests) == 1
+    assert sorted(service.backend.requests[0]) == ["a dragon", "a goblin", "the tavern"]
+    assert results[0][0] == results[1][1]
+    assert results[2] == LocalEmbeddings().embed_query("the tavern")
+
+
+async def test_texts_are_deduplicated_by_content_hash(service):
+    vectors = await service.aembed_documents(["a goblin", "a dragon", "a goblin"])
+    assert service.backend.requests == [["a goblin", "a dragon"]]
+    assert vectors[0] == vectors[2]
+
+    # Later requests are served by the in-memory cache
+    assert await service.aembed_documents(["a dragon", "a goblin"]) == [vectors[1], vectors[0]]
+    assert len(service.backend.requests) == 1
+    assert service.metrics()["memory_hits"] == 2
+
+
+async def test_content_hash_depends_on_the_model(service):
+    other = EmbeddingService(LocalEmbeddings(), model="another-model")
+    assert service.content_hash("a goblin") == service.content_hash("a goblin")
+    assert service.content_hash("a goblin") != other.content_hash("a goblin")
+
+
+async def test_max_batch_size_splits_requests(local_backend):
+    backend = CountingEmbeddings()
+    service = EmbeddingService(backend, model=LOCAL_EMBEDDING_MODEL, max_batch_size=2)
+    await service.aembed_documents(["one", "two", "three", "four", "five"])
+    assert [len(texts) for texts in backend.requests] == [2, 2, 1]
+
+
+async def test_cancelled_caller_does_not_cancel_shared_embedding(service):
+    first = asyncio.create_task(service.aembed_documents(["a goblin"]))
+    second = asyncio.create_task(service.aembed_documents(["a goblin"]))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert (await second)[0] == LocalEmbeddings().embed_query("a goblin")
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert len(service.backend.requests) == 1
+    assert not service._pending
+
+
+async def test_failed_batch_fails_its_callers_and_is_not_cached(service, monkeypatch):
+    async def fail(texts: list[str]) -> list[list[float]]:
+        raise RuntimeError("backend down")
+
+    monkeypatch.setattr(service.backend, "aembed_documents", fail)
+    with pytest.raises(RuntimeError):
+        await service.aembed_documents(["a goblin"])
+    assert not service._pending
+    assert service.metrics()["failed_batches"] == 1
+    assert len(service._cache) == 0
+
+
+async def test_persist_false_is_not_saved(persisted):
+    service, saves = persisted
+    await service.aembed_documents(["an archived message"], persist=False)
+    assert saves == []
+    assert not service._persist
+
+
+async def test_persist_is_merged_across_concurrent_callers(persisted):
+    service, saves = persisted
+    await asyncio.gather(
+        service.aembed_documents(["an archived message", "a shared text"], persist=False),
+        service.aembed_documents(["a shared text", "a query"]),
+    )
+
+    # One batch, where only the texts some caller wanted persisted are saved
+    assert len(service.backend.requests) == 1
+    assert saves == [{service.content_hash("a shared text"), service.content_hash("a query")}]
+    assert not service._persist
+
+
+async def test_persisted_embeddings_are_loaded_instead_of_embedded(persisted):
+    service, _ = persisted
+    vector = await service.aembed_query("a query")
+    service._cache.clear()
+
+    assert await service.aembed_query("a query") == vector
+    assert len(service.backend.requests) == 1
+    assert service.metrics()["persistent_hits"] == 1
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from grug.replicas import DM_GUILD_ID, ReplicaCoordinator, assign_guilds
+
+GUILD_IDS = range(1, 2001)
+
+
+def _coordinator(lease_seconds: float = 10.0, heartbeat_seconds: float = 2.0) -> ReplicaCoordinator:
+    return ReplicaCoordinator(enabled=True, lease_seconds=lease_seconds, heartbeat_seconds=heartbeat_seconds)
+
+
+def test_assign_guilds_to_live_slots():
+    assignment = assign_guilds(GUILD_IDS, [0, 1, 2])
+    assert set(assignment) == set(GUILD_IDS)
+    assert set(assignment.values()) == {0, 1, 2}
+    assert assignment == assign_guilds(reversed(GUILD_IDS), [2, 0, 1])
+
+
+def test_assign_guilds_without_live_slots():
+    assert assign_guilds(GUILD_IDS, []) == {}
+
+
+def test_assign_guilds_only_moves_guilds_to_a_new_slot():
+    before = assign_guilds(GUILD_IDS, [0, 1, 2])
+    after = assign_guilds(GUILD_IDS, [0, 1, 2, 3])
+    moved = {guild_id for guild_id in GUILD_IDS if before[guild_id] != after[guild_id]}
+    assert moved == {guild_id for guild_id, slot in after.items() if slot == 3}
+    # Roughly a quarter of the guilds move to the new slot
+    assert 0.15 < len(moved) / len(GUILD_IDS) < 0.35
+
+
+def test_assign_guilds_only_moves_guilds_of_a_removed_slot():
+    before = assign_guilds(GUILD_IDS, [0, 1, 2])
+    after = assign_guilds(GUILD_IDS, [0, 2])
+    moved = {guild_id for guild_id in GUILD_IDS if before[guild_id] != after[guild_id]}
+    assert moved == {guild_id for guild_id, slot in before.items() if slot == 1}
+
+
+def test_heartbeat_must_fit_in_the_lease():
+    with pytest.raises(ValueError):
+        _coordinator(lease_seconds=10.0, heartbeat_seconds=3.0)
+
+
+@pytest.mark.parametrize(
+    "lease_seconds, heartbeat_seconds", [(10.0, 2.0), (1.0, 0.25), (4.0, 1.0), (30.0, 5.0), (7.5, 1.5)]
+)
+def test_session_timeout_covers_the_lease(lease_seconds, heartbeat_seconds):
+    coordinator = _coordinator(lease_seconds, heartbeat_seconds)
+    keepalive_window = coordinator._keepalive_idle + coordinator._keepalive_count
+    # Unanswered keepalives must not end the session, and release the locks, before the lease would
+    assert keepalive_window >= lease_seconds
+    assert coordinator.session_timeout == min(lease_seconds, keepalive_window)
+
+
+@pytest.mark.parametrize(
+    "lease_seconds, heartbeat_seconds", [(10.0, 2.0), (1.0, 0.25), (4.0, 1.0), (30.0, 5.0), (7.5, 1.5)]
+)
+def test_locks_stop_being_trusted_before_the_session_can_end(lease_seconds, heartbeat_seconds):
+    coordinator = _coordinator(lease_seconds, heartbeat_seconds)
+    valid_until = coordinator.valid_until(100.0)
+    assert valid_until == 100.0 + coordinator.session_timeout - heartbeat_seconds
+    assert valid_until < 100.0 + coordinator.session_timeout
+    # Still valid until the next heartbeat, even if it takes as long as its timeout
+    assert valid_until >= 100.0 + heartbeat_seconds + lease_seconds / 2
+
+
+async def test_ownership_lapses_with_validity(monkeypatch):
+    coordinator = _coordinator()
+    coordinator._guilds = {42, DM_GUILD_ID}
+    coordinator._is_leader = True
+    now = time.monotonic()
+    await coordinator._set_state(coordinator.valid_until(now))
+
+    assert coordinator.owns_guild(42)
+    assert coordinator.owns_guild(None)
+    assert not coordinator.owns_guild(43)
+    assert coordinator.is_leader
+    assert coordinator.owned_guilds == {42, DM_GUILD_ID}
+
+    # No heartbeat has succeeded since, e.g. the replica was frozen or lost the database
+    monkeypatch.setattr(time, "monotonic", lambda: now + coordinator.session_timeout)
+    assert not coordinator.owns_guild(42)
+    assert not coordinator.owns_guild(None)
+    assert not coordinator.is_leader
+    assert coordinator.owned_guilds == set()
+
+
+def test_disabled_coordinator_owns_every_guild():
+    coordinator = ReplicaCoordinator(enabled=False)
+    assert coordinator.owns_guild(42)
+    assert coordinator.owns_guild(None)
+    assert coordinator.is_leader